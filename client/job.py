@@ -829,8 +829,9 @@ class base_client_job(base_job.base_job):
         partition_list = partition_lib.get_partition_list(self,
                                                           exclude_swap=False)
         mount_info = partition_lib.get_mount_info(partition_list)
-        self._state.set('client', 'mount_info', mount_info)
-        self._state.set('client', 'cpu_count', utils.count_cpus())
+        with self._state.transaction():
+            self._state.set('client', 'mount_info', mount_info)
+            self._state.set('client', 'cpu_count', utils.count_cpus())
 
     def reboot(self, tag=LAST_BOOT_TAG):
         if tag == LAST_BOOT_TAG:
@@ -1007,26 +1008,29 @@ class base_client_job(base_job.base_job):
 
     def next_step_append(self, fn, *args, **dargs):
         """Define the next step and place it at the end"""
-        steps = self._state.get('client', 'steps')
-        steps.append(self.__create_step_tuple(fn, args, dargs))
-        self._state.set('client', 'steps', steps)
+        with self._state.transaction():
+            steps = self._state.get('client', 'steps')
+            steps.append(self.__create_step_tuple(fn, args, dargs))
+            self._state.set('client', 'steps', steps)
 
     def next_step(self, fn, *args, **dargs):
         """Create a new step and place it after any steps added
         while running the current step but before any steps added in
         previous steps"""
-        steps = self._state.get('client', 'steps')
-        steps.insert(self._next_step_index,
-                     self.__create_step_tuple(fn, args, dargs))
+        with self._state.transaction():
+            steps = self._state.get('client', 'steps')
+            steps.insert(self._next_step_index,
+                         self.__create_step_tuple(fn, args, dargs))
+            self._state.set('client', 'steps', steps)
         self._next_step_index += 1
-        self._state.set('client', 'steps', steps)
 
     def next_step_prepend(self, fn, *args, **dargs):
         """Insert a new step, executing first"""
-        steps = self._state.get('client', 'steps')
-        steps.insert(0, self.__create_step_tuple(fn, args, dargs))
+        with self._state.transaction():
+            steps = self._state.get('client', 'steps')
+            steps.insert(0, self.__create_step_tuple(fn, args, dargs))
+            self._state.set('client', 'steps', steps)
         self._next_step_index += 1
-        self._state.set('client', 'steps', steps)
 
     def _run_step_fn(self, local_vars, fn, args, dargs):
         """Run a (step) function within the given context"""
@@ -1133,10 +1137,13 @@ class base_client_job(base_job.base_job):
 
         # Iterate through the steps.  If we reboot, we'll simply
         # continue iterating on the next step.
-        while len(self._state.get('client', 'steps')) > 0:
-            steps = self._state.get('client', 'steps')
-            (ancestry, fn_name, args, dargs) = steps.pop(0)
-            self._state.set('client', 'steps', steps)
+        while True:
+            with self._state.transaction():
+                steps = self._state.get('client', 'steps')
+                if not steps:
+                    break
+                (ancestry, fn_name, args, dargs) = steps.pop(0)
+                self._state.set('client', 'steps', steps)
 
             self._next_step_index = 0
             ret = self._create_frame(global_control_vars, ancestry, fn_name)
@@ -57,6 +57,13 @@ class AutotestLocalOptionParser(optparse.OptionParser):
         general.add_option("-d", '--test_directory', dest='test_directory',
                            type='string', default=None, action='store',
                            help=('Specify a custom test directory '))
+        general.add_option('--state_backend', dest='state_backend',
+                           type='choice', choices=['pickle', 'cached'],
+                           default=None,
+                           help=('How the job state is kept on disk: '
+                                 '"pickle" rewrites the state file on every '
+                                 'access, "cached" only when it changes. '
+                                 'Defaults to CLIENT.job_state_backend'))
         self.add_option_group(general)
 
         job_id = optparse.OptionGroup(self, 'JOB IDENTIFICATION')
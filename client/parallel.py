@@ -10,12 +10,13 @@ import sys
 import time
 import traceback
 
-from autotest.client.shared import error, utils
+from autotest.client.shared import base_job, error, utils
 
 
 def fork_start(tmp, l):
     sys.stdout.flush()
     sys.stderr.flush()
+    base_job.flush_status_logs()
     pid = os.fork()
     if pid:
         # Parent
@@ -47,6 +48,7 @@ def fork_start(tmp, l):
 
                 sys.stdout.flush()
                 sys.stderr.flush()
+                base_job.flush_status_logs()
         finally:
             # clear exception information to allow garbage collection of
             # objects referenced by the exception's traceback
@@ -57,6 +59,7 @@ def fork_start(tmp, l):
         try:
             sys.stdout.flush()
             sys.stderr.flush()
+            base_job.flush_status_logs()
         finally:
             os._exit(0)
 
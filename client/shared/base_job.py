@@ -1,4 +1,6 @@
+import atexit
 import cPickle as pickle
+import contextlib
 import copy
 import errno
 import fcntl
@@ -6,6 +8,7 @@ import logging
 import os
 import re
 import tarfile
+import threading
 import time
 import traceback
 import weakref
@@ -218,6 +221,12 @@ class job_state(object):
     NO_DEFAULT = object()
     PICKLE_PROTOCOL = 2  # highest protocol available in python 2.4
 
+    # nesting level of transaction() blocks
+    _transaction_depth = 0
+    # set when the in-memory state is modified, for the subclasses that only
+    # write the backing file when needed
+    _dirty = False
+
     def __init__(self):
         """Initialize the job state."""
         self._state = {}
@@ -264,7 +273,17 @@ class job_state(object):
             on_disk_state = {}
         else:
             on_disk_state = pickle.load(open(file_path))
+        self._merge_state(on_disk_state, merge, file_path)
+        self._dirty = True
+
+        # lock the backing file before we refresh it
+        with_backing_lock(self.__class__._write_to_backing_file)(self)
 
+    def _merge_state(self, on_disk_state, merge, file_path):
+        """
+        Merge (or replace, if merge is False) the in-memory state with the
+        on_disk_state read from file_path, as described in read_from_file.
+        """
         if merge:
             # merge the on-disk state with the in-memory state
             for namespace, namespace_dict in on_disk_state.iteritems():
@@ -287,9 +306,6 @@ class job_state(object):
             # just replace the in-memory state with the on-disk state
             self._state = on_disk_state
 
-        # lock the backing file before we refresh it
-        with_backing_lock(self.__class__._write_to_backing_file)(self)
-
     def write_to_file(self, file_path):
         """
         Write out the current state to the given path.
@@ -352,6 +368,49 @@ class job_state(object):
         self._backing_file_initialized = False
         self._synchronize_backing_file()
 
+    def _end_transaction(self, committed):
+        """
+        Called at the end of the outermost transaction(), with the backing
+        file still locked.
+
+        :param committed: False if the transaction raised an exception.
+        """
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        A context manager holding the backing file lock across several
+        operations, so that a read-modify-write sequence such as::
+
+            with job.state.transaction():
+                steps = state.get('client', 'steps')
+                steps.append(step)
+                state.set('client', 'steps', steps)
+
+        cannot interleave with other processes sharing the backing file.
+        Nested transactions are merged into the outermost one.  Backends that
+        cache the state (see cached_job_state) also write the backing file
+        only once, when the transaction ends, and discard its changes if it
+        raises.
+        """
+        already_have_lock = self._backing_file_lock is not None
+        if not already_have_lock:
+            self._lock_backing_file()
+        self._transaction_depth += 1
+        committed = False
+        try:
+            yield self
+            committed = True
+        finally:
+            self._transaction_depth -= 1
+            try:
+                if not self._transaction_depth:
+                    self._end_transaction(committed)
+            finally:
+                if not already_have_lock:
+                    self._unlock_backing_file()
+
     @with_backing_file
     def get(self, namespace, name, default=NO_DEFAULT):
         """
@@ -396,6 +455,7 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._dirty = True
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -431,6 +491,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._dirty = True
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -447,6 +508,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+            self._dirty = True
         logging.debug('Persistent state %s.* deleted', namespace)
 
     @staticmethod
@@ -481,6 +543,126 @@ class job_state(object):
         return property(getter, setter)
 
 
+class cached_job_state(job_state):
+    """
+    A job_state that avoids rereading and rewriting its backing file.
+
+    The backing file has the same format as the job_state one, so each class
+    can read the files written by the other, but all the processes sharing
+    a backing file must use this class, since it replaces the file instead
+    of rewriting it in place and locks it accordingly.  Compared to
+    job_state:
+
+    * the backing file is only written when the state was modified, and only
+      once per transaction();
+    * it is only read again when it changed since this object last read or
+      wrote it, as told by its inode, size and timestamps;
+    * it is written to a temporary file that is synced to disk and renamed
+      over it, so a crash cannot leave a truncated state behind;
+    * a transaction() that raises discards its changes (when there is a
+      backing file to reload the state from).
+    """
+
+    def __init__(self):
+        super(cached_job_state, self).__init__()
+        self._backing_file_generation = None
+
+    @staticmethod
+    def _get_file_generation(file_path):
+        """
+        :return: a tuple that changes whenever the file is replaced or
+                 modified, or None if it does not exist.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime,
+                stat.st_ctime)
+
+    def _lock_backing_file(self):
+        """
+        Acquire a lock on the backing file.
+
+        The file may be replaced by another process while waiting for the
+        lock, in which case the lock is taken again on the new file.
+        """
+        if not self._backing_file:
+            return
+        while True:
+            lock_file = open(self._backing_file, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            locked = os.fstat(lock_file.fileno())
+            generation = self._get_file_generation(self._backing_file)
+            if generation and generation[:2] == (locked.st_dev,
+                                                 locked.st_ino):
+                self._backing_file_lock = lock_file
+                return
+            lock_file.close()
+
+    def _read_from_backing_file(self):
+        """
+        Refresh the current state from the backing file, if it changed.
+        """
+        if not self._backing_file:
+            return
+        generation = self._get_file_generation(self._backing_file)
+        if (self._backing_file_initialized and
+                generation == self._backing_file_generation):
+            return
+        if not generation or generation[2] == 0:
+            on_disk_state = {}
+        else:
+            on_disk_state = pickle.load(open(self._backing_file, 'rb'))
+        merge = not self._backing_file_initialized
+        self._merge_state(on_disk_state, merge, self._backing_file)
+        self._dirty = merge and self._state != on_disk_state
+        self._backing_file_generation = generation
+        self._backing_file_initialized = True
+
+    def _write_to_backing_file(self):
+        """
+        Atomically replace the backing file, if the state was modified and
+        no transaction is in progress.
+        """
+        if (not self._backing_file or not self._dirty or
+                self._transaction_depth):
+            return
+        temp_path = self._backing_file + '.tmp'
+        temp_file = open(temp_path, 'wb')
+        try:
+            # lock the new file before it becomes visible, so that the lock
+            # is held continuously
+            fcntl.flock(temp_file, fcntl.LOCK_EX)
+            pickle.dump(self._state, temp_file, self.PICKLE_PROTOCOL)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+            os.rename(temp_path, self._backing_file)
+        except Exception:
+            temp_file.close()
+            raise
+        if self._backing_file_lock:
+            self._backing_file_lock.close()
+            self._backing_file_lock = temp_file
+        else:
+            temp_file.close()
+        self._backing_file_generation = self._get_file_generation(
+            self._backing_file)
+        self._dirty = False
+
+    def _end_transaction(self, committed):
+        if committed:
+            self._write_to_backing_file()
+        elif self._backing_file:
+            # reload the state as it was before the transaction
+            self._dirty = False
+            self._backing_file_generation = None
+
+
+# the job_state implementations, by the name used to select them
+JOB_STATE_BACKENDS = {'pickle': job_state, 'cached': cached_job_state}
+
+
 class status_log_entry(object):
     """
     Represents a single status log entry.
@@ -642,6 +824,170 @@ class status_indenter(object):
         """Decrease indentation by one level."""
 
 
+# the status_log_writer instances of this process (the keys, the values are
+# unused)
+_status_log_writers = weakref.WeakKeyDictionary()
+
+
+def flush_status_logs():
+    """
+    Write out the lines buffered by all the status log writers of this
+    process.  To be called before forking, so that lines recorded before the
+    fork are not written after the ones of the child, and before a child
+    exits with os._exit().
+    """
+    for writer in _status_log_writers.keys():
+        writer.flush()
+
+
+def _close_status_logs():
+    for writer in _status_log_writers.keys():
+        writer.close()
+
+
+atexit.register(_close_status_logs)
+
+
+class status_log_writer(object):
+    """
+    Appends rendered entries to status log files, keeping the files open.
+
+    INFO entries are buffered and written out within flush_latency seconds.
+    Any other entry is written at once, along with the lines buffered before
+    it, so test results are never delayed, and START and END entries are
+    also synced to disk, so they survive a crash or a reboot.
+
+    After a fork, the child forgets the lines buffered by the parent, which
+    stays in charge of writing them (see flush_status_logs()).
+    """
+
+    # status log files kept open at most, all are closed when it is exceeded
+    MAX_OPEN_FILES = 16
+    # buffered lines written out at once, whatever the latency
+    MAX_PENDING_LINES = 1000
+
+    def __init__(self, flush_latency):
+        """
+        :param flush_latency: Seconds INFO entries may stay buffered, 0 to
+                              write every entry at once.
+        """
+        self._flush_latency = flush_latency
+        self._reset()
+        _status_log_writers[self] = None
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._files = {}
+        self._pending = []
+        self._timer = None
+        self._cancelled_timer = None
+
+    def _check_fork(self):
+        """Drop the state inherited from the parent process after a fork."""
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _open(self, path):
+        """
+        :return: a file object appending to path, reopened if the file was
+                 removed or replaced since it was opened.
+        """
+        if path in self._files:
+            fileobj, file_id = self._files[path]
+            try:
+                current = os.stat(path)
+                if (current.st_dev, current.st_ino) == file_id:
+                    return fileobj
+            except OSError:
+                pass
+            del self._files[path]
+            fileobj.close()
+        if len(self._files) >= self.MAX_OPEN_FILES:
+            self._close_files()
+        fileobj = open(path, 'a')
+        opened = os.fstat(fileobj.fileno())
+        self._files[path] = (fileobj, (opened.st_dev, opened.st_ino))
+        return fileobj
+
+    def _close_files(self):
+        for fileobj, _ in self._files.itervalues():
+            fileobj.close()
+        self._files = {}
+
+    def _write_lines(self, path, lines, sync):
+        fileobj = self._open(path)
+        fileobj.write(''.join(lines))
+        fileobj.flush()
+        if sync:
+            os.fsync(fileobj.fileno())
+
+    def _write_pending(self, sync=False):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._cancelled_timer, self._timer = self._timer, None
+        paths = []
+        lines_by_path = {}
+        for path, line in self._pending:
+            if path not in lines_by_path:
+                paths.append(path)
+                lines_by_path[path] = []
+            lines_by_path[path].append(line)
+        self._pending = []
+        for path in paths:
+            self._write_lines(path, lines_by_path[path], sync)
+
+    def write(self, paths, text, buffered=False, sync=False):
+        """
+        Append a rendered entry to the given log files.
+
+        :param paths: The paths of the log files.
+        :param text: The rendered entry, without the trailing newline.
+        :param buffered: If True, the entry may be written out later.
+        :param sync: If True, sync the log files to disk after writing.
+        """
+        self._check_fork()
+        self._lock.acquire()
+        try:
+            if not buffered and not self._pending:
+                for path in paths:
+                    self._write_lines(path, [text, '\n'], sync)
+                return
+            self._pending.extend((path, text + '\n') for path in paths)
+            if (not buffered or self._flush_latency <= 0 or
+                    len(self._pending) >= self.MAX_PENDING_LINES):
+                self._write_pending(sync)
+            elif self._timer is None:
+                self._timer = threading.Timer(self._flush_latency,
+                                              self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        """Write out the buffered entries."""
+        self._check_fork()
+        self._lock.acquire()
+        try:
+            if self._pending:
+                self._write_pending()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Write out the buffered entries and close the log files."""
+        self.flush()
+        self._lock.acquire()
+        try:
+            self._close_files()
+            timer, self._cancelled_timer = self._cancelled_timer, None
+        finally:
+            self._lock.release()
+        if timer is not None and timer is not threading.current_thread():
+            timer.join()
+
+
 class status_logger(object):
     """
     Represents a status log file. Responsible for translating messages
@@ -653,7 +999,7 @@ class status_logger(object):
 
     def __init__(self, job, indenter, global_filename='status',
                  subdir_filename='status', record_hook=None,
-                 tap_writer=None):
+                 tap_writer=None, writer=None):
         """
         Construct a logger instance.
 
@@ -676,6 +1022,11 @@ class status_logger(object):
 
         :param tap_writer: An instance of the class TAPReport for addionally
                            writing TAP files
+
+        :param writer: An optional status_log_writer instance for writing the
+                       log files. By default a new one is created, buffering
+                       INFO entries for COMMON.status_log_flush_latency
+                       seconds.
         """
         self._jobref = weakref.ref(job)
         self._indenter = indenter
@@ -686,6 +1037,11 @@ class status_logger(object):
             self._tap_writer = TAPReport(None)
         else:
             self._tap_writer = tap_writer
+        if writer is None:
+            writer = status_log_writer(settings.get_value(
+                'COMMON', 'status_log_flush_latency', type=float,
+                default=0.0))
+        self._writer = writer
 
     def render_entry(self, log_entry):
         """
@@ -732,12 +1088,11 @@ class status_logger(object):
 
         # write out to entry to the log files
         log_text = self.render_entry(log_entry)
-        for log_file in log_files:
-            fileobj = open(log_file, 'a')
-            try:
-                print >> fileobj, log_text
-            finally:
-                fileobj.close()
+        is_boundary = log_entry.is_start() or log_entry.is_end()
+        self._writer.write(
+            log_files, log_text,
+            buffered=getattr(log_entry, 'status_code', None) == 'INFO',
+            sync=is_boundary)
 
         # write to TAPRecord instance
         if log_entry.is_end() and self._tap_writer.do_tap_report:
@@ -1079,7 +1434,7 @@ class base_job(object):
         self._execution_contexts = []
 
         # initialize all the job state
-        self._state = self._job_state()
+        self._state = self._create_job_state(dargs.get('options'))
 
         # initialize tap reporting
         if 'options' in dargs:
@@ -1087,6 +1442,22 @@ class base_job(object):
         else:
             self._tap = self._tap_init(False)
 
+    def _create_job_state(self, options):
+        """
+        Create the job state, with the backend (see JOB_STATE_BACKENDS) given
+        by the state_backend option or else by CLIENT.job_state_backend.
+        The default 'pickle' backend uses the _job_state factory.
+        """
+        backend = getattr(options, 'state_backend', None)
+        if not backend:
+            backend = settings.get_value('CLIENT', 'job_state_backend',
+                                         default='pickle')
+        if backend == 'pickle':
+            return self._job_state()
+        if backend not in JOB_STATE_BACKENDS:
+            raise error.JobError('Unknown job state backend %r' % backend)
+        return JOB_STATE_BACKENDS[backend]()
+
     @classmethod
     # The unittests will hide this method, well, for unittesting
     # pylint: disable=E0202
@@ -5,6 +5,7 @@ import os
 import shutil
 import stat
 import tempfile
+import time
 import unittest
 
 try:
@@ -819,6 +820,112 @@ class test_job_state_backing_file_locking(unittest.TestCase):
         self.state.write_to_file('non_backing_file')
 
 
+# run the backing file tests with the cached backend, the files being read
+# back with the default one
+class test_cached_job_state_with_backing_file(
+        test_job_state_with_backing_file):
+
+    def setUp(self):
+        self.backing_file = tempfile.mktemp()
+        self.state = base_job.cached_job_state()
+        self.state.set_backing_file(self.backing_file)
+
+
+class test_cached_job_state(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.backing_file = os.path.join(self.testdir, 'state')
+        self.state = base_job.cached_job_state()
+        self.state.set_backing_file(self.backing_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+    def _inode(self):
+        return os.stat(self.backing_file).st_ino
+
+    def _read_back(self):
+        state = base_job.job_state()
+        state.read_from_file(self.backing_file)
+        return state
+
+    def test_reads_do_not_rewrite(self):
+        self.state.set('ns', 'var', 1)
+        inode = self._inode()
+        self.assertEqual(1, self.state.get('ns', 'var'))
+        self.assertTrue(self.state.has('ns', 'var'))
+        self.state.discard('ns', 'missing')
+        self.assertEqual(inode, self._inode())
+
+    def test_writes_replace_the_file(self):
+        self.state.set('ns', 'var', 1)
+        inode = self._inode()
+        self.state.set('ns', 'var', 2)
+        self.assertNotEqual(inode, self._inode())
+        self.assertEqual(['state'], os.listdir(self.testdir))
+        self.assertEqual(2, self._read_back().get('ns', 'var'))
+
+    def test_transaction_writes_once(self):
+        self.state.set('ns', 'var', 0)
+        inode = self._inode()
+        with self.state.transaction():
+            for value in xrange(10):
+                self.state.set('ns', 'var', value)
+            with self.state.transaction():
+                self.state.set('ns', 'other', 'value')
+            self.assertEqual(inode, self._inode())
+            self.assertEqual(0, self._read_back().get('ns', 'var'))
+        self.assertNotEqual(inode, self._inode())
+        self.assertEqual(9, self._read_back().get('ns', 'var'))
+        self.assertEqual('value', self._read_back().get('ns', 'other'))
+
+    def test_failed_transaction_is_discarded(self):
+        self.state.set('ns', 'var', 0)
+        try:
+            with self.state.transaction():
+                self.state.set('ns', 'var', 1)
+                self.state.discard_namespace('ns')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(0, self.state.get('ns', 'var'))
+        self.assertEqual(0, self._read_back().get('ns', 'var'))
+
+    def test_changes_are_shared(self):
+        other_state = base_job.cached_job_state()
+        other_state.set_backing_file(self.backing_file)
+        self.state.set('ns', 'var', 1)
+        self.assertEqual(1, other_state.get('ns', 'var'))
+        other_state.discard('ns', 'var')
+        self.assertFalse(self.state.has('ns', 'var'))
+
+    def test_lock_follows_replaced_file(self):
+        os.rename(self.backing_file, self.backing_file + '.old')
+        self.state.set('ns', 'var', 1)
+        with self.state.transaction():
+            locked = os.fstat(self.state._backing_file_lock.fileno())
+            self.assertEqual(self._inode(), locked.st_ino)
+        self.assertEqual(1, self._read_back().get('ns', 'var'))
+
+
+class test_job_state_backends(unittest.TestCase):
+
+    class options(object):
+        state_backend = None
+
+    def _create(self, backend):
+        self.options.state_backend = backend
+        job = base_job.base_job.__new__(base_job.base_job)
+        return job._create_job_state(self.options)
+
+    def test_backends(self):
+        self.assertEqual(base_job.job_state, type(self._create('pickle')))
+        self.assertEqual(base_job.cached_job_state,
+                         type(self._create('cached')))
+        self.assertRaises(error.JobError, self._create, 'sqlite')
+
+
 class test_job_state_property_factory(unittest.TestCase):
 
     def setUp(self):
@@ -1225,6 +1332,77 @@ class test_status_logger(unittest.TestCase):
         shutil.rmtree(self.testdir, ignore_errors=True)
 
 
+class test_status_log_writer(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.log_path = os.path.join(self.testdir, 'status')
+        self.writer = base_job.status_log_writer(60)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+    def _read(self):
+        if not os.path.exists(self.log_path):
+            return ''
+        return open(self.log_path).read()
+
+    def test_buffered_lines_wait_for_unbuffered_ones(self):
+        self.writer.write([self.log_path], 'INFO1', buffered=True)
+        self.writer.write([self.log_path], 'INFO2', buffered=True)
+        self.assertEqual('', self._read())
+        self.writer.write([self.log_path], 'GOOD', sync=True)
+        self.assertEqual('INFO1\nINFO2\nGOOD\n', self._read())
+
+    def test_flush_latency(self):
+        writer = base_job.status_log_writer(0.01)
+        writer.write([self.log_path], 'INFO', buffered=True)
+        for _ in xrange(100):
+            if self._read():
+                break
+            time.sleep(0.01)
+        self.assertEqual('INFO\n', self._read())
+        writer.close()
+
+    def test_removed_file_is_reopened(self):
+        self.writer.write([self.log_path], 'LINE1')
+        os.remove(self.log_path)
+        self.writer.write([self.log_path], 'LINE2')
+        self.assertEqual('LINE2\n', self._read())
+
+    def test_fork(self):
+        self.writer.write([self.log_path], 'PARENT1', buffered=True)
+        base_job.flush_status_logs()
+        self.writer.write([self.log_path], 'PARENT2', buffered=True)
+        pid = os.fork()
+        if not pid:
+            try:
+                self.writer.write([self.log_path], 'CHILD', buffered=True)
+                base_job.flush_status_logs()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.writer.flush()
+        self.assertEqual('PARENT1\nCHILD\nPARENT2\n', self._read())
+
+    def test_logger_buffers_info_entries(self):
+        class stub_job(object):
+            resultdir = self.testdir
+
+        class stub_indenter(object):
+            indent = 0
+        job = stub_job()
+        logger = base_job.status_logger(job, stub_indenter(),
+                                         writer=self.writer)
+        logger.record_entry(base_job.status_log_entry(
+            'INFO', None, None, 'running', {}, timestamp=1))
+        self.assertEqual('', self._read())
+        logger.record_entry(base_job.status_log_entry(
+            'GOOD', None, 'test', 'completed', {}, timestamp=2))
+        self.assertEqual(2, len(self._read().splitlines()))
+
+
 class test_job_tags(unittest.TestCase):
 
     def setUp(self):
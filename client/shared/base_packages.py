@@ -1015,8 +1015,7 @@ class BasePackageManager(object):
             cmd_list.append('--use-compress-prog=pbzip2')
         else:
             cmd_list.append('-j')
-        if include_string is not None:
-            cmd_list.append(include_string)
+        # recent versions of tar ignore the excludes following the files
         if exclude_string is not None:
             if isinstance(exclude_string, list):
                 for exc_str in exclude_string:
@@ -1025,6 +1024,8 @@ class BasePackageManager(object):
                 if "--exclude" not in exclude_string:
                     cmd_list.append('--exclude')
                 cmd_list.append(exclude_string)
+        if include_string is not None:
+            cmd_list.append(include_string)
 
         try:
             utils.system(' '.join(cmd_list))
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+"""
+Measure the overhead of running commands through utils:
+
+* run: --runs runs of 'true', the fixed cost of a command.
+* run-output: a run() of a command writing --size MB to stdout.
+* run-stdin: a run() of cat, given --size MB as a stdin string.
+* system_output: a system_output() of a command writing --size MB of lines.
+* run_parallel: a run_parallel() of --parallel commands, writing --size MB
+  to stdout and a line to stderr altogether.
+* async: --parallel AsyncJob instances writing --size MB altogether, waited
+  for one after the other.
+
+Besides the elapsed time, the CPU time used by this process (not by the
+commands) is reported, which shows how much is spent waiting for and copying
+the output.
+"""
+
+import optparse
+import resource
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import utils
+
+MB = 1024 * 1024
+
+
+def _output_command(size):
+    return 'head -c %d /dev/zero' % size
+
+
+def _run(options):
+    for _ in xrange(options.runs):
+        utils.run('true', verbose=False)
+    return options.runs, 0
+
+
+def _run_output(options):
+    result = utils.run(_output_command(options.size * MB), verbose=False)
+    return 1, len(result.stdout)
+
+
+def _run_stdin(options):
+    result = utils.run('cat', stdin='x' * (options.size * MB), verbose=False)
+    return 1, len(result.stdout)
+
+
+def _system_output(options):
+    # lines of 100 bytes
+    output = utils.system_output(
+        "yes %s | head -n %d" % ('x' * 99, options.size * MB / 100),
+        verbose=False)
+    return 1, len(output)
+
+
+def _run_parallel(options):
+    command = '%s; echo done >&2' % _output_command(
+        options.size * MB / options.parallel)
+    results = utils.run_parallel([command] * options.parallel)
+    return options.parallel, sum(len(result.stdout) for result in results)
+
+
+def _async(options):
+    command = _output_command(options.size * MB / options.parallel)
+    jobs = [utils.AsyncJob(command, verbose=False)
+            for _ in xrange(options.parallel)]
+    results = [job.wait_for() for job in jobs]
+    return options.parallel, sum(len(result.stdout) for result in results)
+
+
+MODES = {'run': _run,
+         'run-output': _run_output,
+         'run-stdin': _run_stdin,
+         'system_output': _system_output,
+         'run_parallel': _run_parallel,
+         'async': _async}
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_benchmark(mode, options):
+    start_time, start_cpu_time = time.time(), _cpu_time()
+    commands, size = MODES[mode](options)
+    seconds = time.time() - start_time
+    cpu_seconds = _cpu_time() - start_cpu_time
+
+    print ('%-14s %8.3f s %8.3f s CPU %6d commands %10.1f commands/s '
+           '%8.1f MB/s' % (mode, seconds, cpu_seconds, commands,
+                           commands / max(seconds, 1e-6),
+                           size / max(seconds, 1e-6) / MB))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type=int, default=200,
+                      help='commands run by the run mode [default: %default]')
+    parser.add_option('--size', type=int, default=64,
+                      help='MB of output or input per mode '
+                           '[default: %default]')
+    parser.add_option('--parallel', type=int, default=500,
+                      help='commands run at once by the run_parallel and '
+                           'async modes [default: %default]')
+    parser.add_option('--modes',
+                      default='run,run-output,run-stdin,system_output,'
+                              'run_parallel,async',
+                      help='comma separated modes to run [default: %default]')
+    options = parser.parse_args()[0]
+
+    for mode in options.modes.split(','):
+        run_benchmark(mode, options)
+
+
+if __name__ == '__main__':
+    main()
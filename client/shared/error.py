@@ -507,6 +507,19 @@ class AutoservSubcommandError(AutoservError):
                 (self.func, self.exit_code))
 
 
+class AutoservSubcommandTimeoutError(AutoservSubcommandError):
+
+    """Indicates a subcommand was killed for exceeding its timeout"""
+
+    def __init__(self, func, timeout):
+        AutoservSubcommandError.__init__(self, func, None)
+        self.timeout = timeout
+
+    def __str__(self):
+        return ("Subcommand %s timed out after %d seconds" %
+                (self.func, self.timeout))
+
+
 class AutoservHardwareRepairRequestedError(AutoservError):
 
     """
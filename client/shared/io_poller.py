@@ -0,0 +1,257 @@
+"""
+Readiness notification for the pipes of the commands run by utils.
+
+utils.run() and utils.run_parallel() wait for their commands with a Poller
+in the calling thread, and the output of all the utils.AsyncJob processes
+is drained by a single background thread, the Reactor, instead of two
+threads per process.  Both use epoll where it is available (poll()
+otherwise), so the number of concurrent commands is only limited by the
+number of open files, not by FD_SETSIZE as with select().
+"""
+
+import errno
+import fcntl
+import logging
+import math
+import os
+import select
+import threading
+
+# event masks, the same for epoll and poll
+READ = select.POLLIN
+WRITE = select.POLLOUT
+HANGUP = select.POLLHUP
+ERROR = select.POLLERR | getattr(select, 'POLLNVAL', 0)
+
+# bytes read from or written to a pipe at once
+READ_SIZE = 65536
+WRITE_SIZE = 65536
+
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    if not flags & os.O_NONBLOCK:
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def read_nonblocking(fd, size=READ_SIZE):
+    """
+    Read from a non-blocking fd.
+
+    :return: the data read, '' at the end of the file, or None if no data
+            is available yet.
+    """
+    while True:
+        try:
+            return os.read(fd, size)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.EAGAIN:
+                return None
+            raise
+
+
+def write_nonblocking(fd, data):
+    """
+    Write to a non-blocking fd.
+
+    :return: the number of bytes written, 0 if the fd is not writable yet.
+    :raise OSError: on errors, such as EPIPE if the reader is gone.
+    """
+    while True:
+        try:
+            return os.write(fd, data)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.EAGAIN:
+                return 0
+            raise
+
+
+class Poller(object):
+
+    """epoll, or poll() where it is not available, with timeouts in seconds."""
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._timeout_scale = 1
+        else:
+            self._poller = select.poll()
+            self._timeout_scale = 1000
+
+    def register(self, fd, events):
+        self._poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self._poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def poll(self, timeout=None):
+        """
+        Wait until one of the registered fds is ready.
+
+        :param timeout: maximum number of seconds to wait, None to wait
+                forever.
+        :return: a list of (fd, events), empty if the timeout expired or the
+                wait was interrupted by a signal.
+        """
+        if timeout is None:
+            timeout = -1
+        else:
+            # rounded up to milliseconds, so that it does not return before
+            # the timeout expired
+            timeout = math.ceil(max(timeout, 0) * 1000)
+            timeout = timeout * self._timeout_scale / 1000
+        try:
+            return self._poller.poll(timeout)
+        except (select.error, IOError), e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def close(self):
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+
+
+class Reactor(object):
+
+    """
+    A background thread reading and writing pipes on behalf of other threads.
+
+    Readers are called from the reactor thread with every chunk of data read
+    from their fd, and with '' once the end of the file was reached, after
+    which the fd is forgotten.  Writers have a string written to their file,
+    which is then closed.
+    """
+
+    def __init__(self):
+        self._poller = Poller()
+        self._lock = threading.Lock()
+        self._added = []
+        self._readers = {}
+        # fd -> [file object, data, offset]
+        self._writers = {}
+        self._wakeup_fd, self._wakeup_write_fd = os.pipe()
+        for fd in (self._wakeup_fd, self._wakeup_write_fd):
+            set_nonblocking(fd)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        self._poller.register(self._wakeup_fd, READ)
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='io-reactor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _add(self, operation):
+        self._lock.acquire()
+        try:
+            self._added.append(operation)
+        finally:
+            self._lock.release()
+        try:
+            write_nonblocking(self._wakeup_write_fd, 'x')
+        except OSError:
+            pass
+
+    def add_reader(self, fileobj, handler):
+        """Call handler(data) with everything read from fileobj."""
+        self._add((fileobj.fileno(), handler, None))
+
+    def add_writer(self, fileobj, data):
+        """Write data to fileobj and close it."""
+        self._add((fileobj.fileno(), None, [fileobj, data, 0]))
+
+    def _register_added(self):
+        while read_nonblocking(self._wakeup_fd):
+            pass
+        self._lock.acquire()
+        try:
+            added, self._added = self._added, []
+        finally:
+            self._lock.release()
+        for fd, handler, writer in added:
+            if handler is not None:
+                self._readers[fd] = handler
+                events = READ
+            else:
+                self._writers[fd] = writer
+                events = WRITE
+            try:
+                set_nonblocking(fd)
+                self._poller.register(fd, events)
+            except (IOError, OSError), e:
+                logging.warning('Cannot watch fd %d: %s', fd, e)
+                self._close(fd)
+
+    def _close(self, fd):
+        """Forget about fd, as if the end of its file was reached."""
+        if fd in self._readers:
+            self._call(fd, self._readers.pop(fd), '')
+        if fd in self._writers:
+            self._writers.pop(fd)[0].close()
+
+    def _call(self, fd, handler, data):
+        try:
+            handler(data)
+        except Exception:
+            logging.exception('Error handling the output of fd %d', fd)
+
+    def _read(self, fd):
+        try:
+            data = read_nonblocking(fd)
+        except OSError:
+            data = ''
+        if data is None:
+            return
+        handler = self._readers[fd]
+        if not data:
+            self._poller.unregister(fd)
+            del self._readers[fd]
+        self._call(fd, handler, data)
+
+    def _write(self, fd):
+        writer = self._writers[fd]
+        fileobj, data, offset = writer
+        try:
+            writer[2] += write_nonblocking(fd,
+                                           data[offset:offset + WRITE_SIZE])
+        except OSError, e:
+            if e.errno != errno.EPIPE:
+                logging.warning('Error writing to fd %d: %s', fd, e)
+            writer[2] = len(data)
+        if writer[2] >= len(data):
+            self._poller.unregister(fd)
+            del self._writers[fd]
+            fileobj.close()
+
+    def _run(self):
+        while True:
+            for fd, events in self._poller.poll():
+                if fd == self._wakeup_fd:
+                    self._register_added()
+                elif fd in self._readers:
+                    self._read(fd)
+                elif fd in self._writers:
+                    self._write(fd)
+
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+
+def get_reactor():
+    """:return: the Reactor of the current process, started when needed."""
+    global _reactor
+    _reactor_lock.acquire()
+    try:
+        # the reactor thread of the parent does not run in a forked child
+        if _reactor is None or _reactor.pid != os.getpid():
+            _reactor = Reactor()
+        return _reactor
+    finally:
+        _reactor_lock.release()
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+import os
+import threading
+import time
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import io_poller
+
+
+class PollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.poller = io_poller.Poller()
+        self.read_fd, self.write_fd = os.pipe()
+
+    def tearDown(self):
+        self.poller.close()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def test_poll(self):
+        self.poller.register(self.read_fd, io_poller.READ)
+        start_time = time.time()
+        self.assertEqual([], self.poller.poll(0.0005))
+        self.assertTrue(time.time() - start_time >= 0.0005)
+
+        os.write(self.write_fd, 'data')
+        self.assertEqual([(self.read_fd, io_poller.READ)],
+                         self.poller.poll())
+        self.poller.unregister(self.read_fd)
+        self.assertEqual([], self.poller.poll(0))
+
+    def test_nonblocking(self):
+        io_poller.set_nonblocking(self.read_fd)
+        self.assertEqual(None, io_poller.read_nonblocking(self.read_fd))
+        os.write(self.write_fd, 'data')
+        self.assertEqual('data', io_poller.read_nonblocking(self.read_fd))
+
+
+class ReactorTest(unittest.TestCase):
+
+    def test_reader_and_writer(self):
+        reactor = io_poller.get_reactor()
+        self.assertTrue(reactor is io_poller.get_reactor())
+        read_fd, write_fd = os.pipe()
+        reader, writer = os.fdopen(read_fd, 'r'), os.fdopen(write_fd, 'w')
+        chunks = []
+        closed = threading.Event()
+
+        def handler(data):
+            chunks.append(data)
+            if not data:
+                closed.set()
+        data = 'x' * (io_poller.WRITE_SIZE * 3 + 1)
+        reactor.add_reader(reader, handler)
+        reactor.add_writer(writer, data)
+        closed.wait(10)
+        self.assertTrue(closed.is_set())
+        self.assertEqual(data, ''.join(chunks))
+        self.assertTrue(writer.closed)
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
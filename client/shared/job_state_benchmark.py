@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""
+Compare the cost of job_state operations with a backing file, for the
+job_state backends (see base_job.JOB_STATE_BACKENDS):
+
+* pickle: every get/set/has locks, rereads and rewrites the whole file.
+* cached: the file is only reread when it changed and rewritten when the
+  state was modified.
+* cached-transaction: the cached backend, with every --batch operations
+  grouped in a transaction().
+
+The state holds --keys values of --value-size bytes, and each measured
+operation is a set() of one of them followed by two get()s and a has(), the
+pattern of the step engine and of the state backed job properties.
+"""
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import base_job
+
+
+def _operation(state, index, value):
+    name = 'key%d' % (index % len(value))
+    state.set('benchmark', name, value[index % len(value)])
+    state.get('benchmark', name)
+    state.get('benchmark', 'key0', None)
+    state.has('benchmark', name)
+
+
+def run_benchmark(mode, options, directory):
+    backend = mode.split('-')[0]
+    state = base_job.JOB_STATE_BACKENDS[backend]()
+    backing_file = os.path.join(directory, '%s.state' % mode)
+    state.set_backing_file(backing_file)
+    values = [('%d' % index).ljust(options.value_size, 'x')
+              for index in xrange(options.keys)]
+    with state.transaction():
+        for index in xrange(options.keys):
+            state.set('benchmark', 'key%d' % index, values[index])
+
+    start_time = time.time()
+    if mode.endswith('-transaction'):
+        for start in xrange(0, options.operations, options.batch):
+            with state.transaction():
+                for index in xrange(start, min(start + options.batch,
+                                               options.operations)):
+                    _operation(state, index, values)
+    else:
+        for index in xrange(options.operations):
+            _operation(state, index, values)
+    seconds = time.time() - start_time
+    state.set_backing_file(None)
+
+    print '%-20s %8.3f s %10.0f operations/s %8.1f kB state' % (
+        mode, seconds, options.operations / max(seconds, 1e-6),
+        os.path.getsize(backing_file) / 1024.0)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--operations', type=int, default=2000,
+                      help='set+get+get+has sequences to run '
+                           '[default: %default]')
+    parser.add_option('--keys', type=int, default=200,
+                      help='values in the state [default: %default]')
+    parser.add_option('--value-size', type=int, default=100,
+                      help='bytes per value [default: %default]')
+    parser.add_option('--batch', type=int, default=20,
+                      help='operations per transaction [default: %default]')
+    parser.add_option('--modes', default='pickle,cached,cached-transaction',
+                      help='comma separated backends to run '
+                           '[default: %default]')
+    parser.add_option('--dir',
+                      help='directory of the state files, a temporary one '
+                           'by default')
+    options = parser.parse_args()[0]
+
+    directory = options.dir or tempfile.mkdtemp()
+    try:
+        for mode in options.modes.split(','):
+            run_benchmark(mode, options, directory)
+    finally:
+        if not options.dir:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
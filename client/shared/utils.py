@@ -12,14 +12,16 @@ inheritance with, just a collection of static methods.
 # Copyright 2008 Google Inc. Released under the GPL v2
 
 import StringIO
+import errno
 import glob
+import heapq
+import itertools
 import logging
 import os
 import pickle
 import random
 import re
 import resource
-import select
 import shutil
 import signal
 import socket
@@ -41,7 +43,7 @@ try:
 except ImportError:
     import md5
     import sha
-from autotest.client.shared import error, logging_manager
+from autotest.client.shared import error, io_poller, logging_manager
 from autotest.client.shared import progressbar
 from autotest.client.shared.settings import settings
 from autotest.client import os_dep
@@ -131,25 +133,33 @@ class BgJob(object):
         self.stderr_file = stderr_file
 
     def process_output(self, stdout=True, final_read=False):
-        """output_prepare must be called prior to calling this"""
+        """
+        output_prepare must be called prior to calling this
+
+        :return: False if the end of the output was reached, True otherwise.
+        """
         if stdout:
             pipe, buf, tee = self.sp.stdout, self.stdout_file, self.stdout_tee
         else:
             pipe, buf, tee = self.sp.stderr, self.stderr_file, self.stderr_tee
 
+        fd = pipe.fileno()
         if final_read:
             # read in all the data we can from pipe and then stop
+            io_poller.set_nonblocking(fd)
             data = []
-            while select.select([pipe], [], [], 0)[0]:
-                data.append(os.read(pipe.fileno(), 1024))
-                if len(data[-1]) == 0:
+            while True:
+                chunk = io_poller.read_nonblocking(fd)
+                if not chunk:
                     break
+                data.append(chunk)
             data = "".join(data)
         else:
             # perform a single read
-            data = os.read(pipe.fileno(), 1024)
+            data = os.read(fd, io_poller.READ_SIZE)
         buf.write(data)
         tee.write(data)
+        return bool(data)
 
     def cleanup(self):
         self.stdout_tee.flush()
@@ -180,83 +190,55 @@ class AsyncJob(BgJob):
         else:
             self.kill_func = kill_func
 
-        if self.string_stdin:
-            self.stdin_lock = Lock()
-            string_stdin = self.string_stdin
-            # replace with None so that _wait_for_commands will not try to re-write it
-            self.string_stdin = None
-            self.stdin_thread = Thread(target=AsyncJob._stdin_string_drainer, name=("%s-stdin" % command),
-                                       args=(string_stdin, self.sp.stdin))
-            self.stdin_thread.daemon = True
-            self.stdin_thread.start()
-
         self.stdout_lock = Lock()
         self.stdout_file = StringIO.StringIO()
-        self.stdout_thread = Thread(target=AsyncJob._fd_drainer, name=("%s-stdout" % command),
-                                    args=(self.sp.stdout, [self.stdout_file, self.stdout_tee],
-                                          self.stdout_lock))
-        self.stdout_thread.daemon = True
-
         self.stderr_lock = Lock()
         self.stderr_file = StringIO.StringIO()
-        self.stderr_thread = Thread(target=AsyncJob._fd_drainer, name=("%s-stderr" % command),
-                                    args=(self.sp.stderr, [self.stderr_file, self.stderr_tee],
-                                          self.stderr_lock))
-        self.stderr_thread.daemon = True
+        # set once the end of the output was read
+        self.stdout_closed = Event()
+        self.stderr_closed = Event()
 
-        self.stdout_thread.start()
-        self.stderr_thread.start()
-
-    @staticmethod
-    def _stdin_string_drainer(input_string, stdin_pipe):
-        """
-        input is a string and output is PIPE
-        """
-        try:
-            while True:
-                # we can write PIPE_BUF bytes without blocking after a poll or
-                # select we aren't doing either but let's write small chunks
-                # anyway. POSIX requires PIPE_BUF is >= 512
-                # 512 should be replaced with select.PIPE_BUF in Python 2.7+
-                tmp = input_string[:512]
-                if tmp == '':
-                    break
-                stdin_pipe.write(tmp)
-                input_string = input_string[512:]
-        finally:
-            # close reading PIPE so that the reader doesn't block
-            stdin_pipe.close()
+        # the pipes are serviced by a reactor thread shared by all the
+        # AsyncJob instances of the process
+        reactor = io_poller.get_reactor()
+        if self.string_stdin:
+            string_stdin = self.string_stdin
+            # replace with None so that _wait_for_commands will not try to
+            # re-write it
+            self.string_stdin = None
+            reactor.add_writer(self.sp.stdin, string_stdin)
+        reactor.add_reader(self.sp.stdout, self._output_handler(
+            [self.stdout_file, self.stdout_tee], self.stdout_lock,
+            self.stdout_closed))
+        reactor.add_reader(self.sp.stderr, self._output_handler(
+            [self.stderr_file, self.stderr_tee], self.stderr_lock,
+            self.stderr_closed))
 
     @staticmethod
-    def _fd_drainer(input_pipe, outputs, lock):
+    def _output_handler(outputs, lock, closed):
         """
-        input is a pipe and output is file-like. if lock is non-None, then
-        we assume output isn't thread-safe
+        :return: a reactor reader writing the data read from a pipe to the
+                file-like outputs while holding lock, and setting the closed
+                event at the end of the data.
         """
-        # if we don't have a lock object, then call a noop function like bool
-        acquire = getattr(lock, 'acquire', bool)
-        release = getattr(lock, 'release', bool)
-        writable_objs = [obj for obj in outputs if hasattr(obj, 'write')]
-        fileno = input_pipe.fileno()
-        while True:
-            # 1024 because that's what we did before
-            tmp = os.read(fileno, 1024)
-            if tmp == '':
-                break
-            acquire()
+        def handler(data):
+            if not data:
+                closed.set()
+                return
+            lock.acquire()
             try:
-                for f in writable_objs:
-                    f.write(tmp)
+                for output in outputs:
+                    output.write(data)
             finally:
-                release()
-        # don't close writeable_objs, the callee will close
+                lock.release()
+        return handler
 
     def output_prepare(self, stdout_file=None, stderr_file=None):
         raise NotImplementedError("This object automatically prepares its own "
                                   "output")
 
     def process_output(self, stdout=True, final_read=False):
-        raise NotImplementedError("This object has background threads "
+        raise NotImplementedError("This object has a background thread "
                                   "automatically polling the process. Use the "
                                   "locked accessors")
 
@@ -281,6 +263,22 @@ class AsyncJob(BgJob):
         except OSError:
             pass  # don't care if the process is already gone
 
+    def _poll_until(self, stop_time):
+        """
+        Poll the process, sleeping longer between each try, until it exits
+        or stop_time.
+
+        :return: the exit status, None if the process is still running.
+        """
+        delay = 0.001
+        while True:
+            exit_status = self.sp.poll()
+            time_left = stop_time - time.time()
+            if exit_status is not None or time_left <= 0:
+                return exit_status
+            time.sleep(min(delay, time_left))
+            delay = min(delay * 2, 0.1)
+
     def wait_for(self, timeout=None):
         """
         Wait for the process to finish. When timeout is provided, process is
@@ -292,23 +290,16 @@ class AsyncJob(BgJob):
             self.sp.wait()
 
         if timeout > 0:
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                self.result.exit_status = self.sp.poll()
-                if self.result.exit_status is not None:
-                    break
+            self.result.exit_status = self._poll_until(time.time() + timeout)
         else:
             timeout = 1     # Increase the timeout to check if it really died
-        # first need to kill the threads and process, then no more locking
-        # issues for superclass's cleanup function
+        # first need to kill the process, then the output is complete for
+        # superclass's cleanup function
         self.kill_func()
         # Verify it was really killed with provided kill function
-        stop_time = time.time() + timeout
-        while time.time() < stop_time:
-            self.result.exit_status = self.sp.poll()
-            if self.result.exit_status is not None:
-                break
-        else:   # Process is immune against self.kill_func() use -9
+        self.result.exit_status = self._poll_until(time.time() + timeout)
+        if self.result.exit_status is None:
+            # Process is immune against self.kill_func() use -9
             try:
                 os.kill(self.sp.pid, signal.SIGKILL)
             except OSError:
@@ -322,10 +313,10 @@ class AsyncJob(BgJob):
         assert self.result.exit_status is not None
 
         # make sure we've got stdout and stderr
-        self.stdout_thread.join(1)
-        self.stderr_thread.join(1)
-        assert not self.stdout_thread.isAlive()
-        assert not self.stderr_thread.isAlive()
+        self.stdout_closed.wait(1)
+        self.stderr_closed.wait(1)
+        assert self.stdout_closed.is_set()
+        assert self.stderr_closed.is_set()
 
         super(AsyncJob, self).cleanup()
 
@@ -1054,78 +1045,121 @@ def join_bg_jobs(bg_jobs, timeout=None):
     return bg_jobs
 
 
+# seconds between the checks for processes that exited while their output
+# pipes are still open (held by processes they left in the background)
+EXIT_CHECK_INTERVAL = 1.0
+
+
 def _wait_for_commands(bg_jobs, start_time, timeout):
     # This returns True if it must return due to a timeout, otherwise False.
 
-    # To check for processes which terminate without producing any output
-    # a 1 second timeout is used in select.
-    SELECT_TIMEOUT = 1
-
-    read_list = []
-    write_list = []
-    reverse_dict = {}
+    # The pipes are watched with a poller, and the processes are polled when
+    # the end of their stdout and stderr was read (sooner and sooner until
+    # they are reaped), and once every EXIT_CHECK_INTERVAL otherwise.
+    poller = io_poller.Poller()
+    # fd -> (bg_job, is_stdout), is_stdout being None for stdin
+    fd_map = {}
+    job_fds = {}
+    stdin_offsets = {}
+    running = set()
+    # heap of (time, sequence, bg_job, delay) of the exit checks, only the
+    # last one scheduled for each job counts
+    checks = []
+    last_check = {}
+    sequence = itertools.count()
+
+    def schedule_check(bg_job, delay):
+        last_check[bg_job] = next(sequence)
+        heapq.heappush(checks, (time.time() + delay, last_check[bg_job],
+                                bg_job, delay))
+
+    def unregister(fd):
+        poller.unregister(fd)
+        bg_job, is_stdout = fd_map.pop(fd)
+        job_fds[bg_job].remove(fd)
+        if is_stdout is None:
+            bg_job.sp.stdin.close()
+
+    def write_stdin(fd, bg_job):
+        # the command may exit without reading all its input
+        offset = stdin_offsets[bg_job]
+        try:
+            stdin_offsets[bg_job] += io_poller.write_nonblocking(
+                fd, buffer(bg_job.string_stdin, offset, io_poller.WRITE_SIZE))
+        except OSError, e:
+            if e.errno != errno.EPIPE:
+                raise
+            stdin_offsets[bg_job] = len(bg_job.string_stdin)
+        # no more input data, close stdin, remove it from the poller
+        if stdin_offsets[bg_job] >= len(bg_job.string_stdin):
+            bg_job.string_stdin = ''
+            unregister(fd)
 
     for bg_job in bg_jobs:
-        read_list.append(bg_job.sp.stdout)
-        read_list.append(bg_job.sp.stderr)
-        reverse_dict[bg_job.sp.stdout] = (bg_job, True)
-        reverse_dict[bg_job.sp.stderr] = (bg_job, False)
+        job_fds[bg_job] = set()
+        for pipe, is_stdout in ((bg_job.sp.stdout, True),
+                                (bg_job.sp.stderr, False)):
+            fd_map[pipe.fileno()] = (bg_job, is_stdout)
         if bg_job.string_stdin is not None:
-            write_list.append(bg_job.sp.stdin)
-            reverse_dict[bg_job.sp.stdin] = bg_job
+            io_poller.set_nonblocking(bg_job.sp.stdin.fileno())
+            fd_map[bg_job.sp.stdin.fileno()] = (bg_job, None)
+            stdin_offsets[bg_job] = 0
+        running.add(bg_job)
+        schedule_check(bg_job, EXIT_CHECK_INTERVAL)
+    for fd, (bg_job, is_stdout) in fd_map.iteritems():
+        job_fds[bg_job].add(fd)
+        if is_stdout is None:
+            poller.register(fd, io_poller.WRITE)
+        else:
+            poller.register(fd, io_poller.READ)
 
     if timeout:
         stop_time = start_time + timeout
-        time_left = stop_time - time.time()
     else:
-        time_left = None  # so that select never times out
-
-    while not timeout or time_left > 0:
-        # select will return when we may write to stdin or when there is
-        # stdout/stderr output we can read (including when it is
-        # EOF, that is the process has terminated).
-        read_ready, write_ready, _ = select.select(read_list, write_list, [],
-                                                   SELECT_TIMEOUT)
-
-        # os.read() has to be used instead of
-        # subproc.stdout.read() which will otherwise block
-        for file_obj in read_ready:
-            bg_job, is_stdout = reverse_dict[file_obj]
-            bg_job.process_output(is_stdout)
-
-        for file_obj in write_ready:
-            # we can write PIPE_BUF bytes without blocking
-            # POSIX requires PIPE_BUF is >= 512
-            bg_job = reverse_dict[file_obj]
-            file_obj.write(bg_job.string_stdin[:512])
-            bg_job.string_stdin = bg_job.string_stdin[512:]
-            # no more input data, close stdin, remove it from the select set
-            if not bg_job.string_stdin:
-                file_obj.close()
-                write_list.remove(file_obj)
-                del reverse_dict[file_obj]
-
-        all_jobs_finished = True
-        for bg_job in bg_jobs:
-            if bg_job.result.exit_status is not None:
-                continue
+        stop_time = None  # so that the poller never times out
 
-            bg_job.result.exit_status = bg_job.sp.poll()
-            if bg_job.result.exit_status is not None:
-                # process exited, remove its stdout/stdin from the select set
-                bg_job.result.duration = time.time() - start_time
-                read_list.remove(bg_job.sp.stdout)
-                read_list.remove(bg_job.sp.stderr)
-                del reverse_dict[bg_job.sp.stdout]
-                del reverse_dict[bg_job.sp.stderr]
-            else:
-                all_jobs_finished = False
-
-        if all_jobs_finished:
-            return False
+    try:
+        while True:
+            now = time.time()
+            while checks and checks[0][0] <= now:
+                _, check, bg_job, delay = heapq.heappop(checks)
+                if last_check.get(bg_job) != check:
+                    continue
+                bg_job.result.exit_status = bg_job.sp.poll()
+                if bg_job.result.exit_status is None:
+                    schedule_check(bg_job, min(delay * 2, EXIT_CHECK_INTERVAL))
+                    continue
+                # process exited, remove its pipes from the poller, what is
+                # left of its output is read by join_bg_jobs()
+                bg_job.result.duration = now - start_time
+                running.remove(bg_job)
+                del last_check[bg_job]
+                for fd in list(job_fds[bg_job]):
+                    unregister(fd)
+
+            if not running:
+                return False
+            if stop_time is not None and now >= stop_time:
+                break
 
-        if timeout:
-            time_left = stop_time - time.time()
+            # the poller returns when we may write to stdin or when there is
+            # stdout/stderr output we can read (including when it is EOF, that
+            # is the process has terminated)
+            wait = checks[0][0] - now
+            if stop_time is not None:
+                wait = min(wait, stop_time - now)
+            for fd, _ in poller.poll(wait):
+                bg_job, is_stdout = fd_map[fd]
+                if is_stdout is None:
+                    write_stdin(fd, bg_job)
+                elif not bg_job.process_output(is_stdout):
+                    unregister(fd)
+                    if not any(fd_map[job_fd][1] is not None
+                               for job_fd in job_fds[bg_job]):
+                        # the process is most likely exiting
+                        schedule_check(bg_job, 0.001)
+    finally:
+        poller.close()
 
     # Kill all processes which did not complete prior to timeout
     for bg_job in bg_jobs:
@@ -3,8 +3,11 @@
 import StringIO
 import logging
 import os
+import resource
 import socket
 import subprocess
+import threading
+import time
 import unittest
 import urllib2
 
@@ -12,7 +15,6 @@ try:
     import autotest.common as common  # pylint: disable=W0611
 except ImportError:
     import common  # pylint: disable=W0611
-from autotest.client.shared.mock import MagicMock, patch
 from autotest.client.shared import utils, autotemp
 from autotest.client.shared.test_utils import mock
 
@@ -664,6 +666,38 @@ class test_run(unittest.TestCase):
         self.__check_result(utils.run(cmd, verbose=False, stdin='hi!\n'),
                             cmd, stdout='hi!\n')
 
+    def test_stdin_large_string(self):
+        data = 'x' * (4 * 1024 * 1024)
+        self.__check_result(utils.run('cat', verbose=False, stdin=data),
+                            'cat', stdout=data)
+
+    def test_large_output(self):
+        cmd = 'head -c 4194304 /dev/zero && echo error >&2'
+        self.__check_result(utils.run(cmd, verbose=False), cmd,
+                            stdout='\0' * 4194304, stderr='error\n')
+
+    def test_background_child_holding_output(self):
+        # the command exits while sleep keeps its stdout and stderr open
+        cmd = 'sleep 10 & echo output'
+        start_time = time.time()
+        self.__check_result(utils.run(cmd, verbose=False), cmd,
+                            stdout='output\n')
+        self.assertTrue(time.time() - start_time < 5)
+
+    def test_parallel(self):
+        # more pipes than select() can watch, if allowed to open them
+        soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        count = min(600, (soft_limit - 100) / 3)
+        commands = ['echo %d && echo error %d >&2' % (i, i)
+                    for i in xrange(count)]
+        for _ in commands:
+            utils.logging.debug.expect_any_call()
+        results = utils.run_parallel(commands)
+        self.assertEqual([result.stdout for result in results],
+                         ['%d\n' % i for i in xrange(count)])
+        self.assertEqual([result.stderr for result in results],
+                         ['error %d\n' % i for i in xrange(count)])
+
     def test_safe_args(self):
         cmd = 'echo "hello \\"world" "again"'
         self.__check_result(utils.run(
@@ -983,77 +1017,34 @@ class test_VersionableClass(unittest.TestCase):
 
 class test_AsyncJob(unittest.TestCase):
 
-    @staticmethod
-    def make_thread_mock():
-        class ThreadMock(object):
-
-            def __init__(self, *args, **kwargs):
-                self.daemon = False
-                self.args = args
-                self.kwargs = kwargs
-
-            def start(self):
-                self.start_called = True
-
-        return ThreadMock
-
-    def test_drainer(self):
-        output = MagicMock()
-        outputs = [output]
-        read_values = ['asdf', '']
-
-        def pop_values(*args):
-            return read_values.pop(0)
-        read_mock = MagicMock(side_effect=pop_values)
-
-        @patch("os.read", read_mock)
-        def _():
-            utils.AsyncJob._fd_drainer(MagicMock(), outputs, MagicMock())
-        _()
-
-    def test_init_stdin_is_None(self):
-        @patch.object(utils, "Thread")
-        @patch.object(utils, "Lock")
-        @patch("subprocess.Popen")
-        def _(lock_mock, thread_mock, popen_mock):
-            job = utils.AsyncJob("command", stdin=None)
-            assert lock_mock.called
-            assert thread_mock.called
-            assert not hasattr(job, "stdin_thread")
-            assert not hasattr(job, "stdin_lock")
-            assert job.string_stdin is None
-        _()
-
-    def test_init_stdin_is_string(self):
-
-        @patch.object(utils, "Thread", new_callable=self.make_thread_mock)
-        @patch.object(utils, "Lock")
-        @patch("subprocess.Popen")
-        def _(lock_mock, thread_mock, popen_mock):
-            job = utils.AsyncJob("echo", stdin="foobar")
-            assert lock_mock.called
-            assert job.stdin_thread.kwargs['name'] == 'echo-stdin'
-            assert job.stdin_thread.kwargs['args'][0] == 'foobar'
-            assert hasattr(job, "stdin_thread")
-            assert hasattr(job, "stdin_lock")
-            assert job.string_stdin is None
-        _()
-
-    def test_init_stdin_is_file(self):
-        @patch.object(utils, "Thread", new_callable=self.make_thread_mock)
-        @patch.object(utils, "Lock")
-        @patch("subprocess.Popen")
-        def _(lock_mock, thread_mock, popen_mock):
-            job = utils.AsyncJob("echo", stdin=MagicMock(spec=file))
-            assert lock_mock.called
-            assert job.stdout_thread.kwargs['name'] == 'echo-stdout'
-            assert job.stderr_thread.kwargs['name'] == 'echo-stderr'
-            assert hasattr(job, "stdout_thread")
-            assert hasattr(job, "stdout_lock")
-            assert hasattr(job, "stderr_thread")
-            assert hasattr(job, "stderr_lock")
-            assert job.string_stdin is None
-        _()
+    def test_output(self):
+        job = utils.AsyncJob('echo output && echo error >&2', verbose=False)
+        result = job.wait_for()
+        self.assertEqual(result.exit_status, 0)
+        self.assertEqual(result.stdout, 'output\n')
+        self.assertEqual(result.stderr, 'error\n')
+
+    def test_stdin_is_string(self):
+        data = 'x' * (1024 * 1024)
+        job = utils.AsyncJob('cat', stdin=data, verbose=False)
+        assert job.string_stdin is None
+        self.assertEqual(job.wait_for().stdout, data)
+
+    def test_get_stdout_while_running(self):
+        job = utils.AsyncJob('echo started && exec sleep 10', verbose=False)
+        utils.wait_for(lambda: job.get_stdout(), 5, step=0.01)
+        self.assertEqual(job.get_stdout(), 'started\n')
+        result = job.wait_for(timeout=0)
+        self.assertEqual(result.stdout, 'started\n')
+        self.assertNotEqual(result.exit_status, 0)
+
+    def test_jobs_share_one_thread(self):
+        utils.AsyncJob('true', verbose=False).wait_for()
+        threads = threading.active_count()
+        jobs = [utils.AsyncJob('true', verbose=False) for _ in xrange(10)]
+        self.assertEqual(threading.active_count(), threads)
+        for job in jobs:
+            self.assertEqual(job.wait_for().exit_status, 0)
 
 
 if __name__ == "__main__":
@@ -173,6 +173,10 @@ class DatabaseConnection(object):
       should be passed to the constructor, not set later, and may be None, in
       which case information must be passed to connect().
     * debug - if set True, all queries will be printed before being executed
+    * pre_execute_hook - if set, called with no arguments before each query is
+      executed
+    * queries_executed, rows_fetched - running totals of the queries executed
+      and of the rows they returned
     """
     _DATABASE_ATTRIBUTES = ('db_type', 'host', 'username', 'password',
                             'db_name')
@@ -182,6 +186,9 @@ class DatabaseConnection(object):
         self._backend = None
         self.rowcount = None
         self.debug = debug
+        self.pre_execute_hook = None
+        self.queries_executed = 0
+        self.rows_fetched = 0
 
         # reconnect defaults
         self.reconnect_enabled = True
@@ -265,6 +272,8 @@ class DatabaseConnection(object):
         Execute a query and return cursor.fetchall(). try_reconnecting, if
         passed, will override self.reconnect_enabled.
         """
+        if self.pre_execute_hook:
+            self.pre_execute_hook()
         if self.debug:
             logging.debug('Executing %s, %s', query, parameters)
         # _connect_backend() contains a retry loop, so don't loop here
@@ -279,6 +288,9 @@ class DatabaseConnection(object):
             results = self._backend.execute(query, parameters)
 
         self.rowcount = self._backend.rowcount
+        self.queries_executed += 1
+        if results:
+            self.rows_fetched += len(results)
         return results
 
     def get_database_info(self):
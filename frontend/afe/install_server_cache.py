@@ -0,0 +1,163 @@
+"""
+Systems and profiles of the install server, for the RPCs listing hosts and
+profiles.
+
+get_hosts() used to ask the cobbler XML-RPC API for the system and the
+profiles of every host it listed, one call after the other.  An
+InstallServerCache keeps the answers for INSTALL_SERVER.cache_ttl seconds,
+and looks up the systems of the hosts not cached yet concurrently, through
+at most INSTALL_SERVER.max_connections connections which are kept open
+between calls.
+"""
+
+import Queue
+import threading
+import time
+import xmlrpclib
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+from autotest.server import subcommand
+from autotest.server.hosts.remote import get_install_server_info
+
+
+class InstallServerCache(object):
+
+    """The systems and profiles of a cobbler install server."""
+
+    def __init__(self, url, ttl=None, max_connections=None):
+        """
+        :param url: the URL of the XML-RPC API of the install server.
+        :param ttl: seconds during which the answers of the install server
+                are used, INSTALL_SERVER.cache_ttl by default.
+        :param max_connections: maximum number of calls made at the same
+                time, INSTALL_SERVER.max_connections by default.
+        """
+        if ttl is None:
+            ttl = settings.get_value('INSTALL_SERVER', 'cache_ttl', type=int,
+                                     default=60)
+        if max_connections is None:
+            max_connections = settings.get_value('INSTALL_SERVER',
+                                                 'max_connections', type=int,
+                                                 default=8)
+        self.url = url
+        self.ttl = ttl
+        self.max_connections = max(max_connections, 1)
+        self._connections = Queue.Queue()
+        self._connection_count = 0
+        self._lock = threading.Lock()
+        # hostname -> (time fetched, systems named hostname)
+        self._systems = {}
+        # (time fetched, profile names)
+        self._profiles = None
+        self.calls = 0
+
+    def _get_connection(self):
+        """Take an idle connection, or open one if there are not too many."""
+        self._lock.acquire()
+        try:
+            self.calls += 1
+            if (self._connections.empty() and
+                    self._connection_count < self.max_connections):
+                self._connection_count += 1
+                return xmlrpclib.ServerProxy(self.url)
+        finally:
+            self._lock.release()
+        return self._connections.get()
+
+    def _call(self, method, *args):
+        connection = self._get_connection()
+        try:
+            return getattr(connection, method)(*args)
+        finally:
+            self._connections.put(connection)
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.time() - entry[0] < self.ttl
+
+    def _find_system(self, hostname):
+        systems = self._call('find_system', {'name': hostname}, True)
+        self._systems[hostname] = (time.time(), systems)
+        return systems
+
+    def get_profiles(self):
+        """:return: a list of the names of the profiles."""
+        entry = self._profiles
+        if not self._is_fresh(entry):
+            entry = (time.time(), self._call('get_item_names', 'profile'))
+            self._profiles = entry
+        return list(entry[1])
+
+    def find_systems(self, hostnames):
+        """
+        :param hostnames: names of hosts.
+        :return: a dictionary mapping each of hostnames to the list of the
+                systems of the install server with that name (as returned
+                by find_system).
+        :raise: the error of the first lookup which failed.
+        """
+        systems_by_name = {}
+        tasks = []
+        for hostname in set(hostnames):
+            entry = self._systems.get(hostname)
+            if self._is_fresh(entry):
+                systems_by_name[hostname] = entry[1]
+            else:
+                tasks.append(subcommand.subcommand(self._find_system,
+                                                   (hostname,)))
+        if len(tasks) == 1:
+            hostname = tasks[0].args[0]
+            systems_by_name[hostname] = self._find_system(hostname)
+        elif tasks:
+            for task in subcommand.parallel_iter(
+                    tasks, max_parallel=self.max_connections, threads=True):
+                if task.returncode != 0:
+                    raise task.result
+                systems_by_name[task.args[0]] = task.result
+        return systems_by_name
+
+    def invalidate(self, hostnames=None):
+        """
+        Forget what the install server answered.
+
+        :param hostnames: the hosts whose systems are looked up again, by
+                default all of them, along with the profiles.
+        """
+        if hostnames is None:
+            self._systems = {}
+            self._profiles = None
+        else:
+            for hostname in hostnames:
+                self._systems.pop(hostname, None)
+
+
+# xmlrpc url -> InstallServerCache
+_caches = {}
+
+
+def get_install_server_cache():
+    """
+    :return: the InstallServerCache of the configured install server, None
+            if there is no cobbler install server configured.
+    """
+    server_info = get_install_server_info()
+    url = server_info.get('xmlrpc_url')
+    if server_info.get('type') != 'cobbler' or not url:
+        return None
+    cache = _caches.get(url)
+    if cache is None:
+        cache = _caches[url] = InstallServerCache(url)
+    return cache
+
+
+def invalidate(hostnames=None):
+    """
+    Forget what the configured install server answered, after AFE changed
+    what it will install on hosts (see InstallServerCache.invalidate()).
+    """
+    cache = get_install_server_cache()
+    if cache is not None:
+        cache.invalidate(hostnames)
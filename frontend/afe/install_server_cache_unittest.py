@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+import SimpleXMLRPCServer
+import SocketServer
+import threading
+import time
+import unittest
+import xmlrpclib
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.frontend.afe import install_server_cache
+
+
+class _ThreadingXMLRPCServer(SocketServer.ThreadingMixIn,
+                             SimpleXMLRPCServer.SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class _FakeCobbler(object):
+
+    """The part of the cobbler API used by the frontend."""
+
+    def __init__(self):
+        self.systems = {'host1': {'name': 'host1', 'profile': 'rhel6'},
+                        'host2': {'name': 'host2', 'profile': 'fedora'}}
+        self.profiles = ['rhel6', 'fedora']
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def find_system(self, criteria, return_dicts):
+        self._lock.acquire()
+        self.calls.append(('find_system', criteria['name']))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self._lock.release()
+        time.sleep(0.05)
+        self._lock.acquire()
+        self.running -= 1
+        self._lock.release()
+        if criteria['name'] == 'broken':
+            raise ValueError('lookup failed')
+        system = self.systems.get(criteria['name'])
+        return system and [system] or []
+
+    def get_item_names(self, what):
+        self.calls.append(('get_item_names', what))
+        return self.profiles
+
+
+class InstallServerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _ThreadingXMLRPCServer(('localhost', 0),
+                                             logRequests=False)
+        self.cobbler = _FakeCobbler()
+        self.server.register_instance(self.cobbler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://localhost:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _cache(self, ttl=60, max_connections=3):
+        return install_server_cache.InstallServerCache(
+            self.url, ttl=ttl, max_connections=max_connections)
+
+    def test_find_systems(self):
+        cache = self._cache()
+        hostnames = ['host1', 'host2'] + ['other%d' % i for i in xrange(7)]
+        systems = cache.find_systems(hostnames)
+        self.assertEqual(set(hostnames), set(systems))
+        self.assertEqual([{'name': 'host1', 'profile': 'rhel6'}],
+                         systems['host1'])
+        self.assertEqual([], systems['other1'])
+        self.assertEqual(3, self.cobbler.max_running)
+        self.assertEqual(9, len(self.cobbler.calls))
+
+        # cached
+        self.assertEqual(systems, cache.find_systems(hostnames))
+        self.assertEqual(9, len(self.cobbler.calls))
+
+        cache.invalidate(['host1'])
+        cache.find_systems(hostnames)
+        self.assertEqual(('find_system', 'host1'), self.cobbler.calls[-1])
+        self.assertEqual(10, len(self.cobbler.calls))
+
+    def test_profiles(self):
+        cache = self._cache()
+        profiles = cache.get_profiles()
+        self.assertEqual(['rhel6', 'fedora'], profiles)
+        profiles.sort()
+        self.assertEqual(['rhel6', 'fedora'], cache.get_profiles())
+        self.assertEqual(1, len(self.cobbler.calls))
+
+        cache.invalidate()
+        cache.get_profiles()
+        self.assertEqual(2, len(self.cobbler.calls))
+
+    def test_ttl(self):
+        cache = self._cache(ttl=0)
+        cache.find_systems(['host1'])
+        cache.find_systems(['host1'])
+        cache.get_profiles()
+        cache.get_profiles()
+        self.assertEqual(4, len(self.cobbler.calls))
+
+    def test_errors(self):
+        cache = self._cache()
+        self.assertRaises(xmlrpclib.Fault, cache.find_systems,
+                          ['host1', 'broken'])
+        self.assertRaises(xmlrpclib.Fault, cache.find_systems, ['broken'])
+        # the connections are still usable
+        self.assertEqual(['host2'], cache.find_systems(['host2']).keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
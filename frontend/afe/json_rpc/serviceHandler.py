@@ -20,6 +20,7 @@
 """
 
 import traceback
+import types
 
 from simplejson import decoder, encoder
 
@@ -50,6 +51,9 @@ def customConvertJson(value):
 json_encoder = encoder.JSONEncoder()
 json_decoder = decoder.JSONDecoder()
 
+# approximate size of the pieces of a streamed result
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 def ServiceMethod(fn):
     fn.IsServiceMethod = True
@@ -135,6 +139,47 @@ class ServiceHandler(object):
     def invokeServiceEndpoint(self, meth, args):
         return meth(*args)
 
+    @staticmethod
+    def isStreamedResult(result_dict):
+        """
+        :return: True if the result is a generator, to be encoded by
+                 iterateResult()
+        """
+        return (result_dict['err'] is None and
+                isinstance(result_dict['result'], types.GeneratorType))
+
+    @staticmethod
+    def iterateResult(result_dict):
+        """
+        Like translateResult() for a result which is a generator: yield the
+        json result in pieces, encoding the items of the result as the
+        generator produces them.
+
+        An error raised while iterating is returned after the items encoded
+        until then.
+        """
+        yield '{"id": %s, "result": [' % json_encoder.encode(result_dict['id'])
+        pieces = []
+        size = 0
+        separator = ''
+        error = None
+        try:
+            for item in result_dict['result']:
+                data = separator + json_encoder.encode(item)
+                separator = ', '
+                pieces.append(data)
+                size += len(data)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield ''.join(pieces)
+                    pieces = []
+                    size = 0
+        except Exception as err:
+            error = {'name': err.__class__.__name__,
+                     'message': str(err),
+                     'traceback': traceback.format_exc()}
+        pieces.append('], "error": %s}' % json_encoder.encode(error))
+        yield ''.join(pieces)
+
     @staticmethod
     def translateResult(result_dict):
         """
@@ -142,6 +187,9 @@ class ServiceHandler(object):
                             and id.
         :return: translated json result
         """
+        if ServiceHandler.isStreamedResult(result_dict):
+            return ''.join(ServiceHandler.iterateResult(result_dict))
+
         if result_dict['err'] is not None:
             error_name = result_dict['err'].__class__.__name__
             result_dict['err'] = {'name': error_name,
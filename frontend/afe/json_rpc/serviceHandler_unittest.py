@@ -18,6 +18,13 @@ class RpcMethodHolder(object):
     def service_2(path):
         return path.split('/')[-1]
 
+    @staticmethod
+    def service_4(count, fail):
+        for index in xrange(count):
+            yield {'index': index}
+        if fail:
+            raise ValueError('no more rows')
+
 
 json_request1 = """
 {
@@ -68,6 +75,40 @@ class TestServiceHandler(unittest.TestCase):
         response_obj = eval(response.replace('null', 'None'))
         self.assertNotEquals(response_obj['error'], 'None')
 
+    def _stream(self, count, fail=False):
+        request = {'method': 'service_4', 'params': [count, fail], 'id': 1}
+        results = self.serviceHandler.dispatchRequest(request)
+        self.assertTrue(self.serviceHandler.isStreamedResult(results))
+        return list(self.serviceHandler.iterateResult(results))
+
+    def test_iterateResult(self):
+        chunks = self._stream(3)
+        self.assertEquals(serviceHandler.json_decoder.decode(''.join(chunks)),
+                          {'id': 1, 'error': None,
+                           'result': [{'index': 0}, {'index': 1},
+                                      {'index': 2}]})
+        self.assertEquals(''.join(self._stream(0)),
+                          '{"id": 1, "result": [], "error": null}')
+
+        chunks = self._stream(10000)
+        self.assertTrue(len(chunks) > 2)
+        response = serviceHandler.json_decoder.decode(''.join(chunks))
+        self.assertEquals(len(response['result']), 10000)
+
+    def test_iterateResult_error(self):
+        response = serviceHandler.json_decoder.decode(
+            ''.join(self._stream(2, fail=True)))
+        self.assertEquals(response['result'], [{'index': 0}, {'index': 1}])
+        self.assertEquals(response['error']['name'], 'ValueError')
+
+    def test_translateResult_generator(self):
+        request = {'method': 'service_4', 'params': [2, False], 'id': None}
+        results = self.serviceHandler.dispatchRequest(request)
+        self.assertEquals(
+            self.serviceHandler.translateResult(results),
+            '{"id": null, "result": [{"index": 0}, {"index": 1}], '
+            '"error": null}')
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -8,6 +8,10 @@ from autotest.frontend.afe import readonly_connection
 from django.db import models as dbmodels, connection
 from django.db.models.sql import query
 
+# maximum number of values of the IN clauses of bulk queries and inserts,
+# kept below the 999 variables sqlite accepts per statement
+BULK_QUERY_SIZE = 500
+
 
 class ValidationError(Exception):
 
@@ -769,8 +773,9 @@ class ModelExtensions(object):
         self.save()
 
     # see query_objects()
-    _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'sort_by',
-                            'extra_args', 'extra_where', 'no_distinct')
+    _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'query_after',
+                            'sort_by', 'extra_args', 'extra_where',
+                            'no_distinct')
 
     @classmethod
     def _extract_special_params(cls, filter_data):
@@ -801,6 +806,14 @@ class ModelExtensions(object):
 
         query_start = special_params.get('query_start', None)
         query_limit = special_params.get('query_limit', None)
+        query_after = special_params.get('query_after', None)
+        if query_after is not None:
+            if sort_by or query_start is not None:
+                raise ValueError('Cannot pass query_after with sort_by or '
+                                 'query_start')
+            # keyset paging: the index on the primary key finds the first
+            # row, where an OFFSET would scan all the rows before it
+            query = query.filter(pk__gt=query_after).order_by('pk')
         if query_start is not None:
             if query_limit is None:
                 raise ValueError('Cannot pass query_start without query_limit')
@@ -817,6 +830,9 @@ class ModelExtensions(object):
         filter_data include:
         -query_start: index of first return to return
         -query_limit: maximum number of results to return
+        -query_after: return only the objects with a primary key greater
+         than this one, sorted by primary key.  To page through results,
+         pass the primary key of the last object of the previous page.
         -sort_by: list of fields to sort on.  prefixing a '-' onto a
          field name changes the sort to descending order.
         -extra_args: keyword args to pass to query.extra() (see Django
@@ -882,11 +898,18 @@ class ModelExtensions(object):
         """
         Like query_objects, but return a list of dictionaries.
         """
+        return list(cls.iter_objects(filter_data, initial_query=initial_query))
+
+    @classmethod
+    def iter_objects(cls, filter_data, initial_query=None):
+        """
+        Like list_objects, but yield the dictionaries as the rows are read,
+        without keeping the objects in the query cache.
+        """
         query = cls.query_objects(filter_data, initial_query=initial_query)
         extra_fields = query.query.extra_select.keys()
-        field_dicts = [model_object.get_object_dict(extra_fields=extra_fields)
-                       for model_object in query]
-        return field_dicts
+        for model_object in query.iterator():
+            yield model_object.get_object_dict(extra_fields=extra_fields)
 
     @classmethod
     def smart_get(cls, id_or_name, valid_only=True):
@@ -907,13 +930,50 @@ class ModelExtensions(object):
             'Invalid positional argument: %s (%s)' % (id_or_name,
                                                       type(id_or_name)))
 
+    @classmethod
+    def _get_bulk_by_field(cls, field, values):
+        """
+        :return: a dictionary mapping the value of field of the valid objects
+                having one of values to the objects.
+        """
+        manager = cls.get_valid_manager()
+        objects_by_value = {}
+        values = list(set(values))
+        for index in xrange(0, len(values), BULK_QUERY_SIZE):
+            query = manager.filter(**{
+                field + '__in': values[index:index + BULK_QUERY_SIZE]})
+            for model_object in query:
+                objects_by_value[getattr(model_object, field)] = model_object
+        return objects_by_value
+
     @classmethod
     def smart_get_bulk(cls, id_or_name_list):
+        """
+        Like smart_get() for every item of id_or_name_list, with one query
+        per BULK_QUERY_SIZE ids or names.
+        """
+        ids = [id_or_name for id_or_name in id_or_name_list
+               if isinstance(id_or_name, (int, long))]
+        objects_by_id = cls._get_bulk_by_field('pk', ids)
+        objects_by_name = {}
+        if hasattr(cls, 'name_field'):
+            names = [id_or_name for id_or_name in id_or_name_list
+                     if isinstance(id_or_name, basestring)]
+            objects_by_name = cls._get_bulk_by_field(cls.name_field, names)
+
         invalid_inputs = []
         result_objects = []
         for id_or_name in id_or_name_list:
+            if isinstance(id_or_name, (int, long)):
+                model_object = objects_by_id.get(id_or_name)
+            else:
+                model_object = objects_by_name.get(id_or_name)
             try:
-                result_objects.append(cls.smart_get(id_or_name))
+                if model_object is None:
+                    # names may match case insensitively (MySQL), and
+                    # invalid arguments raise the errors of smart_get()
+                    model_object = cls.smart_get(id_or_name)
+                result_objects.append(model_object)
             except cls.DoesNotExist:
                 invalid_inputs.append(id_or_name)
         if invalid_inputs:
@@ -3,7 +3,7 @@ import os
 from datetime import datetime
 from xml.sax import saxutils
 
-from django.db import models as dbmodels, connection
+from django.db import models as dbmodels, connection, transaction
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -769,7 +769,8 @@ class AclGroup(dbmodels.Model, model_logic.ModelExtensions):
         if user.is_superuser():
             return
         accessible_host_ids = set(
-            host.id for host in Host.objects.filter(aclgroup__users=user))
+            Host.objects.filter(aclgroup__users=user).values_list('id',
+                                                                  flat=True))
         unaccessible = []
         for host in hosts:
             # Check if the user has access to this host,
@@ -1227,7 +1228,18 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
         super(Job, self).save(*args, **kwargs)
 
     def queue(self, hosts, profiles, atomic_group=None, is_template=False):
-        """Enqueue a job on the given hosts."""
+        """
+        Enqueue a job on the given hosts.
+
+        The queue entries of all the hosts and labels, and the ineligible
+        host rows of the hosts, are inserted with multi-row statements in a
+        single transaction, so the time taken hardly depends on the number
+        of hosts.
+
+        :param hosts: the :class:`hosts <Host>` and the
+                      :class:`labels <Label>` (meta hosts) of the job
+        :param profiles: the profiles of the entries, in sync with hosts
+        """
         if not hosts:
             if atomic_group:
                 # No hosts or labels are required to queue an atomic group
@@ -1242,9 +1254,37 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
 
         if not profiles:
             profiles = [''] * len(hosts)
+        queue_entries = []
+        blocks = []
         for host, profile in zip(hosts, profiles):
-            host.enqueue_job(self, profile=profile, atomic_group=atomic_group,
-                             is_template=is_template)
+            if isinstance(host, Label):
+                queue_entry = HostQueueEntry.create(
+                    meta_host=host, job=self, profile=profile,
+                    is_template=is_template, atomic_group=atomic_group)
+            else:
+                queue_entry = HostQueueEntry.create(
+                    host=host, job=self, profile=profile,
+                    is_template=is_template, atomic_group=atomic_group)
+                # pylint: disable=E1123
+                blocks.append(IneligibleHostQueue(job=self, host=host))
+            queue_entries.append(queue_entry)
+
+        with transaction.commit_on_success():
+            # allow recovery of dead hosts from the frontend, as
+            # Host.enqueue_job() does
+            dead_hosts = [host for host in hosts
+                          if isinstance(host, Host) and host.is_dead()]
+            if dead_hosts:
+                busy_host_ids = set(HostQueueEntry.objects.filter(
+                    host__in=dead_hosts, active=True).values_list('host',
+                                                                  flat=True))
+                for host in dead_hosts:
+                    if host.id not in busy_host_ids:
+                        host.status = Host.Status.READY
+                        host.save()
+            HostQueueEntry.bulk_save(queue_entries)
+            IneligibleHostQueue.objects.bulk_create(
+                blocks, batch_size=model_logic.BULK_QUERY_SIZE)
 
     def create_recurring_job(self, start_date, loop_period, loop_count, owner):
         # pylint: disable=E1123
@@ -1347,6 +1387,21 @@ class HostQueueEntry(dbmodels.Model, model_logic.ModelExtensions):
         super(HostQueueEntry, self).save(*args, **kwargs)
         self._check_for_updated_attributes()
 
+    @classmethod
+    def bulk_save(cls, queue_entries):
+        """
+        Insert new entries with multi-row statements.
+
+        Like save(), the status changes of the entries are checked after the
+        insert.  Unlike save(), the ids of the entries are not set.
+        """
+        for queue_entry in queue_entries:
+            queue_entry._set_active_and_complete()
+        cls.objects.bulk_create(queue_entries,
+                                batch_size=model_logic.BULK_QUERY_SIZE)
+        for queue_entry in queue_entries:
+            queue_entry._check_for_updated_attributes()
+
     def execution_path(self):
         """
         Path to this entry's results (relative to the base results directory).
@@ -10,6 +10,7 @@ import pydoc
 import re
 import urllib
 
+import django.http
 from autotest.frontend.afe import models, rpc_utils
 from autotest.frontend.afe import rpcserver_logging
 from autotest.frontend.afe.json_rpc import serviceHandler
@@ -84,9 +85,13 @@ class RpcHandler(object):
         json_request = self.raw_request_data(request)
         decoded_request = self.decode_request(json_request)
         decoded_result = self.dispatch_request(decoded_request)
-        result = self.encode_result(decoded_result)
         if rpcserver_logging.LOGGING_ENABLED:
             self.log_request(user, decoded_request, decoded_result)
+        if self._dispatcher.isStreamedResult(decoded_result):
+            # sent with chunked encoding as the result is produced
+            return django.http.StreamingHttpResponse(
+                self._dispatcher.iterateResult(decoded_result))
+        result = self.encode_result(decoded_result)
         return rpc_utils.raw_http_response(result)
 
     def handle_jsonp_rpc_request(self, request):
@@ -32,7 +32,6 @@ __author__ = 'showard@google.com (Steve Howard)'
 import datetime
 import logging
 import os
-import xmlrpclib
 # psutil is a non stdlib import, it needs to be installed
 import psutil
 try:
@@ -41,7 +40,7 @@ except ImportError:
     import common  # pylint: disable=W0611
 from autotest.frontend.afe import models, model_logic, model_attributes
 from autotest.frontend.afe import control_file, rpc_utils, reservations
-from autotest.server.hosts.remote import get_install_server_info
+from autotest.frontend.afe import scheduler_wakeup, install_server_cache
 from autotest.client.shared import version
 from autotest.client.shared.settings import settings
 
@@ -50,7 +49,7 @@ from autotest.client.shared.settings import settings
 # IMPORTANT: please update INTERFACE_VERSION with the current date whenever
 # the interface changes, so that RPC clients can handle the changes
 #
-INTERFACE_VERSION = (2013, 9, 11)
+INTERFACE_VERSION = (2026, 10, 18)
 
 
 # labels
@@ -228,7 +227,10 @@ def modify_host(id, **data):
     rpc_utils.check_modify_host(data)
     host = models.Host.smart_get(id)
     rpc_utils.check_modify_host_locking(host, data)
+    hostname = host.hostname
     host.update_object(data)
+    install_server_cache.invalidate(set([hostname, host.hostname]))
+    scheduler_wakeup.notify()
 
 
 def modify_hosts(host_filter_data, update_data):
@@ -241,8 +243,13 @@ def modify_hosts(host_filter_data, update_data):
     """
     rpc_utils.check_modify_host(update_data)
     hosts = models.Host.query_objects(host_filter_data)
+    hostnames = set()
     for host in hosts:
+        hostnames.add(host.hostname)
         host.update_object(update_data)
+        hostnames.add(host.hostname)
+    install_server_cache.invalidate(hostnames)
+    scheduler_wakeup.notify()
 
 
 def host_add_labels(id, labels):
@@ -333,13 +340,13 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
     models.Host.objects.populate_relationships(hosts, models.HostAttribute,
                                                'attribute_list')
 
-    install_server = None
-    install_server_info = get_install_server_info()
-    install_server_type = install_server_info.get('type', None)
-    install_server_url = install_server_info.get('xmlrpc_url', None)
-
-    if install_server_type == 'cobbler' and install_server_url:
-        install_server = xmlrpclib.ServerProxy(install_server_url)
+    install_server = install_server_cache.get_install_server_cache()
+    if install_server is not None:
+        systems_by_name = install_server.find_systems(
+            [host_obj.hostname for host_obj in hosts])
+        use_current_profile = settings.get_value('INSTALL_SERVER',
+                                                 'use_current_profile',
+                                                 type=bool, default=True)
 
     host_dicts = []
     for host_obj in hosts:
@@ -353,8 +360,7 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
 
         error_encountered = True
         if install_server is not None:
-            system_params = {"name": host_dict['hostname']}
-            system_list = install_server.find_system(system_params, True)
+            system_list = systems_by_name[host_dict['hostname']]
 
             if len(system_list) < 1:
                 msg = 'System "%s" not found on install server'
@@ -362,10 +368,8 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
                 rpc_logger.info(msg, host_dict['hostname'])
 
             elif len(system_list) > 1:
-                msg = 'Found multiple systems on install server named %s'
-
-                if install_server_type == 'cobbler':
-                    msg = '%s. This should never happen on cobbler' % msg
+                msg = ('Found multiple systems on install server named %s. '
+                       'This should never happen on cobbler')
                 rpc_logger = logging.getLogger('rpc_logger')
                 rpc_logger.error(msg, host_dict['hostname'])
 
@@ -374,11 +378,9 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
 
                 if host_dict['platform']:
                     error_encountered = False
-                    profiles = sorted(install_server.get_item_names('profile'))
+                    profiles = sorted(install_server.get_profiles())
                     host_dict['profiles'] = profiles
                     host_dict['profiles'].insert(0, 'Do_not_install')
-                    use_current_profile = settings.get_value('INSTALL_SERVER',
-                                                             'use_current_profile', type=bool, default=True)
                     if use_current_profile:
                         host_dict['current_profile'] = system['profile']
                     else:
@@ -414,18 +416,11 @@ def get_install_server_profiles():
 
     :return: Sequence of profiles.
     """
-    install_server = None
-    install_server_info = get_install_server_info()
-    install_server_type = install_server_info.get('type', None)
-    install_server_url = install_server_info.get('xmlrpc_url', None)
-
-    if install_server_type == 'cobbler' and install_server_url:
-        install_server = xmlrpclib.ServerProxy(install_server_url)
-
+    install_server = install_server_cache.get_install_server_cache()
     if install_server is None:
         return None
 
-    return install_server.get_item_names('profile')
+    return install_server.get_profiles()
 
 
 def get_profiles():
@@ -922,13 +917,30 @@ def create_parameterized_job(name, priority, test, parameters, kernel=None,
         if parameters:
             raise Exception('Extra parameters remain: %r' % parameters)
 
-        return rpc_utils.create_job_common(
+        job_id = rpc_utils.create_job_common(
             parameterized_job=parameterized_job.id,
             control_type=control_type,
             **rpc_utils.get_create_job_common_args(args))
     except Exception:
         parameterized_job.delete()
         raise
+    _invalidate_installed_hosts(job_id, profiles)
+    scheduler_wakeup.notify()
+    return job_id
+
+
+def _invalidate_installed_hosts(job_id, profiles):
+    """
+    Forget the install server systems of the hosts a job installs a profile
+    on.
+    """
+    no_install = ('Do_not_install', 'N/A')
+    if [profile for profile in profiles if profile not in no_install]:
+        entries = models.HostQueueEntry.objects.filter(job=job_id,
+                                                       host__isnull=False)
+        install_server_cache.invalidate(
+            entries.exclude(profile__in=no_install).values_list(
+                'host__hostname', flat=True))
 
 
 def create_job(name, priority, control_file, control_type,
@@ -974,8 +986,11 @@ def create_job(name, priority, control_file, control_type,
     :returns: The created Job id number.
     :rtype: integer
     """
-    return rpc_utils.create_job_common(
+    job_id = rpc_utils.create_job_common(
         **rpc_utils.get_create_job_common_args(locals()))
+    _invalidate_installed_hosts(job_id, profiles)
+    scheduler_wakeup.notify()
+    return job_id
 
 
 def abort_host_queue_entries(**filter_data):
@@ -993,6 +1008,7 @@ def abort_host_queue_entries(**filter_data):
 
     for queue_entry in host_queue_entries:
         queue_entry.abort()
+    scheduler_wakeup.notify()
 
 
 def reverify_hosts(**filter_data):
@@ -1007,7 +1023,10 @@ def reverify_hosts(**filter_data):
     for host in hosts:
         models.SpecialTask.schedule_special_task(host,
                                                  models.SpecialTask.Task.VERIFY)
-    return list(sorted(host.hostname for host in hosts))
+    hostnames = sorted(host.hostname for host in hosts)
+    install_server_cache.invalidate(hostnames)
+    scheduler_wakeup.notify()
+    return hostnames
 
 
 def get_jobs(not_yet_run=False, running=False, finished=False, **filter_data):
@@ -7,15 +7,36 @@ try:
 except ImportError:
     import common  # pylint: disable=W0611
 from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from django.db import connection
 from autotest.frontend import test_utils
 from autotest.frontend.afe import models, rpc_interface
 from autotest.frontend.afe import model_logic, model_attributes
+from autotest.frontend.afe import install_server_cache
 from autotest.client.shared import settings
 
 
 _hqe_status = models.HostQueueEntry.Status
 
 
+class _FakeInstallServer(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def find_systems(self, hostnames):
+        self.calls.append(('find_systems', sorted(hostnames)))
+        systems = dict((hostname, []) for hostname in hostnames)
+        systems['host1'] = [{'name': 'host1', 'profile': 'rhel6'}]
+        return systems
+
+    def get_profiles(self):
+        self.calls.append(('get_profiles',))
+        return ['rhel6', 'fedora']
+
+    def invalidate(self, hostnames=None):
+        self.calls.append(('invalidate', sorted(hostnames)))
+
+
 class RpcInterfaceTest(unittest.TestCase,
                        test_utils.FrontendTestMixin):
 
@@ -67,6 +88,39 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertEquals(host['acls'], ['my_acl'])
         self.assertEquals(host['attributes'], {})
 
+    def test_get_hosts_install_server(self):
+        install_server = _FakeInstallServer()
+        self.god.stub_with(install_server_cache, 'get_install_server_cache',
+                           lambda: install_server)
+        hosts = rpc_interface.get_hosts()
+        self._check_hostnames(hosts, [host.hostname for host in self.hosts])
+        hosts_by_name = dict((host['hostname'], host) for host in hosts)
+        self.assertEquals(hosts_by_name['host1']['profiles'],
+                          ['Do_not_install', 'fedora', 'rhel6'])
+        self.assertEquals(hosts_by_name['host1']['current_profile'], 'rhel6')
+        self.assertEquals(hosts_by_name['host2']['profiles'], ['N/A'])
+        # one bulk lookup for all the hosts
+        self.assertEquals(install_server.calls,
+                          [('find_systems',
+                            sorted(host.hostname for host in self.hosts)),
+                           ('get_profiles',)])
+
+    def test_keyset_paging(self):
+        label_ids = []
+        query_after = 0
+        while True:
+            labels = rpc_interface.get_labels(query_after=query_after,
+                                              query_limit=3)
+            if not labels:
+                break
+            self.assertTrue(len(labels) <= 3)
+            label_ids.extend(label['id'] for label in labels)
+            query_after = labels[-1]['id']
+        self.assertEquals(label_ids, sorted(label.id for label in
+                                            models.Label.objects.all()))
+        self.assertRaises(ValueError, rpc_interface.get_labels,
+                          query_after=1, query_start=0, query_limit=3)
+
     def test_get_hosts_multiple_labels(self):
         hosts = rpc_interface.get_hosts(
             multiple_labels=['myplatform', 'label1'])
@@ -94,6 +148,26 @@ class RpcInterfaceTest(unittest.TestCase,
             exclude_atomic_group_hosts=True)
         self._check_hostnames(hosts, ['host2'])
 
+    def test_install_server_invalidation(self):
+        install_server = _FakeInstallServer()
+        self.god.stub_with(install_server_cache, 'get_install_server_cache',
+                           lambda: install_server)
+        rpc_interface.modify_host('host1', locked=True)
+        rpc_interface.modify_hosts({'id__in': [1, 2]}, {'locked': False})
+        rpc_interface.reverify_hosts(id__in=[1, 2])
+        rpc_interface.create_job(name='test', priority='Medium',
+                                 control_file='foo', control_type='Client',
+                                 hosts=['host1', 'host2'],
+                                 profiles=['rhel6', 'Do_not_install'])
+        rpc_interface.create_job(name='test', priority='Medium',
+                                 control_file='foo', control_type='Client',
+                                 hosts=['host2'], profiles=['Do_not_install'])
+        self.assertEquals([('invalidate', ['host1']),
+                           ('invalidate', ['host1', 'host2']),
+                           ('invalidate', ['host1', 'host2']),
+                           ('invalidate', ['host1'])],
+                          install_server.calls)
+
     def test_job_keyvals(self):
         keyval_dict = {'mykey': 'myvalue'}
         job_id = rpc_interface.create_job(name='test', priority='Medium',
@@ -179,6 +253,48 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertRaises(model_logic.ValidationError, self._create_job_helper,
                           hosts=[1, 1])
 
+    def _create_bulk_hosts(self, prefix, count):
+        hostnames = ['%s%d' % (prefix, index) for index in xrange(count)]
+        models.Host.objects.bulk_create(
+            [models.Host(hostname=hostname) for hostname in hostnames])
+        hosts = list(models.Host.objects.filter(hostname__in=hostnames))
+        models.AclGroup.smart_get('my_acl').hosts.add(*hosts)
+        self.label6.host_set.add(*hosts)
+        return hostnames
+
+    def _count_create_job_queries(self, hostnames):
+        connection.queries = []
+        job_id = self._create_job_helper(hosts=hostnames,
+                                         meta_hosts=['label1'],
+                                         dependencies=['label6'])
+        query_count = len(connection.queries)
+        job = models.Job.objects.get(pk=job_id)
+        self.assertEquals(job.hostqueueentry_set.count(), len(hostnames) + 1)
+        # the metahost entry is not scheduled on the hosts of the job
+        self.assertEquals(
+            sorted(models.IneligibleHostQueue.objects.filter(
+                job=job).values_list('host__hostname', flat=True)),
+            sorted(hostnames))
+        return query_count
+
+    def test_create_job_query_count(self):
+        self.hosts[0].update_object(status=models.Host.Status.REPAIR_FAILED)
+        hostnames = self._create_bulk_hosts('few', 10)
+        few_queries = self._count_create_job_queries(hostnames)
+        hostnames = self._create_bulk_hosts('many', 1000)
+        many_queries = self._count_create_job_queries(hostnames)
+        # only the batches of the bulk selects and inserts add queries
+        self.assertTrue(many_queries - few_queries <= 5,
+                        (few_queries, many_queries))
+
+        models.Host.smart_get('host1').labels.add(self.label6)
+        self._count_create_job_queries(['host1'])
+        host = models.Host.smart_get('host1')
+        self.assertEquals(host.status, models.Host.Status.READY)
+        entry = host.hostqueueentry_set.get()
+        self.assertEquals((entry.status, entry.active, entry.complete),
+                          (_hqe_status.QUEUED, False, False))
+
     def test_create_hostless_job(self):
         job_id = self._create_job_helper(hostless=True)
         job = models.Job.objects.get(pk=job_id)
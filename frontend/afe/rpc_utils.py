@@ -9,6 +9,7 @@ import datetime
 import inspect
 import os
 
+import django.db.models
 import django.http
 from autotest.frontend.afe import models, model_logic, model_attributes
 
@@ -26,6 +27,21 @@ def prepare_for_serialization(objects):
     return _prepare_data(objects)
 
 
+def prepare_for_streaming(object_dicts):
+    """
+    Like prepare_for_serialization() for an iterable of object dicts, but
+    return a generator: the RPC handler encodes and sends the dicts as they
+    are produced rather than building the whole result first.
+    """
+    id_set = set()
+    for object_dict in object_dicts:
+        if 'id' in object_dict:
+            if object_dict['id'] in id_set:
+                continue
+            id_set.add(object_dict['id'])
+        yield _prepare_data(object_dict)
+
+
 def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
     """
     Prepare a Django query to be returned via RPC as a sequence of nested
@@ -464,6 +480,21 @@ def check_for_duplicate_hosts(host_objects):
              % ', '.join(duplicate_hostnames)})
 
 
+def _get_labels_by_lower_name(names):
+    """
+    :param names: lower case label names.
+    :return: a dictionary mapping the lower case names of the labels named
+            like one of names, regardless of case, to the labels.
+    """
+    if not names:
+        return {}
+    name_filter = django.db.models.Q()
+    for name in set(names):
+        name_filter |= django.db.models.Q(name__iexact=name)
+    return dict((label.name.lower(), label)
+                for label in models.Label.objects.filter(name_filter))
+
+
 def create_new_job(owner, options, host_objects, profiles, metahost_objects,
                    metahost_profiles, atomic_group=None):
     '''
@@ -484,12 +515,13 @@ def create_new_job(owner, options, host_objects, profiles, metahost_objects,
     :param atomic_group:
     :type atomic_group:
     '''
-    labels_by_name = dict((label.name, label)
-                          for label in models.Label.objects.all())
     all_host_objects = host_objects + metahost_objects
     all_profiles = profiles + metahost_profiles
     metahost_counts = _get_metahost_counts(metahost_objects)
     dependencies = options.get('dependencies', [])
+    labels_by_name = dict(
+        (label.name, label)
+        for label in models.Label.objects.filter(name__in=dependencies))
     synch_count = options.get('synch_count')
 
     if atomic_group:
@@ -701,8 +733,7 @@ def create_job_common(name, priority, control_type, control_file=None,
                 'control_type': 'Hostless jobs cannot use client-side '
                 'control files'})
 
-    labels_by_name = dict((label.name.lower(), label)
-                          for label in models.Label.objects.all())
+    labels_by_name = _get_labels_by_lower_name(meta_hosts)
     atomic_groups_by_name = dict((ag.name.lower(), ag)
                                  for ag in models.AtomicGroup.objects.all())
 
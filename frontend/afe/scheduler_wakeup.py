@@ -0,0 +1,113 @@
+"""
+Wake the scheduler up as soon as there is new work for it.
+
+When SCHEDULER.event_driven_wakeups is enabled, the scheduler listens for
+UDP datagrams on SCHEDULER.wakeup_port and, while idle, sleeps between ticks
+until one arrives (or a maximum idle pause elapses).  RPCs that create or
+abort work call notify() so that the scheduler reacts right away instead of
+on its next polling tick.  Notifications are best effort: a lost datagram
+only delays the work until the next tick.
+"""
+
+import errno
+import logging
+import select
+import socket
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+
+_CONFIG_SECTION = 'SCHEDULER'
+_MESSAGE = 'wakeup'
+_DEFAULT_PORT = 13468
+
+
+def is_enabled():
+    return settings.get_value(_CONFIG_SECTION, 'event_driven_wakeups',
+                              type=bool, default=False)
+
+
+def _get_port():
+    return settings.get_value(_CONFIG_SECTION, 'wakeup_port', type=int,
+                              default=_DEFAULT_PORT)
+
+
+def send_wakeup(host, port):
+    """Send a wakeup datagram to a scheduler listening on host:port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(_MESSAGE, (host, port))
+    finally:
+        sock.close()
+
+
+def notify():
+    """
+    Tell the scheduler there is new work, if event driven wakeups are enabled.
+
+    Never raises; failing to notify only delays scheduling until the next
+    tick.
+    """
+    if not is_enabled():
+        return
+    host = settings.get_value(_CONFIG_SECTION, 'wakeup_host',
+                              default='localhost')
+    try:
+        send_wakeup(host, _get_port())
+    except socket.error, e:
+        logging.warning('Could not wake up the scheduler on %s: %s', host, e)
+
+
+class WakeupListener(object):
+
+    """Receives the wakeup datagrams sent by notify()."""
+
+    def __init__(self, port=None):
+        """
+        :param port: UDP port to listen on, SCHEDULER.wakeup_port by default.
+                Use 0 to pick a free port (see the port attribute).
+        """
+        if port is None:
+            port = _get_port()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('', port))
+        self._socket.setblocking(0)
+        self.port = self._socket.getsockname()[1]
+
+    def _drain(self):
+        received = False
+        while True:
+            try:
+                self._socket.recv(len(_MESSAGE))
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return received
+                raise
+            received = True
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for a wakeup.
+
+        All the wakeups received so far are consumed, so several
+        notifications sent during a tick only cause one early tick.
+
+        :return: True if woken up, False if the timeout expired or the wait
+                was interrupted by a signal.
+        """
+        if self._drain():
+            return True
+        try:
+            readable = select.select([self._socket], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        return bool(readable) and self._drain()
+
+    def close(self):
+        self._socket.close()
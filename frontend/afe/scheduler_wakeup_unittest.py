@@ -0,0 +1,39 @@
+#!/usr/bin/python
+
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.frontend.afe import scheduler_wakeup
+
+
+class WakeupListenerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = scheduler_wakeup.WakeupListener(port=0)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def _send_wakeup(self):
+        scheduler_wakeup.send_wakeup('localhost', self.listener.port)
+
+    def test_timeout(self):
+        self.assertFalse(self.listener.wait(0.01))
+
+    def test_wakeup(self):
+        self._send_wakeup()
+        self.assertTrue(self.listener.wait(5))
+        self.assertFalse(self.listener.wait(0.01))
+
+    def test_wakeups_are_coalesced(self):
+        for _ in xrange(3):
+            self._send_wakeup()
+        self.assertTrue(self.listener.wait(5))
+        self.assertFalse(self.listener.wait(0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,21 @@
-from django.db import models as dbmodels, connection
+import re
+
+from django.db import models as dbmodels, connection, transaction
+from django.db.models import F
+from autotest.client.shared.settings import settings
 from autotest.frontend.afe import model_logic, readonly_connection
 from autotest.frontend.afe.models import TestEnvironment
 
 _quote_name = connection.ops.quote_name
 
+# string literals and identifiers (or keywords) of user SQL
+_SQL_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_SQL_WORD_RE = re.compile(r'[A-Za-z_][\w.]*')
+# the words of conditions and group fields which are not columns
+_SQL_KEYWORDS = frozenset(['and', 'or', 'not', 'in', 'is', 'null', 'like',
+                           'between', 'regexp', 'rlike', 'escape', 'binary',
+                           'true', 'false', 'date', 'lower', 'upper'])
+
 
 class TempManager(model_logic.ExtendedManager):
     _GROUP_COUNT_NAME = 'group_count'
@@ -629,6 +641,83 @@ class TestViewManager(TempManager):
 
         return query_set
 
+    # the parameters of get_query_set_with_joins()
+    _JOIN_KEYS = ('test_attribute_fields', 'test_label_fields',
+                  'machine_label_fields', 'iteration_result_fields',
+                  'job_keyval_fields', 'iteration_attribute_fields',
+                  'include_labels', 'exclude_labels',
+                  'include_attributes_where', 'exclude_attributes_where')
+
+    @staticmethod
+    def _uses_rollup_fields_only(sql):
+        """
+        :param sql: a field, possibly a function of fields, or a condition.
+        :return: True if all the columns sql refers to are in TestRollup.
+        """
+        words = _SQL_WORD_RE.findall(_SQL_STRING_RE.sub('', sql))
+        return all(word in TestRollup.view_fields or
+                   word.lower() in _SQL_KEYWORDS for word in words)
+
+    def can_use_rollups(self, filter_data, fields):
+        """
+        Tell whether the tests of a grouped query can be counted from the
+        rows of TestRollup instead of the test view: the query does not join
+        other tables and only the fields of TestRollup are used in its
+        filters, groups and order.
+
+        :param filter_data: the parameters of the query.
+        :param fields: the fields the query is grouped on (and the header
+                fields it is restricted on).
+        """
+        if not settings.get_value('AUTOTEST_WEB', 'tko_rollups', type=bool,
+                                  default=True):
+            return False
+        special_params, regular_filters = self.model._extract_special_params(
+            filter_data)
+        if (special_params.get('extra_args') or
+                special_params.get('query_after') is not None):
+            return False
+        for key, value in regular_filters.iteritems():
+            if key in self._JOIN_KEYS:
+                if value:
+                    return False
+            elif key.split('__')[0] not in TestRollup.view_fields:
+                return False
+        for field in fields:
+            if (field not in TestRollup.view_fields and
+                    field not in TestRollup.extra_fields):
+                return False
+        expressions = [field.lstrip('-')
+                       for field in special_params.get('sort_by') or []]
+        if special_params.get('extra_where'):
+            expressions.append(special_params['extra_where'])
+        return all(self._uses_rollup_fields_only(expression)
+                   for expression in expressions)
+
+    def get_group_query(self, filter_data, fields, use_rollups=True):
+        """
+        Planner of the grouped queries over tests: the query set of the tests
+        matching filter_data, without presentation applied, over TestRollup
+        when it can answer the query (see can_use_rollups()), over the test
+        view otherwise.  The managers of both models provide get_count_sql()
+        and get_latest_test_sql() for the aggregates of the query.
+
+        :param use_rollups: False to always query the test view, e.g. for
+                aggregates TestRollup does not have.
+        """
+        if use_rollups and self.can_use_rollups(filter_data, fields):
+            for key in self._JOIN_KEYS:
+                filter_data.pop(key, None)
+            filter_data['no_distinct'] = True
+            return TestRollup.query_objects(filter_data,
+                                            apply_presentation=False)
+        query = self.get_query_set_with_joins(filter_data)
+        return self.model.query_objects(filter_data, initial_query=query,
+                                        apply_presentation=False)
+
+    def get_latest_test_sql(self):
+        return 'MAX(%s)' % self.get_key_on_this_table('test_idx')
+
     def query_test_ids(self, filter_data, apply_presentation=True):
         query = self.model.query_objects(filter_data,
                                          apply_presentation=apply_presentation)
@@ -714,3 +803,178 @@ class TestView(dbmodels.Model, model_logic.ModelExtensions):
     class Meta:
         db_table = 'tko_test_view_2'
         managed = False
+
+
+class TestRollupManager(TempManager):
+
+    # counts of the tests of a group of rows of the test view
+    _COUNTS_SQL = """
+        SELECT %(fields)s, COUNT(1),
+               SUM(CASE WHEN status = 'GOOD' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN status NOT IN ('TEST_NA', 'RUNNING', 'NOSTATUS')
+                   THEN 1 ELSE 0 END),
+               SUM(CASE WHEN status = 'RUNNING' THEN 1 ELSE 0 END),
+               MAX(test_idx)
+        FROM %(view)s
+        WHERE %(where)s
+        GROUP BY %(fields)s
+        """
+    _COUNT_FIELDS = ('test_count', 'passed_tests', 'complete_tests',
+                     'incomplete_tests')
+
+    def get_query_set(self):
+        query = super(TestRollupManager, self).get_query_set()
+        extra_select = dict((sql, sql)
+                            for sql in self.model.extra_fields.iterkeys())
+        return query.extra(select=extra_select)
+
+    def get_count_sql(self, query):
+        return self._GROUP_COUNT_NAME, 'SUM(test_count)'
+
+    def get_latest_test_sql(self):
+        return 'MAX(%s)' % self.get_key_on_this_table('latest_test_idx')
+
+    def execute_group_query(self, query, group_by):
+        row_dicts = super(TestRollupManager, self).execute_group_query(
+            query, group_by)
+        fields = set(self.model.view_fields).union(self.model.extra_fields)
+        for row in row_dicts:
+            for name in row.keys():
+                if name in fields:
+                    continue
+                if name in query.query.extra_select:
+                    # the sums are decimals on MySQL
+                    if row[name] is not None:
+                        row[name] = int(row[name])
+                else:
+                    # the counts of one of the rows of the group
+                    del row[name]
+        return row_dicts
+
+    def _get_counts_sql(self, where):
+        fields = ', '.join(_quote_name(field)
+                           for field in self.model.view_fields)
+        return self._COUNTS_SQL % {
+            'fields': fields, 'where': where,
+            'view': _quote_name(TestView._meta.db_table)}
+
+    def refresh_job(self, job_idx):
+        """
+        Compute again the rows of a job from its tests, once they were
+        inserted, updated or deleted.
+        """
+        table = _quote_name(self.model._meta.db_table)
+        fields = self.model.view_fields + self._COUNT_FIELDS
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE job_idx = %%s' % table,
+                       [job_idx])
+        cursor.execute('INSERT INTO %s (%s, latest_test_idx) %s' %
+                       (table, ', '.join(_quote_name(field)
+                                         for field in fields),
+                        self._get_counts_sql('job_idx = %s')),
+                       [job_idx])
+        transaction.commit_unless_managed()
+
+    def add_tests(self, test_idxs):
+        """
+        Add new tests, once they were inserted, to the rows of their job.
+        Unlike refresh_job(), only the rows of the groups of the new tests
+        are read and written.
+
+        :param test_idxs: indexes of tests inserted since the rows of their
+                job were computed, none of them updated or deleted since.
+        """
+        if not test_idxs:
+            return
+        cursor = connection.cursor()
+        cursor.execute(self._get_counts_sql(
+            'test_idx IN (%s)' % ', '.join(['%s'] * len(test_idxs))),
+            list(test_idxs))
+        field_count = len(self.model.view_fields)
+        for row in cursor.fetchall():
+            group = dict(zip(self.model.view_fields, row[:field_count]))
+            # the sums are decimals on MySQL
+            counts = dict((field, int(count)) for field, count
+                          in zip(self._COUNT_FIELDS, row[field_count:-1]))
+            updates = dict((field, F(field) + count)
+                           for field, count in counts.iteritems())
+            # the new tests are the latest ones of the job
+            latest_test_idx = row[-1]
+            if not self.filter(**group).update(
+                    latest_test_idx=latest_test_idx, **updates):
+                group.update(counts)
+                self.create(latest_test_idx=latest_test_idx, **group)
+        transaction.commit_unless_managed()
+
+    def refresh_machine(self, machine):
+        """Update the host fields of the rows of the jobs run on machine."""
+        jobs = Job.objects.filter(machine=machine).values('job_idx')
+        self.filter(job_idx__in=jobs).update(
+            hostname=machine.hostname, platform=machine.machine_group,
+            machine_owner=machine.owner)
+
+
+class TestRollup(dbmodels.Model, model_logic.ModelExtensions):
+
+    """
+    Counts of the tests of the test view, for each job, test name, kernel
+    and status, maintained by the parser as it inserts the tests of a job.
+    The grouped queries over tests only using the fields of the job, host,
+    kernel, status or name of the tests are answered from these rows, see
+    TestViewManager.get_group_query().
+    """
+
+    extra_fields = {
+        'DATE(job_queued_time)': 'job queued day',
+    }
+
+    # the fields of the test view, in the same columns
+    view_fields = ('job_idx', 'test_name', 'kernel_idx', 'status_idx',
+                   'job_tag', 'job_name', 'job_owner', 'job_queued_time',
+                   'job_started_time', 'job_finished_time', 'afe_job_id',
+                   'hostname', 'platform', 'machine_owner', 'kernel_hash',
+                   'kernel_base', 'kernel', 'status')
+
+    job_idx = dbmodels.IntegerField('job index', db_index=True)
+    test_name = dbmodels.CharField(null=True, blank=True, max_length=90,
+                                   db_index=True)
+    kernel_idx = dbmodels.IntegerField('kernel index')
+    status_idx = dbmodels.IntegerField('status index')
+    job_tag = dbmodels.CharField(null=True, blank=True, max_length=300)
+    job_name = dbmodels.CharField(null=True, blank=True, max_length=300)
+    job_owner = dbmodels.CharField('owner', null=True, blank=True,
+                                   max_length=240)
+    job_queued_time = dbmodels.DateTimeField(null=True, blank=True)
+    job_started_time = dbmodels.DateTimeField(null=True, blank=True)
+    job_finished_time = dbmodels.DateTimeField(null=True, blank=True)
+    afe_job_id = dbmodels.IntegerField(null=True)
+    hostname = dbmodels.CharField(null=True, blank=True, max_length=300,
+                                  db_index=True)
+    platform = dbmodels.CharField(null=True, blank=True, max_length=240)
+    machine_owner = dbmodels.CharField(null=True, blank=True, max_length=240)
+    kernel_hash = dbmodels.CharField(null=True, blank=True, max_length=105)
+    kernel_base = dbmodels.CharField(null=True, blank=True, max_length=90)
+    kernel = dbmodels.CharField(null=True, blank=True, max_length=300)
+    status = dbmodels.CharField(null=True, blank=True, max_length=30)
+    test_count = dbmodels.IntegerField(default=0)
+    passed_tests = dbmodels.IntegerField(default=0)
+    complete_tests = dbmodels.IntegerField(default=0)
+    incomplete_tests = dbmodels.IntegerField(default=0)
+    latest_test_idx = dbmodels.IntegerField(null=True)
+
+    objects = TestRollupManager()
+
+    class Meta:
+        db_table = 'tko_test_rollups'
+
+
+class RpcCacheGeneration(dbmodels.Model):
+
+    """
+    The generation of the TKO data the cached RPC results were computed
+    from, in a single row, see rpc_cache.
+    """
+    generation = dbmodels.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'tko_rpc_cache_generation'
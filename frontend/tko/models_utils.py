@@ -3,6 +3,8 @@ Simple utility wrappers around the TKO models
 """
 
 from autotest.frontend.tko.models import Job, Test, Machine, TestLabel
+from autotest.frontend.tko.models import TestRollup
+from autotest.frontend.tko import rpc_cache
 
 
 def job_get_by_tag(tag):
@@ -41,7 +43,10 @@ def job_delete_by_tag(tag):
     '''
     Deletes a job entry based on its tag
     '''
-    Job.objects.get(tag=tag).delete()
+    job = Job.objects.get(tag=tag)
+    TestRollup.objects.filter(job_idx=job.job_idx).delete()
+    job.delete()
+    rpc_cache.bump_generation()
     return job_get_by_tag(tag) is None
 
 
@@ -75,11 +80,18 @@ def test_get_by_idx(test_idx):
         return None
 
 
-def test_delete_by_idx(test_idx):
+def test_delete_by_idx(test_idx, refresh=True):
     '''
     Delete test based on its idx
+
+    With refresh False, the caller updates the test rollups of the job and
+    makes the cached RPC results stale (e.g. dbutils.insert_job()).
     '''
-    Test.objects.get(pk=test_idx).delete()
+    test = Test.objects.get(pk=test_idx)
+    test.delete()
+    if refresh:
+        TestRollup.objects.refresh_job(test.job_id)
+        rpc_cache.bump_generation()
     return test_get_by_idx(test_idx) is None
 
 
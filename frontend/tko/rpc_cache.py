@@ -0,0 +1,326 @@
+"""
+Results of the TKO RPCs the frontend calls again and again with the same
+arguments, e.g. the counts of the spreadsheet as users page through it.
+
+An RpcCache keeps the results of each RPC and set of arguments in an LRU of
+AUTOTEST_WEB.tko_rpc_cache_size entries of the process, and in the backend
+shared by the processes of the frontend set by
+AUTOTEST_WEB.tko_rpc_cache_backend, if any: a directory, or memcached
+servers.  A result is used while the generation of the TKO data it was
+computed from is current: the parser and the RPCs changing tests, labels or
+attributes bump it with bump_generation().
+"""
+
+import collections
+import copy
+import cPickle as pickle
+import functools
+import hashlib
+import heapq
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    import memcache
+except ImportError:
+    memcache = None
+
+from django.db import IntegrityError
+from django.db.models import F
+from autotest.client.shared.settings import settings
+from autotest.frontend.tko import models
+
+# prefix of the keys in the shared backend
+KEY_PREFIX = 'tko-rpc-'
+# results kept in a directory backend, the oldest ones are removed beyond
+FILE_BACKEND_MAX_ENTRIES = 10000
+# results written to a directory backend between two checks of its size
+FILE_BACKEND_CHECK_INTERVAL = 100
+
+
+def get_generation():
+    """:return: the generation of the TKO data."""
+    for generation in models.RpcCacheGeneration.objects.filter(
+            pk=1).values_list('generation', flat=True):
+        return generation
+    return 0
+
+
+def bump_generation():
+    """Make the results cached until now stale, after TKO data changed."""
+    generations = models.RpcCacheGeneration.objects.filter(pk=1)
+    if generations.update(generation=F('generation') + 1):
+        return
+    try:
+        models.RpcCacheGeneration.objects.create(id=1, generation=1)
+    except IntegrityError:
+        # created meanwhile
+        generations.update(generation=F('generation') + 1)
+
+
+def get_key(name, args, kwargs):
+    """
+    :return: the key of the result of RPC name called with args and kwargs,
+            whatever the order of the keyword arguments and of the keys of
+            the dictionaries they contain.
+    """
+    canonical = json.dumps([name, args, kwargs], sort_keys=True,
+                           separators=(',', ':'), default=repr)
+    return hashlib.sha1(canonical).hexdigest()
+
+
+class FileBackend(object):
+
+    """
+    Results pickled in the files of a directory, with the get() and set()
+    of a memcached client.
+    """
+
+    def __init__(self, directory, max_entries=FILE_BACKEND_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process meanwhile
+                if not os.path.isdir(directory):
+                    raise
+
+    def get(self, key):
+        try:
+            result_file = open(os.path.join(self.directory, key), 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                return pickle.load(result_file)
+            except Exception:
+                # being replaced, or written by another version
+                return None
+        finally:
+            result_file.close()
+
+    def set(self, key, value):
+        fd, temp_path = tempfile.mkstemp(prefix='.', dir=self.directory)
+        result_file = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump(value, result_file, pickle.HIGHEST_PROTOCOL)
+        finally:
+            result_file.close()
+        os.rename(temp_path, os.path.join(self.directory, key))
+        self._writes += 1
+        if self._writes % FILE_BACKEND_CHECK_INTERVAL == 0:
+            self._remove_oldest()
+        return True
+
+    def _remove_oldest(self):
+        """Remove the least recently written files beyond max_entries."""
+        ages = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('.'):
+                try:
+                    path = os.path.join(self.directory, name)
+                    ages.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        ages.sort()
+        for _, path in ages[:len(ages) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def get_backend(url):
+    """
+    :param url: memcached://host:port[,host:port...] for memcached servers,
+            or the path of a directory.
+    :return: a backend with get() and set() methods, None if url is empty.
+    """
+    if not url:
+        return None
+    if url.startswith('memcached://'):
+        if memcache is None:
+            logging.warning('Cannot share the TKO RPC cache through %s, the '
+                            'memcache module is not installed', url)
+            return None
+        servers = url[len('memcached://'):].split(',')
+        return memcache.Client(servers)
+    return FileBackend(url)
+
+
+class RpcCache(object):
+
+    """The results of the RPCs decorated with cached()."""
+
+    def __init__(self, max_entries, backend=None,
+                 get_generation=get_generation):
+        """
+        :param max_entries: number of results kept in the process.
+        :param backend: shared backend, see get_backend().
+        :param get_generation: function returning the current generation of
+                the data.
+        """
+        self.max_entries = max_entries
+        self.backend = backend
+        self.get_generation = get_generation
+        # key -> (number of its last access, result), and a heap of the
+        # (access number, key) of the accesses, the least recent first,
+        # where the earlier accesses to a key are dropped lazily
+        self._entries = {}
+        self._accesses = []
+        self._access_count = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        # RPC name -> [hits, shared backend hits, misses]
+        self._counts = collections.defaultdict(lambda: [0, 0, 0])
+
+    def _access(self, key, result):
+        """Make key the most recently used entry, with the lock held."""
+        self._access_count += 1
+        self._entries[key] = (self._access_count, result)
+        heapq.heappush(self._accesses, (self._access_count, key))
+        if len(self._accesses) > 2 * self.max_entries:
+            self._accesses = [(access, entry_key) for entry_key, (access, _)
+                              in self._entries.iteritems()]
+            heapq.heapify(self._accesses)
+
+    def _clear_entries(self):
+        self._entries.clear()
+        self._accesses = []
+
+    def _lookup(self, key):
+        """:return: the cached result of key, None if there is none."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._access(key, entry[1])
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def _store(self, key, result):
+        self._lock.acquire()
+        try:
+            self._access(key, result)
+            while len(self._entries) > self.max_entries:
+                access, key = heapq.heappop(self._accesses)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == access:
+                    del self._entries[key]
+        finally:
+            self._lock.release()
+
+    def _count(self, name, index):
+        self._lock.acquire()
+        try:
+            self._counts[name][index] += 1
+        finally:
+            self._lock.release()
+
+    def call(self, function, args, kwargs):
+        """
+        :return: the result of function(*args, **kwargs), cached unless the
+                data changed since.
+        """
+        generation = self.get_generation()
+        if generation != self._generation:
+            # the results of the previous generations are stale
+            self._lock.acquire()
+            try:
+                self._clear_entries()
+                self._generation = generation
+            finally:
+                self._lock.release()
+        name = function.__name__
+        key = '%s%d-%s' % (KEY_PREFIX, generation,
+                           get_key(name, args, kwargs))
+
+        result = self._lookup(key)
+        if result is not None:
+            self._count(name, 0)
+            return copy.deepcopy(result)
+        if self.backend is not None:
+            try:
+                result = self.backend.get(key)
+            except Exception, e:
+                logging.warning('Could not read the TKO RPC cache: %s', e)
+            if result is not None:
+                self._count(name, 1)
+                self._store(key, result)
+                return copy.deepcopy(result)
+
+        self._count(name, 2)
+        # the RPCs modify their keyword arguments
+        result = function(*args, **copy.deepcopy(kwargs))
+        self._store(key, copy.deepcopy(result))
+        if self.backend is not None:
+            try:
+                self.backend.set(key, result)
+            except Exception, e:
+                logging.warning('Could not write the TKO RPC cache: %s', e)
+        return result
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._clear_entries()
+            self._counts.clear()
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        :return: a dictionary mapping the names of the RPCs to their counts
+                of hits (in the process, in the shared backend) and misses,
+                and their hit rate.
+        """
+        stats = {}
+        self._lock.acquire()
+        try:
+            for name, (hits, shared_hits, misses) in self._counts.iteritems():
+                calls = hits + shared_hits + misses
+                stats[name] = {'hits': hits, 'shared_hits': shared_hits,
+                               'misses': misses,
+                               'hit_rate': float(hits + shared_hits) / calls}
+        finally:
+            self._lock.release()
+        return stats
+
+
+_cache = None
+
+
+def get_rpc_cache():
+    """
+    :return: the RpcCache of the process, None if the cache is disabled
+            (AUTOTEST_WEB.tko_rpc_cache_size is 0).
+    """
+    global _cache
+    max_entries = settings.get_value('AUTOTEST_WEB', 'tko_rpc_cache_size',
+                                     type=int, default=256)
+    if max_entries <= 0:
+        return None
+    if _cache is None or _cache.max_entries != max_entries:
+        url = settings.get_value('AUTOTEST_WEB', 'tko_rpc_cache_backend',
+                                 default='')
+        _cache = RpcCache(max_entries, backend=get_backend(url))
+    return _cache
+
+
+def cached(function):
+    """Decorator of the RPCs whose results are cached."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        cache = get_rpc_cache()
+        if cache is None:
+            return function(*args, **kwargs)
+        return cache.call(function, args, kwargs)
+    return wrapper
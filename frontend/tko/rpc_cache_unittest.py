@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from autotest.frontend.tko import rpc_cache
+
+
+class RpcCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generation = 0
+        self.calls = []
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_status_counts(self, group_by, **filter_data):
+        self.calls.append((group_by, dict(filter_data)))
+        filter_data.pop('extra_where', None)
+        return {'groups': [{'group_by': group_by}], 'filters': filter_data}
+
+    def _cache(self, max_entries=10, backend=None):
+        return rpc_cache.RpcCache(max_entries, backend=backend,
+                                  get_generation=lambda: self.generation)
+
+    def _call(self, cache, *args, **kwargs):
+        return cache.call(self.get_status_counts, args, kwargs)
+
+    def test_get_key(self):
+        key = rpc_cache.get_key('get_status_counts', (['job_name'],),
+                                {'hostname__in': ['a', 'b'],
+                                 'extra_args': {'where': ['1'], 'select': {}}})
+        self.assertEqual(key, rpc_cache.get_key(
+            'get_status_counts', [[u'job_name']],
+            {u'extra_args': {u'select': {}, u'where': [u'1']},
+             u'hostname__in': [u'a', u'b']}))
+        self.assertNotEqual(key, rpc_cache.get_key(
+            'get_status_counts', (['job_name'],),
+            {'hostname__in': ['b', 'a'],
+             'extra_args': {'where': ['1'], 'select': {}}}))
+        self.assertNotEqual(key, rpc_cache.get_key(
+            'get_latest_tests', (['job_name'],),
+            {'hostname__in': ['a', 'b'],
+             'extra_args': {'where': ['1'], 'select': {}}}))
+
+    def test_call(self):
+        cache = self._cache()
+        result = self._call(cache, ['job_name'], extra_where='x')
+        self.assertEqual({'groups': [{'group_by': ['job_name']}],
+                          'filters': {}}, result)
+        # the cached result is not changed by its caller
+        result['groups'].pop()
+        self.assertEqual(result, {'groups': [], 'filters': {}})
+        self.assertEqual({'groups': [{'group_by': ['job_name']}],
+                          'filters': {}},
+                         self._call(cache, ['job_name'], extra_where='x'))
+        self.assertEqual(1, len(self.calls))
+
+        self._call(cache, ['job_name'], extra_where='y')
+        self.assertEqual(2, len(self.calls))
+
+        self.generation += 1
+        self._call(cache, ['job_name'], extra_where='x')
+        self.assertEqual(3, len(self.calls))
+
+        self.assertEqual({'get_status_counts': {'hits': 1, 'shared_hits': 0,
+                                                'misses': 3,
+                                                'hit_rate': 0.25}},
+                         cache.get_stats())
+
+    def test_lru(self):
+        cache = self._cache(max_entries=2)
+        for group_by in (['a'], ['b'], ['a'], ['c'], ['a'], ['b']):
+            self._call(cache, group_by)
+        self.assertEqual([['a'], ['b'], ['c'], ['b']],
+                         [group_by for group_by, _ in self.calls])
+
+        # hits of the same entry do not make it the least recently used
+        del self.calls[:]
+        for group_by in (['a'], ['b']) * 5 + (['a'], ['c'], ['b'], ['a']):
+            self._call(cache, group_by)
+        self.assertEqual([['c'], ['b'], ['a']],
+                         [group_by for group_by, _ in self.calls])
+
+    def test_file_backend(self):
+        backend = rpc_cache.get_backend(os.path.join(self.tmpdir, 'cache'))
+        self._call(self._cache(backend=backend), ['job_name'], hostname='a')
+        # another process
+        cache = self._cache(backend=backend)
+        self._call(cache, ['job_name'], hostname='a')
+        self._call(cache, ['job_name'], hostname='a')
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual({'hits': 1, 'shared_hits': 1, 'misses': 0,
+                          'hit_rate': 1.0},
+                         cache.get_stats()['get_status_counts'])
+
+        self.generation += 1
+        self._call(self._cache(backend=backend), ['job_name'], hostname='a')
+        self.assertEqual(2, len(self.calls))
+
+    def test_file_backend_size(self):
+        backend = rpc_cache.FileBackend(self.tmpdir, max_entries=10)
+        for i in xrange(rpc_cache.FILE_BACKEND_CHECK_INTERVAL):
+            backend.set('key%d' % i, i)
+        self.assertEqual(10, len(os.listdir(self.tmpdir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,23 +6,33 @@ import pickle
 from autotest.frontend.afe import models as afe_models, readonly_connection
 from autotest.frontend.afe import rpc_utils, model_logic
 from autotest.frontend.tko import models, tko_rpc_utils, graphing_utils
-from autotest.frontend.tko import preconfigs
+from autotest.frontend.tko import preconfigs, rpc_cache
 from django.db import models as dbmodels
 
 #
 # IMPORTANT: please update INTERFACE_VERSION with the current date whenever
 # the interface changes, so that RPC clients can handle the changes
 #
-INTERFACE_VERSION = (2013, 05, 23)
+INTERFACE_VERSION = (2026, 10, 18)
 
 
 # table/spreadsheet view support
 
-def get_test_views(**filter_data):
+def get_test_views(stream=False, **filter_data):
+    """
+    :param stream: if True, return an iterator, which the RPC handler
+            encodes and sends as the rows are read from the database.  For
+            results too large to be built in memory, possibly along with
+            query_after and query_limit to fetch them in pages.
+    """
+    if stream:
+        return rpc_utils.prepare_for_streaming(
+            models.TestView.iter_objects(filter_data))
     return rpc_utils.prepare_for_serialization(
         models.TestView.list_objects(filter_data))
 
 
+@rpc_cache.cached
 def get_num_test_views(**filter_data):
     return models.TestView.query_count(filter_data)
 
@@ -31,7 +41,8 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
                      extra_select_fields=None, **filter_data):
     """
     Queries against TestView grouping by the specified fields and computings
-    counts for each group.
+    counts for each group.  The counts are summed from the rows of TestRollup
+    when they can be (see TestViewManager.get_group_query()).
     * group_by should be a list of field names.
     * extra_select_fields can be used to specify additional fields to select
       (usually for aggregate functions).
@@ -52,15 +63,20 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
       The keys for the extra_select_fields are determined by the "AS" alias of
       the field.
     """
-    query = models.TestView.objects.get_query_set_with_joins(filter_data)
+    rollup_select_fields = tko_rpc_utils.get_rollup_select_fields(
+        extra_select_fields)
     # don't apply presentation yet, since we have extra selects to apply
-    query = models.TestView.query_objects(filter_data, initial_query=query,
-                                          apply_presentation=False)
-    count_alias, count_sql = models.TestView.objects.get_count_sql(query)
+    query = models.TestView.objects.get_group_query(
+        filter_data, list(group_by) + (fixed_headers or {}).keys(),
+        use_rollups=rollup_select_fields is not None)
+    model = query.model
+    if model is models.TestRollup:
+        extra_select_fields = rollup_select_fields
+    count_alias, count_sql = model.objects.get_count_sql(query)
     query = query.extra(select={count_alias: count_sql})
     if extra_select_fields:
         query = query.extra(select=extra_select_fields)
-    query = models.TestView.apply_presentation(query, filter_data)
+    query = model.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups or [],
@@ -69,15 +85,17 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
     return rpc_utils.prepare_for_serialization(group_processor.get_info_dict())
 
 
+@rpc_cache.cached
 def get_num_groups(group_by, **filter_data):
     """
     Gets the count of unique groups with the given grouping fields.
     """
-    query = models.TestView.objects.get_query_set_with_joins(filter_data)
-    query = models.TestView.query_objects(filter_data, initial_query=query)
-    return models.TestView.objects.get_num_groups(query, group_by)
+    query = models.TestView.objects.get_group_query(filter_data, group_by)
+    query = query.model.apply_presentation(query, filter_data)
+    return query.model.objects.get_num_groups(query, group_by)
 
 
+@rpc_cache.cached
 def get_status_counts(group_by, header_groups=[], fixed_headers={},
                       **filter_data):
     """
@@ -91,6 +109,7 @@ def get_status_counts(group_by, header_groups=[], fixed_headers={},
                             **filter_data)
 
 
+@rpc_cache.cached
 def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                      extra_info=[], **filter_data):
     """
@@ -102,17 +121,17 @@ def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                       with each cell. The fields are returned in the extra_info
                       field of the return dictionary.
     """
-    # find latest test per group
+    # the fields of extra_info may come from the joins
     initial_query = models.TestView.objects.get_query_set_with_joins(
-        filter_data)
-    query = models.TestView.query_objects(filter_data,
-                                          initial_query=initial_query,
-                                          apply_presentation=False)
+        dict(filter_data))
+    # find latest test per group
+    query = models.TestView.objects.get_group_query(
+        filter_data, list(group_by) + fixed_headers.keys())
+    model = query.model
     query = query.exclude(status__in=tko_rpc_utils._INVALID_STATUSES)
     query = query.extra(
-        select={'latest_test_idx': 'MAX(%s)' %
-                models.TestView.objects.get_key_on_this_table('test_idx')})
-    query = models.TestView.apply_presentation(query, filter_data)
+        select={'latest_test_idx': model.objects.get_latest_test_sql()})
+    query = model.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups,
@@ -188,6 +207,7 @@ def _job_keyvals_to_dict(keyvals):
     return dict((keyval.key, keyval.value) for keyval in keyvals)
 
 
+@rpc_cache.cached
 def get_detailed_test_views(**filter_data):
     test_views = models.TestView.list_objects(filter_data)
 
@@ -303,10 +323,12 @@ def add_test_label(name, description=None):
 
 def modify_test_label(label_id, **data):
     models.TestLabel.smart_get(label_id).update_object(data)
+    rpc_cache.bump_generation()
 
 
 def delete_test_label(label_id):
     models.TestLabel.smart_get(label_id).delete()
+    rpc_cache.bump_generation()
 
 
 def get_test_labels(**filter_data):
@@ -323,6 +345,7 @@ def get_test_labels_for_tests(**test_filter_data):
 def test_label_add_tests(label_id, **test_filter_data):
     test_ids = models.TestView.objects.query_test_ids(test_filter_data)
     models.TestLabel.smart_get(label_id).tests.add(*test_ids)
+    rpc_cache.bump_generation()
 
 
 def test_label_remove_tests(label_id, **test_filter_data):
@@ -337,6 +360,7 @@ def test_label_remove_tests(label_id, **test_filter_data):
     test_ids = models.TestView.objects.query_test_ids(test_filter_data)
 
     label.tests.remove(*test_ids)
+    rpc_cache.bump_generation()
 
 
 # user-created test attributes
@@ -354,6 +378,7 @@ def set_test_attribute(attribute, value, **test_filter_data):
 
     for test in tests.itervalues():
         test.set_or_delete_attribute(attribute, value)
+    rpc_cache.bump_generation()
 
 
 # saved queries
@@ -387,6 +412,17 @@ def delete_saved_queries(id_list):
 
 
 # other
+def get_rpc_cache_stats():
+    """
+    Returns the hits and misses of the cache of the RPC results of this
+    frontend process, for each cached RPC, along with its hit rate.
+    """
+    cache = rpc_cache.get_rpc_cache()
+    if cache is None:
+        return {}
+    return cache.get_stats()
+
+
 def get_motd():
     return rpc_utils.get_motd()
 
@@ -9,9 +9,10 @@ except ImportError:
     import common  # pylint: disable=W0611
 from autotest.frontend import setup_django_environment  # pylint: disable=W0611
 from autotest.frontend import setup_test_environment  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
 from autotest.client.shared.test_utils import mock
 from django.db import connection
-from autotest.frontend.tko import models, rpc_interface
+from autotest.frontend.tko import models, rpc_cache, rpc_interface
 
 # this will need to be updated if the table schemas change (or removed if we
 # add proper primary keys)
@@ -110,6 +111,8 @@ class TkoTestMixin(object):
         return names
 
     def _create_initial_data(self):
+        # the tests change the data without making the cached results stale
+        settings.override_value('AUTOTEST_WEB', 'tko_rpc_cache_size', '0')
         machine = models.Machine.objects.create(hostname='myhost')
 
         # create basic objects
@@ -182,6 +185,10 @@ class TkoTestMixin(object):
         label2.tests.add(job1_test1)
         label3.tests.add(job1_test1)
 
+        # as the parser does once it inserted the tests of a job
+        models.TestRollup.objects.refresh_job(job1.job_idx)
+        models.TestRollup.objects.refresh_job(job2.job_idx)
+
     def _add_iteration_keyval(self, table, test, iteration, attribute, value):
         cursor = connection.cursor()
         cursor.execute('INSERT INTO %s ' 'VALUES (%%s, %%s, %%s, %%s)' % table,
@@ -201,6 +208,7 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
     def tearDown(self):
         setup_test_environment.tear_down()
         self.god.unstub_all()
+        settings.reset_values()
 
     def _check_for_get_test_views(self, test):
         self.assertEquals(test['test_name'], 'mytest1')
@@ -342,6 +350,111 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
         self.assertEquals(group1['extra_info'], ['1-myjobtag1'])
         self.assertEquals(group2['extra_info'], ['2-myjobtag2'])
 
+    # the keys of the groups computed the same way from the rollups, the
+    # other ones are the fields of one of the rows of the group
+    _GROUP_KEYS = ('id', 'header_indices', 'group_count', 'pass_count',
+                   'complete_count', 'incomplete_count', 'extra_info')
+
+    def _check_rollups_match_view(self, method, group_by, **filter_data):
+        results = []
+        for use_rollups in ('False', 'True'):
+            settings.override_value('AUTOTEST_WEB', 'tko_rollups', use_rollups)
+            result = method(group_by, **dict(filter_data))
+            if isinstance(result, dict):
+                keys = list(self._GROUP_KEYS) + group_by
+                result['groups'] = [
+                    dict((key, group[key]) for key in keys if key in group)
+                    for group in result['groups']]
+            results.append(result)
+        self.assertEquals(results[0], results[1])
+        return results[1]
+
+    def test_rollups(self):
+        self.assertEquals(3, models.TestRollup.objects.count())
+        counts = self._check_rollups_match_view(
+            rpc_interface.get_status_counts, ['hostname', 'kernel'],
+            header_groups=[('kernel',)], sort_by=['kernel'],
+            extra_where='status != "RUNNING" AND job_name LIKE "myjob%"')
+        self.assertEquals(['mykernel1', 'mykernel2'],
+                          [str(kernel) for kernel, in
+                           counts['header_values'][0]])
+        group1, group2 = counts['groups']
+        self.assertEquals((2, 1, 2), (group1['group_count'],
+                                      group1['pass_count'],
+                                      group1['complete_count']))
+        self.assertEquals((1, 1, 1), (group2['group_count'],
+                                      group2['pass_count'],
+                                      group2['complete_count']))
+        self._check_rollups_match_view(rpc_interface.get_group_counts,
+                                       ['DATE(job_queued_time)', 'status'],
+                                       job_name__in=['myjob1'])
+        latest = self._check_rollups_match_view(
+            rpc_interface.get_latest_tests, ['job_name'],
+            extra_info=['job_tag'])
+        self.assertEquals([['1-myjobtag1'], ['2-myjobtag2']],
+                          [group['extra_info'] for group in latest['groups']])
+        self.assertEquals(
+            [2, 3], [group['test_idx'] for group in
+                     rpc_interface.get_latest_tests(['job_name'])['groups']])
+        self.assertEquals(2, self._check_rollups_match_view(
+            rpc_interface.get_num_groups, ['test_name'], job_owner='myuser',
+            status='GOOD'))
+
+    def test_rollups_planner(self):
+        settings.override_value('AUTOTEST_WEB', 'tko_rollups', 'True')
+        can_use_rollups = models.TestView.objects.can_use_rollups
+        self.assertTrue(can_use_rollups({'hostname__in': ['myhost'],
+                                         'test_label_fields': [],
+                                         'extra_where': "kernel = 'a.b'"},
+                                        ['DATE(job_queued_time)']))
+        self.assertFalse(can_use_rollups({}, ['reason']))
+        self.assertFalse(can_use_rollups({'test_idx__gt': 1}, ['job_name']))
+        self.assertFalse(can_use_rollups({'test_label_fields': ['label']},
+                                         ['job_name']))
+        self.assertFalse(can_use_rollups(
+            {'extra_where': 'tko_test_labels.name = "label"'}, ['job_name']))
+        self.assertFalse(can_use_rollups({'sort_by': ['-test_finished_time']},
+                                         ['job_name']))
+        self.assertFalse(can_use_rollups({'extra_args': {'where': ['1']}},
+                                         ['job_name']))
+
+        # the rows of a job follow its tests
+        test = models.Test.objects.get(test='mytest2')
+        test.status = self.first_test.status
+        test.save()
+        models.TestRollup.objects.refresh_job(test.job_id)
+        self._check_rollups_match_view(rpc_interface.get_status_counts,
+                                       ['job_name'])
+        machine = models.Machine.objects.get(hostname='myhost')
+        machine.machine_group = 'myplatform'
+        machine.save()
+        models.TestRollup.objects.refresh_machine(machine)
+        self._check_rollups_match_view(rpc_interface.get_group_counts,
+                                       ['platform', 'test_name'])
+
+    def test_rpc_cache(self):
+        settings.override_value('AUTOTEST_WEB', 'tko_rpc_cache_size', '10')
+        rpc_cache.get_rpc_cache().clear()
+        self.assertEquals(3, rpc_interface.get_num_test_views())
+        self.assertEquals(1, rpc_interface.get_num_test_views(
+            test_name='mytest1', job_name='myjob1'))
+        self.assertEquals(1, rpc_interface.get_num_test_views(
+            job_name='myjob1', test_name='mytest1'))
+        test = rpc_interface.get_detailed_test_views(test_name='mytest1')[0]
+        self.assertEquals('myval', test['attributes']['myattr'])
+
+        rpc_interface.set_test_attribute('foo', 'bar', test_name='mytest1')
+        test = rpc_interface.get_detailed_test_views(test_name='mytest1')[0]
+        self.assertEquals('bar', test['attributes']['foo'])
+        self.assertEquals({'get_num_test_views': {'hits': 1, 'shared_hits': 0,
+                                                  'misses': 2,
+                                                  'hit_rate': 1 / 3.0},
+                           'get_detailed_test_views': {'hits': 0,
+                                                       'shared_hits': 0,
+                                                       'misses': 2,
+                                                       'hit_rate': 0.0}},
+                          rpc_interface.get_rpc_cache_stats())
+
     def test_get_job_ids(self):
         self.assertEquals([1, 2], rpc_interface.get_job_ids())
         self.assertEquals([1], rpc_interface.get_job_ids(test_name='mytest2'))
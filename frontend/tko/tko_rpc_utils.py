@@ -54,9 +54,25 @@ _INCOMPLETE_COUNT_SQL = 'COUNT(IF(status="RUNNING", 1, NULL))'
 STATUS_FIELDS = {_PASS_COUNT_NAME: _PASS_COUNT_SQL,
                  _COMPLETE_COUNT_NAME: _COMPLETE_COUNT_SQL,
                  _INCOMPLETE_COUNT_NAME: _INCOMPLETE_COUNT_SQL}
+# the same counts, from the rows of TestRollup
+ROLLUP_STATUS_FIELDS = {_PASS_COUNT_NAME: 'SUM(passed_tests)',
+                        _COMPLETE_COUNT_NAME: 'SUM(complete_tests)',
+                        _INCOMPLETE_COUNT_NAME: 'SUM(incomplete_tests)'}
 _INVALID_STATUSES = ('TEST_NA', 'NOSTATUS')
 
 
+def get_rollup_select_fields(extra_select_fields):
+    """
+    :return: the extra select fields computing extra_select_fields from the
+            rows of TestRollup, None if they cannot be computed from them.
+    """
+    if not extra_select_fields:
+        return {}
+    if extra_select_fields == STATUS_FIELDS:
+        return ROLLUP_STATUS_FIELDS
+    return None
+
+
 def add_status_counts(group_dict, status):
     pass_count = complete_count = incomplete_count = 0
     if status == 'GOOD':
@@ -117,7 +133,7 @@ class GroupDataProcessor(object):
 
     def _fetch_data(self):
         self._restrict_header_values()
-        self._group_dicts = models.TestView.objects.execute_group_query(
+        self._group_dicts = self._query.model.objects.execute_group_query(
             self._query, self._group_by)
 
     @staticmethod
@@ -1,5 +1,7 @@
 import heapq
 import os
+import sys
+import threading
 import traceback
 
 try:
@@ -111,6 +113,26 @@ class InvalidPidfile(object):
         return self.error
 
 
+class _DroneRefreshState(object):
+
+    """
+    What the DroneManager knows about one drone from incremental refreshes
+    (see DroneUtility.refresh_changes()).
+    """
+
+    def __init__(self):
+        self.session = None
+        # pidfile paths the drone checks in this session
+        self.pidfile_paths = frozenset()
+        # maps pidfile path to raw contents, as of the second read
+        self.pidfiles = {}
+        # maps pidfile path to raw contents (None if absent) as of the first
+        # read, for the pidfiles that changed between the two reads
+        self.first_read_changes = {}
+        # Process objects of the autoserv and parse processes
+        self.processes = set()
+
+
 class _DroneHeapWrapper(object):
 
     """Wrapper to compare drones based on used_capacity().
@@ -156,6 +178,18 @@ class DroneManager(object):
         self._attached_files = {}
         # heapq of _DroneHeapWrappers
         self._drone_queue = []
+        # whether to talk to all drones at once or one after another
+        self._concurrent_drone_calls = False
+        # whether drones only report changes (see _refresh_incrementally())
+        self._incremental_refresh = False
+        # maps hostname to _DroneRefreshState
+        self._drone_refresh_states = {}
+        # maps PidfileId to (hostname, number of processes) of the running
+        # processes, and hostname to the total of its processes
+        self._pidfile_process_counts = {}
+        self._drone_process_counts = {}
+        # PidfileIds whose number of processes must be recounted
+        self._pidfiles_to_recount = set()
 
     def initialize(self, base_results_dir, drone_hostnames,
                    results_repository_hostname):
@@ -209,6 +243,9 @@ class DroneManager(object):
 
     def _remove_drone(self, hostname):
         self._drones.pop(hostname, None)
+        state = self._drone_refresh_states.pop(hostname, None)
+        if state is not None:
+            self._process_set -= state.processes
 
     def refresh_drone_configs(self):
         """
@@ -231,11 +268,30 @@ class DroneManager(object):
                 allowed_users = set(allowed_users.split())
             drone.allowed_users = allowed_users
 
+        self._concurrent_drone_calls = settings.get_value(
+            section, 'drone_concurrent_calls', type=bool, default=False)
+        self._incremental_refresh = settings.get_value(
+            section, 'drone_incremental_refresh', type=bool, default=False)
+
         self._reorder_drone_queue()  # max_processes may have changed
 
     def get_drones(self):
         return self._drones.itervalues()
 
+    def get_transfer_stats(self):
+        """
+        :return: a list of (name, stats) for the drones, and the results
+                repository, that reported TransferEngine statistics.
+        """
+        transfer_stats = [(drone.hostname, drone.transfer_stats)
+                          for drone in self.get_drones()
+                          if drone.transfer_stats]
+        if self._results_drone and self._results_drone.transfer_stats:
+            transfer_stats.append(
+                ('%s (results repository)' % self._results_drone.hostname,
+                 self._results_drone.transfer_stats))
+        return transfer_stats
+
     def _get_drone_for_process(self, process):
         return self._drones[process.hostname]
 
@@ -245,9 +301,10 @@ class DroneManager(object):
         return self._get_drone_for_process(pidfile_contents.process)
 
     def _drop_old_pidfiles(self):
+        max_pidfile_refreshes = self._get_max_pidfile_refreshes()
         # use items() since the dict is modified in unregister_pidfile()
         for pidfile_id, info in self._registered_pidfile_info.items():
-            if info.age > self._get_max_pidfile_refreshes():
+            if info.age > max_pidfile_refreshes:
                 logging.warning('dropping leaked pidfile %s', pidfile_id)
                 self.unregister_pidfile(pidfile_id)
             else:
@@ -259,12 +316,48 @@ class DroneManager(object):
         self._pidfiles_second_read = {}
         self._drone_queue = []
 
-    def _call_all_drones(self, method, *args, **kwargs):
+    def _for_each_drone(self, drones, function):
+        """
+        Apply function to each of the given drones.
+
+        If drone_concurrent_calls is enabled, every drone is handled in its own
+        thread, so the slowest drone rather than the sum of all drones bounds
+        the time spent.  In that case all drones are handled before the first
+        exception raised (if any) is re-raised.
+
+        :return: A dict mapping each drone to the return value of function.
+        """
+        drones = list(drones)
+        if not self._concurrent_drone_calls or len(drones) < 2:
+            return dict((drone, function(drone)) for drone in drones)
+
         all_results = {}
-        for drone in self.get_drones():
-            all_results[drone] = drone.call(method, *args, **kwargs)
+        failures = {}
+
+        def handle(drone):
+            try:
+                all_results[drone] = function(drone)
+            except Exception:
+                failures[drone] = sys.exc_info()
+
+        threads = [threading.Thread(target=handle, args=(drone,))
+                   for drone in drones]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for drone in drones:
+            if drone in failures:
+                exc_type, exc_value, exc_traceback = failures[drone]
+                raise exc_type, exc_value, exc_traceback
         return all_results
 
+    def _call_all_drones(self, method, *args, **kwargs):
+        return self._for_each_drone(
+            self.get_drones(),
+            lambda drone: drone.call(method, *args, **kwargs))
+
     def _parse_pidfile(self, drone, raw_contents):
         contents = PidfileContents()
         if not raw_contents:
@@ -311,6 +404,21 @@ class DroneManager(object):
     def _reorder_drone_queue(self):
         heapq.heapify(self._drone_queue)
 
+    def _count_processes(self, pidfile_id, contents):
+        """
+        :return: (hostname, number of processes) if the pidfile is of a
+                running process whose number of processes is known, None
+                otherwise.
+        """
+        if contents.is_invalid() or contents.exit_status is not None:
+            return None
+        if not contents.process:
+            return None
+        info = self._registered_pidfile_info.get(pidfile_id)
+        if info is None or info.num_processes is None:
+            return None
+        return contents.process.hostname, info.num_processes
+
     def _compute_active_processes(self, drone):
         drone.active_processes = 0
         for pidfile_id, contents in self._pidfiles.iteritems():
@@ -327,6 +435,11 @@ class DroneManager(object):
         Called at the beginning of a scheduler cycle to refresh all process
         information.
         """
+        if self._incremental_refresh:
+            self._drop_old_pidfiles()
+            self._refresh_incrementally()
+            return
+        self._reset_incremental_refresh()
         self._reset()
         self._drop_old_pidfiles()
         pidfile_paths = [pidfile_id.path
@@ -349,13 +462,185 @@ class DroneManager(object):
             if drone.enabled:
                 self._enqueue_drone(drone)
 
+    def _reset_incremental_refresh(self):
+        self._drone_refresh_states = {}
+        self._pidfile_process_counts = {}
+        self._drone_process_counts = {}
+        self._pidfiles_to_recount = set()
+
+    def _call_refresh_changes(self, drone, state, pidfile_paths):
+        if state.session is None or not drone.is_resident():
+            # a drone_utility that does not stay resident must be sent
+            # everything every time
+            return drone.call('refresh_changes',
+                              drone_utility.REFRESH_PROTOCOL_VERSION, None,
+                              list(pidfile_paths), [])[0]
+        reply = drone.call('refresh_changes',
+                           drone_utility.REFRESH_PROTOCOL_VERSION,
+                           state.session,
+                           list(pidfile_paths - state.pidfile_paths),
+                           list(state.pidfile_paths - pidfile_paths))[0]
+        if reply.get('resync'):
+            logging.info('drone_utility on %s was restarted, starting a new '
+                         'refresh session', drone.hostname)
+            reply = drone.call('refresh_changes',
+                               drone_utility.REFRESH_PROTOCOL_VERSION, None,
+                               list(pidfile_paths), [])[0]
+        if reply['version'] != drone_utility.REFRESH_PROTOCOL_VERSION:
+            raise DroneManagerError('Drone %s replied with refresh protocol '
+                                    'version %r' % (drone.hostname,
+                                                    reply['version']))
+        return reply
+
+    @staticmethod
+    def _apply_raw_changes(pidfiles, changes):
+        for path, contents in changes.iteritems():
+            if contents is None:
+                pidfiles.pop(path, None)
+            else:
+                pidfiles[path] = contents
+
+    def _apply_refresh_changes(self, drone, state, reply, pidfile_paths):
+        """
+        Update the state of a drone with the changes it reported.
+
+        :return: the paths of the pidfiles whose contents may have changed.
+        """
+        changed_paths = set(state.first_read_changes)
+        if reply['full']:
+            changed_paths.update(state.pidfiles)
+            state.pidfiles = {}
+            self._process_set -= state.processes
+            state.processes = set()
+        state.session = reply['session']
+        state.pidfile_paths = pidfile_paths
+
+        # the first read changes the pidfiles as of the previous second read
+        self._apply_raw_changes(state.pidfiles, reply['pidfiles'])
+        changed_paths.update(reply['pidfiles'])
+        state.first_read_changes = dict(
+            (path, state.pidfiles.get(path))
+            for path in reply['pidfiles_second_read'])
+        self._apply_raw_changes(state.pidfiles, reply['pidfiles_second_read'])
+        changed_paths.update(reply['pidfiles_second_read'])
+
+        for category, process_info in reply['processes_exited']:
+            process = Process(drone.hostname, int(process_info['pid']))
+            state.processes.discard(process)
+            self._process_set.discard(process)
+        for category, process_info in reply['processes_started']:
+            # only root autoserv processes have pgid == pid
+            if (category == 'autoserv' and
+                    process_info['pgid'] != process_info['pid']):
+                continue
+            process = Process(drone.hostname, int(process_info['pid']),
+                              int(process_info['ppid']))
+            state.processes.add(process)
+            self._process_set.add(process)
+        return changed_paths
+
+    def _merge_pidfile(self, path):
+        """
+        Recompute the contents of a pidfile from what the drones reported,
+        the last drone having it winning like in a full refresh.
+        """
+        pidfile_id = PidfileId(path)
+        self._pidfiles.pop(pidfile_id, None)
+        self._pidfiles_second_read.pop(pidfile_id, None)
+        for hostname, drone in self._drones.iteritems():
+            state = self._drone_refresh_states.get(hostname)
+            if state is None:
+                continue
+            second_read = state.pidfiles.get(path)
+            first_read = state.first_read_changes.get(path, second_read)
+            if first_read is not None:
+                self._pidfiles[pidfile_id] = self._parse_pidfile(drone,
+                                                                 first_read)
+            if second_read is not None:
+                self._pidfiles_second_read[pidfile_id] = self._parse_pidfile(
+                    drone, second_read)
+        self._pidfiles_to_recount.add(pidfile_id)
+
+    def _recount_processes(self):
+        for pidfile_id in self._pidfiles_to_recount:
+            old_count = self._pidfile_process_counts.pop(pidfile_id, None)
+            if old_count:
+                self._drone_process_counts[old_count[0]] -= old_count[1]
+            contents = self._pidfiles.get(pidfile_id)
+            if contents is None:
+                continue
+            count = self._count_processes(pidfile_id, contents)
+            if count:
+                self._pidfile_process_counts[pidfile_id] = count
+                hostname, num_processes = count
+                self._drone_process_counts[hostname] = (
+                    self._drone_process_counts.get(hostname, 0) +
+                    num_processes)
+        self._pidfiles_to_recount = set()
+
+    def _refresh_incrementally(self):
+        """
+        Refresh using DroneUtility.refresh_changes(): drones are only sent
+        the pidfiles registered or unregistered since the previous refresh
+        and only report the pidfiles that changed and the processes that
+        started or exited, and the pidfiles, processes and per-drone process
+        counts are updated from these changes only.
+        """
+        if not self._drone_refresh_states:
+            self._reset()
+            self._reset_incremental_refresh()
+        pidfile_paths = frozenset(pidfile_id.path for pidfile_id
+                                  in self._registered_pidfile_info)
+        forgotten_paths = set()
+        for hostname in self._drones:
+            state = self._drone_refresh_states.setdefault(
+                hostname, _DroneRefreshState())
+            forgotten_paths.update(state.pidfile_paths - pidfile_paths)
+
+        try:
+            all_results = self._for_each_drone(
+                self.get_drones(),
+                lambda drone: self._call_refresh_changes(
+                    drone, self._drone_refresh_states[drone.hostname],
+                    pidfile_paths))
+            changed_paths = set()
+            for drone, reply in all_results.iteritems():
+                changed_paths.update(self._apply_refresh_changes(
+                    drone, self._drone_refresh_states[drone.hostname], reply,
+                    pidfile_paths))
+        except Exception:
+            # some drones may have moved on without the changes being
+            # applied here, start over with everything
+            for state in self._drone_refresh_states.itervalues():
+                state.session = None
+            raise
+
+        for path in forgotten_paths:
+            pidfile_id = PidfileId(path)
+            for state in self._drone_refresh_states.itervalues():
+                state.pidfiles.pop(path, None)
+                state.first_read_changes.pop(path, None)
+            self._pidfiles.pop(pidfile_id, None)
+            self._pidfiles_second_read.pop(pidfile_id, None)
+            self._pidfiles_to_recount.add(pidfile_id)
+        for path in changed_paths - forgotten_paths:
+            self._merge_pidfile(path)
+        self._recount_processes()
+
+        self._drone_queue = []
+        for drone in self.get_drones():
+            drone.active_processes = self._drone_process_counts.get(
+                drone.hostname, 0)
+            if drone.enabled:
+                self._enqueue_drone(drone)
+
     def execute_actions(self):
         """
         Called at the end of a scheduler cycle to execute all queued actions
         on drones.
         """
-        for drone in self._drones.values():
-            drone.execute_queued_calls()
+        self._for_each_drone(self._drones.values(),
+                             lambda drone: drone.execute_queued_calls())
 
         try:
             self._results_drone.execute_queued_calls()
@@ -518,7 +803,7 @@ class DroneManager(object):
         pidfile_path = os.path.join(abs_working_directory, pidfile_name)
         pidfile_id = PidfileId(pidfile_path)
         self.register_pidfile(pidfile_id)
-        self._registered_pidfile_info[pidfile_id].num_processes = num_processes
+        self.declare_process_count(pidfile_id, num_processes)
         return pidfile_id
 
     def get_pidfile_id_from(self, execution_tag, pidfile_name):
@@ -546,6 +831,7 @@ class DroneManager(object):
 
     def declare_process_count(self, pidfile_id, num_processes):
         self._registered_pidfile_info[pidfile_id].num_processes = num_processes
+        self._pidfiles_to_recount.add(pidfile_id)
 
     def get_pidfile_contents(self, pidfile_id, use_second_read=False):
         """
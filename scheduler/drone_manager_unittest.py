@@ -1,6 +1,8 @@
 #!/usr/bin/python
 
 import os
+import shutil
+import tempfile
 import unittest
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -8,7 +10,7 @@ except ImportError:
     import common  # pylint: disable=W0611
 from autotest.client.shared.settings import settings
 from autotest.client.shared.test_utils import mock
-from autotest.scheduler import drone_manager, drones
+from autotest.scheduler import drone_manager, drone_utility, drones
 from autotest.scheduler import scheduler_config
 
 
@@ -310,6 +312,179 @@ class DroneManager(unittest.TestCase):
         self.manager._drop_old_pidfiles()
         self.assertFalse(self.manager._registered_pidfile_info)
 
+    def test_concurrent_drone_calls(self):
+        self.god.stub_with(self.manager, '_concurrent_drone_calls', True)
+        other_drone = MockDrone('other_drone')
+        self.manager._drones[other_drone.name] = other_drone
+
+        self.manager.reinitialize_drones()
+
+        for drone in (self.mock_drone, other_drone):
+            self.assert_(drone.was_call_queued('initialize',
+                                               self._RESULTS_DIR))
+
+    def test_concurrent_drone_calls_failure(self):
+        self.god.stub_with(self.manager, '_concurrent_drone_calls', True)
+        other_drone = MockDrone('other_drone')
+        self.manager._drones[other_drone.name] = other_drone
+
+        def fail(method, *args, **kwargs):
+            raise drones.error.AutoservError('drone down')
+        self.god.stub_with(self.mock_drone, 'call', fail)
+
+        self.assertRaises(drones.error.AutoservError,
+                          self.manager.reinitialize_drones)
+        # the healthy drone was still contacted
+        self.assert_(other_drone.was_call_queued('initialize',
+                                                 self._RESULTS_DIR))
+
+
+class IncrementalRefreshTest(unittest.TestCase):
+
+    _PIDFILE = '/results/1-job/.autoserv_execute'
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.manager = drone_manager.DroneManager()
+        self.god.stub_with(self.manager, '_incremental_refresh', True)
+        self.drone = MockDrone('drone')
+        self.god.stub_with(self.drone, 'call', self._call)
+        self.god.stub_with(self.drone, 'is_resident', lambda: True)
+        self.manager._drones[self.drone.hostname] = self.drone
+        self.calls = []
+        self.replies = []
+        self.pidfile_id = drone_manager.PidfileId(self._PIDFILE)
+        self.manager.register_pidfile(self.pidfile_id)
+        self.manager.declare_process_count(self.pidfile_id, 2)
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+    def _call(self, method, *args):
+        self.assertEquals('refresh_changes', method)
+        self.calls.append(args)
+        return [self.replies.pop(0)]
+
+    @staticmethod
+    def _reply(full=False, pidfiles={}, started=(), exited=(),
+               pidfiles_second_read={}):
+        return {'version': drone_utility.REFRESH_PROTOCOL_VERSION,
+                'session': 's1', 'full': full, 'pidfiles': pidfiles,
+                'processes_started': list(started),
+                'processes_exited': list(exited),
+                'pidfiles_second_read': pidfiles_second_read}
+
+    @staticmethod
+    def _autoserv(pid):
+        return ('autoserv', {'pid': str(pid), 'pgid': str(pid), 'ppid': '1',
+                             'comm': 'autotest-remote', 'args': ''})
+
+    def test_refresh(self):
+        process = drone_manager.Process('drone', 100)
+        self.replies.append(self._reply(
+            full=True, pidfiles={self._PIDFILE: '100\n'},
+            started=[self._autoserv(100)],
+            pidfiles_second_read={}))
+        self.manager.refresh()
+        self.assertEquals((drone_utility.REFRESH_PROTOCOL_VERSION, None,
+                           [self._PIDFILE], []), self.calls[-1])
+        self.assertEquals(process, self.manager.get_pidfile_contents(
+            self.pidfile_id).process)
+        self.assert_(self.manager.is_process_running(process))
+        self.assertEquals(2, self.drone.active_processes)
+
+        # nothing changed
+        self.replies.append(self._reply())
+        self.manager.refresh()
+        self.assertEquals((drone_utility.REFRESH_PROTOCOL_VERSION, 's1',
+                           [], []), self.calls[-1])
+        self.assert_(self.manager.is_process_running(process))
+        self.assertEquals(2, self.drone.active_processes)
+
+        # autoserv exits between the two reads
+        self.replies.append(self._reply(
+            exited=[self._autoserv(100)],
+            pidfiles_second_read={self._PIDFILE: '100\n0\n0\n'}))
+        self.manager.refresh()
+        self.assertFalse(self.manager.is_process_running(process))
+        self.assertEquals(None, self.manager.get_pidfile_contents(
+            self.pidfile_id).exit_status)
+        self.assertEquals(0, self.manager.get_pidfile_contents(
+            self.pidfile_id, use_second_read=True).exit_status)
+        self.assertEquals(2, self.drone.active_processes)
+
+        # the next first read sees the previous second read
+        self.replies.append(self._reply())
+        self.manager.refresh()
+        self.assertEquals(0, self.manager.get_pidfile_contents(
+            self.pidfile_id).exit_status)
+        self.assertEquals(0, self.drone.active_processes)
+
+        self.manager.unregister_pidfile(self.pidfile_id)
+        self.replies.append(self._reply())
+        self.manager.refresh()
+        self.assertEquals((drone_utility.REFRESH_PROTOCOL_VERSION, 's1',
+                           [], [self._PIDFILE]), self.calls[-1])
+        self.assertEquals(None, self.manager.get_pidfile_contents(
+            self.pidfile_id).process)
+
+    def test_resync(self):
+        self.replies.append(self._reply(full=True, started=[
+            self._autoserv(100)]))
+        self.manager.refresh()
+        self.replies.append({'version': drone_utility.REFRESH_PROTOCOL_VERSION,
+                             'session': None, 'resync': True})
+        self.replies.append(self._reply(full=True, started=[
+            self._autoserv(200)]))
+        self.manager.refresh()
+        self.assertEquals((drone_utility.REFRESH_PROTOCOL_VERSION, None,
+                           [self._PIDFILE], []), self.calls[-1])
+        self.assertEquals(set([drone_manager.Process('drone', 200)]),
+                          self.manager._process_set)
+
+    def test_failure_starts_a_new_session(self):
+        self.replies.append(self._reply(full=True))
+        self.manager.refresh()
+        self.replies.append({'version': 0})
+        self.assertRaises(drone_manager.DroneManagerError,
+                          self.manager.refresh)
+        self.replies.append(self._reply(full=True))
+        self.manager.refresh()
+        self.assertEquals(None, self.calls[-1][1])
+
+    def test_matches_full_refresh(self):
+        results_dir = tempfile.mkdtemp()
+        try:
+            local_drone = drones._LocalDrone()
+            self.manager._drones = {local_drone.hostname: local_drone}
+            pidfile_ids = []
+            for index in xrange(3):
+                job_dir = os.path.join(results_dir, '%d-job' % index)
+                os.mkdir(job_dir)
+                pidfile_id = drone_manager.PidfileId(
+                    os.path.join(job_dir, '.autoserv_execute'))
+                self.manager.register_pidfile(pidfile_id)
+                self.manager.declare_process_count(pidfile_id, 1)
+                pidfile_ids.append(pidfile_id)
+            open(pidfile_ids[0].path, 'w').write('%d\n' % os.getpid())
+            open(pidfile_ids[1].path, 'w').write('1\n0\n0\n')
+
+            def view():
+                self.manager.refresh()
+                return ([(self.manager.get_pidfile_contents(pidfile_id)
+                          .process, self.manager.get_pidfile_contents(
+                              pidfile_id).exit_status)
+                         for pidfile_id in pidfile_ids],
+                        local_drone.active_processes)
+
+            incremental_view = view()
+            self.assertEquals(incremental_view, view())
+            self.manager._incremental_refresh = False
+            self.assertEquals(incremental_view, view())
+            self.assertEquals(1, incremental_view[1])
+        finally:
+            shutil.rmtree(results_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+"""
+Compare the cost of DroneManager.refresh() with a local drone and thousands
+of running jobs:
+
+* full: the drone runs ps and reads every registered pidfile twice, and the
+  manager rebuilds its view from scratch.
+* tracker: the drone keeps a DroneTracker (SCHEDULER.drone_process_tracker)
+  but still returns the full view.
+* incremental: the drone only reports changes and the manager updates its
+  view from them (SCHEDULER.drone_incremental_refresh).
+
+Every tick, some jobs finish (their pidfile gets an exit status) and as many
+new ones start, and the pidfiles of the jobs that finished on the previous
+tick are unregistered.  The size of the pickled drone replies is reported
+too, as it is what goes over the wire for remote drones.
+"""
+
+import cPickle
+import logging
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+from autotest.scheduler import drone_manager, drones
+
+
+class _MeasuredLocalDrone(drones._LocalDrone):
+
+    """A local drone recording the size of its pickled replies."""
+
+    def __init__(self):
+        super(_MeasuredLocalDrone, self).__init__()
+        self.reply_bytes = 0
+
+    def _execute_calls_impl(self, calls):
+        return_message = super(_MeasuredLocalDrone,
+                               self)._execute_calls_impl(calls)
+        self.reply_bytes += len(cPickle.dumps(return_message,
+                                              cPickle.HIGHEST_PROTOCOL))
+        return return_message
+
+
+class _Jobs(object):
+
+    """Fake running jobs: a results directory and pidfile per job."""
+
+    def __init__(self, results_dir, manager):
+        self._results_dir = results_dir
+        self._manager = manager
+        self._count = 0
+        self.running = []
+        self._finished = []
+
+    def start(self):
+        self._count += 1
+        job_dir = os.path.join(self._results_dir, '%d-bench' % self._count)
+        os.mkdir(job_dir)
+        pidfile_id = drone_manager.PidfileId(
+            os.path.join(job_dir, drone_manager.AUTOSERV_PID_FILE))
+        open(pidfile_id.path, 'w').write('%d\n' % (100000 + self._count))
+        self._manager.register_pidfile(pidfile_id)
+        self._manager.declare_process_count(pidfile_id, 1)
+        self.running.append(pidfile_id)
+
+    def churn(self, count):
+        for pidfile_id in self._finished:
+            self._manager.unregister_pidfile(pidfile_id)
+        self._finished = self.running[:count]
+        del self.running[:count]
+        for pidfile_id in self._finished:
+            open(pidfile_id.path, 'a').write('0\n0\n')
+        for _ in xrange(count):
+            self.start()
+
+
+def run_benchmark(mode, options):
+    settings.override_value('SCHEDULER', 'drone_process_tracker',
+                            repr(mode != 'full'))
+    results_dir = tempfile.mkdtemp()
+    try:
+        manager = drone_manager.DroneManager()
+        manager._incremental_refresh = (mode == 'incremental')
+        drone = _MeasuredLocalDrone()
+        drone.max_processes = options.jobs * 2
+        manager._drones[drone.hostname] = drone
+        jobs = _Jobs(results_dir, manager)
+        for _ in xrange(options.jobs):
+            jobs.start()
+
+        start_time = time.time()
+        manager.refresh()
+        first_refresh_time = time.time() - start_time
+        drone.reply_bytes = 0
+
+        refresh_time = 0
+        for _ in xrange(options.ticks):
+            jobs.churn(options.churn)
+            start_time = time.time()
+            manager.refresh()
+            refresh_time += time.time() - start_time
+        assert drone.active_processes == options.jobs, drone.active_processes
+        drone._drone_utility._tracker and drone._drone_utility._tracker.close()
+    finally:
+        shutil.rmtree(results_dir)
+        settings.reset_values()
+
+    print '%-12s first refresh %8.1f ms, then %8.2f ms/tick, %9d bytes ' \
+        'replied/tick' % (mode, first_refresh_time * 1000,
+                          refresh_time * 1000 / options.ticks,
+                          drone.reply_bytes / options.ticks)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--jobs', type=int, default=5000,
+                      help='number of running jobs [default: %default]')
+    parser.add_option('--churn', type=int, default=20,
+                      help='jobs finishing and starting every tick '
+                           '[default: %default]')
+    parser.add_option('--ticks', type=int, default=10,
+                      help='ticks to average over [default: %default]')
+    parser.add_option('--modes', default='full,tracker,incremental',
+                      help='comma separated refresh modes to run '
+                           '[default: %default]')
+    options = parser.parse_args()[0]
+    # pidfile registrations are logged at INFO level
+    logging.disable(logging.INFO)
+
+    print '%d running jobs, %d finishing and starting per tick' % (
+        options.jobs, options.churn)
+    for mode in options.modes.split(','):
+        run_benchmark(mode, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""
+Incremental tracking of pidfiles and processes on a drone.
+
+A drone_utility that stays resident (the local drone, or a remote drone
+reached over a persistent channel) keeps a DroneTracker between refreshes.
+Instead of running ps and reading every registered pidfile twice per tick,
+the tracker
+
+* watches the directories of the registered pidfiles with inotify and only
+  reads the pidfiles that changed since the previous refresh (all of them
+  are polled where inotify is not available), and
+* lists /proc and only reads /proc/<pid>/stat and cmdline of the PIDs it has
+  not seen before.
+
+Each refresh returns the changes since the previous one, so its cost scales
+with the churn rather than with the number of running jobs.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+               IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 65536
+
+# fields of the process info dicts, the same as drone_utility's ps columns
+PROCESS_FIELDS = ('pid', 'pgid', 'ppid', 'comm', 'args')
+
+
+class InotifyUnavailable(Exception):
+
+    """inotify cannot be used on this system."""
+    pass
+
+
+class Inotify(object):
+
+    """A minimal non-blocking ctypes binding of the Linux inotify API."""
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init1 = libc.inotify_init1
+        except (OSError, AttributeError), e:
+            raise InotifyUnavailable(str(e))
+        self._libc = libc
+        self.fd = init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask):
+        """
+        :return: the watch descriptor.
+        :raise OSError: if path cannot be watched.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """:return: a list of (wd, mask, name) of all the pending events."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PidfileWatcher(object):
+
+    """
+    Keeps the contents of a set of pidfiles and tells which ones changed.
+
+    The directories of the pidfiles are watched with inotify.  Pidfiles in
+    directories that cannot be watched (they do not exist yet, or the watch
+    limit was reached) are read on every refresh, as are all of them if
+    inotify is not available at all.
+    """
+
+    def __init__(self, use_inotify=True):
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+            except InotifyUnavailable, e:
+                logging.warning('inotify is not available, polling pidfiles: '
+                                '%s', e)
+        self._paths = set()
+        # directory -> set of the names of the pidfiles it holds
+        self._directories = {}
+        self._wd_to_directory = {}
+        self._directory_to_wd = {}
+        # pidfile path -> contents, for the existing pidfiles
+        self.contents = {}
+        self._dirty = set()
+
+    def _watch(self, directory):
+        if self._inotify is None:
+            return
+        try:
+            wd = self._inotify.add_watch(directory, _WATCH_MASK)
+        except OSError, e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                logging.warning('Cannot watch %s, polling it instead: %s',
+                                directory, e)
+            return
+        self._wd_to_directory[wd] = directory
+        self._directory_to_wd[directory] = wd
+
+    def _unwatch(self, directory):
+        wd = self._directory_to_wd.pop(directory, None)
+        if wd is not None:
+            del self._wd_to_directory[wd]
+            self._inotify.rm_watch(wd)
+
+    def _mark_directory_dirty(self, directory):
+        for name in self._directories.get(directory, ()):
+            self._dirty.add(os.path.join(directory, name))
+
+    def add_paths(self, pidfile_paths):
+        """Start tracking the given pidfiles."""
+        for path in pidfile_paths:
+            if path in self._paths:
+                continue
+            self._paths.add(path)
+            directory, name = os.path.split(path)
+            names = self._directories.get(directory)
+            if names is None:
+                names = self._directories[directory] = set()
+                # watch before reading, so no change can be missed
+                self._watch(directory)
+            names.add(name)
+            self._dirty.add(path)
+
+    def remove_paths(self, pidfile_paths):
+        """Stop tracking the given pidfiles and forget their contents."""
+        for path in pidfile_paths:
+            if path not in self._paths:
+                continue
+            self._paths.remove(path)
+            self.contents.pop(path, None)
+            self._dirty.discard(path)
+            directory, name = os.path.split(path)
+            names = self._directories[directory]
+            names.remove(name)
+            if not names:
+                del self._directories[directory]
+                self._unwatch(directory)
+
+    def set_paths(self, pidfile_paths):
+        """Set the pidfiles to track, forgetting the ones not listed."""
+        pidfile_paths = set(pidfile_paths)
+        self.remove_paths(self._paths - pidfile_paths)
+        self.add_paths(pidfile_paths - self._paths)
+
+    def _handle_events(self):
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logging.warning('inotify queue overflow, rereading all '
+                                'pidfiles')
+                self._dirty.update(self._paths)
+                continue
+            directory = self._wd_to_directory.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # the directory is gone, poll it until it comes back
+                self._unwatch(directory)
+                self._mark_directory_dirty(directory)
+            elif name in self._directories.get(directory, ()):
+                self._dirty.add(os.path.join(directory, name))
+
+    def _read(self, path):
+        try:
+            pidfile = open(path, 'r')
+        except IOError:
+            return None
+        try:
+            return pidfile.read()
+        finally:
+            pidfile.close()
+
+    def refresh(self):
+        """
+        Reread the pidfiles that may have changed.
+
+        :return: a dict mapping the paths of the pidfiles that changed to
+                their new contents, or to None for removed pidfiles.
+        """
+        if self._inotify is not None:
+            for directory in self._directories:
+                if directory not in self._directory_to_wd:
+                    self._watch(directory)
+                    self._mark_directory_dirty(directory)
+            self._handle_events()
+        else:
+            self._dirty.update(self._paths)
+
+        changes = {}
+        for path in self._dirty:
+            contents = self._read(path)
+            if contents != self.contents.get(path):
+                changes[path] = contents
+                if contents is None:
+                    del self.contents[path]
+                else:
+                    self.contents[path] = contents
+        self._dirty = set()
+        return changes
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class ProcessScanner(object):
+
+    """
+    Tracks the processes of the current user through /proc.
+
+    A process is classified when it is first seen, by a classifier that
+    decides whether the process is of interest, and only classified again
+    when it executes another program (its command name or arguments change).
+    A process is identified by its PID and its start time, so that a PID
+    reused between two scans is seen as a process exiting and another one
+    starting.
+    """
+
+    def __init__(self, classify, proc_dir='/proc'):
+        """
+        :param classify: function taking a process info dict (see
+                PROCESS_FIELDS, all values are strings, as given by ps) and
+                returning a category for it, or None to ignore the process.
+        """
+        self._classify = classify
+        self._proc_dir = proc_dir
+        self._uid = os.getuid()
+        # pid -> (start time, category, info), category None for ignored
+        # processes
+        self._known = {}
+
+    def _read_info(self, pid):
+        """
+        :return: a (start time, info) tuple, None if the process is not ours
+                or has already exited.
+        """
+        proc_path = os.path.join(self._proc_dir, pid)
+        try:
+            if os.stat(proc_path).st_uid != self._uid:
+                return None
+            stat = open(os.path.join(proc_path, 'stat')).read()
+            cmdline = open(os.path.join(proc_path, 'cmdline')).read()
+        except EnvironmentError:
+            return None  # it has already exited
+        # the command name is in parentheses and may contain anything
+        comm_start, comm_end = stat.index('('), stat.rindex(')')
+        # fields from the 3rd one (state) on, the start time is the 22nd
+        fields = stat[comm_end + 2:].split()
+        args = cmdline.replace('\0', ' ').strip()
+        info = {'pid': pid, 'pgid': fields[2], 'ppid': fields[1],
+                'comm': stat[comm_start + 1:comm_end],
+                'args': args or '[%s]' % stat[comm_start + 1:comm_end]}
+        return fields[19], info
+
+    def processes(self, category):
+        """:return: the info dicts of the known processes of category."""
+        return [info for _, known_category, info in self._known.itervalues()
+                if known_category == category]
+
+    def scan(self):
+        """
+        :return: (started, exited) lists of (category, info) of the
+                processes of interest that started and exited since the
+                previous scan.
+        """
+        current_pids = set(entry for entry in os.listdir(self._proc_dir)
+                           if entry.isdigit())
+        exited = []
+        for pid in set(self._known) - current_pids:
+            _, category, info = self._known.pop(pid)
+            if category is not None:
+                exited.append((category, info))
+        started = []
+        for pid in current_pids:
+            process = self._read_info(pid)
+            known = self._known.get(pid)
+            if known is not None:
+                starttime, category, info = known
+                if (process is not None and process[0] == starttime and
+                        process[1]['comm'] == info['comm'] and
+                        process[1]['args'] == info['args']):
+                    continue
+                # the process exited and its PID was reused, or it executed
+                # another program
+                del self._known[pid]
+                if category is not None:
+                    exited.append((category, info))
+            if process is None:
+                continue
+            starttime, info = process
+            category = self._classify(info)
+            self._known[pid] = (starttime, category, info)
+            if category is not None:
+                started.append((category, info))
+        return started, exited
+
+
+class DroneTracker(object):
+
+    """
+    Pidfile and process tracking for DroneUtility.refresh().
+
+    refresh() returns the changes since the previous call, while the
+    pidfiles and processes attributes hold the complete current view.
+    """
+
+    def __init__(self, classify, use_inotify=True, proc_dir='/proc'):
+        self.pidfiles = PidfileWatcher(use_inotify)
+        self.processes = ProcessScanner(classify, proc_dir)
+
+    def refresh(self, pidfile_paths=None):
+        """
+        :param pidfile_paths: the pidfiles to track, None to keep tracking
+                the same ones (see also pidfiles.add_paths() and
+                pidfiles.remove_paths()).
+        :return: a dict containing:
+        * pidfiles: dict mapping the paths of the pidfiles that changed to
+          their contents (None if removed), read before the processes.
+        * processes_started, processes_exited: lists of (category, info) of
+          processes of interest.
+        * pidfiles_second_read: pidfiles changed again after the processes
+          were scanned, like pidfiles.
+        """
+        if pidfile_paths is not None:
+            self.pidfiles.set_paths(pidfile_paths)
+        pidfiles = self.pidfiles.refresh()
+        started, exited = self.processes.scan()
+        return {'pidfiles': pidfiles,
+                'processes_started': started,
+                'processes_exited': exited,
+                'pidfiles_second_read': self.pidfiles.refresh()}
+
+    def close(self):
+        self.pidfiles.close()
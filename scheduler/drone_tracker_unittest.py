@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+from autotest.scheduler import drone_tracker, drone_utility
+
+
+def _write(path, contents):
+    pidfile = open(path, 'w')
+    pidfile.write(contents)
+    pidfile.close()
+
+
+class PidfileWatcherTest(unittest.TestCase):
+
+    use_inotify = True
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.job_dir = os.path.join(self.results_dir, '1-job')
+        self.pidfile = os.path.join(self.job_dir, '.autoserv_execute')
+        self.watcher = drone_tracker.PidfileWatcher(self.use_inotify)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.results_dir)
+
+    def test_missing_directory(self):
+        self.watcher.set_paths([self.pidfile])
+        self.assertEquals({}, self.watcher.refresh())
+        os.mkdir(self.job_dir)
+        _write(self.pidfile, '100\n')
+        self.assertEquals({self.pidfile: '100\n'}, self.watcher.refresh())
+
+    def test_only_changes_are_returned(self):
+        os.mkdir(self.job_dir)
+        _write(self.pidfile, '100\n')
+        other_pidfile = os.path.join(self.job_dir, '.parser_execute')
+        self.watcher.set_paths([self.pidfile, other_pidfile])
+        self.assertEquals({self.pidfile: '100\n'}, self.watcher.refresh())
+        self.assertEquals({}, self.watcher.refresh())
+
+        _write(self.pidfile, '100\n0\n1\n')
+        self.assertEquals({self.pidfile: '100\n0\n1\n'},
+                          self.watcher.refresh())
+        self.assertEquals({self.pidfile: '100\n0\n1\n'},
+                          self.watcher.contents)
+
+        os.remove(self.pidfile)
+        self.assertEquals({self.pidfile: None}, self.watcher.refresh())
+        self.assertEquals({}, self.watcher.contents)
+
+    def test_unregistered_pidfiles_are_forgotten(self):
+        os.mkdir(self.job_dir)
+        _write(self.pidfile, '100\n')
+        self.watcher.set_paths([self.pidfile])
+        self.watcher.refresh()
+        self.watcher.set_paths([])
+        _write(self.pidfile, '100\n0\n1\n')
+        self.assertEquals({}, self.watcher.refresh())
+        self.assertEquals({}, self.watcher.contents)
+
+    def test_removed_directory(self):
+        os.mkdir(self.job_dir)
+        _write(self.pidfile, '100\n')
+        self.watcher.set_paths([self.pidfile])
+        self.watcher.refresh()
+        shutil.rmtree(self.job_dir)
+        self.assertEquals({self.pidfile: None}, self.watcher.refresh())
+        os.mkdir(self.job_dir)
+        _write(self.pidfile, '200\n')
+        self.assertEquals({self.pidfile: '200\n'}, self.watcher.refresh())
+
+
+class PollingPidfileWatcherTest(PidfileWatcherTest):
+
+    use_inotify = False
+
+
+class ProcessScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.proc_dir = tempfile.mkdtemp()
+        self.scanner = drone_tracker.ProcessScanner(self._classify,
+                                                    self.proc_dir)
+        self.classified = []
+
+    def tearDown(self):
+        shutil.rmtree(self.proc_dir)
+
+    def _classify(self, info):
+        self.classified.append(info['pid'])
+        if info['comm'].startswith('autotest'):
+            return 'autoserv'
+        return None
+
+    def _add_process(self, pid, comm, pgid, args, starttime=1000):
+        process_dir = os.path.join(self.proc_dir, str(pid))
+        if not os.path.isdir(process_dir):
+            os.mkdir(process_dir)
+        _write(os.path.join(process_dir, 'stat'),
+               '%d (%s) S 1 %d %d 0 -1 4194304 %s %d 0 0 0 0' %
+               (pid, comm, pgid, pgid, ' '.join(['0'] * 9), starttime))
+        _write(os.path.join(process_dir, 'cmdline'), '\0'.join(args) + '\0')
+
+    def test_deltas(self):
+        self._add_process(10, 'autotest-remote', 10,
+                          ['/usr/bin/python', 'autotest-remote', '-m', 'h'])
+        self._add_process(11, 'bash) (x', 11, ['bash'])
+        info = {'pid': '10', 'pgid': '10', 'ppid': '1',
+                'comm': 'autotest-remote',
+                'args': '/usr/bin/python autotest-remote -m h'}
+        self.assertEquals(([('autoserv', info)], []), self.scanner.scan())
+        self.assertEquals(['10', '11'], sorted(self.classified))
+
+        self.assertEquals(([], []), self.scanner.scan())
+        self.assertEquals(2, len(self.classified))
+        self.assertEquals([info], self.scanner.processes('autoserv'))
+
+        shutil.rmtree(os.path.join(self.proc_dir, '10'))
+        shutil.rmtree(os.path.join(self.proc_dir, '11'))
+        self.assertEquals(([], [('autoserv', info)]), self.scanner.scan())
+        self.assertEquals([], self.scanner.processes('autoserv'))
+
+    def test_reused_pid(self):
+        self._add_process(10, 'autotest-remote', 10,
+                          ['/usr/bin/python', 'autotest-remote', '-m', 'h'])
+        info = {'pid': '10', 'pgid': '10', 'ppid': '1',
+                'comm': 'autotest-remote',
+                'args': '/usr/bin/python autotest-remote -m h'}
+        self.assertEquals(([('autoserv', info)], []), self.scanner.scan())
+
+        # autoserv exited and another process got its PID between two scans
+        self._add_process(10, 'autotest-remote', 10,
+                          ['/usr/bin/python', 'autotest-remote', '-m', 'h2'],
+                          starttime=2000)
+        reused_info = dict(info, args='/usr/bin/python autotest-remote -m h2')
+        self.assertEquals(([('autoserv', reused_info)], [('autoserv', info)]),
+                          self.scanner.scan())
+        self.assertEquals([reused_info], self.scanner.processes('autoserv'))
+
+        # the same PID and start time, another program
+        self._add_process(10, 'sleep', 10, ['sleep', '60'], starttime=2000)
+        self.assertEquals(([], [('autoserv', reused_info)]),
+                          self.scanner.scan())
+        self.assertEquals([], self.scanner.processes('autoserv'))
+        self.assertEquals(['10', '10', '10'], self.classified)
+
+        self.assertEquals(([], []), self.scanner.scan())
+        self.assertEquals(3, len(self.classified))
+
+    def test_real_proc(self):
+        scanner = drone_tracker.ProcessScanner(
+            lambda info: info['comm'] == 'sleep' and 'sleep' or None)
+        scanner.scan()
+        process = subprocess.Popen(['sleep', '60'])
+        try:
+            started, exited = scanner.scan()
+            self.assertEquals([str(process.pid)],
+                              [info['pid'] for _, info in started])
+            self.assertEquals('sleep 60', started[0][1]['args'])
+        finally:
+            process.kill()
+            process.wait()
+        started, exited = scanner.scan()
+        self.assertEquals([str(process.pid)],
+                          [info['pid'] for _, info in exited])
+
+
+class TrackedRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        settings.override_value('SCHEDULER', 'drone_process_tracker', 'True')
+        self.job_dir = tempfile.mkdtemp()
+        self.pidfile = os.path.join(self.job_dir, '.autoserv_execute')
+        self.drone_utility = drone_utility.DroneUtility()
+
+    def tearDown(self):
+        self.drone_utility._tracker.close()
+        shutil.rmtree(self.job_dir)
+        settings.reset_values()
+
+    def test_refresh(self):
+        _write(self.pidfile, '100\n')
+        results = self.drone_utility.refresh([self.pidfile])
+        self.assertEquals({self.pidfile: '100\n'}, results['pidfiles'])
+        self.assertEquals({self.pidfile: '100\n'},
+                          results['pidfiles_second_read'])
+        self.assertEquals([], results['autoserv_processes'])
+
+        results = self.drone_utility.refresh([self.pidfile])
+        self.assertEquals({self.pidfile: '100\n'}, results['pidfiles'])
+
+        results = self.drone_utility.refresh([])
+        self.assertEquals({}, results['pidfiles'])
+
+    def test_refresh_changes(self):
+        version = drone_utility.REFRESH_PROTOCOL_VERSION
+        _write(self.pidfile, '100\n')
+        reply = self.drone_utility.refresh_changes(version, None,
+                                                   [self.pidfile], [])
+        self.assertTrue(reply['full'])
+        self.assertEquals({self.pidfile: '100\n'}, reply['pidfiles'])
+        session = reply['session']
+
+        reply = self.drone_utility.refresh_changes(version, session, [], [])
+        self.assertFalse(reply['full'])
+        self.assertEquals({}, reply['pidfiles'])
+        self.assertEquals([], reply['processes_started'])
+
+        _write(self.pidfile, '100\n0\n0\n')
+        reply = self.drone_utility.refresh_changes(version, session, [],
+                                                   [self.pidfile])
+        self.assertEquals({}, reply['pidfiles'])
+
+        reply = self.drone_utility.refresh_changes(version, 'other', [], [])
+        self.assertEquals(dict(version=version, session=None, resync=True),
+                          reply)
+        self.assertRaises(ValueError, self.drone_utility.refresh_changes,
+                          version + 1, None, [], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
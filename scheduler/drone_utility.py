@@ -4,10 +4,12 @@ import datetime
 import getpass
 import itertools
 import logging
+import optparse
 import os
 import pickle
 import shutil
 import signal
+import socket
 import subprocess
 import sys
 import tempfile
@@ -22,7 +24,8 @@ from autotest.client.shared import utils, error
 from autotest.client.shared.settings import settings
 from autotest.client.shared import mail
 from autotest.server import hosts, subcommand
-from autotest.scheduler import scheduler_config
+from autotest.scheduler import drone_tracker, scheduler_config
+from autotest.scheduler import transfer_engine
 
 # An environment variable we add to the environment to enable us to
 # distinguish processes we started from those that were started by
@@ -38,6 +41,9 @@ else:
 
 _TRANSFER_FAILED_FILE = '.transfer_failed'
 
+# version of the refresh_changes() protocol, bumped on incompatible changes
+REFRESH_PROTOCOL_VERSION = 1
+
 
 class _MethodCall(object):
 
@@ -77,6 +83,10 @@ class DroneUtility(object):
 
         self.warnings = []
         self._subcommands = []
+        self._tracker = None
+        self._tracked_pidfiles = {}
+        self._refresh_session = None
+        self._transfer_engine = None
 
     def initialize(self, results_dir):
         if _OUTPUT_DIR:
@@ -165,6 +175,69 @@ class DroneUtility(object):
                 continue
         return pidfiles
 
+    def _classify_process(self, info, site_check_parse, check_mark):
+        """
+        :return: 'autoserv' or 'parse' for the processes reported by
+                refresh(), None for the others.
+        """
+        if info['comm'] == 'autotest-remote':
+            category = 'autoserv'
+        elif info['comm'] == 'parse' or (site_check_parse and
+                                         site_check_parse(info)):
+            category = 'parse'
+        else:
+            return None
+        if check_mark and not self._check_pid_for_dark_mark(info['pid']):
+            self._warn('%(comm)s process pid %(pid)s has no '
+                       'dark mark; ignoring.' % info)
+            return None
+        return category
+
+    def _get_tracker(self, site_check_parse):
+        if self._tracker is None:
+            check_mark = settings.get_value('SCHEDULER',
+                                            'check_processes_for_dark_mark',
+                                            bool, False)
+
+            def classify(info):
+                return self._classify_process(info, site_check_parse,
+                                              check_mark)
+            self._tracker = drone_tracker.DroneTracker(classify)
+        return self._tracker
+
+    def _apply_pidfile_changes(self, changes):
+        for pidfile_path, contents in changes.iteritems():
+            if contents is None:
+                self._tracked_pidfiles.pop(pidfile_path, None)
+            else:
+                self._tracked_pidfiles[pidfile_path] = contents
+        return dict(self._tracked_pidfiles)
+
+    def _tracked_refresh(self, pidfile_paths, site_check_parse):
+        """
+        refresh() using a DroneTracker kept across calls, which only reads
+        the pidfiles that changed and the processes that started since the
+        previous call.
+        """
+        tracker = self._get_tracker(site_check_parse)
+        changes = tracker.refresh(pidfile_paths)
+        registered = set(pidfile_paths)
+        for pidfile_path in set(self._tracked_pidfiles) - registered:
+            del self._tracked_pidfiles[pidfile_path]
+        return {
+            'pidfiles': self._apply_pidfile_changes(changes['pidfiles']),
+            'autoserv_processes': tracker.processes.processes('autoserv'),
+            'parse_processes': tracker.processes.processes('parse'),
+            'pidfiles_second_read': self._apply_pidfile_changes(
+                changes['pidfiles_second_read']),
+        }
+
+    @staticmethod
+    def _get_site_check_parse():
+        return utils.import_site_function(
+            __file__, 'autotest.scheduler.site_drone_utility',
+            'check_parse', lambda x: False)
+
     def refresh(self, pidfile_paths):
         """
         pidfile_paths should be a list of paths to check for pidfiles.
@@ -178,10 +251,15 @@ class DroneUtility(object):
         * parse_processes: likewise, for parse processes.
         * pidfiles_second_read: same info as pidfiles, but gathered after the
         processes are scanned.
+
+        With SCHEDULER.drone_process_tracker, ps is not run and the pidfiles
+        are not all read again: a DroneTracker kept between calls maintains
+        the same information from the changes since the previous call.
         """
-        site_check_parse = utils.import_site_function(
-            __file__, 'autotest.scheduler.site_drone_utility',
-            'check_parse', lambda x: False)
+        site_check_parse = self._get_site_check_parse()
+        if settings.get_value('SCHEDULER', 'drone_process_tracker',
+                              type=bool, default=False):
+            return self._tracked_refresh(pidfile_paths, site_check_parse)
         results = {
             'pidfiles': self._read_pidfiles(pidfile_paths),
             'autoserv_processes': self._refresh_processes(['autotest-remote']),
@@ -191,6 +269,56 @@ class DroneUtility(object):
         }
         return results
 
+    def refresh_changes(self, protocol_version, session, added_paths,
+                        removed_paths):
+        """
+        Incremental version of refresh(), reporting only what changed since
+        the previous call of the same session.
+
+        :param protocol_version: REFRESH_PROTOCOL_VERSION of the caller.
+        :param session: the session returned by the previous call, or None to
+                start a new session, in which case everything is reported.
+        :param added_paths: pidfile paths to start checking.
+        :param removed_paths: pidfile paths to stop checking.
+
+        Returns a dict containing:
+        * version: REFRESH_PROTOCOL_VERSION.
+        * session: the session to pass to the next call.
+        * full: True if this is the first reply of the session.
+        * pidfiles: dict mapping the paths of the pidfiles that changed to
+        their contents, or to None for pidfiles that were removed.
+        * processes_started, processes_exited: lists of (category, info)
+        pairs, category being 'autoserv' or 'parse' and info a process
+        dict like refresh() returns.
+        * pidfiles_second_read: the pidfiles that changed again after the
+        processes were scanned, like pidfiles.
+
+        If session is not the current one (this drone_utility was restarted)
+        the reply only holds version, session (None) and resync (True); the
+        caller must start a new session.
+        """
+        if protocol_version != REFRESH_PROTOCOL_VERSION:
+            raise ValueError('Unsupported refresh protocol version %r, '
+                             'expected %r' % (protocol_version,
+                                              REFRESH_PROTOCOL_VERSION))
+        if session is not None and session != self._refresh_session:
+            return {'version': REFRESH_PROTOCOL_VERSION, 'session': None,
+                    'resync': True}
+        if session is None:
+            if self._tracker is not None:
+                self._tracker.close()
+                self._tracker = None
+            self._refresh_session = '%s:%d:%f' % (socket.gethostname(),
+                                                  os.getpid(), time.time())
+
+        tracker = self._get_tracker(self._get_site_check_parse())
+        tracker.pidfiles.remove_paths(removed_paths)
+        tracker.pidfiles.add_paths(added_paths)
+        changes = tracker.refresh()
+        changes.update(version=REFRESH_PROTOCOL_VERSION,
+                       session=self._refresh_session, full=session is None)
+        return changes
+
     def kill_process(self, process):
         signal_queue = (signal.SIGCONT, signal.SIGTERM, signal.SIGKILL)
         utils.nuke_pid(process.pid, signal_queue=signal_queue)
@@ -337,21 +465,47 @@ class DroneUtility(object):
         self._subcommands.append(subproc)
         subproc.fork_start()
 
+    def _get_transfer_engine(self):
+        """
+        :return: the TransferEngine running the transfers, or None if they
+                are forked as soon as they are queued.
+        """
+        if settings.get_value('SCHEDULER', 'transfer_engine', type=bool,
+                              default=False):
+            if self._transfer_engine is None:
+                self._transfer_engine = transfer_engine.TransferEngine()
+        else:
+            self._transfer_engine = None
+        return self._transfer_engine
+
+    def _run_transfer(self, function, args, destination, source_path=None):
+        engine = self._get_transfer_engine()
+        if engine is None:
+            self.run_async_command(function, args)
+        else:
+            engine.queue(function, args, destination, source_path)
+
     def _sync_get_file_from(self, hostname, source_path, destination_path):
         self._ensure_directory_exists(os.path.dirname(destination_path))
         host = create_host(hostname)
         host.get_file(source_path, destination_path, delete_dest=True)
 
     def get_file_from(self, hostname, source_path, destination_path):
-        self.run_async_command(self._sync_get_file_from,
-                               (hostname, source_path, destination_path))
+        self._run_transfer(self._sync_get_file_from,
+                           (hostname, source_path, destination_path),
+                           ('localhost', destination_path))
 
     def sync_send_file_to(self, hostname, source_path, destination_path,
                           can_fail):
+        """
+        :return: True if the file was sent, False if sending it failed and
+                can_fail is set.
+        """
         host = create_host(hostname)
         try:
             host.run('mkdir -p ' + os.path.dirname(destination_path))
             host.send_file(source_path, destination_path, delete_dest=True)
+            return True
         except error.AutoservError:
             if not can_fail:
                 raise
@@ -370,12 +524,14 @@ class DroneUtility(object):
                 copy_to = destination_path + _TRANSFER_FAILED_FILE
                 self._ensure_directory_exists(os.path.dirname(copy_to))
                 self.copy_file_or_directory(source_path, copy_to)
+            return False
 
     def send_file_to(self, hostname, source_path, destination_path,
                      can_fail=False):
-        self.run_async_command(self.sync_send_file_to,
-                               (hostname, source_path, destination_path,
-                                can_fail))
+        self._run_transfer(self.sync_send_file_to,
+                           (hostname, source_path, destination_path,
+                            can_fail),
+                           (hostname, destination_path), source_path)
 
     def _report_long_execution(self, calls, duration):
         call_count = {}
@@ -394,6 +550,9 @@ class DroneUtility(object):
             results.append(method_call.execute_on(self))
             if len(self._subcommands) >= max_processes:
                 self._wait_for_some_async_commands()
+        engine = self._transfer_engine
+        if engine is not None:
+            engine.run(max_processes)
         self.wait_for_all_async_commands()
 
         duration = time.time() - start_time
@@ -402,7 +561,10 @@ class DroneUtility(object):
 
         warnings = self.warnings
         self.warnings = []
-        return dict(results=results, warnings=warnings)
+        return_message = dict(results=results, warnings=warnings)
+        if engine is not None:
+            return_message['transfer_stats'] = engine.get_stats()
+        return return_message
 
 
 def create_host(hostname):
@@ -435,11 +597,120 @@ def return_data(data):
     print pickle.dumps(data)
 
 
-def main():
-    calls = parse_input()
+def write_message(stream, data):
+    """
+    Write data to stream as a single framed message.
+
+    A message is the length of the pickled payload on its own line, followed
+    by the payload itself, so several messages can share one connection.
+    """
+    payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    stream.write('%d\n' % len(payload))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_message(stream):
+    """
+    Read a single framed message written by write_message() from stream.
+
+    :return: The unpickled message, or None if the stream was closed before a
+            new message started.
+    :raise EOFError: if the stream was closed in the middle of a message.
+    """
+    header = stream.readline()
+    if not header:
+        return None
+    try:
+        length = int(header)
+    except ValueError:
+        raise ValueError('Invalid message header: %r' % header)
+    payload = stream.read(length)
+    if len(payload) != length:
+        raise EOFError('Truncated message: got %d of %d bytes' %
+                       (len(payload), length))
+    return pickle.loads(payload)
+
+
+def serve(input_stream, output_stream):
+    """
+    Persistent agent mode: execute batches of calls read from input_stream
+    until it is closed, writing one reply per batch to output_stream.
+
+    The same DroneUtility serves every batch, so the interpreter start-up
+    cost is paid once per connection instead of once per scheduler tick.
+    """
     drone_utility = DroneUtility()
-    return_value = drone_utility.execute_calls(calls)
-    return_data(return_value)
+    while True:
+        calls = read_message(input_stream)
+        if calls is None:
+            return
+        try:
+            return_value = drone_utility.execute_calls(calls)
+        except Exception:
+            drone_utility.warnings = []
+            return_value = dict(results=[], warnings=[],
+                                error=traceback.format_exc())
+        write_message(output_stream, return_value)
+
+
+def serve_unix_socket(socket_path):
+    """
+    Serve the persistent agent protocol on a local unix socket, one
+    connection at a time.  This is a stand-in for the ssh transport that is
+    handy for testing the scheduler side without a remote machine.
+    """
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    try:
+        while True:
+            connection = server.accept()[0]
+            input_stream = connection.makefile('rb')
+            output_stream = connection.makefile('wb')
+            try:
+                serve(input_stream, output_stream)
+            finally:
+                input_stream.close()
+                output_stream.close()
+                connection.close()
+    finally:
+        server.close()
+
+
+def _claim_stdout():
+    """
+    Take over the stdout file descriptor for the agent protocol.
+
+    Anything else writing to stdout (stray prints, inherited child process
+    descriptors) would corrupt the message stream, so fd 1 is pointed at
+    stderr and the protocol gets a private duplicate of the original stdout.
+    """
+    sys.stdout.flush()
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return channel
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--persistent', action='store_true', default=False,
+                      help='stay resident and execute framed batches of '
+                           'calls from stdin until it is closed')
+    parser.add_option('--socket', default=None,
+                      help='serve framed batches of calls on the given unix '
+                           'socket path instead of stdin/stdout')
+    options = parser.parse_args()[0]
+
+    if options.socket:
+        serve_unix_socket(options.socket)
+    elif options.persistent:
+        serve(sys.stdin, _claim_stdout())
+    else:
+        calls = parse_input()
+        drone_utility = DroneUtility()
+        return_value = drone_utility.execute_calls(calls)
+        return_data(return_value)
 
 
 if __name__ == '__main__':
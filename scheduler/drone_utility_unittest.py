@@ -80,5 +80,55 @@ class TestDroneUtility(unittest.TestCase):
         self.god.check_playback()
 
 
+class TestPersistentAgent(unittest.TestCase):
+
+    def test_message_round_trip(self):
+        stream = StringIO()
+        drone_utility.write_message(stream, {'results': [1, 2]})
+        drone_utility.write_message(stream, 'second')
+        stream.seek(0)
+        self.assertEqual({'results': [1, 2]},
+                         drone_utility.read_message(stream))
+        self.assertEqual('second', drone_utility.read_message(stream))
+        self.assertEqual(None, drone_utility.read_message(stream))
+
+    def test_read_truncated_message(self):
+        stream = StringIO()
+        drone_utility.write_message(stream, 'some data')
+        stream = StringIO(stream.getvalue()[:-1])
+        self.assertRaises(EOFError, drone_utility.read_message, stream)
+
+    def test_serve_executes_each_batch(self):
+        input_stream = StringIO()
+        drone_utility.write_message(input_stream, [])
+        drone_utility.write_message(
+            input_stream, [drone_utility.call('_same_file', '/', '/')])
+        input_stream.seek(0)
+        output_stream = StringIO()
+
+        drone_utility.serve(input_stream, output_stream)
+
+        output_stream.seek(0)
+        self.assertEqual(dict(results=[], warnings=[]),
+                         drone_utility.read_message(output_stream))
+        self.assertEqual(dict(results=[True], warnings=[]),
+                         drone_utility.read_message(output_stream))
+        self.assertEqual(None, drone_utility.read_message(output_stream))
+
+    def test_serve_reports_errors(self):
+        input_stream = StringIO()
+        drone_utility.write_message(
+            input_stream, [drone_utility.call('no_such_method')])
+        input_stream.seek(0)
+        output_stream = StringIO()
+
+        drone_utility.serve(input_stream, output_stream)
+
+        output_stream.seek(0)
+        reply = drone_utility.read_message(output_stream)
+        self.assertEqual([], reply['results'])
+        self.assertTrue('no_such_method' in reply['error'])
+
+
 if __name__ == '__main__':
     unittest.main()
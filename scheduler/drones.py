@@ -1,6 +1,9 @@
 import cPickle
 import logging
 import os
+import socket
+import subprocess
+import traceback
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -8,7 +11,7 @@ except ImportError:
     import common  # pylint: disable=W0611
 from autotest.scheduler import drone_utility
 from autotest.client.shared.settings import settings
-from autotest.client.shared import mail
+from autotest.client.shared import error, mail
 
 
 AUTOTEST_INSTALL_DIR = settings.get_value('SCHEDULER',
@@ -21,6 +24,78 @@ class DroneUnreachable(Exception):
     pass
 
 
+class DroneChannelError(error.AutoservError):
+
+    """The persistent channel to a drone failed."""
+    pass
+
+
+class _DroneChannel(object):
+
+    """
+    A persistent connection to a drone_utility agent (see
+    drone_utility.serve()), over which any number of call batches can be
+    executed.
+    """
+
+    def __init__(self, input_stream, output_stream):
+        self._input = input_stream
+        self._output = output_stream
+
+    def execute_calls(self, calls):
+        drone_utility.write_message(self._output, calls)
+        return_message = drone_utility.read_message(self._input)
+        if return_message is None:
+            raise EOFError('Drone agent closed the connection')
+        return return_message
+
+    def close(self):
+        for stream in (self._output, self._input):
+            try:
+                stream.close()
+            except EnvironmentError:
+                pass
+
+
+class _SshDroneChannel(_DroneChannel):
+
+    """
+    Channel to a drone_utility agent started over ssh.
+    """
+
+    def __init__(self, host, drone_utility_path):
+        command = '%s "python %s --persistent"' % (
+            host.ssh_command(connect_timeout=300), drone_utility_path)
+        self._process = subprocess.Popen(command, shell=True,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+        super(_SshDroneChannel, self).__init__(self._process.stdout,
+                                               self._process.stdin)
+
+    def close(self):
+        super(_SshDroneChannel, self).close()
+        self._process.wait()
+
+
+class _SocketDroneChannel(_DroneChannel):
+
+    """
+    Channel to a drone_utility agent listening on a local unix socket (see
+    drone_utility.serve_unix_socket()).
+    """
+
+    def __init__(self, socket_path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        super(_SocketDroneChannel, self).__init__(self._socket.makefile('rb'),
+                                                  self._socket.makefile('wb'))
+
+    def close(self):
+        super(_SocketDroneChannel, self).close()
+        self._socket.close()
+
+
 class _AbstractDrone(object):
 
     """
@@ -36,6 +111,9 @@ class _AbstractDrone(object):
         self.max_processes = 0
         self.active_processes = 0
         self.allowed_users = None
+        # statistics of the TransferEngine of the drone, see
+        # TransferEngine.get_stats()
+        self.transfer_stats = None
 
     def shutdown(self):
         pass
@@ -61,11 +139,20 @@ class _AbstractDrone(object):
             return True
         return user in self.allowed_users
 
+    def is_resident(self):
+        """
+        Whether the same drone_utility executes all the calls, so that it can
+        keep state between them (see DroneUtility.refresh_changes()).
+        """
+        return False
+
     def _execute_calls_impl(self, calls):
         raise NotImplementedError
 
     def _execute_calls(self, calls):
         return_message = self._execute_calls_impl(calls)
+        if 'transfer_stats' in return_message:
+            self.transfer_stats = return_message['transfer_stats']
         for warning in return_message['warnings']:
             subject = 'Warning from drone %s' % self.hostname
             logging.warn(subject + '\n' + warning)
@@ -99,6 +186,9 @@ class _LocalDrone(_AbstractDrone):
         self.hostname = 'localhost'
         self._drone_utility = drone_utility.DroneUtility()
 
+    def is_resident(self):
+        return True
+
     def _execute_calls_impl(self, calls):
         return self._drone_utility.execute_calls(calls)
 
@@ -122,6 +212,9 @@ class _RemoteDrone(_AbstractDrone):
             logging.error('Drone %s is unpingable, kicking out', hostname)
             raise DroneUnreachable
         self._autotest_install_dir = AUTOTEST_INSTALL_DIR
+        self._use_persistent_channel = settings.get_value(
+            'SCHEDULER', 'drone_persistent_channel', type=bool, default=False)
+        self._channel = None
 
     @property
     def _drone_utility_path(self):
@@ -131,11 +224,42 @@ class _RemoteDrone(_AbstractDrone):
     def set_autotest_install_dir(self, path):
         self._autotest_install_dir = path
 
+    def is_resident(self):
+        return self._use_persistent_channel
+
     def shutdown(self):
         super(_RemoteDrone, self).shutdown()
+        self._close_channel()
         self._host.close()
 
+    def _open_channel(self):
+        return _SshDroneChannel(self._host, self._drone_utility_path)
+
+    def _close_channel(self):
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+
+    def _execute_calls_on_channel(self, calls):
+        if self._channel is None:
+            logging.info('Starting persistent drone_utility on %s',
+                         self.hostname)
+            self._channel = self._open_channel()
+        try:
+            return_message = self._channel.execute_calls(calls)
+        except Exception:  # the batch may have been partially executed
+            self._close_channel()
+            raise DroneChannelError('Drone channel to %s failed:\n%s' %
+                                    (self.hostname, traceback.format_exc()))
+        if 'error' in return_message:
+            raise error.AutoservError('drone_utility on %s failed:\n%s' %
+                                      (self.hostname,
+                                       return_message['error']))
+        return return_message
+
     def _execute_calls_impl(self, calls):
+        if self._use_persistent_channel:
+            return self._execute_calls_on_channel(calls)
         logging.info("Running drone_utility on %s", self.hostname)
         result = self._host.run('python %s' % self._drone_utility_path,
                                 stdin=cPickle.dumps(calls), stdout_tee=None,
@@ -3,6 +3,12 @@
 """Tests for autotest.scheduler.drones."""
 
 import cPickle
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -11,7 +17,7 @@ except ImportError:
 
 from autotest.client.shared import utils
 from autotest.client.shared.test_utils import mock, unittest
-from autotest.scheduler import drones
+from autotest.scheduler import drone_utility, drones
 from autotest.server.hosts import ssh_host
 
 
@@ -52,5 +58,67 @@ class RemoteDroneTest(unittest.TestCase):
         self.god.check_playback()
 
 
+class PersistentChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self._tempdir = tempfile.mkdtemp()
+        self._socket_path = os.path.join(self._tempdir, 'drone.sock')
+        server = threading.Thread(target=drone_utility.serve_unix_socket,
+                                  args=(self._socket_path,))
+        server.setDaemon(True)
+        server.start()
+        while not os.path.exists(self._socket_path):
+            time.sleep(0.01)
+
+        self._mock_host = self.god.create_mock_class(ssh_host.SSHHost,
+                                                     'mock SSHHost')
+        self.god.stub_function(drones.drone_utility, 'create_host')
+        drones.drone_utility.create_host.expect_call('fakehost').and_return(
+            self._mock_host)
+        self._mock_host.is_up.expect_call().and_return(True)
+        self.drone = drones._RemoteDrone('fakehost')
+        self.drone._use_persistent_channel = True
+        self._channels_opened = []
+
+        def open_channel():
+            channel = drones._SocketDroneChannel(self._socket_path)
+            self._channels_opened.append(channel)
+            return channel
+        self.god.stub_with(self.drone, '_open_channel', open_channel)
+
+    def tearDown(self):
+        self.drone._close_channel()
+        self.god.unstub_all()
+        shutil.rmtree(self._tempdir)
+
+    def test_channel_is_reused(self):
+        path = os.path.join(self._tempdir, 'out')
+        self.drone.queue_call('write_to_file', path, 'foo\n')
+        self.drone.execute_queued_calls()
+        self.assertEqual([True],
+                         self.drone.call('_same_file', path, path))
+        self.assertEqual(1, len(self._channels_opened))
+        self.assertEqual('foo\n', open(path).read())
+        self.god.check_playback()
+
+    def test_remote_error(self):
+        self.assertRaises(drones.error.AutoservError,
+                          self.drone.call, 'no_such_method')
+        # the agent survives errors in a batch, so the channel is kept
+        self.assertEqual([None],
+                         self.drone.call('wait_for_all_async_commands'))
+        self.assertEqual(1, len(self._channels_opened))
+
+    def test_broken_channel_is_reopened(self):
+        self.drone.call('wait_for_all_async_commands')
+        self._channels_opened[0]._socket.shutdown(socket.SHUT_RDWR)
+        self.assertRaises(drones.DroneChannelError,
+                          self.drone.call, 'wait_for_all_async_commands')
+        self.assertEqual(None, self.drone._channel)
+        self.drone.call('wait_for_all_async_commands')
+        self.assertEqual(2, len(self._channels_opened))
+
+
 if __name__ == '__main__':
     unittest.main()
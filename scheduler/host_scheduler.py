@@ -2,6 +2,7 @@
 Autotest scheduling utility.
 """
 import logging
+import operator
 
 from autotest.client.shared import utils
 from autotest.client.shared.settings import settings
@@ -20,6 +21,131 @@ class SchedulerError(Exception):
     """Raised by HostScheduler when an inconsistent state occurs."""
 
 
+class Many2ManyIndex(object):
+
+    """In-memory copy of a many-to-many table, kept up to date between ticks.
+
+    Rows of the AFE many-to-many tables are only ever inserted or deleted,
+    and their ids are auto-incremented.  So on each update() only rows with an
+    id above the highest one seen so far are fetched.  If the table then holds
+    a different number of rows than the index, rows were deleted (or inserted
+    concurrently) and the whole table is loaded again.
+    """
+
+    def __init__(self, db, table, left_column, right_column):
+        self._db = db
+        self._table = table
+        self._left_column = left_column
+        self._right_column = right_column
+        self._clear()
+        self.full_loads = 0
+        self.rows_fetched = 0
+
+    def _clear(self):
+        self._left_to_right = {}
+        self._right_to_left = {}
+        self._row_count = 0
+        self._max_id = 0
+
+    def _fetch_rows_after(self, row_id):
+        query = """
+        SELECT id, %s, %s
+        FROM %s
+        WHERE id > %d
+        ORDER BY id
+        """ % (self._left_column, self._right_column, self._table, row_id)
+        rows = self._db.execute(query)
+        for row in rows:
+            left_id, right_id = int(row[1]), int(row[2])
+            self._left_to_right.setdefault(left_id, set()).add(right_id)
+            self._right_to_left.setdefault(right_id, set()).add(left_id)
+            self._max_id = int(row[0])
+        self._row_count += len(rows)
+        self.rows_fetched += len(rows)
+
+    def _count_rows(self):
+        rows = self._db.execute('SELECT COUNT(*) FROM %s' % self._table)
+        return int(rows[0][0])
+
+    def update(self):
+        """
+        Bring the index up to date with the table.
+
+        :return: True if the index changed, False otherwise.
+        """
+        rows_fetched = self.rows_fetched
+        self._fetch_rows_after(self._max_id)
+        if self._count_rows() != self._row_count:
+            self._clear()
+            self._fetch_rows_after(0)
+            self.full_loads += 1
+        return self.rows_fetched != rows_fetched
+
+    def get_right(self, left_id):
+        """Return the set of ids related to left_id (do not modify it)."""
+        return self._left_to_right.get(left_id, frozenset())
+
+    def get_left(self, right_id):
+        """Return the set of ids related to right_id (do not modify it)."""
+        return self._right_to_left.get(right_id, frozenset())
+
+    def right_ids(self):
+        """Return all ids present in the right column."""
+        return self._right_to_left.keys()
+
+
+class HostBitmaps(object):
+
+    """Represents sets of hosts as bitmaps (Python longs) over dense ordinals.
+
+    Ordinals are handed out to host ids on first sight and never reused, so
+    bitmaps built at different times can be combined with each other.
+    """
+
+    _ONE = ord('1')
+
+    def __init__(self):
+        self._ordinals = {}
+        self._host_ids = []
+
+    def _ordinal(self, host_id):
+        ordinal = self._ordinals.get(host_id)
+        if ordinal is None:
+            ordinal = len(self._host_ids)
+            self._ordinals[host_id] = ordinal
+            self._host_ids.append(host_id)
+        return ordinal
+
+    def bit(self, host_id):
+        return 1 << self._ordinal(host_id)
+
+    def to_bitmap(self, host_ids):
+        ordinals = [self._ordinal(host_id) for host_id in host_ids]
+        if not ordinals:
+            return 0
+        # build the binary representation in one go rather than or-ing in
+        # one bit (and copying the whole long) per host
+        bits = bytearray('0' * (max(ordinals) + 1))
+        for ordinal in ordinals:
+            bits[ordinal] = self._ONE
+        bits.reverse()
+        return int(str(bits), 2)
+
+    def to_host_ids(self, bitmap):
+        # binary digits lowest ordinal first, without the '0b' prefix
+        bits = bin(bitmap)[:1:-1]
+        host_ids = []
+        ordinal = bits.find('1')
+        while ordinal != -1:
+            host_ids.append(self._host_ids[ordinal])
+            ordinal = bits.find('1', ordinal + 1)
+        return host_ids
+
+    @staticmethod
+    def union(bitmaps):
+        return reduce(operator.or_, bitmaps, 0)
+
+
 class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
 
     """Handles the logic for choosing when to run jobs and on which hosts.
@@ -57,6 +183,21 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         self.everyone_acl = set(
             [int(acl.id) for acl in
                 scheduler_models.ACLGroup.fetch(where="name like 'Everyone'")])
+        # label and ACL membership of all hosts, loaded on the first refresh()
+        # and only updated with changes after that
+        self._label_index = Many2ManyIndex(db, 'afe_hosts_labels',
+                                           'label_id', 'host_id')
+        self._acl_index = Many2ManyIndex(db, 'afe_acl_groups_hosts',
+                                         'host_id', 'aclgroup_id')
+        # dependencies never change once a job is created, so they're kept
+        # for as long as the job has pending entries
+        self._job_dependencies = {}
+        # bitmaps of the hosts in each label and ACL group, kept until the
+        # corresponding index changes
+        self._host_bitmaps = HostBitmaps()
+        self._label_bitmaps = {}
+        self._acl_bitmaps = {}
+        self._everyone_only_bitmap = None
 
     def _get_ready_hosts(self):
         # avoid any host with a currently active queue entry against it
@@ -145,32 +286,148 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         for metahost_scheduler in self._metahost_schedulers:
             metahost_scheduler.recovery_on_startup()
 
+    def _refresh_job_dependencies(self, job_ids):
+        new_job_ids = [job_id for job_id in job_ids
+                       if job_id not in self._job_dependencies]
+        job_dependencies = dict((job_id, self._job_dependencies[job_id])
+                                for job_id in job_ids
+                                if job_id in self._job_dependencies)
+        job_dependencies.update(dict.fromkeys(new_job_ids, frozenset()))
+        job_dependencies.update(self._get_job_dependencies(new_job_ids))
+        self._job_dependencies = job_dependencies
+
     def refresh(self, pending_queue_entries):
         self._hosts_available = self._get_ready_hosts()
 
-        relevant_jobs = [queue_entry.job_id
-                         for queue_entry in pending_queue_entries]
+        relevant_jobs = set(queue_entry.job_id
+                            for queue_entry in pending_queue_entries)
         self._job_acls = self._get_job_acl_groups(relevant_jobs)
         self._ineligible_hosts = self._get_job_ineligible_hosts(relevant_jobs)
-        self._job_dependencies = self._get_job_dependencies(relevant_jobs)
+        self._refresh_job_dependencies(relevant_jobs)
 
-        host_ids = self._hosts_available.keys()
-        self._host_acls = self._get_host_acls(host_ids)
-        self._label_hosts, self._host_labels = self._get_label_hosts(host_ids)
+        if self._label_index.update():
+            self._label_bitmaps = {}
+        if self._acl_index.update():
+            self._acl_bitmaps = {}
+            self._everyone_only_bitmap = None
+        # usable hosts per label, computed on demand during this tick
+        self._label_hosts = {}
 
         self._labels = self._get_labels()
+        self._refresh_bitmaps()
+
+    def _refresh_bitmaps(self):
+        self._usable_hosts_bitmap = self._host_bitmaps.to_bitmap(
+            host_id for host_id, host in self._hosts_available.iteritems()
+            if not host.invalid)
+        self._ineligible_bitmaps = {}
+        self._only_if_needed_label_ids = [
+            label_id for label_id, label in self._labels.iteritems()
+            if label.only_if_needed]
+        self._atomic_label_ids = {}
+        for label_id, label in self._labels.iteritems():
+            if label.atomic_group_id is not None:
+                self._atomic_label_ids.setdefault(label.atomic_group_id,
+                                                  []).append(label_id)
+
+    def _get_label_bitmap(self, label_id):
+        if label_id not in self._label_bitmaps:
+            self._label_bitmaps[label_id] = self._host_bitmaps.to_bitmap(
+                self._label_index.get_right(label_id))
+        return self._label_bitmaps[label_id]
+
+    def _get_acl_bitmap(self, acl_id):
+        if acl_id not in self._acl_bitmaps:
+            self._acl_bitmaps[acl_id] = self._host_bitmaps.to_bitmap(
+                self._acl_index.get_left(acl_id))
+        return self._acl_bitmaps[acl_id]
+
+    def _get_ineligible_bitmap(self, job_id):
+        if job_id not in self._ineligible_bitmaps:
+            self._ineligible_bitmaps[job_id] = self._host_bitmaps.to_bitmap(
+                self._ineligible_hosts.get(job_id, ()))
+        return self._ineligible_bitmaps[job_id]
+
+    def _get_everyone_only_bitmap(self):
+        """
+        Mask of the hosts whose ACL groups are exactly self.everyone_acl
+        (it may be negative, so only use it to mask other bitmaps).
+        """
+        if self._everyone_only_bitmap is None:
+            other_acls = HostBitmaps.union(
+                self._get_acl_bitmap(acl_id)
+                for acl_id in self._acl_index.right_ids()
+                if acl_id not in self.everyone_acl)
+            everyone_only = ~other_acls
+            for acl_id in self.everyone_acl:
+                everyone_only &= self._get_acl_bitmap(acl_id)
+            self._everyone_only_bitmap = everyone_only
+        return self._everyone_only_bitmap
+
+    def _get_eligible_hosts_bitmap(self, queue_entry):
+        """
+        Compute, for all hosts at once, which ones are usable, not ineligible
+        for the job, in the entry's metahost label (if any) and pass
+        is_host_eligible_for_job() for the given queue entry.
+        """
+        job_id = queue_entry.job_id
+        job_dependencies = self._job_dependencies.get(job_id, set())
+
+        eligible = self._usable_hosts_bitmap
+        eligible &= ~self._get_ineligible_bitmap(job_id)
+        # _is_acl_accessible
+        eligible &= HostBitmaps.union(
+            self._get_acl_bitmap(acl_id)
+            for acl_id in self._job_acls.get(job_id, ()))
+        # _check_job_dependencies
+        for label_id in job_dependencies:
+            eligible &= self._get_label_bitmap(label_id)
+        if queue_entry.meta_host:
+            eligible &= self._get_label_bitmap(queue_entry.meta_host)
+            # _check_only_if_needed_labels
+            for label_id in self._only_if_needed_label_ids:
+                if (label_id != queue_entry.meta_host and
+                        label_id not in job_dependencies):
+                    eligible &= ~self._get_label_bitmap(label_id)
+        # _check_atomic_group_labels
+        if (queue_entry.atomic_group_id is not None and
+                queue_entry.atomic_group_id not in self._atomic_label_ids):
+            return 0
+        for atomic_group_id, label_ids in self._atomic_label_ids.iteritems():
+            group_hosts = HostBitmaps.union(
+                self._get_label_bitmap(label_id) for label_id in label_ids)
+            if atomic_group_id == queue_entry.atomic_group_id:
+                eligible &= group_hosts
+            else:
+                eligible &= ~group_hosts
+        # _check_no_acl_for_metahost
+        if queue_entry.meta_host is not None:
+            eligible &= self._get_everyone_only_bitmap()
+        return eligible
+
+    def eligible_hosts_for_entry(self, queue_entry):
+        return self._host_bitmaps.to_host_ids(
+            self._get_eligible_hosts_bitmap(queue_entry))
 
     def tick(self):
         for metahost_scheduler in self._metahost_schedulers:
             metahost_scheduler.tick()
 
+    def _get_label_hosts_available(self, label_id):
+        if label_id not in self._label_hosts:
+            self._label_hosts[label_id] = set(
+                host_id for host_id in self._label_index.get_right(label_id)
+                if host_id in self._hosts_available)
+        return self._label_hosts[label_id]
+
     def hosts_in_label(self, label_id):
-        return set(self._label_hosts.get(label_id, ()))
+        return set(self._get_label_hosts_available(label_id))
 
     def remove_host_from_label(self, host_id, label_id):
-        self._label_hosts[label_id].remove(host_id)
+        self._get_label_hosts_available(label_id).remove(host_id)
 
     def pop_host(self, host_id):
+        self._usable_hosts_bitmap &= ~self._host_bitmaps.bit(host_id)
         return self._hosts_available.pop(host_id)
 
     def ineligible_hosts_for_entry(self, queue_entry):
@@ -178,7 +435,7 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
 
     def _is_acl_accessible(self, host_id, queue_entry):
         job_acls = self._job_acls.get(queue_entry.job_id, set())
-        host_acls = self._host_acls.get(host_id, set())
+        host_acls = self._acl_index.get_right(host_id)
         return len(host_acls.intersection(job_acls)) > 0
 
     def _check_job_dependencies(self, job_dependencies, host_labels):
@@ -227,7 +484,7 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
 
         :return: True if entry is not a metahost or the host only has the "Everyone" ACL, False otherwise.
         """
-        host_acls = self._host_acls.get(host_id, set())
+        host_acls = self._acl_index.get_right(host_id)
         return (queue_entry.meta_host is None or host_acls == self.everyone_acl)
 
     def _get_host_atomic_group_id(self, host_labels, queue_entry=None):
@@ -265,20 +522,6 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
                 label.atomic_group_id == atomic_group_id and not
                 label.invalid)
 
-    def _get_eligible_host_ids_in_group(self, group_hosts, queue_entry):
-        """
-        :param group_hosts - A sequence of Host ids to test for usability
-                and eligibility against the Job associated with queue_entry.
-        :param queue_entry - The HostQueueEntry that these hosts are being
-                tested for eligibility against.
-
-        :return: A subset of group_hosts Host ids that are eligible for the
-                supplied queue_entry.
-        """
-        return set(host_id for host_id in group_hosts if
-                   self.is_host_usable(host_id) and
-                   self.is_host_eligible_for_job(host_id, queue_entry))
-
     def is_host_eligible_for_job(self, host_id, queue_entry):
         if self._is_host_invalid(host_id):
             # if an invalid host is scheduled for a job, it's a one-time host
@@ -288,7 +531,7 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             return True
 
         job_dependencies = self._job_dependencies.get(queue_entry.job_id, set())
-        host_labels = self._host_labels.get(host_id, set())
+        host_labels = self._label_index.get_left(host_id)
 
         return (self._is_acl_accessible(host_id, queue_entry) and
                 self._check_job_dependencies(job_dependencies, host_labels) and
@@ -304,7 +547,9 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
     def _schedule_non_metahost(self, queue_entry):
         if not self.is_host_eligible_for_job(queue_entry.host_id, queue_entry):
             return None
-        return self._hosts_available.pop(queue_entry.host_id, None)
+        if queue_entry.host_id not in self._hosts_available:
+            return None
+        return self.pop_host(queue_entry.host_id)
 
     def is_host_usable(self, host_id):
         if host_id not in self._hosts_available:
@@ -362,19 +607,14 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
                 job.id, job.synch_count, atomic_group.id,
                 atomic_group.max_number_of_machines, queue_entry.id)
             return []
-        hosts_in_label = self.hosts_in_label(queue_entry.meta_host)
-        ineligible_host_ids = self.ineligible_hosts_for_entry(queue_entry)
+        # Usable and eligible hosts, restricted to the metahost label if any.
+        eligible_hosts = self._get_eligible_hosts_bitmap(queue_entry)
 
         # Look in each label associated with atomic_group until we find one with
         # enough hosts to satisfy the job.
         for atomic_label_id in self._get_atomic_group_labels(atomic_group.id):
-            group_hosts = set(self.hosts_in_label(atomic_label_id))
-            if queue_entry.meta_host is not None:
-                # If we have a metahost label, only allow its hosts.
-                group_hosts.intersection_update(hosts_in_label)
-            group_hosts -= ineligible_host_ids
-            eligible_host_ids_in_group = self._get_eligible_host_ids_in_group(
-                group_hosts, queue_entry)
+            eligible_host_ids_in_group = self._host_bitmaps.to_host_ids(
+                eligible_hosts & self._get_label_bitmap(atomic_label_id))
 
             # Job.synch_count is treated as "minimum synch count" when
             # scheduling for an atomic group of hosts.  The atomic group
@@ -398,12 +638,7 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
 
             # Remove the selected hosts from our cached internal state
             # of available hosts in order to return the Host objects.
-            host_list = []
-            for host in eligible_hosts_in_group:
-                hosts_in_label.discard(host.id)
-                self._hosts_available.pop(host.id)
-                host_list.append(host)
-            return host_list
+            return [self.pop_host(host.id) for host in eligible_hosts_in_group]
 
         return []
 
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+"""
+Compare the per-tick cost of loading host labels and ACLs in the host
+scheduler: the full reload done before Many2ManyIndex existed against
+incremental index updates.
+
+The tables live in an in-memory sqlite database, so the numbers mostly
+reflect query and Python processing cost, not network round trips.
+"""
+
+import optparse
+import random
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.database_legacy import database_connection
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from autotest.scheduler import host_scheduler
+
+
+class _FullReloadHostScheduler(host_scheduler.BaseHostScheduler):
+
+    """Only what's needed to run the full reload queries."""
+
+    def __init__(self, db):
+        self._db = db
+
+
+def _insert_rows(db, table, columns, rows, chunk_size=500):
+    for start in xrange(0, len(rows), chunk_size):
+        values = ','.join('(%d, %d)' % row
+                          for row in rows[start:start + chunk_size])
+        db.execute('INSERT INTO %s (%s) VALUES %s' %
+                   (table, ', '.join(columns), values))
+
+
+def _create_database(num_hosts, num_labels, labels_per_host, acls_per_host):
+    db = database_connection.DatabaseConnection.get_test_database()
+    db.execute('CREATE TABLE afe_hosts_labels '
+               '(id INTEGER PRIMARY KEY AUTOINCREMENT, '
+               'host_id INTEGER, label_id INTEGER)')
+    db.execute('CREATE TABLE afe_acl_groups_hosts '
+               '(id INTEGER PRIMARY KEY AUTOINCREMENT, '
+               'aclgroup_id INTEGER, host_id INTEGER)')
+    host_ids = xrange(1, num_hosts + 1)
+    label_ids = xrange(1, num_labels + 1)
+    _insert_rows(db, 'afe_hosts_labels', ('host_id', 'label_id'),
+                 [(host_id, label_id) for host_id in host_ids
+                  for label_id in random.sample(label_ids, labels_per_host)])
+    _insert_rows(db, 'afe_acl_groups_hosts', ('host_id', 'aclgroup_id'),
+                 [(host_id, acl_id) for host_id in host_ids
+                  for acl_id in xrange(1, acls_per_host + 1)])
+    return db
+
+
+def _add_labels(db, num_hosts, num_labels, count):
+    for _ in xrange(count):
+        db.execute('INSERT INTO afe_hosts_labels (host_id, label_id) '
+                   'VALUES (%s, %s)', (random.randint(1, num_hosts),
+                                       num_labels + random.randint(1, 100)))
+
+
+def _time(function, ticks):
+    start = time.time()
+    for _ in xrange(ticks):
+        function()
+    return (time.time() - start) / ticks
+
+
+def run_benchmark(num_hosts, options):
+    db = _create_database(num_hosts, options.labels, options.labels_per_host,
+                          options.acls_per_host)
+    host_ids = range(1, num_hosts + 1)
+    scheduler = _FullReloadHostScheduler(db)
+
+    def full_reload():
+        scheduler._get_host_acls(host_ids)
+        scheduler._get_label_hosts(host_ids)
+
+    label_index = host_scheduler.Many2ManyIndex(db, 'afe_hosts_labels',
+                                                'label_id', 'host_id')
+    acl_index = host_scheduler.Many2ManyIndex(db, 'afe_acl_groups_hosts',
+                                              'host_id', 'aclgroup_id')
+
+    def index_update():
+        _add_labels(db, num_hosts, options.labels, options.changes_per_tick)
+        label_index.update()
+        acl_index.update()
+
+    full_reload_time = _time(full_reload, options.ticks)
+    initial_load_time = _time(index_update, 1)
+    index_update_time = _time(index_update, options.ticks)
+    db.disconnect()
+
+    print '%8d hosts: full reload %8.2f ms/tick, ' \
+        'index initial load %8.2f ms, index update %6.2f ms/tick (%.0fx)' % (
+            num_hosts, full_reload_time * 1000, initial_load_time * 1000,
+            index_update_time * 1000,
+            full_reload_time / max(index_update_time, 1e-6))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--hosts', default='1000,10000,50000',
+                      help='comma separated fleet sizes [default: %default]')
+    parser.add_option('--labels', type=int, default=500,
+                      help='number of distinct labels [default: %default]')
+    parser.add_option('--labels-per-host', type=int, default=10,
+                      help='labels on each host [default: %default]')
+    parser.add_option('--acls-per-host', type=int, default=2,
+                      help='ACL groups of each host [default: %default]')
+    parser.add_option('--changes-per-tick', type=int, default=10,
+                      help='label assignments added between ticks '
+                           '[default: %default]')
+    parser.add_option('--ticks', type=int, default=5,
+                      help='ticks to average over [default: %default]')
+    options = parser.parse_args()[0]
+
+    for num_hosts in options.hosts.split(','):
+        run_benchmark(int(num_hosts), options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.database_legacy import database_connection
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from autotest.scheduler import host_scheduler
+
+
+class Many2ManyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database_connection.DatabaseConnection.get_test_database()
+        self.db.execute('CREATE TABLE afe_hosts_labels '
+                        '(id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                        'host_id INTEGER, label_id INTEGER)')
+        self.index = host_scheduler.Many2ManyIndex(
+            self.db, 'afe_hosts_labels', 'label_id', 'host_id')
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def _add(self, host_id, label_id):
+        self.db.execute('INSERT INTO afe_hosts_labels (host_id, label_id) '
+                        'VALUES (%s, %s)', (host_id, label_id))
+
+    def _remove(self, host_id, label_id):
+        self.db.execute('DELETE FROM afe_hosts_labels '
+                        'WHERE host_id = %s AND label_id = %s',
+                        (host_id, label_id))
+
+    def test_initial_load(self):
+        self._add(1, 10)
+        self._add(2, 10)
+        self._add(2, 20)
+        self.index.update()
+        self.assertEquals(set([1, 2]), self.index.get_right(10))
+        self.assertEquals(set([10, 20]), self.index.get_left(2))
+        self.assertEquals(set(), self.index.get_right(30))
+
+    def test_insertions_are_fetched_incrementally(self):
+        self._add(1, 10)
+        self.index.update()
+        self._add(2, 10)
+        self.index.update()
+        self.assertEquals(set([1, 2]), self.index.get_right(10))
+        self.assertEquals(2, self.index.rows_fetched)
+        self.assertEquals(0, self.index.full_loads)
+
+    def test_deletion_triggers_full_load(self):
+        self._add(1, 10)
+        self._add(2, 10)
+        self.index.update()
+        self._remove(1, 10)
+        self.index.update()
+        self.assertEquals(set([2]), self.index.get_right(10))
+        self.assertEquals(set(), self.index.get_left(1))
+        self.assertEquals(1, self.index.full_loads)
+
+    def test_deletion_and_insertion(self):
+        self._add(1, 10)
+        self.index.update()
+        self._remove(1, 10)
+        self._add(1, 20)
+        self.index.update()
+        self.assertEquals(set([20]), self.index.get_left(1))
+
+
+class HostBitmapsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bitmaps = host_scheduler.HostBitmaps()
+
+    def test_round_trip(self):
+        bitmap = self.bitmaps.to_bitmap([100, 7, 42])
+        self.assertEquals([100, 7, 42], self.bitmaps.to_host_ids(bitmap))
+
+    def test_empty(self):
+        self.assertEquals(0, self.bitmaps.to_bitmap([]))
+        self.assertEquals([], self.bitmaps.to_host_ids(0))
+
+    def test_operations(self):
+        label = self.bitmaps.to_bitmap([1, 2, 3, 4])
+        acl = self.bitmaps.to_bitmap([2, 3, 4, 5])
+        ineligible = self.bitmaps.to_bitmap([3])
+        eligible = label & acl & ~ineligible
+        self.assertEquals([2, 4], sorted(self.bitmaps.to_host_ids(eligible)))
+        self.assertEquals([2], self.bitmaps.to_host_ids(
+            eligible & ~self.bitmaps.bit(4)))
+
+    def test_union(self):
+        self.assertEquals(0, host_scheduler.HostBitmaps.union([]))
+        bitmap = host_scheduler.HostBitmaps.union(
+            [self.bitmaps.to_bitmap([1]), self.bitmaps.to_bitmap([2, 3])])
+        self.assertEquals([1, 2, 3], self.bitmaps.to_host_ids(bitmap))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,14 @@ class HostSchedulingUtility(object):
         """
         raise NotImplementedError
 
+    def eligible_hosts_for_entry(self, queue_entry):
+        """Get the usable hosts in the entry's metahost label that are not
+        ineligible for its job and are eligible for the entry itself.
+
+        :param queue_entry: a HostQueueEntry DBObject
+        """
+        raise NotImplementedError
+
 
 class MetahostScheduler(object):
 
@@ -80,27 +88,18 @@ class LabelMetahostScheduler(MetahostScheduler):
         return bool(queue_entry.meta_host)
 
     def schedule_metahost(self, queue_entry, scheduling_utility):
-        label_id = queue_entry.meta_host
-        hosts_in_label = scheduling_utility.hosts_in_label(label_id)
-        ineligible_host_ids = scheduling_utility.ineligible_hosts_for_entry(
+        eligible_host_ids = scheduling_utility.eligible_hosts_for_entry(
             queue_entry)
-
-        for host_id in hosts_in_label:
-            if not scheduling_utility.is_host_usable(host_id):
-                scheduling_utility.remove_host_from_label(host_id, label_id)
-                continue
-            if host_id in ineligible_host_ids:
-                continue
-            if not scheduling_utility.is_host_eligible_for_job(host_id,
-                                                               queue_entry):
-                continue
-
-            # Remove the host from our cached internal state before returning
-            scheduling_utility.remove_host_from_label(host_id, label_id)
-            host = scheduling_utility.pop_host(host_id)
-            queue_entry.set_host(host)
+        if not eligible_host_ids:
             return
 
+        host_id = min(eligible_host_ids)
+        # Remove the host from our cached internal state before returning
+        scheduling_utility.remove_host_from_label(host_id,
+                                                  queue_entry.meta_host)
+        host = scheduling_utility.pop_host(host_id)
+        queue_entry.set_host(host)
+
 
 def get_metahost_schedulers():
     return [LabelMetahostScheduler()]
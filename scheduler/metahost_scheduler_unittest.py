@@ -39,23 +39,9 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
         entry.meta_host = 1
         host = object()
 
-        self.scheduling_utility.hosts_in_label.expect_call(1).and_return(
-            [2, 3, 4, 5])
-        # 2 is in ineligible_hosts
-        (self.scheduling_utility.ineligible_hosts_for_entry.expect_call(entry)
-         .and_return([2]))
-        self.scheduling_utility.is_host_usable.expect_call(2).and_return(True)
-        # 3 is unusable
-        self.scheduling_utility.is_host_usable.expect_call(3).and_return(False)
-        self.scheduling_utility.remove_host_from_label.expect_call(3, 1)
-        # 4 is ineligible for the job
-        self.scheduling_utility.is_host_usable.expect_call(4).and_return(True)
-        (self.scheduling_utility.is_host_eligible_for_job.expect_call(4, entry)
-         .and_return(False))
-        # 5 runs
-        self.scheduling_utility.is_host_usable.expect_call(5).and_return(True)
-        (self.scheduling_utility.is_host_eligible_for_job.expect_call(5, entry)
-         .and_return(True))
+        (self.scheduling_utility.eligible_hosts_for_entry.expect_call(entry)
+         .and_return([7, 5, 6]))
+        # the host with the lowest id runs
         self.scheduling_utility.remove_host_from_label.expect_call(5, 1)
         self.scheduling_utility.pop_host.expect_call(5).and_return(host)
         entry.set_host.expect_call(host)
@@ -68,9 +54,8 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
         entry = self.entry()
         entry.meta_host = 1
 
-        self.scheduling_utility.hosts_in_label.expect_call(1).and_return(())
-        (self.scheduling_utility.ineligible_hosts_for_entry.expect_call(entry)
-         .and_return(()))
+        (self.scheduling_utility.eligible_hosts_for_entry.expect_call(entry)
+         .and_return([]))
 
         self.metahost_scheduler.schedule_metahost(entry,
                                                   self.scheduling_utility)
@@ -25,11 +25,13 @@ from autotest.database_legacy import database_connection
 from autotest.frontend import setup_django_environment  # pylint: disable=W0611
 from autotest.frontend.afe import model_attributes
 from autotest.frontend.afe import models, rpc_utils, readonly_connection
+from autotest.frontend.afe import scheduler_wakeup
 from autotest.scheduler import drone_manager, drones
 from autotest.scheduler import gc_stats, host_scheduler, monitor_db_cleanup
 from autotest.scheduler import scheduler_logging_config
 from autotest.scheduler import scheduler_models
 from autotest.scheduler import status_server, scheduler_config
+from autotest.scheduler import tick_profiler
 
 WATCHER_PID_FILE_PREFIX = 'autotest-scheduler-watcher'
 PID_FILE_PREFIX = 'autotest-scheduler'
@@ -258,9 +260,18 @@ def main_without_exception_handling():
         dispatcher = Dispatcher()
         dispatcher.initialize(recover_hosts=options.recover_hosts)
 
+        wakeup_listener = None
+        if scheduler_wakeup.is_enabled():
+            wakeup_listener = scheduler_wakeup.WakeupListener()
+        idle_pause = scheduler_config.config.tick_pause_sec
+
         while not _shutdown and not server._shutdown_scheduler:
             dispatcher.tick()
-            time.sleep(scheduler_config.config.tick_pause_sec)
+            if wakeup_listener:
+                idle_pause = _wait_for_work(dispatcher, wakeup_listener,
+                                            idle_pause)
+            else:
+                time.sleep(scheduler_config.config.tick_pause_sec)
     except Exception:
         e_msg = "Uncaught exception, terminating scheduler"
         mail.manager.enqueue_exception_admin(e_msg)
@@ -271,6 +282,33 @@ def main_without_exception_handling():
     _db.disconnect()
 
 
+def _wait_for_work(dispatcher, wakeup_listener, idle_pause):
+    """
+    Sleep between two ticks when event driven wakeups are enabled.
+
+    While the dispatcher has agents to poll, this sleeps tick_pause_sec like
+    the polling loop.  When it is idle, the pause doubles after every idle
+    tick, up to max_idle_tick_pause_sec.  A wakeup notification cuts the
+    pause short and resets the backoff.
+
+    :param idle_pause: how long to sleep if the dispatcher is idle.
+    :return: the idle_pause to use after the next tick.
+    """
+    tick_pause = scheduler_config.config.tick_pause_sec
+    max_idle_pause = settings.get_value(scheduler_config.CONFIG_SECTION,
+                                        'max_idle_tick_pause_sec', type=int,
+                                        default=60)
+    if dispatcher.is_idle():
+        woken_up = wakeup_listener.wait(idle_pause)
+        next_idle_pause = min(max(idle_pause * 2, 1), max_idle_pause)
+    else:
+        woken_up = wakeup_listener.wait(tick_pause)
+        next_idle_pause = tick_pause
+    if woken_up:
+        return tick_pause
+    return max(next_idle_pause, tick_pause)
+
+
 def main():
     try:
         try:
@@ -302,6 +340,13 @@ class Dispatcher(object):
             settings.get_value(
                 scheduler_config.CONFIG_SECTION,
                 'gc_stats_interval_mins', type=int, default=6 * 60))
+        self._batch_db_updates = settings.get_value(
+            scheduler_config.CONFIG_SECTION, 'batch_db_updates', type=bool,
+            default=False)
+        self._tick_profiler = tick_profiler.instance()
+        for database in (_db, scheduler_models._db):
+            if database:
+                self._tick_profiler.add_database(database)
 
     def initialize(self, recover_hosts=True):
         self._periodic_cleanup.initialize()
@@ -315,23 +360,51 @@ class Dispatcher(object):
 
         self._host_scheduler.recovery_on_startup()
 
+    def is_idle(self):
+        """
+        True if there is nothing to poll: no agent is running or waiting.
+        """
+        return not self._agents
+
     def tick(self):
-        self._garbage_collection()
-        _drone_manager.refresh()
-        self._run_cleanup()
-        self._find_aborting()
-        self._process_recurring_runs()
-        self._schedule_delay_tasks()
-        self._schedule_running_host_queue_entries()
-        self._schedule_special_tasks()
-        self._schedule_new_jobs()
-        self._handle_agents()
-        self._host_scheduler.tick()
-        _drone_manager.execute_actions()
-        mail.manager.send_queued_admin()
+        profiler = self._tick_profiler
+        profiler.start_tick()
+        if self._batch_db_updates:
+            scheduler_models.begin_unit_of_work(extra_databases=[_db])
+        try:
+            profiler.run_phase('garbage_collection', self._garbage_collection)
+            profiler.run_phase('drone_refresh', _drone_manager.refresh)
+            profiler.run_phase('run_cleanup', self._run_cleanup)
+            profiler.run_phase('find_aborting', self._find_aborting)
+            profiler.run_phase('process_recurring_runs',
+                               self._process_recurring_runs)
+            profiler.run_phase('schedule_delay_tasks',
+                               self._schedule_delay_tasks)
+            profiler.run_phase('schedule_running_host_queue_entries',
+                               self._schedule_running_host_queue_entries)
+            profiler.run_phase('schedule_special_tasks',
+                               self._schedule_special_tasks)
+            profiler.run_phase('schedule_new_jobs', self._schedule_new_jobs)
+            profiler.run_phase('handle_agents', self._handle_agents)
+            profiler.run_phase('host_scheduler_tick',
+                               self._host_scheduler.tick)
+            profiler.run_phase('drone_execute_actions',
+                               _drone_manager.execute_actions)
+        finally:
+            profiler.run_phase('flush_db_updates', self._end_unit_of_work)
+        profiler.run_phase('send_queued_admin', mail.manager.send_queued_admin)
+        profiler.end_tick()
         django.db.reset_queries()
         self._tick_count += 1
 
+    def _end_unit_of_work(self):
+        unit_of_work = scheduler_models.end_unit_of_work()
+        if unit_of_work and unit_of_work.updates_requested:
+            logging.debug('Wrote %d field updates with %d statements '
+                          '(%d saved)', unit_of_work.updates_requested,
+                          unit_of_work.statements_executed,
+                          unit_of_work.statements_saved)
+
     def _run_cleanup(self):
         self._periodic_cleanup.run_cleanup_maybe()
         self._24hr_upkeep.run_cleanup_maybe()
@@ -1285,6 +1285,40 @@ class TopLevelFunctionsTest(unittest.TestCase):
         self.assertEqual(ecl, cl)
         self.assertEqual(ecl_profiles, cl_profiles)
 
+    def test_wait_for_work(self):
+        class FakeDispatcher(object):
+            idle = True
+
+            def is_idle(self):
+                return self.idle
+
+        class FakeListener(object):
+            woken_up = False
+
+            def wait(self, timeout):
+                self.timeout = timeout
+                return self.woken_up
+
+        self.god.stub_with(scheduler_config.config, 'tick_pause_sec', 5)
+        dispatcher = FakeDispatcher()
+        listener = FakeListener()
+        # idle: back off up to max_idle_tick_pause_sec
+        pause = 5
+        for expected_pause in (10, 20, 40, 60, 60):
+            pause = monitor_db._wait_for_work(dispatcher, listener, pause)
+            self.assertEqual(expected_pause, pause)
+        self.assertEqual(60, listener.timeout)
+        # a wakeup resets the backoff
+        listener.woken_up = True
+        self.assertEqual(5, monitor_db._wait_for_work(dispatcher, listener,
+                                                      pause))
+        # agents to poll: regular pause
+        listener.woken_up = False
+        dispatcher.idle = False
+        self.assertEqual(5, monitor_db._wait_for_work(dispatcher, listener,
+                                                      60))
+        self.assertEqual(5, listener.timeout)
+
 
 class AgentTaskTest(unittest.TestCase,
                     test_utils.FrontendTestMixin):
@@ -31,6 +31,8 @@ import sys
 import time
 import weakref
 
+import django.db
+
 from autotest.client.shared import host_protections, mail
 from autotest.client.shared.settings import settings
 from autotest.database_legacy import database_connection
@@ -156,6 +158,128 @@ class DBError(Exception):
     """Raised by the DBObject constructor when its select fails."""
 
 
+class UnitOfWork(object):
+
+    """
+    Collects DBObject field updates and writes them with as few statements as
+    possible.
+
+    While a unit of work is active (see begin_unit_of_work()), update_field()
+    changes the in-memory object right away but only records the new value
+    here.  Updates of the same row are merged, and rows receiving the same new
+    values are written by a single UPDATE ... WHERE id IN (...).  Pending
+    updates are flushed before any other query runs on the given database
+    connections or on the Django connection, so reads never see stale rows.
+    """
+
+    _MAX_IDS_PER_STATEMENT = 500
+
+    def __init__(self, database, extra_databases=()):
+        self._database = database
+        self._databases = [database]
+        for extra_database in extra_databases:
+            if extra_database not in self._databases:
+                self._databases.append(extra_database)
+        # maps (table, row id) to a dict of field -> new value
+        self._pending = {}
+        self.updates_requested = 0
+        self.statements_executed = 0
+
+    @property
+    def statements_saved(self):
+        return self.updates_requested - self.statements_executed
+
+    def install(self):
+        for database in self._databases:
+            database.pre_execute_hook = self.flush
+        django_connection = django.db.connections[django.db.DEFAULT_DB_ALIAS]
+        django_cursor = django_connection.cursor
+
+        def flushing_cursor():
+            self.flush()
+            return django_cursor()
+        django_connection.cursor = flushing_cursor
+
+    def uninstall(self):
+        for database in self._databases:
+            database.pre_execute_hook = None
+        django_connection = django.db.connections[django.db.DEFAULT_DB_ALIAS]
+        del django_connection.cursor
+
+    def add_update(self, table, row_id, field, value):
+        self._pending.setdefault((table, row_id), {})[field] = value
+        self.updates_requested += 1
+
+    def flush(self):
+        if not self._pending:
+            return
+        # swapped out first, as the UPDATEs run the flush hook again
+        pending, self._pending = self._pending, {}
+        try:
+            self._write(pending)
+        except Exception:
+            # the objects already have the new values: keep the updates
+            # that were not written for the next flush, under the ones
+            # recorded meanwhile
+            for key, fields in pending.iteritems():
+                fields.update(self._pending.get(key, {}))
+                self._pending[key] = fields
+            raise
+
+    def _write(self, pending):
+        """
+        Write pending updates, removing them from pending as they are.
+        """
+        ids_by_update = {}
+        for (table, row_id), fields in pending.iteritems():
+            update = (table, tuple(sorted(fields.iteritems())))
+            ids_by_update.setdefault(update, []).append(row_id)
+
+        for (table, fields), row_ids in sorted(ids_by_update.iteritems()):
+            row_ids.sort()
+            set_clause = ', '.join('%s = %%s' % field for field, _ in fields)
+            values = [value for _, value in fields]
+            for start in xrange(0, len(row_ids), self._MAX_IDS_PER_STATEMENT):
+                chunk = row_ids[start:start + self._MAX_IDS_PER_STATEMENT]
+                query = 'UPDATE %s SET %s WHERE id IN (%s)' % (
+                    table, set_clause, ','.join(['%s'] * len(chunk)))
+                self._database.execute(query, values + chunk)
+                self.statements_executed += 1
+                for row_id in chunk:
+                    del pending[(table, row_id)]
+
+
+_unit_of_work = None
+
+
+def begin_unit_of_work(extra_databases=()):
+    """
+    Start collecting DBObject field updates instead of writing them one by one.
+
+    :param extra_databases: other connections to the same database; pending
+            updates are flushed before any query runs on them.
+    """
+    global _unit_of_work
+    assert _unit_of_work is None, 'a unit of work is already active'
+    _unit_of_work = UnitOfWork(_db, extra_databases)
+    _unit_of_work.install()
+
+
+def end_unit_of_work():
+    """
+    Flush the pending updates of the active unit of work and stop collecting.
+
+    :return: the finished UnitOfWork, or None if none was active.
+    """
+    global _unit_of_work
+    unit_of_work, _unit_of_work = _unit_of_work, None
+    if unit_of_work is None:
+        return None
+    unit_of_work.uninstall()
+    unit_of_work.flush()
+    return unit_of_work
+
+
 class DBObject(object):
 
     """A miniature object relational model for the database."""
@@ -306,6 +430,11 @@ class DBObject(object):
         if getattr(self, field) == value:
             return
 
+        if _unit_of_work:
+            setattr(self, field, value)
+            _unit_of_work.add_update(self.__table, self.id, field, value)
+            return
+
         query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table, field)
         _db.execute(query, (value, self.id))
 
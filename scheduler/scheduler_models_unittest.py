@@ -94,6 +94,91 @@ class DelayedCallTaskTest(unittest.TestCase):
         self.god.check_playback()
 
 
+class UnitOfWorkTest(unittest.TestCase):
+
+    class TestRow(scheduler_models.DBObject):
+        _table_name = 'test_rows'
+        _fields = ('id', 'status', 'active')
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self._database = (
+            database_connection.DatabaseConnection.get_test_database())
+        self._database.execute('CREATE TABLE test_rows '
+                               '(id INTEGER PRIMARY KEY, '
+                               'status VARCHAR(20), active BOOLEAN)')
+        for row_id in (1, 2, 3):
+            self._database.execute('INSERT INTO test_rows VALUES (%s, %s, %s)',
+                                   (row_id, 'Queued', False))
+        self.god.stub_with(scheduler_models, '_db', self._database)
+        scheduler_models.DBObject._clear_instance_cache()
+        self.rows = [self.TestRow(id=row_id) for row_id in (1, 2, 3)]
+
+    def tearDown(self):
+        scheduler_models.end_unit_of_work()
+        self._database.disconnect()
+        self.god.unstub_all()
+
+    def _statuses(self):
+        return self._database.execute(
+            'SELECT id, status, active FROM test_rows ORDER BY id')
+
+    def test_updates_are_coalesced(self):
+        scheduler_models.begin_unit_of_work()
+        for row in self.rows[:2]:
+            row.update_field('status', 'Running')
+            row.update_field('active', True)
+        self.rows[2].update_field('status', 'Failed')
+        self.assertEqual('Running', self.rows[0].status)
+
+        unit_of_work = scheduler_models.end_unit_of_work()
+        self.assertEqual([(1, 'Running', 1), (2, 'Running', 1),
+                          (3, 'Failed', 0)], self._statuses())
+        self.assertEqual(5, unit_of_work.updates_requested)
+        self.assertEqual(2, unit_of_work.statements_executed)
+        self.assertEqual(3, unit_of_work.statements_saved)
+
+    def test_flushed_before_queries(self):
+        scheduler_models.begin_unit_of_work()
+        self.rows[0].update_field('status', 'Running')
+        self.assertEqual((1, 'Running', 0), self._statuses()[0])
+        self.assertEqual(1, scheduler_models.end_unit_of_work()
+                         .statements_executed)
+
+    def test_failed_flush_keeps_updates(self):
+        execute = self._database.execute
+        # the UPDATE of the rows set to Running fails once
+        failures = [RuntimeError('lost connection')]
+
+        def failing_execute(query, parameters=()):
+            if (failures and query.startswith('UPDATE') and
+                    'Running' in parameters):
+                raise failures.pop()
+            return execute(query, parameters)
+        self.god.stub_with(self._database, 'execute', failing_execute)
+
+        scheduler_models.begin_unit_of_work()
+        for row in self.rows:
+            row.update_field('status', 'Running')
+        self.rows[2].update_field('status', 'Failed')
+        self.assertRaises(RuntimeError,
+                          scheduler_models._unit_of_work.flush)
+        self.rows[1].update_field('active', True)
+
+        unit_of_work = scheduler_models.end_unit_of_work()
+        self.assertEqual([(1, 'Running', 0), (2, 'Running', 1),
+                          (3, 'Failed', 0)], self._statuses())
+        self.assertEqual(3, unit_of_work.statements_executed)
+
+    def test_last_update_wins(self):
+        scheduler_models.begin_unit_of_work()
+        self.rows[0].update_field('status', 'Starting')
+        self.rows[0].update_field('status', 'Running')
+        scheduler_models.end_unit_of_work()
+        self.assertEqual((1, 'Running', 0), self._statuses()[0])
+        self.assertEqual(None, scheduler_models.end_unit_of_work())
+
+
 class DBObjectTest(BaseSchedulerModelsTest):
 
     def test_compare_fields_in_row(self):
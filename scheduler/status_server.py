@@ -9,7 +9,9 @@ try:
     import autotest.common as common  # pylint: disable=W0611
 except ImportError:
     import common  # pylint: disable=W0611
-from autotest.scheduler import drone_manager, scheduler_config
+from autotest.client.shared.settings import settings
+from autotest.frontend.afe import scheduler_wakeup
+from autotest.scheduler import drone_manager, scheduler_config, tick_profiler
 
 _PORT = 13467
 
@@ -20,6 +22,8 @@ _HEADER = """
 Actions:<br>
 <a href="?reparse_config=1">Reparse global config values</a><br>
 <a href="?restart_scheduler=1">Restart the scheduler</a><br>
+<a href="?profile_ticks=1">Start profiling scheduler ticks</a><br>
+<a href="?dump_tick_profiles=1">Dump the profiles of the slowest ticks</a><br>
 <br>
 """
 
@@ -29,6 +33,12 @@ _FOOTER = """
 """
 
 
+def _format_throughput(num_bytes, seconds):
+    """:return: [MB, MB/s] table cells."""
+    megabytes = num_bytes / (1024.0 * 1024)
+    return ['%.1f' % megabytes, '%.2f' % (megabytes / max(seconds, 1e-3))]
+
+
 class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     def _send_headers(self):
@@ -50,6 +60,9 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     def _write_field(self, field, value):
         self._write_line('%s=%s' % (field, value))
 
+    def _write_row(self, cells):
+        self.wfile.write('<tr><td>%s</td></tr>\n' % '</td><td>'.join(cells))
+
     def _write_all_fields(self):
         self._write_line('Config values:')
         for field in scheduler_config.SchedulerConfig.FIELDS:
@@ -74,6 +87,76 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self._write_drone(drone)
         self._write_line()
 
+    def _write_tick_stats(self):
+        profiler = self.server._tick_profiler
+        self._write_line('Tick statistics over the last ticks '
+                         '(%d ticks run%s):'
+                         % (profiler.tick_count,
+                            profiler.is_profiling() and ', profiling' or ''))
+        self.wfile.write('<table border="1">\n<tr><th>phase</th>'
+                         '<th>samples</th><th>mean ms</th><th>p50 ms</th>'
+                         '<th>p90 ms</th><th>p99 ms</th><th>max ms</th>'
+                         '<th>mean queries</th><th>max queries</th>'
+                         '<th>mean rows</th><th>max rows</th></tr>\n')
+        for stats in profiler.get_phase_stats():
+            seconds = stats.seconds
+            cells = [cgi.escape(stats.name), str(len(seconds))]
+            cells += ['%.1f' % (value * 1000) for value in
+                      (seconds.mean(), seconds.percentile(50),
+                       seconds.percentile(90), seconds.percentile(99),
+                       seconds.max())]
+            cells += ['%.1f' % stats.queries.mean(), str(stats.queries.max()),
+                      '%.1f' % stats.rows.mean(), str(stats.rows.max())]
+            self._write_row(cells)
+        self.wfile.write('</table>\n')
+
+        tick_seconds = profiler.get_phase_stats()[0].seconds
+        buckets = []
+        for bound, count in tick_seconds.bucket_counts():
+            if bound is None:
+                buckets.append('&gt;%gs: %d' % (tick_seconds.bounds[-1],
+                                                count))
+            else:
+                buckets.append('&lt;=%gs: %d' % (bound, count))
+        self._write_line('Tick time histogram: ' + ', '.join(buckets))
+        self._write_line()
+
+    def _write_transfer_stats(self):
+        transfer_stats = self.server._drone_manager.get_transfer_stats()
+        if not transfer_stats:
+            return
+        self._write_line('Result transfers (last batch / since start):')
+        self.wfile.write('<table border="1">\n<tr><th>drone</th>'
+                         '<th>queued</th><th>skipped</th><th>coalesced</th>'
+                         '<th>failed</th><th>MB</th><th>MB/s</th>'
+                         '<th>total transfers</th><th>total skipped</th>'
+                         '<th>total failed</th><th>total MB</th>'
+                         '<th>total MB/s</th></tr>\n')
+        for name, stats in transfer_stats:
+            cells = [cgi.escape(name)]
+            cells += [str(stats[field]) for field in
+                      ('queued', 'skipped', 'coalesced', 'failed')]
+            cells += _format_throughput(stats['bytes'], stats['seconds'])
+            cells += [str(stats[field]) for field in
+                      ('total_transfers', 'total_skipped', 'total_failed')]
+            cells += _format_throughput(stats['total_bytes'],
+                                        stats['total_seconds'])
+            self._write_row(cells)
+        self.wfile.write('</table>\n')
+        self._write_line()
+
+    def _dump_tick_profiles(self):
+        directory = settings.get_value(scheduler_config.CONFIG_SECTION,
+                                       'tick_profile_dir',
+                                       default='tick_profiles')
+        # relative to the results directory of the scheduler
+        directory = self.server._drone_manager.absolute_path(
+            directory, on_results_repository=True)
+        paths = self.server._tick_profiler.dump_profiles(directory)
+        self._write_line('Dumped %d tick profiles:' % len(paths))
+        for path in paths:
+            self._write_line(cgi.escape(path))
+
     def _execute_actions(self, arguments):
         if 'reparse_config' in arguments:
             scheduler_config.config.read_config()
@@ -81,7 +164,13 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self._write_line('Reparsed config!')
         elif 'restart_scheduler' in arguments:
             self.server._shutdown_scheduler = True
+            scheduler_wakeup.notify()
             self._write_line('Posted the shutdown request')
+        elif 'profile_ticks' in arguments:
+            self.server._tick_profiler.start_profiling()
+            self._write_line('Profiling the following ticks')
+        elif 'dump_tick_profiles' in arguments:
+            self._dump_tick_profiles()
         self._write_line()
 
     def do_GET(self):
@@ -92,6 +181,8 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self._execute_actions(arguments)
         self._write_all_fields()
         self._write_drone_list()
+        self._write_tick_stats()
+        self._write_transfer_stats()
 
         self.wfile.write(_FOOTER)
 
@@ -105,6 +196,7 @@ class StatusServer(BaseHTTPServer.HTTPServer):
                                            StatusServerRequestHandler)
         self._shutting_down = False
         self._drone_manager = drone_manager.instance()
+        self._tick_profiler = tick_profiler.instance()
         self._shutdown_scheduler = False
 
         # ensure the listening socket is not inherited by child processes
@@ -0,0 +1,247 @@
+"""
+Per-phase instrumentation of the scheduler tick.
+
+The dispatcher runs every phase of its tick through TickProfiler.run_phase(),
+which records the wall time, the number of database queries and the number
+of rows they returned.  The last samples of each phase are kept in rolling
+histograms which the status server displays.  On demand, every tick can also
+be run under cProfile; the profiles of the slowest ones are kept and can be
+dumped to disk.
+"""
+
+import collections
+import cProfile
+import heapq
+import logging
+import os
+import time
+
+import django.db
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+from autotest.scheduler import scheduler_config
+
+# upper bounds, in seconds, of the time histogram buckets
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                2.5, 5, 10, 30)
+# upper bounds of the query and row count histogram buckets
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000)
+
+TICK = 'tick'
+
+
+class RollingHistogram(object):
+
+    """A histogram of the last window_size values added to it."""
+
+    def __init__(self, bounds, window_size):
+        """
+        :param bounds: sorted upper bounds of the buckets.  Values above the
+                last bound go to an extra overflow bucket.
+        :param window_size: number of most recent values to keep.
+        """
+        self.bounds = bounds
+        self._values = collections.deque(maxlen=window_size)
+
+    def add(self, value):
+        self._values.append(value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def mean(self):
+        if not self._values:
+            return 0
+        return float(sum(self._values)) / len(self._values)
+
+    def max(self):
+        if not self._values:
+            return 0
+        return max(self._values)
+
+    def percentile(self, percent):
+        """Return the smallest value not exceeded by percent% of the values."""
+        if not self._values:
+            return 0
+        values = sorted(self._values)
+        index = int(round(percent / 100.0 * len(values))) - 1
+        return values[min(max(index, 0), len(values) - 1)]
+
+    def bucket_counts(self):
+        """
+        :return: a list of (upper bound, count) pairs, the upper bound of the
+                overflow bucket being None.
+        """
+        counts = [0] * (len(self.bounds) + 1)
+        for value in self._values:
+            for index, bound in enumerate(self.bounds):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return zip(list(self.bounds) + [None], counts)
+
+
+class PhaseStats(object):
+
+    """Rolling histograms of the cost of one phase of the tick."""
+
+    def __init__(self, name, window_size):
+        self.name = name
+        self.seconds = RollingHistogram(TIME_BUCKETS, window_size)
+        self.queries = RollingHistogram(COUNT_BUCKETS, window_size)
+        self.rows = RollingHistogram(COUNT_BUCKETS, window_size)
+
+    def add(self, seconds, queries, rows):
+        self.seconds.add(seconds)
+        self.queries.add(queries)
+        self.rows.add(rows)
+
+
+class TickProfiler(object):
+
+    """
+    Collects per-phase statistics of scheduler ticks.
+
+    Queries are counted on the DatabaseConnections given to add_database() and,
+    when Django records them (settings.DEBUG), on the Django connection.  Rows
+    are only counted for DatabaseConnection queries.
+    """
+
+    def __init__(self, window_size=1000, slowest_ticks=5):
+        """
+        :param window_size: number of most recent ticks kept in the
+                histograms.
+        :param slowest_ticks: number of tick profiles kept while profiling.
+        """
+        self._window_size = window_size
+        self._slowest_ticks = slowest_ticks
+        self._databases = []
+        # phase name -> PhaseStats, and the names in order of appearance
+        self._phases = {TICK: PhaseStats(TICK, window_size)}
+        self._phase_names = [TICK]
+        self.tick_count = 0
+        self._tick_start = None
+        self._tick_counts = None
+        self._profiling = False
+        self._profile = None
+        # heap of (seconds, tick number, cProfile.Profile), fastest first
+        self._profiles = []
+
+    def add_database(self, database):
+        if database not in self._databases:
+            self._databases.append(database)
+
+    def _counts(self):
+        queries = sum(database.queries_executed
+                      for database in self._databases)
+        queries += len(django.db.connection.queries)
+        rows = sum(database.rows_fetched for database in self._databases)
+        return queries, rows
+
+    def _record(self, name, start_time, start_counts):
+        queries, rows = self._counts()
+        # Django's query log may have been reset in between
+        queries = max(queries - start_counts[0], 0)
+        rows -= start_counts[1]
+        stats = self._phases.get(name)
+        if stats is None:
+            stats = self._phases[name] = PhaseStats(name, self._window_size)
+            self._phase_names.append(name)
+        stats.add(time.time() - start_time, queries, rows)
+
+    def start_tick(self):
+        if self._profile:
+            # the previous tick raised an exception before end_tick()
+            self._profile.disable()
+        self._profile = None
+        if self._profiling:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._tick_counts = self._counts()
+        self._tick_start = time.time()
+
+    def run_phase(self, name, function, *args, **dargs):
+        """Call function(*args, **dargs) and record its cost under name."""
+        start_counts = self._counts()
+        start_time = time.time()
+        try:
+            return function(*args, **dargs)
+        finally:
+            self._record(name, start_time, start_counts)
+
+    def end_tick(self):
+        seconds = time.time() - self._tick_start
+        self._record(TICK, self._tick_start, self._tick_counts)
+        self.tick_count += 1
+
+        if self._profile:
+            self._profile.disable()
+            entry = (seconds, self.tick_count, self._profile)
+            if len(self._profiles) < self._slowest_ticks:
+                heapq.heappush(self._profiles, entry)
+            else:
+                heapq.heappushpop(self._profiles, entry)
+            self._profile = None
+
+    def get_phase_stats(self):
+        """:return: a list of PhaseStats, the whole tick first."""
+        return [self._phases[name] for name in self._phase_names]
+
+    def is_profiling(self):
+        return self._profiling
+
+    def start_profiling(self):
+        """Run the following ticks under cProfile, dropping older profiles."""
+        logging.info('Starting to profile scheduler ticks')
+        self._profiling = True
+        self._profiles = []
+
+    def stop_profiling(self):
+        self._profiling = False
+
+    def dump_profiles(self, directory):
+        """
+        Write the profiles of the slowest ticks to directory and stop
+        profiling.
+
+        :return: the paths of the written files, slowest tick first.
+        """
+        self.stop_profiling()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for seconds, tick_number, profile in sorted(self._profiles,
+                                                    reverse=True):
+            path = os.path.join(directory, 'tick-%d-%dms.prof' %
+                                (tick_number, seconds * 1000))
+            profile.dump_stats(path)
+            paths.append(path)
+        logging.info('Dumped %d scheduler tick profiles to %s', len(paths),
+                     directory)
+        return paths
+
+
+_the_instance = None
+
+
+def instance():
+    if _the_instance is None:
+        window_size = settings.get_value(scheduler_config.CONFIG_SECTION,
+                                         'tick_profiler_window', type=int,
+                                         default=1000)
+        slowest_ticks = settings.get_value(scheduler_config.CONFIG_SECTION,
+                                           'tick_profiler_slowest_ticks',
+                                           type=int, default=5)
+        _set_instance(TickProfiler(window_size, slowest_ticks))
+    return _the_instance
+
+
+def _set_instance(instance):  # usable for testing
+    global _the_instance
+    _the_instance = instance
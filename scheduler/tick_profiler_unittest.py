@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.database_legacy import database_connection
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from autotest.scheduler import tick_profiler
+
+
+class RollingHistogramTest(unittest.TestCase):
+
+    def test_window(self):
+        histogram = tick_profiler.RollingHistogram((1, 10), window_size=3)
+        for value in (100, 1, 5, 20):
+            histogram.add(value)
+        self.assertEquals(3, len(histogram))
+        self.assertEquals(20, histogram.max())
+        self.assertEquals([(1, 1), (10, 1), (None, 1)],
+                          histogram.bucket_counts())
+
+    def test_percentile(self):
+        histogram = tick_profiler.RollingHistogram((), window_size=100)
+        self.assertEquals(0, histogram.percentile(50))
+        for value in xrange(1, 101):
+            histogram.add(value)
+        self.assertEquals(50, histogram.percentile(50))
+        self.assertEquals(99, histogram.percentile(99))
+        self.assertEquals(100, histogram.percentile(100))
+        self.assertEquals(50.5, histogram.mean())
+
+
+class TickProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = tick_profiler.TickProfiler(window_size=10,
+                                                   slowest_ticks=2)
+        self.db = database_connection.DatabaseConnection.get_test_database()
+        self.db.execute('CREATE TABLE things (id INTEGER PRIMARY KEY)')
+        self.db.execute('INSERT INTO things VALUES (1)')
+        self.db.execute('INSERT INTO things VALUES (2)')
+        self.profiler.add_database(self.db)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.directory)
+
+    def _select(self):
+        return self.db.execute('SELECT id FROM things')
+
+    def _tick(self):
+        self.profiler.start_tick()
+        self.assertEquals([(1,), (2,)],
+                          self.profiler.run_phase('select', self._select))
+        self.profiler.run_phase('nothing', lambda: None)
+        self.profiler.end_tick()
+
+    def test_phase_stats(self):
+        self._tick()
+        self._tick()
+        stats = dict((phase.name, phase)
+                     for phase in self.profiler.get_phase_stats())
+        self.assertEquals([tick_profiler.TICK, 'select', 'nothing'],
+                          [phase.name for phase in
+                           self.profiler.get_phase_stats()])
+        self.assertEquals(2, len(stats['select'].seconds))
+        self.assertEquals(1, stats['select'].queries.max())
+        self.assertEquals(2, stats['select'].rows.max())
+        self.assertEquals(0, stats['nothing'].queries.max())
+        self.assertEquals(1, stats[tick_profiler.TICK].queries.max())
+        self.assertEquals(2, self.profiler.tick_count)
+
+    def test_failing_phase_is_recorded(self):
+        self.profiler.start_tick()
+        self.assertRaises(ZeroDivisionError, self.profiler.run_phase,
+                          'fail', lambda: 1 / 0)
+        self.assertEquals(1, len(self.profiler.get_phase_stats()[1].seconds))
+
+    def test_dump_slowest_profiles(self):
+        self.profiler.start_profiling()
+        for _ in xrange(3):
+            self._tick()
+        paths = self.profiler.dump_profiles(self.directory)
+        self.assertEquals(2, len(paths))
+        for path in paths:
+            self.assert_(os.path.exists(path))
+        self.assertFalse(self.profiler.is_profiling())
+
+    def test_not_profiling_by_default(self):
+        self._tick()
+        self.assertEquals([], self.profiler.dump_profiles(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+"""
+Execution of the file transfers queued on a drone.
+
+Without it, DroneUtility forks each send_file_to/get_file_from in the order
+the calls were queued and waits for free slots by polling every second.  The
+TransferEngine instead collects all the transfers of a batch of calls and
+
+* coalesces transfers of the same source to the same destination,
+* skips the transfers whose source did not change since it was last sent to
+  the same destination (size and mtime of every file, and the contents of
+  small single files, so that rewriting an identical keyval does not cause
+  a copy),
+* starts the small transfers first, single files before directories, so a
+  status log or keyval is not stuck behind the debug directories of other
+  jobs, and
+* waits for the transfers with select() on their result pipes, starting the
+  next one as soon as a slot frees up.
+
+The data itself is still moved by the host's send_file/get_file (rsync -z
+over ssh, so it is streamed compressed).  Remembering what was sent only
+helps drone_utility instances that stay resident between batches (see
+_AbstractDrone.is_resident()).
+"""
+
+import collections
+import cPickle
+import errno
+import hashlib
+import os
+import select
+import sys
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import error
+from autotest.server import subcommand
+
+# single files up to this size are compared by contents instead of mtime
+HASH_SIZE_LIMIT = 64 * 1024
+# number of destinations whose last sent source is remembered
+MANIFEST_SIZE = 10000
+_READ_SIZE = 65536
+
+
+def source_signature(path):
+    """
+    Summarize the state of a local file or directory tree.
+
+    :return: (signature, total size in bytes, is_directory), signature being
+            None if path does not exist.
+    """
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return None, None, False
+    digest = hashlib.md5()
+    if not os.path.isdir(path):
+        if stat.st_size <= HASH_SIZE_LIMIT and os.path.isfile(path):
+            try:
+                digest.update(open(path, 'rb').read())
+            except IOError:
+                return None, None, False
+            digest.update(str(stat.st_size))
+        else:
+            digest.update('%d %r' % (stat.st_size, stat.st_mtime))
+        return digest.hexdigest(), stat.st_size, False
+
+    size = 0
+    for directory, subdirs, files in os.walk(path):
+        subdirs.sort()
+        digest.update('d %s\n' % os.path.relpath(directory, path))
+        for name in sorted(files):
+            try:
+                stat = os.lstat(os.path.join(directory, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            digest.update('f %s %d %r\n' % (name, stat.st_size,
+                                            stat.st_mtime))
+    return digest.hexdigest(), size, True
+
+
+class Transfer(object):
+
+    """A transfer waiting to be executed by a TransferEngine."""
+
+    def __init__(self, function, args, destination, source_path, signature,
+                 size, is_directory):
+        self.function = function
+        self.args = args
+        self.destination = destination
+        self.source_path = source_path
+        self.signature = signature
+        self.size = size
+        self.is_directory = is_directory
+
+    def priority(self):
+        """Sort key, lowest first: known sizes, files, then smallest."""
+        return (self.size is None, self.is_directory, self.size)
+
+
+class TransferEngine(object):
+
+    """
+    Runs the transfers of each batch of drone calls concurrently, smallest
+    first.
+
+    A transfer is a function executed in a forked subcommand; it fails if it
+    raises, and a return value of False means it did not copy anything (for
+    example a send_file_to that is allowed to fail), so the source is not
+    remembered as sent.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._queued = set()
+        # destination -> signature of the source last sent to it, and the
+        # destinations from the least recently sent to
+        self._manifest = {}
+        self._manifest_order = []
+        self._batch_stats = self._new_batch_stats()
+        self._last_stats = self._new_batch_stats()
+        self._totals = {'transfers': 0, 'skipped': 0, 'failed': 0,
+                        'bytes': 0, 'seconds': 0.0}
+
+    @staticmethod
+    def _new_batch_stats():
+        return {'queued': 0, 'skipped': 0, 'coalesced': 0, 'failed': 0,
+                'bytes': 0, 'seconds': 0.0}
+
+    def pending(self):
+        """:return: the number of transfers waiting for run()."""
+        return len(self._queue)
+
+    def queue(self, function, args, destination, source_path=None):
+        """
+        Queue a transfer for the next run().  Transfers with the same
+        destination and args as one already queued are dropped.
+
+        :param destination: hashable identifying where the data goes, such as
+                (hostname, path).
+        :param source_path: local path of the data, None if it is not local,
+                in which case the transfer is never skipped.
+        """
+        key = (destination, args)
+        if key in self._queued:
+            self._batch_stats['coalesced'] += 1
+            return
+        signature, size, is_directory = None, None, False
+        if source_path is not None:
+            signature, size, is_directory = source_signature(source_path)
+        if (signature is not None and
+                self._manifest.get(destination) == (source_path, signature)):
+            self._batch_stats['skipped'] += 1
+            return
+        self._queued.add(key)
+        self._queue.append(Transfer(function, args, destination, source_path,
+                                    signature, size, is_directory))
+
+    def _forget(self, destination):
+        if self._manifest.pop(destination, None) is not None:
+            self._manifest_order.remove(destination)
+
+    def _remember(self, transfer, result):
+        self._forget(transfer.destination)
+        if result is False or transfer.signature is None:
+            return
+        self._manifest[transfer.destination] = (transfer.source_path,
+                                                transfer.signature)
+        self._manifest_order.append(transfer.destination)
+        while len(self._manifest_order) > MANIFEST_SIZE:
+            del self._manifest[self._manifest_order.pop(0)]
+
+    def _wait_for_some(self, running):
+        """
+        Wait until at least one running transfer finishes.
+
+        :return: list of (transfer, result, exc_info) of the finished ones,
+                exc_info being None unless the transfer failed.
+        """
+        try:
+            readable = select.select(list(running), [], [])[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        finished = []
+        for fd in readable:
+            transfer, subproc, chunks = running[fd]
+            chunk = os.read(fd, _READ_SIZE)
+            if chunk:
+                chunks.append(chunk)
+                continue
+            del running[fd]
+            subproc.result_pickle.close()
+            try:
+                subproc.wait()
+            except error.AutoservSubcommandError:
+                finished.append((transfer, None, sys.exc_info()))
+                continue
+            result = None
+            if chunks:
+                result = cPickle.loads(''.join(chunks))
+            finished.append((transfer, result, None))
+        return finished
+
+    def run(self, max_transfers):
+        """
+        Execute all the queued transfers, at most max_transfers at once.
+
+        The statistics of the last run are left alone if nothing was queued,
+        even to be skipped, since the previous one.
+
+        :raise error.AutoservSubcommandError: the first transfer failure,
+                once all the transfers are done.
+        """
+        if not self._queue and self._batch_stats == self._new_batch_stats():
+            return
+        pending = collections.deque(sorted(self._queue,
+                                           key=Transfer.priority))
+        self._queue = []
+        self._queued = set()
+        stats = self._batch_stats
+        self._batch_stats = self._new_batch_stats()
+        stats['queued'] = len(pending)
+
+        start_time = time.time()
+        running = {}
+        first_failure = None
+        while pending or running:
+            while pending and len(running) < max(max_transfers, 1):
+                transfer = pending.popleft()
+                subproc = subcommand.subcommand(transfer.function,
+                                                transfer.args)
+                subproc.fork_start()
+                running[subproc.result_pickle.fileno()] = (transfer, subproc,
+                                                           [])
+            for transfer, result, exc_info in self._wait_for_some(running):
+                if exc_info is not None:
+                    stats['failed'] += 1
+                    first_failure = first_failure or exc_info
+                    self._forget(transfer.destination)
+                    continue
+                self._remember(transfer, result)
+                if result is not False:
+                    stats['bytes'] += transfer.size or 0
+        stats['seconds'] = time.time() - start_time
+
+        self._totals['transfers'] += stats['queued']
+        for name in ('skipped', 'failed', 'bytes', 'seconds'):
+            self._totals[name] += stats[name]
+        self._last_stats = stats
+        if first_failure is not None:
+            raise first_failure[0], first_failure[1], first_failure[2]
+
+    def get_stats(self):
+        """
+        :return: a dict with the statistics of the last run() (queued,
+                skipped, coalesced, failed, bytes and seconds) and the totals
+                since the engine was created, prefixed with 'total_'.
+        """
+        stats = dict(self._last_stats)
+        for name, value in self._totals.iteritems():
+            stats['total_' + name] = value
+        return stats
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import error
+from autotest.client.shared.settings import settings
+from autotest.scheduler import drone_utility, transfer_engine
+
+
+def _write(path, contents):
+    output = open(path, 'w')
+    output.write(contents)
+    output.close()
+
+
+class TransferEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmpdir, 'log')
+        self.engine = transfer_engine.TransferEngine()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, name, size=1):
+        path = os.path.join(self.tmpdir, name)
+        _write(path, 'x' * size)
+        return path
+
+    def _copy(self, source_path, result=True):
+        # runs in the forked subcommand, so only the file system is shared
+        log = open(self.log_path, 'a')
+        log.write(os.path.basename(source_path) + '\n')
+        log.close()
+        return result
+
+    def _fail(self, source_path):
+        raise IOError('cannot copy %s' % source_path)
+
+    def _queue(self, source_path, function=None, result=True):
+        self.engine.queue(function or self._copy, (source_path, result),
+                          ('results', source_path), source_path)
+
+    def _copied(self):
+        if not os.path.exists(self.log_path):
+            return []
+        copied = open(self.log_path).read().split()
+        os.remove(self.log_path)
+        return copied
+
+    def test_small_transfers_first(self):
+        bulk = os.path.join(self.tmpdir, 'debug')
+        os.mkdir(bulk)
+        _write(os.path.join(bulk, 'messages'), 'x')
+        self._queue(bulk)
+        self._queue(self._path('big', 10000))
+        self._queue(self._path('keyval', 10))
+        self.engine.queue(self._copy, ('remote', True), ('results', 'remote'))
+        self.assertEquals(4, self.engine.pending())
+        self.engine.run(1)
+        self.assertEquals(['keyval', 'big', 'debug', 'remote'], self._copied())
+        self.assertEquals(0, self.engine.pending())
+
+        stats = self.engine.get_stats()
+        self.assertEquals(4, stats['queued'])
+        self.assertEquals(10011, stats['bytes'])
+        self.assertEquals(4, stats['total_transfers'])
+
+    def test_unchanged_sources_are_skipped(self):
+        keyval = self._path('keyval')
+        self._queue(keyval)
+        self._queue(keyval)
+        self.engine.run(5)
+        self.assertEquals(['keyval'], self._copied())
+        self.assertEquals(1, self.engine.get_stats()['coalesced'])
+
+        # same contents, different mtime
+        os.utime(keyval, (time.time() - 100, time.time() - 100))
+        self._queue(keyval)
+        self.engine.run(5)
+        self.assertEquals([], self._copied())
+        self.assertEquals(1, self.engine.get_stats()['skipped'])
+
+        _write(keyval, 'y')
+        self._queue(keyval)
+        self.engine.run(5)
+        self.assertEquals(['keyval'], self._copied())
+
+    def test_changed_directory_is_sent(self):
+        directory = os.path.join(self.tmpdir, 'debug')
+        os.mkdir(directory)
+        self._queue(directory)
+        self.engine.run(5)
+        self._queue(directory)
+        self.engine.run(5)
+        self.assertEquals(['debug'], self._copied())
+
+        _write(os.path.join(directory, 'messages'), 'x')
+        self._queue(directory)
+        self.engine.run(5)
+        self.assertEquals(['debug'], self._copied())
+
+    def test_unsent_sources_are_not_remembered(self):
+        keyval = self._path('keyval')
+        self._queue(keyval, result=False)
+        self.engine.run(5)
+        self._queue(keyval)
+        self.engine.run(5)
+        self.assertEquals(['keyval', 'keyval'], self._copied())
+
+    def test_manifest_size(self):
+        manifest_size = transfer_engine.MANIFEST_SIZE
+        transfer_engine.MANIFEST_SIZE = 2
+        try:
+            paths = [self._path(name) for name in ('a', 'b', 'c')]
+            self._queue(paths[0])
+            self._queue(paths[1])
+            self.engine.run(1)
+            self._queue(paths[2])
+            self.engine.run(1)
+            self.assertEquals(['a', 'b', 'c'], self._copied())
+
+            # the least recently sent destination was forgotten
+            for path in paths:
+                self._queue(path)
+            self.engine.run(1)
+            self.assertEquals(['a'], self._copied())
+        finally:
+            transfer_engine.MANIFEST_SIZE = manifest_size
+
+    def test_failures(self):
+        keyval = self._path('keyval')
+        self._queue(keyval, function=self._fail)
+        self._queue(self._path('status.log'))
+        self.assertRaises(error.AutoservSubcommandError, self.engine.run, 5)
+        self.assertEquals(['status.log'], self._copied())
+        stats = self.engine.get_stats()
+        self.assertEquals(1, stats['failed'])
+        self.assertEquals(1, stats['total_failed'])
+
+        self._queue(keyval)
+        self.engine.run(5)
+        self.assertEquals(['keyval'], self._copied())
+
+
+class DroneUtilityTransferTest(unittest.TestCase):
+
+    def setUp(self):
+        settings.override_value('SCHEDULER', 'transfer_engine', 'True')
+        self.tmpdir = tempfile.mkdtemp()
+        self.drone_utility = drone_utility.DroneUtility()
+        self.drone_utility.sync_send_file_to = self._send
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        settings.reset_values()
+
+    def _send(self, hostname, source_path, destination_path, can_fail):
+        shutil.copy(source_path, destination_path)
+        return True
+
+    def test_send_file_to(self):
+        source = os.path.join(self.tmpdir, 'keyval')
+        destination = os.path.join(self.tmpdir, 'copy')
+        _write(source, 'a=1\n')
+        calls = [drone_utility.call('send_file_to', 'results', source,
+                                    destination, can_fail=True)]
+        reply = self.drone_utility.execute_calls(calls)
+        self.assertEquals('a=1\n', open(destination).read())
+        self.assertEquals(1, reply['transfer_stats']['queued'])
+
+        reply = self.drone_utility.execute_calls(calls)
+        self.assertEquals(1, reply['transfer_stats']['skipped'])
+        self.assertEquals(1, reply['transfer_stats']['total_transfers'])
+
+
+if __name__ == '__main__':
+    unittest.main()
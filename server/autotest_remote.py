@@ -14,10 +14,13 @@ from autotest.client import utils as client_utils
 from autotest.client.shared import base_job, error, autotemp
 from autotest.client.shared import packages
 from autotest.client.shared.settings import settings, SettingsError
-from autotest.server import installable_object, prebuild, utils
+from autotest.server import client_image, installable_object, package_cache
+from autotest.server import prebuild, subcommand, utils
 
 autoserv_prebuild = settings.get_value('AUTOSERV', 'enable_server_prebuild',
                                        type=bool, default=False)
+# source directories of the tests and profilers prebuilt by this process
+_prebuilt_dirs = set()
 
 CLIENT_BINARY = 'autotest-local-streamhandler'
 
@@ -230,8 +233,10 @@ class BaseAutotest(installable_object.InstallableObject):
         host.run("mkdir -p %s" % profilers_autodir)
         host.send_file(profilers_init, profilers_autodir, delete_dest=True)
         dirs_to_exclude.discard("profilers")
+        self._create_excluded_dirs(host, autodir, dirs_to_exclude)
 
-        # create empty dirs for all the stuff we excluded
+    def _create_excluded_dirs(self, host, autodir, dirs_to_exclude):
+        """Create empty dirs for all the stuff a light client excludes."""
         commands = []
         for path in dirs_to_exclude:
             abs_path = os.path.join(autodir, path)
@@ -240,6 +245,23 @@ class BaseAutotest(installable_object.InstallableObject):
             commands.append("touch '%s'/__init__.py" % abs_path)
         host.run(';'.join(commands))
 
+    def _install_using_delta(self, host, autodir, light):
+        """
+        Only send the client files that changed since the last install.
+
+        :param light: if True, install the client without the tests,
+                profilers and deps, like _install_using_send_file().
+        """
+        start_time = time.time()
+        image = client_image.get_client_image(self.source_material, light)
+        sent, size, removed = image.install(host, autodir)
+        if light:
+            self._create_excluded_dirs(host, autodir,
+                                       ["tests", "site_tests", "deps"])
+        logging.info("Updated the autotest client on %s in %.1f s: %d paths "
+                     "sent (%d bytes), %d removed", host.hostname,
+                     time.time() - start_time, sent, size, removed)
+
     def _install(self, host=None, autodir=None, use_autoserv=True,
                  use_packaging=True):
         """
@@ -298,6 +320,23 @@ class BaseAutotest(installable_object.InstallableObject):
         host.run('rm -rf %s/*' % utils.sh_escape(results_path),
                  ignore_status=True)
 
+        # Update the client already on the host, if any
+        delta_install = settings.get_value('AUTOSERV', 'client_delta_install',
+                                           type=bool, default=False)
+        if self.source_material and delta_install:
+            light = use_autoserv and settings.get_value(
+                "PACKAGES", "serve_packages_from_autoserv", type=bool,
+                default=False)
+            try:
+                self._install_using_delta(host, autodir, light)
+                self._create_test_output_dir(host, autodir)
+                logging.info("Installation of autotest completed")
+                self.installed = True
+                return
+            except error.AutoservRunError as e:
+                logging.info("Could not update the autotest client: %s. "
+                             "Trying other methods", e)
+
         # Fetch the autotest client from the nearest repository
         if use_packaging:
             try:
@@ -1111,13 +1150,12 @@ class client_logger(object):
                 src_dir = os.path.join(self.job.clientdir, test_dir, name)
                 if os.path.exists(src_dir):
                     src_dirs += [src_dir]
-                    if autoserv_prebuild:
-                        prebuild.setup(self.job.clientdir, src_dir)
+                    self._prebuild(src_dir)
                     break
         elif pkg_type == 'profiler':
-            src_dirs += [os.path.join(self.job.clientdir, 'profilers', name)]
-            if autoserv_prebuild:
-                prebuild.setup(self.job.clientdir, src_dir)
+            src_dir = os.path.join(self.job.clientdir, 'profilers', name)
+            src_dirs += [src_dir]
+            self._prebuild(src_dir)
         elif pkg_type == 'dep':
             src_dirs += [os.path.join(self.job.clientdir, 'deps', name)]
         elif pkg_type == 'client':
@@ -1128,26 +1166,44 @@ class client_logger(object):
         # iterate over src_dirs until we find one that exists, then tar it
         for src_dir in src_dirs:
             if os.path.exists(src_dir):
-                try:
+                exclude_paths = None
+                exclude_file_path = os.path.join(src_dir, ".pack_exclude")
+                if os.path.exists(exclude_file_path):
+                    exclude_file = open(exclude_file_path)
+                    exclude_paths = exclude_file.read().splitlines()
+                    exclude_file.close()
+
+                def build(dest_dir):
                     logging.info('Bundling %s into %s', src_dir, pkg_name)
+                    return self.job.pkgmgr.tar_package(pkg_name, src_dir,
+                                                       dest_dir, " .",
+                                                       exclude_paths)
+
+                cache = package_cache.get_package_cache()
+                if cache is not None:
+                    misses = cache.misses
+                    tarball_path = cache.get_tarball(pkg_name, src_dir,
+                                                     exclude_paths, build)
+                    logging.info('Package cache %s for %s (%d hits, %d '
+                                 'misses)',
+                                 cache.misses > misses and 'miss' or 'hit',
+                                 pkg_name, cache.hits, cache.misses)
+                    self.host.send_file(tarball_path, remote_dest)
+                    return
+                try:
                     temp_dir = autotemp.tempdir(unique_id='autoserv-packager',
                                                 dir=self.job.tmpdir)
-
-                    exclude_paths = None
-                    exclude_file_path = os.path.join(src_dir, ".pack_exclude")
-                    if os.path.exists(exclude_file_path):
-                        exclude_file = open(exclude_file_path)
-                        exclude_paths = exclude_file.read().splitlines()
-                        exclude_file.close()
-
-                    tarball_path = self.job.pkgmgr.tar_package(
-                        pkg_name, src_dir, temp_dir.name,
-                        " .", exclude_paths)
-                    self.host.send_file(tarball_path, remote_dest)
+                    self.host.send_file(build(temp_dir.name), remote_dest)
                 finally:
                     temp_dir.clean()
                 return
 
+    def _prebuild(self, src_dir):
+        """Prebuild a test or profiler, once per autoserv process."""
+        if autoserv_prebuild and src_dir not in _prebuilt_dirs:
+            prebuild.setup(self.job.clientdir, src_dir)
+            _prebuilt_dirs.add(src_dir)
+
     def log_warning(self, msg, warning_type):
         """Injects a WARN message into the current status logging stream."""
         timestamp = int(time.time())
@@ -1200,6 +1256,33 @@ class _Run(_SiteRun):
     pass
 
 
+def install_hosts(hosts, autodir=None, max_parallel=None):
+    """
+    Install the autotest client on several hosts at once.
+
+    With AUTOSERV.client_delta_install, the client image is prepared before
+    forking a subcommand per host, which all send the files of that image.
+
+    :param hosts: a list of Host instances.
+    :param autodir: location to install to on every host.
+    :param max_parallel: maximum number of hosts installed at the same
+            time, AUTOSERV.parallel_max_subcommands by default.
+    """
+    client = Autotest()
+    client.get()
+    if settings.get_value('AUTOSERV', 'client_delta_install', type=bool,
+                          default=False):
+        light = settings.get_value("PACKAGES", "serve_packages_from_autoserv",
+                                   type=bool, default=False)
+        client_image.get_client_image(client.source_material,
+                                      light).prepare()
+
+    def install(host):
+        client.install(host, autodir=autodir)
+    subcommand.parallel_simple(install, hosts, log=False,
+                               max_parallel=max_parallel)
+
+
 class AutotestHostMixin(object):
 
     """A generic mixin to add a run_test method to classes, which will allow
@@ -16,6 +16,7 @@ from autotest.client import sysinfo
 from autotest.client import utils as client_utils
 from autotest.client.shared import error
 from autotest.client.shared import packages
+from autotest.client.shared.settings import settings
 from autotest.client.shared.test_utils import mock
 from autotest.server import autotest_remote, utils, hosts, server_job, profilers
 
@@ -85,6 +86,7 @@ class TestBaseAutotest(unittest.TestCase):
         self.base_autotest = autotest_remote.BaseAutotest(self.host)
         self.base_autotest.job = self.host.job
         self.god.stub_function(self.base_autotest, "_install_using_send_file")
+        self.god.stub_function(self.base_autotest, "_install_using_delta")
 
         # stub out abspath
         self.god.stub_function(os.path, "abspath")
@@ -92,7 +94,7 @@ class TestBaseAutotest(unittest.TestCase):
         # check
         self.god.check_playback()
 
-    def record_install_prologue(self):
+    def record_install_prologue(self, delta_install=False):
         self.construct()
 
         # setup
@@ -116,6 +118,9 @@ class TestBaseAutotest(unittest.TestCase):
         self.host.run.expect_call('mkdir -p autodir')
         self.host.run.expect_call('rm -rf autodir/results/*',
                                   ignore_status=True)
+        autotest_remote.settings.get_value.expect_call(
+            'AUTOSERV', 'client_delta_install', type=bool,
+            default=False).and_return(delta_install)
 
     def test_constructor(self):
         self.construct()
@@ -162,6 +167,23 @@ class TestBaseAutotest(unittest.TestCase):
         self.base_autotest.install()
         self.god.check_playback()
 
+    def test_delta_install(self):
+        self.record_install_prologue(delta_install=True)
+
+        autotest_remote.settings.get_value.expect_call(
+            'PACKAGES', 'serve_packages_from_autoserv', type=bool,
+            default=False).and_return(True)
+        self.base_autotest._install_using_delta.expect_call(self.host,
+                                                            'autodir', True)
+        tmpdir = 'autodir/tmp'
+        autotest_remote.settings.get_value.expect_call('COMMON',
+                                                       'test_output_dir',
+                                                       default=tmpdir).and_return(tmpdir)
+        self.host.run.expect_call('mkdir -p %s' % tmpdir)
+        # run and check
+        self.base_autotest.install()
+        self.god.check_playback()
+
     def test_packaging_install(self):
         self.record_install_prologue()
 
@@ -377,5 +399,66 @@ class test_autotest_mixin(unittest.TestCase):
         self.assertEqual(self.mixin, self.host)
 
 
+class install_hosts_test(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.events = []
+        events = self.events
+
+        class stub_autotest(object):
+            source_material = '/autotest/client'
+
+            def get(self):
+                events.append('get')
+
+            def install(self, host, autodir=None):
+                events.append(('install', host, autodir))
+
+        class stub_image(object):
+
+            def prepare(self):
+                events.append('prepare')
+
+        def get_client_image(source_dir, light=False):
+            events.append(('image', source_dir, light))
+            return stub_image()
+
+        def parallel_simple(function, arglist, log=True, timeout=None,
+                            return_results=False, max_parallel=None):
+            events.append(('fork', max_parallel))
+            for arg in arglist:
+                function(arg)
+
+        self.god.stub_with(autotest_remote, 'Autotest', stub_autotest)
+        self.god.stub_with(autotest_remote.client_image, 'get_client_image',
+                           get_client_image)
+        self.god.stub_with(autotest_remote.subcommand, 'parallel_simple',
+                           parallel_simple)
+        settings.override_value('PACKAGES', 'serve_packages_from_autoserv',
+                                'False')
+
+    def tearDown(self):
+        self.god.unstub_all()
+        settings.reset_values()
+
+    def test_delta_install(self):
+        settings.override_value('AUTOSERV', 'client_delta_install', 'True')
+        autotest_remote.install_hosts(['host1', 'host2'], '/autodir',
+                                      max_parallel=2)
+        # the image is prepared once, before forking
+        self.assertEqual(['get', ('image', '/autotest/client', False),
+                          'prepare', ('fork', 2),
+                          ('install', 'host1', '/autodir'),
+                          ('install', 'host2', '/autodir')], self.events)
+
+    def test_full_install(self):
+        settings.override_value('AUTOSERV', 'client_delta_install', 'False')
+        autotest_remote.install_hosts(['host1', 'host2'])
+        self.assertEqual(['get', ('fork', None),
+                          ('install', 'host1', None),
+                          ('install', 'host2', None)], self.events)
+
+
 if __name__ == "__main__":
     unittest.main()
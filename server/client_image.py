@@ -0,0 +1,272 @@
+"""
+Incremental installation of the autotest client on hosts.
+
+BaseAutotest used to remove the client from the autodir of a host and send
+all of it again for every job.  A ClientImage describes the client files
+autoserv installs, and only sends a host what it does not already have:
+
+* The manifest of the image maps the path of every file, symlink and
+  directory, relative to the client directory, to its type, permissions
+  and contents.  Files are only hashed again when their stat changed (see
+  package_cache.file_digest).
+* The same manifest is computed on the host by a find | sha1sum command.
+* The paths that differ are sent in a single tar.gz stream, piped to tar
+  through the stdin of the command run on the host, and the paths the
+  image does not have are removed.
+
+Only the top level entries of the image (its roots) are synchronized: the
+state the client keeps in its autodir (packages, results, tmp) and, for a
+light image, the test, profiler and dep directories fetched from autoserv
+on demand are left alone.  Compiled python files are not sent, the ones
+found on the host are removed along with their source file.
+
+The tarballs sent are kept in memory, so a process that prepares an image
+before forking (see autotest_remote.install_hosts) builds them only once for
+all of its subcommands.
+"""
+
+import cStringIO
+import glob
+import os
+import stat
+import tarfile
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import utils
+from autotest.server import package_cache
+
+# directories a light client gets from autoserv when it needs them
+LIGHT_EXCLUDED_DIRS = ('tests', 'site_tests', 'deps', 'profilers')
+# state of the client in its autodir, never synchronized
+STATE_DIRS = ('packages', 'results', 'tmp')
+COMPILED_SUFFIXES = ('.pyc', '.pyo')
+# number of tarballs an image keeps in memory
+MAX_CACHED_TARBALLS = 8
+
+# find -printf formats of the listing, a line per path
+_LIST_FORMATS = (('f', r'f\t%m\t%p\n'),
+                 ('l', r'l\t%l\t%p\n'),
+                 ('d', r'd\t\t%p\n'))
+
+
+def _is_compiled(path):
+    return path.endswith(COMPILED_SUFFIXES)
+
+
+def _topmost(paths):
+    """:return: the sorted paths, except those below another one of them."""
+    paths = set(paths)
+    topmost = []
+    for path in sorted(paths):
+        parts = path.split('/')
+        if not any('/'.join(parts[:index]) in paths
+                   for index in xrange(1, len(parts))):
+            topmost.append(path)
+    return topmost
+
+
+def _add_owned_by_root(archive, path, arcname):
+    """
+    Add path to archive as arcname, not recursing into directories, with
+    root as its owner.
+    """
+    tarinfo = archive.gettarinfo(path, arcname)
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = 'root'
+    if not tarinfo.isreg():
+        archive.addfile(tarinfo)
+        return
+    contents = open(path, 'rb')
+    try:
+        archive.addfile(tarinfo, contents)
+    finally:
+        contents.close()
+
+
+def parse_listing(output):
+    """
+    :param output: the output of the ClientImage.listing_command() command.
+    :return: the manifest of the host, like ClientImage.manifest.  Files
+            that could not be hashed have None as their digest.
+    """
+    manifest = {}
+    digests = {}
+    for line in output.splitlines():
+        if '\t' in line:
+            kind, value, path = line.split('\t', 2)
+            if kind == 'f':
+                manifest[path] = ('f', value, None)
+            elif kind == 'l':
+                manifest[path] = ('l', value)
+            elif kind == 'd':
+                manifest[path] = ('d',)
+        elif '  ' in line:
+            # sha1sum output
+            digest, path = line.split('  ', 1)
+            digests[path] = digest
+    for path, digest in digests.iteritems():
+        entry = manifest.get(path)
+        if entry is not None and entry[0] == 'f':
+            manifest[path] = ('f', entry[1], digest)
+    return manifest
+
+
+class ClientImage(object):
+
+    """
+    The client files autoserv installs on hosts.
+
+    The manifest maps paths relative to source_dir to ('d',) for
+    directories, ('l', target) for symlinks and ('f', octal permissions,
+    sha1 digest) for files.
+    """
+
+    def __init__(self, source_dir, light=False):
+        """
+        :param source_dir: the client directory.
+        :param light: if True, only the files of the client installed when
+                packages are served from autoserv: no tests, profilers nor
+                deps except the grubby tarball.
+        """
+        self.source_dir = source_dir
+        self.light = light
+        self.roots = []
+        self.extras = []
+        self.manifest = {}
+        self._tarballs = {}
+
+    def _add(self, manifest, path):
+        full_path = os.path.join(self.source_dir, path)
+        path_stat = os.lstat(full_path)
+        if stat.S_ISDIR(path_stat.st_mode):
+            manifest[path] = ('d',)
+            for name in os.listdir(full_path):
+                self._add(manifest, os.path.join(path, name))
+        elif stat.S_ISLNK(path_stat.st_mode):
+            manifest[path] = ('l', os.readlink(full_path))
+        elif stat.S_ISREG(path_stat.st_mode) and not _is_compiled(path):
+            manifest[path] = ('f', '%o' % stat.S_IMODE(path_stat.st_mode),
+                              package_cache.file_digest(full_path, path_stat))
+
+    def refresh(self):
+        """Update the manifest with the current contents of source_dir."""
+        excluded = set(STATE_DIRS)
+        if self.light:
+            excluded.update(LIGHT_EXCLUDED_DIRS)
+        self.roots = sorted(name for name in os.listdir(self.source_dir)
+                            if name not in excluded)
+        self.extras = []
+        if self.light:
+            extras = [os.path.join('profilers', '__init__.py')]
+            # there should be one and only one grubby tarball
+            grubby_tarball_paths = glob.glob(os.path.join(
+                self.source_dir, 'deps', 'grubby', 'grubby-*.tar.bz2'))
+            if grubby_tarball_paths:
+                extras.append(os.path.relpath(grubby_tarball_paths[0],
+                                              self.source_dir))
+            self.extras = [path for path in extras if os.path.exists(
+                os.path.join(self.source_dir, path))]
+        manifest = {}
+        for path in self.roots + self.extras:
+            self._add(manifest, path)
+        self.manifest = manifest
+
+    def listing_command(self, autodir):
+        """
+        :return: a command listing the manifest of the client in autodir,
+                to be given to parse_listing().
+        """
+        paths = ' '.join('"%s"' % utils.sh_escape(path)
+                         for path in self.roots + self.extras)
+        tests = ' -o '.join("\\( -type %s -printf '%s' \\)" % list_format
+                            for list_format in _LIST_FORMATS)
+        return ('cd "%s" && { find %s %s 2>/dev/null; '
+                "find %s -type f ! -name '*.py[co]' -print0 2>/dev/null | "
+                'xargs -0 -r sha1sum; }' % (utils.sh_escape(autodir), paths,
+                                           tests, paths))
+
+    def diff(self, remote):
+        """
+        :param remote: the manifest of the client on a host.
+        :return: (send, remove), the sorted paths of the image the host does
+                not have, and the paths to remove from the host before
+                sending them.
+        """
+        send = sorted(path for path, entry in self.manifest.iteritems()
+                      if remote.get(path) != entry)
+        roots = set(self.roots)
+        remove = []
+        for path, entry in remote.iteritems():
+            local = self.manifest.get(path)
+            if local is not None:
+                # replaced by another type of file
+                if local[0] != entry[0]:
+                    remove.append(path)
+            elif _is_compiled(path):
+                if path[:-1] not in self.manifest:
+                    remove.append(path)
+            elif path.split('/', 1)[0] in roots:
+                remove.append(path)
+        return send, _topmost(remove)
+
+    def tarball(self, paths):
+        """
+        :param paths: paths of the image, directories are not recursed into.
+        :return: the contents of a tar.gz archive of paths.
+        """
+        key = tuple((path, self.manifest.get(path)) for path in paths)
+        data = self._tarballs.get(key)
+        if data is None:
+            output = cStringIO.StringIO()
+            archive = tarfile.open(fileobj=output, mode='w:gz',
+                                   compresslevel=6)
+            for path in paths:
+                _add_owned_by_root(archive,
+                                   os.path.join(self.source_dir, path), path)
+            archive.close()
+            data = output.getvalue()
+            if len(self._tarballs) >= MAX_CACHED_TARBALLS:
+                self._tarballs.clear()
+            self._tarballs[key] = data
+        return data
+
+    def prepare(self):
+        """Build the tarball sent to hosts which have no client yet."""
+        self.tarball(sorted(self.manifest))
+
+    def install(self, host, autodir):
+        """
+        Make the client in autodir on host identical to the image.
+
+        :return: (paths sent, bytes sent, paths removed)
+        :raise AutoservRunError: if updating the files failed.
+        """
+        result = host.run(self.listing_command(autodir), ignore_status=True,
+                          stdout_tee=None, verbose=False)
+        send, remove = self.diff(parse_listing(result.stdout))
+        if remove:
+            host.run('cd "%s" && xargs -0 -r rm -rf' %
+                     utils.sh_escape(autodir), stdin='\0'.join(remove))
+        data = ''
+        if send:
+            data = self.tarball(send)
+            host.run('tar -xzpf - -C "%s"' % utils.sh_escape(autodir),
+                     stdin=data)
+        return len(send), len(data), len(remove)
+
+
+# (source_dir, light) -> ClientImage
+_images = {}
+
+
+def get_client_image(source_dir, light=False):
+    """:return: the ClientImage of source_dir, with an up to date manifest."""
+    key = (source_dir, light)
+    image = _images.get(key)
+    if image is None:
+        image = _images[key] = ClientImage(source_dir, light)
+    image.refresh()
+    return image
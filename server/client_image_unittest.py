@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+import cStringIO
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import utils
+from autotest.server import client_image
+
+
+def _write(path, contents):
+    output = open(path, 'w')
+    output.write(contents)
+    output.close()
+
+
+class _LocalHost(object):
+
+    """Runs the commands of the image on this machine."""
+
+    def __init__(self):
+        self.commands = []
+
+    def run(self, command, ignore_status=False, stdout_tee=None, stdin=None,
+            verbose=True):
+        self.commands.append(command)
+        return utils.run(command, ignore_status=ignore_status, stdin=stdin,
+                         verbose=False)
+
+
+def _tree(top):
+    """:return: the files of top and their contents, without state dirs."""
+    tree = {}
+    for directory, subdirs, files in os.walk(top):
+        for name in subdirs + files:
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, top)
+            if relative_path.split('/')[0] in client_image.STATE_DIRS:
+                continue
+            if os.path.islink(path):
+                tree[relative_path] = 'link ' + os.readlink(path)
+            elif os.path.isdir(path):
+                tree[relative_path] = 'dir'
+            else:
+                tree[relative_path] = '%o %s' % (os.stat(path).st_mode,
+                                                 open(path).read())
+    return tree
+
+
+class ClientImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmpdir, 'client')
+        self.autodir = os.path.join(self.tmpdir, 'autodir')
+        for path in ('shared', 'tests/sleeptest', 'profilers/oprofile',
+                     'deps/grubby', 'tmp'):
+            os.makedirs(os.path.join(self.source_dir, path))
+        os.mkdir(self.autodir)
+        for path in ('autotest-local', 'shared/__init__.py',
+                     'shared/utils.py', 'shared/utils.pyc',
+                     'tests/sleeptest/sleeptest.py', 'profilers/__init__.py',
+                     'profilers/oprofile/oprofile.py',
+                     'deps/grubby/grubby-8.11.tar.bz2', 'tmp/state'):
+            _write(os.path.join(self.source_dir, path), path)
+        os.chmod(os.path.join(self.source_dir, 'autotest-local'), 0755)
+        os.symlink('shared', os.path.join(self.source_dir, 'common_lib'))
+        self.host = _LocalHost()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _install(self, light=False):
+        image = client_image.get_client_image(self.source_dir, light)
+        self.host.commands = []
+        return image.install(self.host, self.autodir)
+
+    def test_full_install(self):
+        sent, size, removed = self._install()
+        self.assertEqual((15, 0), (sent, removed))
+        self.assertTrue(size > 0)
+        expected = _tree(self.source_dir)
+        del expected['shared/utils.pyc']
+        self.assertEqual(expected, _tree(self.autodir))
+
+        # nothing changed, only the listing is run
+        self.assertEqual((0, 0, 0), self._install())
+        self.assertEqual(1, len(self.host.commands))
+
+    def test_delta(self):
+        self._install()
+        os.mkdir(os.path.join(self.autodir, 'tmp'))
+        _write(os.path.join(self.autodir, 'tmp', 'state'), 'host state')
+        _write(os.path.join(self.autodir, 'shared', 'utils.pyc'), 'compiled')
+        _write(os.path.join(self.autodir, 'shared', 'gone.pyc'), 'compiled')
+        _write(os.path.join(self.autodir, 'shared', 'local.py'), 'local')
+        _write(os.path.join(self.source_dir, 'shared', 'utils.py'), 'new')
+        os.chmod(os.path.join(self.source_dir, 'shared', '__init__.py'), 0700)
+        os.remove(os.path.join(self.source_dir, 'common_lib'))
+        os.mkdir(os.path.join(self.source_dir, 'common_lib'))
+
+        sent, size, removed = self._install()
+        self.assertEqual((3, 3), (sent, removed))
+        expected = _tree(self.source_dir)
+        # kept along with its source file
+        expected['shared/utils.pyc'] = _tree(self.autodir)['shared/utils.pyc']
+        self.assertEqual(expected, _tree(self.autodir))
+        state_path = os.path.join(self.autodir, 'tmp', 'state')
+        self.assertEqual('host state', open(state_path).read())
+
+    def test_light_install(self):
+        os.makedirs(os.path.join(self.autodir, 'tests', 'installed'))
+        self._install(light=True)
+        installed = set(_tree(self.autodir))
+        self.assertEqual(
+            set(['autotest-local', 'common_lib', 'shared',
+                 'shared/__init__.py', 'shared/utils.py', 'tests',
+                 'tests/installed', 'profilers', 'profilers/__init__.py',
+                 'deps', 'deps/grubby',
+                 'deps/grubby/grubby-8.11.tar.bz2']),
+            installed)
+        self.assertEqual((0, 0, 0), self._install(light=True))
+
+    def test_tarball_cache(self):
+        image = client_image.get_client_image(self.source_dir)
+        paths = sorted(image.manifest)
+        data = image.tarball(paths)
+        self.assertTrue(data is image.tarball(paths))
+        archive = tarfile.open(fileobj=cStringIO.StringIO(data))
+        self.assertEqual(paths, sorted(archive.getnames()))
+        self.assertEqual(set([(0, 0, 'root', 'root')]),
+                         set((member.uid, member.gid, member.uname,
+                              member.gname)
+                             for member in archive.getmembers()))
+        _write(os.path.join(self.source_dir, 'autotest-local'), 'changed')
+        image = client_image.get_client_image(self.source_dir)
+        self.assertNotEqual(data, image.tarball(paths))
+
+    def test_topmost(self):
+        self.assertEqual(['a', 'a-b'],
+                         client_image._topmost(['a/c', 'a-b', 'a', 'a/c/d']))
+
+
+if __name__ == '__main__':
+    unittest.main()
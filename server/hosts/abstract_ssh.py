@@ -7,10 +7,10 @@ import tempfile
 import time
 import traceback
 
-from autotest.client.shared import autotemp, error
+from autotest.client.shared import error
 from autotest.client.shared.settings import settings
 from autotest.server import utils, autotest_remote
-from autotest.server.hosts import remote
+from autotest.server.hosts import remote, ssh_pool
 
 enable_master_ssh = settings.get_value('AUTOSERV', 'enable_master_ssh',
                                        type=bool, default=False)
@@ -59,14 +59,14 @@ class AbstractSSHHost(SiteHost):
         self._use_rsync = None
         self.known_hosts_file = tempfile.mkstemp()[1]
 
-        """
-        Master SSH connection background job, socket temp directory and socket
-        control path option. If master-SSH is enabled, these fields will be
-        initialized by start_master_ssh when a new SSH connection is initiated.
-        """
-        self.master_ssh_job = None
-        self.master_ssh_tempdir = None
-        self.master_ssh_option = ''
+        # the master SSH connection, if enabled, and the sessions using it
+        use_master = enable_master_ssh and hasattr(self, 'ssh_command')
+        self.ssh_pool = ssh_pool.ConnectionPool(self, use_master=use_master)
+
+    @property
+    def master_ssh_option(self):
+        """The ssh options to use the master SSH connection, if ready."""
+        return self.ssh_pool.master_option
 
     def use_rsync(self):
         if self._use_rsync is not None:
@@ -262,9 +262,6 @@ class AbstractSSHHost(SiteHost):
                 AutoservRunError: the scp command failed
         """
 
-        # Start a master SSH connection if necessary.
-        self.start_master_ssh()
-
         if isinstance(source, basestring):
             source = [source]
         dest = os.path.abspath(dest)
@@ -275,9 +272,11 @@ class AbstractSSHHost(SiteHost):
             try:
                 remote_source = self._encode_remote_paths(source)
                 local_dest = utils.sh_escape(dest)
-                rsync = self._make_rsync_cmd([remote_source], local_dest,
-                                             delete_dest, preserve_symlinks)
-                utils.run(rsync)
+                with self.ssh_pool.session():
+                    rsync = self._make_rsync_cmd([remote_source], local_dest,
+                                                 delete_dest,
+                                                 preserve_symlinks)
+                    utils.run(rsync)
                 try_scp = False
             except error.CmdError as e:
                 logging.warn("trying scp, rsync failed: %s" % e)
@@ -294,11 +293,12 @@ class AbstractSSHHost(SiteHost):
                 remote_source = self._encode_remote_paths(remote_source,
                                                           escape=False)
                 local_dest = utils.sh_escape(dest)
-                scp = self._make_scp_cmd([remote_source], local_dest)
-                try:
-                    utils.run(scp)
-                except error.CmdError as e:
-                    raise error.AutoservRunError(e.args[0], e.args[1])
+                with self.ssh_pool.session():
+                    scp = self._make_scp_cmd([remote_source], local_dest)
+                    try:
+                        utils.run(scp)
+                    except error.CmdError as e:
+                        raise error.AutoservRunError(e.args[0], e.args[1])
 
         if not preserve_perm:
             # we have no way to tell scp to not try to preserve the
@@ -337,9 +337,6 @@ class AbstractSSHHost(SiteHost):
                 AutoservRunError: the scp command failed
         """
 
-        # Start a master SSH connection if necessary.
-        self.start_master_ssh()
-
         if isinstance(source, basestring):
             source_is_dir = os.path.isdir(source)
             source = [source]
@@ -350,9 +347,11 @@ class AbstractSSHHost(SiteHost):
         if self.use_rsync():
             try:
                 local_sources = [utils.sh_escape(path) for path in source]
-                rsync = self._make_rsync_cmd(local_sources, remote_dest,
-                                             delete_dest, preserve_symlinks)
-                utils.run(rsync)
+                with self.ssh_pool.session():
+                    rsync = self._make_rsync_cmd(local_sources, remote_dest,
+                                                 delete_dest,
+                                                 preserve_symlinks)
+                    utils.run(rsync)
                 try_scp = False
             except error.CmdError as e:
                 logging.warn("trying scp, rsync failed: %s" % e)
@@ -393,11 +392,12 @@ class AbstractSSHHost(SiteHost):
 
             local_sources = self._make_rsync_compatible_source(source, True)
             if local_sources:
-                scp = self._make_scp_cmd(local_sources, remote_dest)
-                try:
-                    utils.run(scp)
-                except error.CmdError as e:
-                    raise error.AutoservRunError(e.args[0], e.args[1])
+                with self.ssh_pool.session():
+                    scp = self._make_scp_cmd(local_sources, remote_dest)
+                    try:
+                        utils.run(scp)
+                    except error.CmdError as e:
+                        raise error.AutoservRunError(e.args[0], e.args[1])
 
     def ssh_ping(self, timeout=60):
         try:
@@ -555,6 +555,9 @@ class AbstractSSHHost(SiteHost):
     def close(self):
         super(AbstractSSHHost, self).close()
         self._cleanup_master_ssh()
+        if self.job and self.job.resultdir and (self.ssh_pool.opened or
+                                                self.ssh_pool.reused):
+            utils.write_keyval(self.job.resultdir, self.ssh_pool.keyvals())
         os.remove(self.known_hosts_file)
 
     def _cleanup_master_ssh(self):
@@ -562,47 +565,15 @@ class AbstractSSHHost(SiteHost):
         Release all resources (process, temporary directory) used by an active
         master SSH connection.
         """
-        # If a master SSH connection is running, kill it.
-        if self.master_ssh_job is not None:
-            utils.nuke_subprocess(self.master_ssh_job.sp)
-            self.master_ssh_job = None
-
-        # Remove the temporary directory for the master SSH socket.
-        if self.master_ssh_tempdir is not None:
-            self.master_ssh_tempdir.clean()
-            self.master_ssh_tempdir = None
-            self.master_ssh_option = ''
+        self.ssh_pool.close()
 
     def start_master_ssh(self):
         """
-        Called whenever a slave SSH connection needs to be initiated (e.g., by
-        run, rsync, scp). If master SSH support is enabled and a master SSH
-        connection is not active already, start a new one in the background.
-        Also, cleanup any zombie master SSH connections (e.g., dead due to
-        reboot).
+        If master SSH support is enabled and a master SSH connection is not
+        active already, start a new one.  The commands run on the host (by
+        run, rsync, scp) start it when needed, see ssh_pool.ConnectionPool.
         """
-        if not enable_master_ssh:
-            return
-
-        # If a previously started master SSH connection is not running
-        # anymore, it needs to be cleaned up and then restarted.
-        if self.master_ssh_job is not None:
-            if self.master_ssh_job.sp.poll() is not None:
-                logging.info("Master ssh connection to %s is down.",
-                             self.hostname)
-                self._cleanup_master_ssh()
-
-        # Start a new master SSH connection.
-        if self.master_ssh_job is None:
-            # Create a shared socket in a temp location.
-            self.master_ssh_tempdir = autotemp.tempdir(unique_id='ssh-master')
-            self.master_ssh_option = ("-o ControlPath=%s/socket" %
-                                      self.master_ssh_tempdir.name)
-
-            # Start the master SSH connection in the background.
-            master_cmd = self.ssh_command(options="-N -o ControlMaster=yes")
-            logging.info("Starting master ssh connection '%s'" % master_cmd)
-            self.master_ssh_job = utils.BgJob(master_cmd)
+        self.ssh_pool.start_master()
 
     def clear_known_hosts(self):
         """Clears out the temporary ssh known_hosts file.
@@ -17,7 +17,7 @@ import subprocess
 
 from autotest.client.shared import error, ssh_key
 from autotest.server import utils
-from autotest.server.hosts import abstract_ssh
+from autotest.server.hosts import abstract_ssh, ssh_pool
 
 
 class SSHHost(abstract_ssh.AbstractSSHHost):
@@ -68,17 +68,27 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
     def _run(self, command, timeout, ignore_status, stdout, stderr,
              connect_timeout, env, options, stdin, args):
         """Helper function for run()."""
-        ssh_cmd = self.ssh_command(connect_timeout, options)
         if not env.strip():
             env = ""
         else:
             env = "export %s;" % env
         for arg in args:
             command += ' "%s"' % utils.sh_escape(arg)
-        full_cmd = '%s "%s %s"' % (ssh_cmd, env, utils.sh_escape(command))
-        result = utils.run(full_cmd, timeout, True, stdout, stderr,
-                           verbose=False, stdin=stdin,
-                           stderr_is_expected=ignore_status)
+
+        def run_ssh():
+            ssh_cmd = self.ssh_command(connect_timeout, options)
+            full_cmd = '%s "%s %s"' % (ssh_cmd, env, utils.sh_escape(command))
+            return utils.run(full_cmd, timeout, True, stdout, stderr,
+                             verbose=False, stdin=stdin,
+                             stderr_is_expected=ignore_status)
+        result = run_ssh()
+        if ssh_pool.is_session_error(result):
+            # the command did not run, the master connection is broken
+            logging.debug("Master ssh connection to %s refused a session, "
+                          "reconnecting", self.hostname)
+            self.ssh_pool.reconnect()
+            self.ssh_pool.start_master(connect_timeout)
+            result = run_ssh()
 
         # The error messages will show up in band (indistinguishable
         # from stuff sent through the SSH connection), so we have the
@@ -115,14 +125,13 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
         if verbose:
             logging.debug("Running (ssh) '%s'" % command)
 
-        # Start a master SSH connection if necessary.
-        self.start_master_ssh()
-
         env = " ".join("=".join(pair) for pair in self.env.iteritems())
         try:
-            return self._run(command, timeout, ignore_status, stdout_tee,
-                             stderr_tee, connect_timeout, env, options,
-                             stdin, args)
+            # starts the master SSH connection if necessary
+            with self.ssh_pool.session(connect_timeout):
+                return self._run(command, timeout, ignore_status, stdout_tee,
+                                 stderr_tee, connect_timeout, env, options,
+                                 stdin, args)
         except error.CmdError as cmderr:
             # We get a CmdError here only if there is timeout of that command.
             # Catch that and stuff it into AutoservRunError and raise it.
@@ -231,8 +240,6 @@ class AsyncSSHMixin(object):
         if verbose:
             logging.debug("Running (async ssh) '%s'" % command)
 
-        # Start a master SSH connection if necessary.
-        self.start_master_ssh()
         run_helper_path = self.job.tmpdir
         # Create directory for run_helper.py
         self.run("mkdir -p %s" % run_helper_path)
@@ -242,6 +249,8 @@ class AsyncSSHMixin(object):
 
         env = " ".join("=".join(pair) for pair in self.env.iteritems())
 
+        # not holding a session of the pool, the command may run for long
+        self.ssh_pool.get_master(connect_timeout)
         ssh_cmd = self.ssh_command(connect_timeout, options)
         if not env.strip():
             env = ""
@@ -0,0 +1,267 @@
+"""
+Connections of the hosts controlled through OpenSSH.
+
+Every ssh, rsync and scp command autoserv runs for an AbstractSSHHost goes
+through the ConnectionPool of the host.  When AUTOSERV.enable_master_ssh is
+set, the pool keeps a master connection the commands share (OpenSSH
+ControlMaster):
+
+* The master is started on first use, and the commands wait for its
+  control socket instead of each opening a connection meanwhile.  If it
+  cannot connect, the commands connect on their own, and no new master is
+  tried for MASTER_RETRY_INTERVAL seconds.
+* A master is used while its process runs and, every HEALTH_CHECK_INTERVAL
+  seconds, answers ssh -O check.  It sends keepalives to the host, so it
+  exits soon after the host went away (e.g. rebooted) and is restarted on
+  the next use.
+* A command which could not open its session through the master is run
+  again once, after restarting the master.
+* At most AUTOSERV.ssh_max_sessions commands run at the same time on a
+  host (except the ones of run_async, which can run for the whole job):
+  sshd refuses more sessions per connection than its MaxSessions.
+
+The pool counts the connections it opened and the commands that reused the
+master connection, which are recorded in the job keyvals when the host is
+closed.
+"""
+
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+
+from autotest.client.shared import autotemp
+from autotest.client.shared.settings import settings
+from autotest.server import utils
+
+# seconds between the ssh -O check of a master, which otherwise is only
+# checked to be running
+HEALTH_CHECK_INTERVAL = 60
+# seconds during which no master is started after one failed to connect
+MASTER_RETRY_INTERVAL = 30
+# keepalive interval of the master, it exits after 3 unanswered ones
+MASTER_ALIVE_INTERVAL = 30
+
+# stderr of ssh when a session could not be opened through the master,
+# before running the command
+_SESSION_ERRORS = re.compile(r'mux_client_request_session|'
+                             r'Session open refused by peer|'
+                             r'master hello exchange failed')
+
+
+def is_session_error(result):
+    """
+    :param result: the CmdResult of an ssh command.
+    :return: True if the command was not run because the master connection
+            could not open a session for it.
+    """
+    return (result.exit_status == 255 and
+            _SESSION_ERRORS.search(result.stderr or '') is not None)
+
+
+class ConnectionPool(object):
+
+    """The master connection of a host and the sessions using it."""
+
+    def __init__(self, host, use_master=None, max_sessions=None):
+        """
+        :param host: the AbstractSSHHost the connections are to, providing
+                ssh_command().
+        :param use_master: whether to share a master connection,
+                AUTOSERV.enable_master_ssh by default.
+        :param max_sessions: maximum number of commands running at the same
+                time, AUTOSERV.ssh_max_sessions by default.
+        """
+        if use_master is None:
+            use_master = settings.get_value('AUTOSERV', 'enable_master_ssh',
+                                            type=bool, default=False)
+        if max_sessions is None:
+            max_sessions = settings.get_value('AUTOSERV', 'ssh_max_sessions',
+                                              type=int, default=10)
+        self.host = host
+        self.use_master = use_master
+        self.max_sessions = max_sessions
+        self._sessions = threading.BoundedSemaphore(max(max_sessions, 1))
+        self._lock = threading.RLock()
+        self.master_job = None
+        self.master_tempdir = None
+        # ssh options of the commands, set once the master is ready
+        self.master_option = ''
+        self._control_option = ''
+        self._master_pid = None
+        self._master_ready = False
+        self._checked_time = 0
+        self._retry_time = 0
+        self.opened = 0
+        self.reused = 0
+        self.reconnects = 0
+
+    def _socket_path(self):
+        return os.path.join(self.master_tempdir.name, 'socket')
+
+    def _master_running(self):
+        """Tell whether the master process (or its socket) is still there."""
+        if self._master_pid == os.getpid():
+            return self.master_job.sp.poll() is None
+        # started by the process we were forked from, which waits for it
+        return os.path.exists(self._socket_path())
+
+    def _check_master(self):
+        """:return: True if the master answers ssh -O check."""
+        # the master is ready, the command includes its ControlPath
+        check = self.host.ssh_command(options='-O check')
+        result = utils.run(check, ignore_status=True, verbose=False,
+                           stdout_tee=None, stderr_tee=None)
+        return result.exit_status == 0
+
+    def _start_master(self, connect_timeout):
+        self.master_tempdir = autotemp.tempdir(unique_id='ssh-master')
+        self._control_option = '-o ControlPath=%s' % self._socket_path()
+        master_cmd = self.host.ssh_command(
+            connect_timeout=connect_timeout,
+            options='-N -o ControlMaster=yes %s' % self._control_option,
+            alive_interval=MASTER_ALIVE_INTERVAL)
+        logging.info("Starting master ssh connection '%s'", master_cmd)
+        self.master_job = utils.BgJob(master_cmd, verbose=False)
+        self._master_pid = os.getpid()
+        self._master_ready = False
+        self.opened += 1
+
+    def _wait_master(self, connect_timeout):
+        """:return: True once the master accepts sessions."""
+        end_time = time.time() + connect_timeout
+        delay = 0.01
+        while not os.path.exists(self._socket_path()):
+            if self._master_pid != os.getpid():
+                # not ready when the process we were forked from forked
+                self._stop_master()
+                return False
+            if self.master_job.sp.poll() is not None:
+                stderr = self.master_job.sp.stderr.read().strip()
+                logging.info("Master ssh connection to %s failed: %s",
+                             self.host.hostname, stderr)
+                self._retry_time = time.time() + MASTER_RETRY_INTERVAL
+                self._stop_master()
+                return False
+            if time.time() > end_time:
+                # slow to connect, let the command connect on its own
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        self._master_ready = True
+        self.master_option = self._control_option
+        self._checked_time = time.time()
+        return True
+
+    def _stop_master(self):
+        """Release the process and directory of the master, if ours."""
+        if self.master_job is not None and self._master_pid == os.getpid():
+            master = self.master_job.sp
+            if master.poll() is None:
+                master.terminate()
+                end_time = time.time() + 1
+                while master.poll() is None and time.time() < end_time:
+                    time.sleep(0.01)
+            # escalates to SIGKILL if it did not exit
+            utils.nuke_subprocess(master)
+            master.stdout.close()
+            master.stderr.close()
+            self.master_tempdir.clean()
+        elif self.master_tempdir is not None:
+            # the directory belongs to the process we were forked from
+            self.master_tempdir.name = None
+        self.master_job = None
+        self.master_tempdir = None
+        self.master_option = ''
+        self._control_option = ''
+        self._master_pid = None
+        self._master_ready = False
+
+    def start_master(self, connect_timeout=30):
+        """
+        Start the master connection, or restart it if it went away.
+
+        :return: the ssh options using the master, '' if there is no master
+                ready to use.
+        """
+        if not self.use_master:
+            return ''
+        self._lock.acquire()
+        try:
+            if self.master_job is not None:
+                healthy = self._master_running()
+                if (healthy and self._master_ready and
+                        time.time() - self._checked_time >
+                        HEALTH_CHECK_INTERVAL):
+                    healthy = self._check_master()
+                    self._checked_time = time.time()
+                if not healthy:
+                    logging.info("Master ssh connection to %s is down.",
+                                 self.host.hostname)
+                    self._stop_master()
+                    self.reconnects += 1
+            if self.master_job is None and time.time() >= self._retry_time:
+                self._start_master(connect_timeout)
+            if self.master_job is not None and (
+                    self._master_ready or self._wait_master(connect_timeout)):
+                return self.master_option
+            return ''
+        finally:
+            self._lock.release()
+
+    def get_master(self, connect_timeout=30):
+        """
+        Like start_master(), for a command about to run.
+
+        :return: the ssh options of the command, '' if it has to open its own
+                connection.
+        """
+        option = self.start_master(connect_timeout)
+        self._lock.acquire()
+        try:
+            if option:
+                self.reused += 1
+            else:
+                self.opened += 1
+        finally:
+            self._lock.release()
+        return option
+
+    def reconnect(self):
+        """Restart the master connection on its next use."""
+        self._lock.acquire()
+        try:
+            if self.master_job is not None:
+                self._stop_master()
+                self.reconnects += 1
+        finally:
+            self._lock.release()
+
+    @contextlib.contextmanager
+    def session(self, connect_timeout=30):
+        """
+        Hold one of the sessions of the host for a command.
+
+        Yields the ssh options of the command, see get_master().
+        """
+        self._sessions.acquire()
+        try:
+            yield self.get_master(connect_timeout)
+        finally:
+            self._sessions.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._stop_master()
+        finally:
+            self._lock.release()
+
+    def keyvals(self):
+        """:return: the counters of the pool, as job keyvals."""
+        name = re.sub(r'[^-\.\w]', '_', self.host.hostname)
+        return {'ssh_connections_opened-%s' % name: self.opened,
+                'ssh_connections_reused-%s' % name: self.reused,
+                'ssh_reconnects-%s' % name: self.reconnects}
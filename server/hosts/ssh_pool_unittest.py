@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+import os
+import re
+import threading
+import time
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import utils
+from autotest.server.hosts import ssh_pool
+
+
+class _FakeHost(object):
+
+    """
+    Builds local commands standing for the ssh commands of the pool: the
+    master creates its control "socket" and waits, ssh -O check tests that
+    it exists.
+    """
+
+    hostname = 'host1.example.com'
+
+    def __init__(self, master_command='touch %s; exec sleep 60'):
+        self.master_command = master_command
+        self.pool = None
+
+    def ssh_command(self, connect_timeout=30, options='', alive_interval=300):
+        options = '%s %s' % (options, self.pool.master_option)
+        socket_path = re.search(r'ControlPath=(\S+)', options).group(1)
+        if '-O check' in options:
+            return 'test -e %s' % socket_path
+        return self.master_command % socket_path
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.host = _FakeHost()
+
+    def tearDown(self):
+        if self.host.pool is not None:
+            self.host.pool.close()
+
+    def _pool(self, use_master=True, max_sessions=10):
+        self.host.pool = ssh_pool.ConnectionPool(
+            self.host, use_master=use_master, max_sessions=max_sessions)
+        return self.host.pool
+
+    def test_without_master(self):
+        pool = self._pool(use_master=False)
+        for _ in xrange(3):
+            self.assertEqual('', pool.get_master())
+        self.assertEqual((3, 0), (pool.opened, pool.reused))
+
+    def test_master_reused(self):
+        pool = self._pool()
+        option = pool.get_master()
+        self.assertTrue(option.startswith('-o ControlPath='))
+        socket_path = option.split('=', 1)[1]
+        self.assertTrue(os.path.exists(socket_path))
+        self.assertEqual(option, pool.get_master())
+        self.assertEqual((1, 2, 0),
+                         (pool.opened, pool.reused, pool.reconnects))
+        self.assertEqual({'ssh_connections_opened-host1.example.com': 1,
+                          'ssh_connections_reused-host1.example.com': 2,
+                          'ssh_reconnects-host1.example.com': 0},
+                         pool.keyvals())
+
+        pool.close()
+        self.assertEqual('', pool.master_option)
+        self.assertFalse(os.path.exists(os.path.dirname(socket_path)))
+
+    def test_reconnect(self):
+        pool = self._pool()
+        option = pool.get_master()
+        pool.master_job.sp.kill()
+        pool.master_job.sp.wait()
+        new_option = pool.get_master()
+        self.assertTrue(new_option)
+        self.assertNotEqual(option, new_option)
+        self.assertEqual((2, 2, 1),
+                         (pool.opened, pool.reused, pool.reconnects))
+
+        # a master which stops answering is replaced too
+        os.remove(new_option.split('=', 1)[1])
+        pool._checked_time = 0
+        self.assertNotEqual(new_option, pool.get_master())
+        self.assertEqual(2, pool.reconnects)
+
+        pool.reconnect()
+        self.assertEqual('', pool.master_option)
+        self.assertEqual(3, pool.reconnects)
+
+    def test_master_failure(self):
+        self.host.master_command = 'echo refused %s >&2; exit 255'
+        pool = self._pool()
+        self.assertEqual('', pool.get_master())
+        # no new master is tried for a while
+        self.assertEqual('', pool.get_master())
+        self.assertEqual((3, 0), (pool.opened, pool.reused))
+        self.assertEqual(None, pool.master_job)
+
+    def test_max_sessions(self):
+        pool = self._pool(use_master=False, max_sessions=2)
+        running = []
+        counts = []
+        lock = threading.Lock()
+
+        def command():
+            with pool.session():
+                lock.acquire()
+                running.append(1)
+                counts.append(len(running))
+                lock.release()
+                time.sleep(0.05)
+                lock.acquire()
+                running.pop()
+                lock.release()
+        threads = [threading.Thread(target=command) for _ in xrange(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, max(counts))
+        self.assertEqual(6, pool.opened)
+
+    def test_is_session_error(self):
+        result = utils.CmdResult('ssh host true', exit_status=255)
+        result.stderr = ('mux_client_request_session: session request '
+                         'failed: Session open refused by peer\n')
+        self.assertTrue(ssh_pool.is_session_error(result))
+        result.stderr = 'ssh: connect to host host1 port 22: No route to host'
+        self.assertFalse(ssh_pool.is_session_error(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
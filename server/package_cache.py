@@ -0,0 +1,245 @@
+"""
+Cache of the package tarballs autoserv builds for its clients.
+
+When a client fetches a test, profiler or dep package from autoserv (see
+autotest_remote.client_logger), the tarball was built again for every host.
+The PackageCache keeps the tarballs in a directory shared by all the
+autoserv processes of the user, named after a hash of the contents of the
+packaged directory, so a package is built once until its sources change.
+
+* The hash covers the relative path, mode and contents of every file and
+  symlink that tar would pack, that is not matching the .pack_exclude
+  patterns.  The contents of a file are only hashed again when its size,
+  mtime, ctime or inode changed since it was last hashed by the process.
+* A tarball is built by one process at a time while holding a lock on
+  <tarball>.lock, and appears under its final name once complete.
+* The tarballs not used for an hour are removed, oldest first, when the
+  cache exceeds its size limit.
+"""
+
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+
+# tarballs used more recently than this are never removed
+MIN_UNUSED_SECONDS = 3600
+_READ_SIZE = 65536
+
+# path -> (size, mtime, ctime, inode, digest) of the files already hashed
+_file_digests = {}
+
+
+def _is_excluded(name, patterns):
+    """
+    Tell whether tar --exclude would skip a member.
+
+    Like tar, patterns are matched against the whole member name and against
+    every part of it following a '/', and wildcards match '/'.
+
+    :param name: name of the member, relative to the packaged directory and
+            starting with './', as tar names them.
+    """
+    parts = name.split('/')
+    candidates = ['/'.join(parts[index:]) for index in xrange(len(parts))]
+    for pattern in patterns:
+        for candidate in candidates:
+            if fnmatch.fnmatchcase(candidate, pattern):
+                return True
+    return False
+
+
+def file_digest(path, file_stat):
+    """
+    :param path: path of a regular file.
+    :param file_stat: the os.stat() result of path.
+    :return: the sha1 hex digest of the contents of the file, not read again
+            while its stat is unchanged.
+    """
+    key = (file_stat.st_size, file_stat.st_mtime, file_stat.st_ctime,
+           file_stat.st_ino)
+    known = _file_digests.get(path)
+    if known is not None and known[:4] == key:
+        return known[4]
+    digest = hashlib.sha1()
+    source = open(path, 'rb')
+    try:
+        while True:
+            data = source.read(_READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        source.close()
+    _file_digests[path] = key + (digest.hexdigest(),)
+    return digest.hexdigest()
+
+
+def source_hash(src_dir, exclude_paths=None):
+    """
+    :param src_dir: the directory to package.
+    :param exclude_paths: list of tar --exclude patterns.
+    :return: a hex digest of the contents of src_dir that would be packed.
+    """
+    patterns = [pattern for pattern in exclude_paths or [] if pattern]
+    digest = hashlib.sha1()
+    for pattern in patterns:
+        digest.update('exclude %s\n' % pattern)
+    for directory, subdirs, files in os.walk(src_dir):
+        relative_dir = os.path.relpath(directory, src_dir)
+        if relative_dir != '.':
+            relative_dir = './' + relative_dir
+        subdirs.sort()
+        for subdir in list(subdirs):
+            name = relative_dir + '/' + subdir
+            if _is_excluded(name, patterns):
+                subdirs.remove(subdir)
+            elif os.path.islink(os.path.join(directory, subdir)):
+                # os.walk does not follow them, tar packs them as symlinks
+                subdirs.remove(subdir)
+                files.append(subdir)
+            else:
+                digest.update('d %s\n' % name)
+        for file_name in sorted(files):
+            name = relative_dir + '/' + file_name
+            if _is_excluded(name, patterns):
+                continue
+            path = os.path.join(directory, file_name)
+            file_stat = os.lstat(path)
+            if stat.S_ISLNK(file_stat.st_mode):
+                contents = 'link ' + os.readlink(path)
+            elif stat.S_ISREG(file_stat.st_mode):
+                contents = file_digest(path, file_stat)
+            else:
+                contents = 'special'
+            digest.update('f %s %o %s\n' % (name, file_stat.st_mode,
+                                            contents))
+    return digest.hexdigest()
+
+
+class PackageCache(object):
+
+    """A directory of package tarballs named after their source hash."""
+
+    def __init__(self, cache_dir, max_size_mb):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+
+    def _prune(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.tar.bz2'):
+                continue
+            try:
+                entry_stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total_size += entry_stat.st_size
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, name))
+        entries.sort()
+        unused_time = time.time() - MIN_UNUSED_SECONDS
+        for mtime, size, name in entries:
+            if total_size <= self.max_size or mtime > unused_time:
+                break
+            logging.debug('Removing %s from the package cache', name)
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total_size -= size
+
+    def _build(self, tarball_path, build):
+        """
+        Build a tarball unless another process did it while we waited.
+
+        :return: True if the tarball was built.
+        """
+        lock_path = tarball_path + '.lock'
+        lock_file = open(lock_path, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(tarball_path):
+                os.utime(tarball_path, None)
+                return False
+            build_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='build-')
+            try:
+                os.rename(build(build_dir), tarball_path)
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+            os.remove(lock_path)
+        finally:
+            lock_file.close()
+        self._prune()
+        return True
+
+    def get_tarball(self, pkg_name, src_dir, exclude_paths, build):
+        """
+        Get the tarball of a package, building it if it is not cached.
+
+        :param pkg_name: the name of the package tarball.
+        :param src_dir: the directory it is built from.
+        :param exclude_paths: list of the tar --exclude patterns applied.
+        :param build: function building the tarball in the directory it is
+                given and returning its path.
+        :return: the path of the tarball in the cache.
+        """
+        key = source_hash(src_dir, exclude_paths)
+        tarball_path = os.path.join(self.cache_dir,
+                                    '%s-%s' % (key, pkg_name))
+        try:
+            # also keeps it from being pruned for a while
+            os.utime(tarball_path, None)
+        except OSError:
+            if self._build(tarball_path, build):
+                self.misses += 1
+                return tarball_path
+        self.hits += 1
+        return tarball_path
+
+
+_cache = None
+
+
+def get_package_cache():
+    """
+    :return: the PackageCache of this process, None if disabled by the
+            PACKAGES.autoserv_cache_size_mb setting.
+    """
+    global _cache
+    max_size_mb = settings.get_value('PACKAGES', 'autoserv_cache_size_mb',
+                                     type=int, default=1024)
+    if max_size_mb <= 0:
+        return None
+    cache_dir = settings.get_value('PACKAGES', 'autoserv_cache_dir',
+                                   default='')
+    if not cache_dir:
+        cache_dir = os.path.join(tempfile.gettempdir(),
+                                 'autoserv-packages-%d' % os.getuid())
+    if _cache is None or _cache.cache_dir != cache_dir:
+        try:
+            os.makedirs(cache_dir, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        if os.stat(cache_dir).st_uid != os.getuid():
+            logging.warning('Not caching packages in %s, owned by another '
+                            'user', cache_dir)
+            return None
+        _cache = PackageCache(cache_dir, max_size_mb)
+    _cache.max_size = max_size_mb * 1024 * 1024
+    return _cache
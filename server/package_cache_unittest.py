@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.settings import settings
+from autotest.server import package_cache
+
+
+def _write(path, contents):
+    output = open(path, 'w')
+    output.write(contents)
+    output.close()
+
+
+class SourceHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.src_dir, 'src'))
+        _write(os.path.join(self.src_dir, 'test.py'), 'print 1\n')
+        _write(os.path.join(self.src_dir, 'src', 'big.tar'), 'x')
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+
+    def test_contents(self):
+        digest = package_cache.source_hash(self.src_dir)
+        self.assertEqual(digest, package_cache.source_hash(self.src_dir))
+
+        # same size and mtime, different contents
+        path = os.path.join(self.src_dir, 'test.py')
+        stat = os.stat(path)
+        _write(path, 'print 2\n')
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        self.assertNotEqual(digest, package_cache.source_hash(self.src_dir))
+
+        os.symlink('test.py', os.path.join(self.src_dir, 'link'))
+        digest = package_cache.source_hash(self.src_dir)
+        os.remove(os.path.join(self.src_dir, 'link'))
+        os.symlink('src', os.path.join(self.src_dir, 'link'))
+        self.assertNotEqual(digest, package_cache.source_hash(self.src_dir))
+
+    def test_excluded_files(self):
+        for patterns in (['src'], ['*.tar'], ['./src/big.tar'],
+                         ['src/*', '']):
+            digest = package_cache.source_hash(self.src_dir, patterns)
+            _write(os.path.join(self.src_dir, 'src', 'big.tar'), 'y')
+            self.assertEqual(
+                digest, package_cache.source_hash(self.src_dir, patterns),
+                patterns)
+            _write(os.path.join(self.src_dir, 'test.py'), patterns[0])
+            self.assertNotEqual(
+                digest, package_cache.source_hash(self.src_dir, patterns),
+                patterns)
+        self.assertNotEqual(package_cache.source_hash(self.src_dir, ['src']),
+                            package_cache.source_hash(self.src_dir, ['x']))
+
+
+class PackageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmpdir, 'sleeptest')
+        os.mkdir(self.src_dir)
+        _write(os.path.join(self.src_dir, 'sleeptest.py'), 'pass\n')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        settings.override_value('PACKAGES', 'autoserv_cache_dir',
+                                self.cache_dir)
+        self.cache = package_cache.get_package_cache()
+        self.builds = 0
+
+    def tearDown(self):
+        settings.reset_values()
+        shutil.rmtree(self.tmpdir)
+
+    def _build(self, dest_dir):
+        self.builds += 1
+        tarball_path = os.path.join(dest_dir, 'test-sleeptest.tar.bz2')
+        tarball = tarfile.open(tarball_path, 'w:bz2')
+        tarball.add(self.src_dir, '.')
+        tarball.close()
+        return tarball_path
+
+    def _get(self):
+        return self.cache.get_tarball('test-sleeptest.tar.bz2', self.src_dir,
+                                      None, self._build)
+
+    def test_hits_and_misses(self):
+        self.assertTrue(self.cache is package_cache.get_package_cache())
+        path = self._get()
+        self.assertEqual(os.path.dirname(path), self.cache_dir)
+        self.assertEqual(path, self._get())
+        self.assertEqual((1, 1, 1),
+                         (self.builds, self.cache.hits, self.cache.misses))
+        self.assertEqual(['./sleeptest.py'],
+                         [name for name in tarfile.open(path).getnames()
+                          if name != '.'])
+
+        _write(os.path.join(self.src_dir, 'control'), 'job.run_test()\n')
+        self.assertNotEqual(path, self._get())
+        self.assertEqual((2, 1, 2),
+                         (self.builds, self.cache.hits, self.cache.misses))
+        self.assertEqual([], [name for name in os.listdir(self.cache_dir)
+                              if not name.endswith('.tar.bz2')])
+
+    def test_prune(self):
+        self.cache.max_size = 0
+        old_path = self._get()
+        unused_time = time.time() - package_cache.MIN_UNUSED_SECONDS - 10
+        os.utime(old_path, (unused_time, unused_time))
+        _write(os.path.join(self.src_dir, 'control'), 'job.run_test()\n')
+        path = self._get()
+        # the new tarball was just used, it is kept despite the size limit
+        self.assertEqual([os.path.basename(path)], os.listdir(self.cache_dir))
+
+    def test_disabled(self):
+        settings.override_value('PACKAGES', 'autoserv_cache_size_mb', '0')
+        self.assertEqual(None, package_cache.get_package_cache())
+
+
+if __name__ == '__main__':
+    unittest.main()
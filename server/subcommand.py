@@ -1,29 +1,228 @@
 __author__ = """Copyright Andy Whitcroft, Martin J. Bligh - 2006, 2007"""
 
+import Queue
 import cPickle
+import collections
 import logging
 import os
 import signal
 import sys
+import threading
 import time
 
-from autotest.client.shared import error, utils
+from autotest.client.shared import base_job, error, io_poller, utils
+from autotest.client.shared.settings import settings
 
 # entry points that use subcommand must set this to their logging manager
 # to get log redirection for subcommands
 logging_manager_object = None
 
 
-def parallel(tasklist, timeout=None, return_results=False):
+def _get_max_parallel(max_parallel):
+    if max_parallel is None:
+        max_parallel = settings.get_value('AUTOSERV',
+                                          'parallel_max_subcommands',
+                                          type=int, default=0)
+    return max_parallel
+
+
+def _task_finished(task, result):
+    task.result = result
+    task.runtime = time.time() - task.start_time
+    logging.debug('%s finished in %.1f seconds, returncode %s', task,
+                  task.runtime, task.returncode)
+
+
+def _collect_process(task, chunks):
+    """Reap a forked task whose result pipe was closed."""
+    task.result_pickle.close()
+    try:
+        task.wait()
+    except error.AutoservSubcommandError, e:
+        result = e
+    if chunks:
+        result = cPickle.loads(''.join(chunks))
+    elif task.returncode == 0:
+        result = None
+    _task_finished(task, result)
+
+
+def _kill_process(task, timeout):
+    task.result_pickle.close()
+    utils.nuke_pid(task.pid)
+    task.returncode = None
+    _task_finished(task, error.AutoservSubcommandTimeoutError(task.func,
+                                                             timeout))
+
+
+def _iter_processes(tasklist, max_parallel, timeout):
+    pending = collections.deque(tasklist)
+    poller = io_poller.Poller()
+    # result pipe fd -> (task, chunks of the pickled result read so far)
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < max_parallel:
+                task = pending.popleft()
+                task.fork_start()
+                fd = task.result_pickle.fileno()
+                poller.register(fd, io_poller.READ)
+                running[fd] = (task, [])
+
+            wait = None
+            if timeout:
+                wait = (min(task.start_time for task, _ in running.values()) +
+                        timeout - time.time())
+            for fd, _ in poller.poll(wait):
+                task, chunks = running[fd]
+                data = os.read(fd, io_poller.READ_SIZE)
+                if data:
+                    chunks.append(data)
+                    continue
+                poller.unregister(fd)
+                del running[fd]
+                _collect_process(task, chunks)
+                yield task
+
+            if timeout:
+                now = time.time()
+                for fd, (task, _) in running.items():
+                    if now >= task.start_time + timeout:
+                        poller.unregister(fd)
+                        del running[fd]
+                        _kill_process(task, timeout)
+                        yield task
+    finally:
+        # the caller stopped iterating early
+        for task, _ in running.itervalues():
+            task.result_pickle.close()
+            utils.nuke_pid(task.pid)
+        poller.close()
+
+
+def _run_thread(task, finished):
+    try:
+        result = task.lambda_function()
+        returncode = 0
+    except Exception, e:
+        logging.exception('function failed')
+        result = e
+        returncode = 1
+    finished.put((task, returncode, result))
+
+
+def _iter_threads(tasklist, max_parallel, timeout):
+    pending = collections.deque(tasklist)
+    finished = Queue.Queue()
+    running = set()
+    while pending or running:
+        while pending and len(running) < max_parallel:
+            task = pending.popleft()
+            task.start_time = time.time()
+            thread = threading.Thread(target=_run_thread,
+                                      args=(task, finished),
+                                      name='subcommand-%s' % (task.args,))
+            thread.daemon = True
+            thread.start()
+            running.add(task)
+
+        # without a timeout, Queue.get() could not be interrupted
+        wait = 60
+        if timeout:
+            wait = max(min(task.start_time for task in running) + timeout -
+                       time.time(), 0)
+        try:
+            task, returncode, result = finished.get(timeout=wait)
+        except Queue.Empty:
+            if not timeout:
+                continue
+            # threads cannot be killed, a late result is ignored
+            now = time.time()
+            for task in list(running):
+                if now >= task.start_time + timeout:
+                    running.remove(task)
+                    task.returncode = None
+                    _task_finished(task, error.AutoservSubcommandTimeoutError(
+                        task.func, timeout))
+                    yield task
+            continue
+        if task not in running:
+            continue
+        running.remove(task)
+        task.returncode = returncode
+        _task_finished(task, result)
+        yield task
+
+
+def parallel_iter(tasklist, timeout=None, max_parallel=None, threads=False):
+    """
+    Run a set of predefined subcommands, at most max_parallel at once, and
+    yield them as they finish.
+
+    Each yielded subcommand has the attributes:
+    * result: the value returned or the exception raised by its function, or
+      an AutoservSubcommandTimeoutError if it was killed.
+    * returncode: 0 if the function returned, non zero if it failed, None
+      if it timed out.
+    * runtime: seconds it took.
+
+    :param tasklist: A list of subcommand instances to execute, started in
+            order.
+    :param timeout: Number of seconds after which each command should
+            timeout, counted from its own start.
+    :param max_parallel: Maximum number of commands running at once, 0 for
+            no limit, None to use the AUTOSERV.parallel_max_subcommands
+            setting.
+    :param threads: If True, run the functions in threads of this process
+            instead of forked processes.  Only fit for functions that do not
+            change the process (such as its current directory): the fork and
+            join hooks are not called, output is not redirected to the
+            subcommand subdirs, and a timed out function is left running.
+    """
+    max_parallel = _get_max_parallel(max_parallel)
+    if max_parallel <= 0:
+        max_parallel = len(tasklist)
+    if threads:
+        return _iter_threads(tasklist, max_parallel, timeout)
+    return _iter_processes(tasklist, max_parallel, timeout)
+
+
+def parallel(tasklist, timeout=None, return_results=False, max_parallel=None,
+             threads=False):
     """
     Run a set of predefined subcommands in parallel.
 
     :param tasklist: A list of subcommand instances to execute.
     :param timeout: Number of seconds after which the commands should timeout.
+            When the number of commands running at once is limited, it
+            applies to each command from its own start.
     :param return_results: If True instead of an AutoServError being raised
             on any error a list of the results|exceptions from the tasks is
             returned.  [default: False]
+    :param max_parallel: Maximum number of commands running at once, see
+            parallel_iter().  With no limit, all the commands are forked at
+            once and waited for in order.
+    :param threads: If True, run the commands in threads, see parallel_iter().
     """
+    if _get_max_parallel(max_parallel) > 0 or threads:
+        run_error = False
+        for task in parallel_iter(tasklist, timeout, max_parallel, threads):
+            if task.returncode != 0:
+                run_error = True
+        results = [task.result for task in tasklist]
+    else:
+        run_error, results = _parallel_forked(tasklist, timeout)
+
+    if return_results:
+        return results
+    elif run_error:
+        message = 'One or more subcommands failed:\n'
+        for task, result in zip(tasklist, results):
+            message += 'task: %s returned/raised: %r\n' % (task, result)
+        raise error.AutoservError(message)
+
+
+def _parallel_forked(tasklist, timeout):
     run_error = False
     for task in tasklist:
         task.fork_start()
@@ -47,17 +246,11 @@ def parallel(tasklist, timeout=None, return_results=False):
         results.append(cPickle.load(task.result_pickle))
         task.result_pickle.close()
 
-    if return_results:
-        return results
-    elif run_error:
-        message = 'One or more subcommands failed:\n'
-        for task, result in zip(tasklist, results):
-            message += 'task: %s returned/raised: %r\n' % (task, result)
-        raise error.AutoservError(message)
+    return run_error, results
 
 
 def parallel_simple(function, arglist, log=True, timeout=None,
-                    return_results=False):
+                    return_results=False, max_parallel=None, threads=False):
     """
     Each element in the arglist used to create a subcommand object,
     where that arg is used both as a subdir name, and a single argument
@@ -77,6 +270,9 @@ def parallel_simple(function, arglist, log=True, timeout=None,
     :param return_results: If True instead of an AutoServError being raised
             on any error a list of the results|exceptions from the function
             called on each arg is returned.  [default: False]
+    :param max_parallel: Maximum number of args processed at once, see
+            parallel_iter().
+    :param threads: If True, call function in threads, see parallel_iter().
 
     :return: None or a list of results/exceptions.
     """
@@ -104,7 +300,8 @@ def parallel_simple(function, arglist, log=True, timeout=None,
         else:
             subdir = None
         subcommands.append(subcommand(function, args, subdir))
-    return parallel(subcommands, timeout, return_results=return_results)
+    return parallel(subcommands, timeout, return_results=return_results,
+                    max_parallel=max_parallel, threads=threads)
 
 
 class subcommand(object):
@@ -154,8 +351,10 @@ class subcommand(object):
     def fork_start(self):
         sys.stdout.flush()
         sys.stderr.flush()
+        base_job.flush_status_logs()
         r, w = os.pipe()
         self.returncode = None
+        self.start_time = time.time()
         self.pid = os.fork()
 
         if self.pid:                            # I am the parent
@@ -190,6 +389,7 @@ class subcommand(object):
         finally:
             sys.stdout.flush()
             sys.stderr.flush()
+            base_job.flush_status_logs()
             os._exit(exit_code)
 
     def _handle_exitstatus(self, sts):
@@ -1,6 +1,10 @@
 #!/usr/bin/python
 # Copyright 2009 Google Inc. Released under the GPL v2
 
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
 try:
@@ -339,6 +343,76 @@ class parallel_test(unittest.TestCase):
         self.god.check_playback()
 
 
+class parallel_iter_test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _tasks(self, *delays):
+        return [subcommand.subcommand(self._sleep, [delay])
+                for delay in delays]
+
+    def _sleep(self, delay):
+        # records how many tasks are running at once, across processes
+        marker = os.path.join(self.tmpdir, str(os.getpid()) + str(delay))
+        open(marker, 'w').close()
+        running = len(os.listdir(self.tmpdir))
+        time.sleep(delay)
+        os.remove(marker)
+        if delay < 0.1:
+            raise ValueError(delay)
+        return running, 'x' * 100000
+
+    def _check_width(self, tasks, width):
+        for task in tasks:
+            if task.returncode == 0:
+                self.assertTrue(task.result[0] <= width)
+                self.assertEqual('x' * 100000, task.result[1])
+
+    def test_processes_stream_results(self):
+        tasks = self._tasks(0.6, 0.2, 0.05, 0.3)
+        finished = list(subcommand.parallel_iter(tasks, max_parallel=2))
+        self.assertEqual([tasks[1], tasks[2], tasks[3], tasks[0]], finished)
+        self.assertEqual([0, 0, 1, 0], [task.returncode for task in tasks])
+        self.assertTrue(isinstance(tasks[2].result, ValueError))
+        self.assertTrue(tasks[0].runtime >= 0.6)
+        self._check_width(tasks, 2)
+
+    def test_threads(self):
+        tasks = self._tasks(0.4, 0.2, 0.05)
+        finished = list(subcommand.parallel_iter(tasks, max_parallel=2,
+                                                 threads=True))
+        self.assertEqual([tasks[1], tasks[2], tasks[0]], finished)
+        self.assertEqual([0, 0, 1], [task.returncode for task in tasks])
+        self._check_width(tasks, 2)
+
+    def test_timeout(self):
+        for threads in (False, True):
+            tasks = self._tasks(5, 0.2)
+            finished = list(subcommand.parallel_iter(tasks, timeout=1,
+                                                     max_parallel=1,
+                                                     threads=threads))
+            self.assertEqual(tasks, finished)
+            self.assertEqual(None, tasks[0].returncode)
+            self.assertTrue(isinstance(
+                tasks[0].result,
+                subcommand.error.AutoservSubcommandTimeoutError))
+            self.assertEqual(0, tasks[1].returncode)
+            for name in os.listdir(self.tmpdir):
+                os.remove(os.path.join(self.tmpdir, name))
+
+    def test_parallel(self):
+        tasks = self._tasks(0.2, 0.3)
+        results = subcommand.parallel(tasks, return_results=True,
+                                      max_parallel=1)
+        self.assertEqual([(1, 'x' * 100000)] * 2, results)
+        self.assertRaises(subcommand.error.AutoservError, subcommand.parallel,
+                          self._tasks(0.2, 0.05), max_parallel=1)
+
+
 class test_parallel_simple(unittest.TestCase):
 
     def setUp(self):
@@ -398,7 +472,8 @@ class test_parallel_simple(unittest.TestCase):
             (subcommand.subcommand.expect_call(func, [arg], subdir)
              .and_return(cmd))
 
-        subcommand.parallel.expect_call(cmds, None, return_results=False)
+        subcommand.parallel.expect_call(cmds, None, return_results=False,
+                                        max_parallel=None, threads=False)
         return func, args
 
     def test_passthrough(self):
@@ -1,9 +1,12 @@
 import os
 import re
+import time
 
 from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from django.db import transaction
 from autotest.frontend.tko import models as tko_models
 from autotest.frontend.tko import models_utils as tko_models_utils
+from autotest.frontend.tko import rpc_cache
 from autotest.tko import utils
 
 
@@ -46,16 +49,30 @@ def insert_kernel(kernel):
     return tko_kernel
 
 
-def insert_test(job, test, tko_job=None, tko_machine=None):
-    tko_kernel = insert_kernel(test.kernel)
-    status = tko_models.Status.objects.get(word=test.status)
+# maximum rows per multi-row INSERT statement
+_BULK_INSERT_BATCH_SIZE = 1000
 
-    if tko_job is None:
-        tko_job = tko_models_utils.job_get_by_idx(job.index)
+# test status words never change, so they are cached for the whole process
+_status_cache = {}
+
+
+def _get_status(word):
+    status = _status_cache.get(word)
+    if status is None:
+        status = tko_models.Status.objects.get(word=word)
+        _status_cache[word] = status
+    return status
+
+
+def _get_kernel(kernel, kernel_cache):
+    tko_kernel = kernel_cache.get(kernel.kernel_hash)
+    if tko_kernel is None:
+        tko_kernel = insert_kernel(kernel)
+        kernel_cache[kernel.kernel_hash] = tko_kernel
+    return tko_kernel
 
-    if tko_machine is None:
-        tko_machine = tko_models_utils.machine_get_by_idx(job.machine_idx)
 
+def _save_test(test, tko_job, tko_machine, kernel_cache):
     subdir = test.subdir
     if test.subdir is None:
         subdir = ''
@@ -64,8 +81,8 @@ def insert_test(job, test, tko_job=None, tko_machine=None):
         'job': tko_job,
         'test': test.testname,
         'subdir': subdir,
-        'kernel': tko_kernel,
-        'status': status,
+        'kernel': _get_kernel(test.kernel, kernel_cache),
+        'status': _get_status(test.status),
         'reason': test.reason,
         'machine': tko_machine,
         'started_time': test.started_time,
@@ -75,57 +92,163 @@ def insert_test(job, test, tko_job=None, tko_machine=None):
     test_already_exists = hasattr(test, "test_idx")
     if test_already_exists:
         tko_models.Test.objects.filter(pk=test.test_idx).update(**tko_test_data)
-        tko_test = tko_models.Test.objects.get(pk=test.test_idx)
-
-        # clean up iteration result/attributes and test attributes that will
-        # be re-added shortly
-        tko_models.IterationResult.objects.filter(
-            test=test.test_idx).delete()
-        tko_models.IterationAttribute.objects.filter(
-            test=test.test_idx).delete()
-        tko_models.TestAttribute.objects.filter(test=test.test_idx,
-                                                user_created=False).delete()
-
+        tko_test = tko_models.Test(test_idx=test.test_idx, **tko_test_data)
     else:
         tko_test = tko_models.Test.objects.create(**tko_test_data)
-        tko_test.save()
         test.test_idx = tko_test.test_idx
-
-    for i in test.iterations:
-        for key, value in i.attr_keyval.iteritems():
-            tko_models.IterationAttribute.objects.create(
+    return tko_test
+
+
+def _delete_test_children(test_idxs):
+    """
+    Clean up the iteration results/attributes and test attributes of
+    existing tests, they are re-added right after.
+    """
+    tko_models.IterationResult.objects.filter(test__in=test_idxs).delete()
+    tko_models.IterationAttribute.objects.filter(test__in=test_idxs).delete()
+    tko_models.TestAttribute.objects.filter(test__in=test_idxs,
+                                            user_created=False).delete()
+
+
+# insert_tests() makes the cached results of the TKO RPCs stale at most once
+# per this many seconds, rather than on every test a running job finishes;
+# insert_job(), run by the final parse of the job, makes them stale right away
+_GENERATION_BUMP_INTERVAL = 60
+_last_generation_bump = 0
+
+
+def _bump_generation(coalesce=False):
+    """
+    Make the cached results of the TKO RPCs stale.
+
+    :param coalesce: only if the last time was _GENERATION_BUMP_INTERVAL
+            seconds ago or more.
+    """
+    global _last_generation_bump
+    now = time.time()
+    if coalesce and now - _last_generation_bump < _GENERATION_BUMP_INTERVAL:
+        return
+    rpc_cache.bump_generation()
+    _last_generation_bump = now
+
+
+def _write_tests(tests, tko_job, tko_machine, existing_test_idxs):
+    """
+    Insert (or update, for tests having a test_idx) tests of a job.
+
+    The iteration results/attributes and test attributes of all the tests
+    are written with multi-row INSERTs, the ones of the existing tests are
+    deleted with one DELETE per table.
+    """
+    if existing_test_idxs:
+        _delete_test_children(existing_test_idxs)
+
+    kernel_cache = {}
+    iteration_attributes = []
+    iteration_results = []
+    test_attributes = []
+    for test in tests:
+        tko_test = _save_test(test, tko_job, tko_machine, kernel_cache)
+
+        for i in test.iterations:
+            for key, value in i.attr_keyval.iteritems():
+                iteration_attributes.append(tko_models.IterationAttribute(
+                    test=tko_test,
+                    attribute=key,
+                    iteration=i.index,
+                    value=value))
+
+            for key, value in i.perf_keyval.iteritems():
+                iteration_results.append(tko_models.IterationResult(
+                    test=tko_test,
+                    iteration=i.index,
+                    attribute=key,
+                    value=value))
+
+        for key, value in test.attributes.iteritems():
+            test_attributes.append(tko_models.TestAttribute(
                 test=tko_test,
                 attribute=key,
-                iteration=i.index,
-                value=value)
+                value=value))
 
-        for key, value in i.perf_keyval.iteritems():
-            tko_models.IterationResult.objects.create(
-                test=tko_test,
-                iteration=i.index,
-                attribute=key,
-                value=value)
+        for label_index in test.labels:
+            label = tko_models_utils.test_label_get_by_idx(label_index)
+            if label is not None:
+                label.tests.append(tko_test)
+
+    for model, objects in ((tko_models.IterationAttribute,
+                            iteration_attributes),
+                           (tko_models.IterationResult, iteration_results),
+                           (tko_models.TestAttribute, test_attributes)):
+        # the backend may lower the batch size further (e.g. sqlite)
+        for start in xrange(0, len(objects), _BULK_INSERT_BATCH_SIZE):
+            model.objects.bulk_create(
+                objects[start:start + _BULK_INSERT_BATCH_SIZE])
 
-    for key, value in test.attributes.iteritems():
-        tko_models.TestAttribute.objects.create(
-            test=tko_test,
-            attribute=key,
-            value=value)
 
-    for label_index in test.labels:
-        label = tko_models_utils.test_label_get_by_idx(label_index)
-        if label is not None:
-            label.tests.append(tko_test)
+def _get_existing_test_idxs(tests):
+    return [test.test_idx for test in tests if hasattr(test, "test_idx")]
 
 
+def insert_tests(job, tests, tko_job=None, tko_machine=None):
+    """
+    Insert (or update, for tests having a test_idx) tests of a job, e.g.
+    as they finish while the job runs.
+
+    New tests are added to the test rollups of the job, which are computed
+    again only if some tests were updated.  The cached results of the TKO
+    RPCs are made stale, at most once per _GENERATION_BUMP_INTERVAL.
+    """
+    if tko_job is None:
+        tko_job = tko_models_utils.job_get_by_idx(job.index)
+
+    if tko_machine is None:
+        tko_machine = tko_models_utils.machine_get_by_idx(job.machine_idx)
+
+    existing_test_idxs = _get_existing_test_idxs(tests)
+    _write_tests(tests, tko_job, tko_machine, existing_test_idxs)
+    if existing_test_idxs:
+        tko_models.TestRollup.objects.refresh_job(tko_job.job_idx)
+    else:
+        tko_models.TestRollup.objects.add_tests(
+            [test.test_idx for test in tests])
+    _bump_generation(coalesce=True)
+
+
+def insert_test(job, test, tko_job=None, tko_machine=None):
+    insert_tests(job, [test], tko_job, tko_machine)
+
+
+def _save_machine(job):
+    """
+    Create the machine of job, or update its group and owner.  The test
+    rollups of the jobs run on the machine are updated if they changed.
+    """
+    try:
+        machine = tko_models.Machine.objects.get(hostname__exact=job.machine)
+        host_fields = (machine.machine_group, machine.owner)
+    except tko_models.Machine.DoesNotExist:
+        machine = tko_models.Machine.objects.create(hostname=job.machine)
+        host_fields = None
+
+    if job.machine_group is not None:
+        machine.machine_group = job.machine_group
+    if job.machine_owner is not None:
+        machine.owner = job.machine_owner
+    machine.save()
+
+    if (host_fields is not None and
+            host_fields != (machine.machine_group, machine.owner)):
+        tko_models.TestRollup.objects.refresh_machine(machine)
+    return machine
+
+
+@transaction.commit_on_success
 def insert_job(jobname, job):
     # write the job into the database
-    machine = tko_models_utils.machine_create(job.machine,
-                                              job.machine_group,
-                                              job.machine_owner)
+    machine = _save_machine(job)
 
     # Update back machine index, used by some legacy code
-    machine.save()
     job.machine_idx = machine.pk
 
     afe_job_id = utils.get_afe_job_id(jobname)
@@ -163,6 +286,9 @@ def insert_job(jobname, job):
         job_keyval.value = value
         job_keyval.save()
 
-    # now insert the tests
-    for test in job.tests:
-        insert_test(job, test, tko_job, machine)
+    # now insert the tests; the test rollups of the job are computed again
+    # as tests of a reparsed job may have been deleted
+    _write_tests(job.tests, tko_job, machine,
+                 _get_existing_test_idxs(job.tests))
+    tko_models.TestRollup.objects.refresh_job(tko_job.job_idx)
+    _bump_generation()
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from autotest.frontend import setup_test_environment  # pylint: disable=W0611
+from autotest.client.shared.test_utils import mock
+from autotest.frontend.tko import models as tko_models
+from autotest.frontend.tko import rpc_cache, rpc_interface_unittest
+from autotest.tko import dbutils, models
+
+JOB_TAG = '1-debug_user/host1'
+
+
+class InsertJobTest(unittest.TestCase, rpc_interface_unittest.TkoTestMixin):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        setup_test_environment.set_up()
+        self._patch_sqlite_stuff()
+        rpc_interface_unittest.setup_test_view()
+        # the Status rows of the previous test database are gone
+        dbutils._status_cache.clear()
+        self.kernel = models.kernel('2.6.32', [], 'kernel-hash')
+
+    def tearDown(self):
+        setup_test_environment.tear_down()
+        self.god.unstub_all()
+        dbutils._status_cache.clear()
+
+    def _make_test(self, name, status='GOOD', iterations=(), attributes=None):
+        return models.test(name, name, status, 'reason', self.kernel,
+                           'host1', None, None, list(iterations),
+                           attributes or {}, [])
+
+    def _make_job(self, tests, owner='owner1'):
+        job = models.job('/results/' + JOB_TAG, 'debug_user', 'myjob',
+                         'host1', None, None, None, owner, 'platform1',
+                         None, None, {'job_key': 'job_value'})
+        job.tests = tests
+        return job
+
+    def _count_calls(self, manager, method):
+        """
+        :return: the list of the arguments of the calls to method of manager.
+        """
+        calls = []
+        original = getattr(manager, method)
+
+        def counting_method(*args, **dargs):
+            calls.append(args + tuple(sorted(dargs.items())))
+            return original(*args, **dargs)
+        self.god.stub_with(manager, method, counting_method)
+        return calls
+
+    def _insert_first_job(self):
+        iterations = [models.iteration(1, {'iattr': 'ival'}, {'iresult': 1.5}),
+                      models.iteration(2, {'iattr': 'ival'}, {'iresult': 2.5})]
+        job = self._make_job([
+            self._make_test('sleeptest', iterations=iterations,
+                            attributes={'attr': 'value'}),
+            self._make_test('dbench', status='FAIL')])
+        dbutils.insert_job(JOB_TAG, job)
+        return job
+
+    def test_first_insert(self):
+        generation = rpc_cache.get_generation()
+        job = self._insert_first_job()
+
+        tko_job = tko_models.Job.objects.get(tag=JOB_TAG)
+        self.assertEqual(tko_job.job_idx, job.index)
+        self.assertEqual(('host1', 'platform1', 'owner1'),
+                         (tko_job.machine.hostname,
+                          tko_job.machine.machine_group,
+                          tko_job.machine.owner))
+        self.assertEqual(job.machine_idx, tko_job.machine.machine_idx)
+        self.assertEqual([('job_key', 'job_value')],
+                         list(tko_job.jobkeyval_set.values_list('key',
+                                                                'value')))
+
+        sleeptest, dbench = job.tests
+        tests = tko_models.Test.objects.filter(job=tko_job)
+        self.assertEqual(set([(sleeptest.test_idx, 'sleeptest', 'GOOD'),
+                              (dbench.test_idx, 'dbench', 'FAIL')]),
+                         set((test.test_idx, test.test, test.status.word)
+                             for test in tests))
+        self.assertEqual(
+            [('attr', 'value')],
+            list(tko_models.TestAttribute.objects.filter(
+                test=sleeptest.test_idx).values_list('attribute', 'value')))
+        self.assertEqual(
+            [(1, 'iattr', 'ival'), (2, 'iattr', 'ival')],
+            sorted(tko_models.IterationAttribute.objects.filter(
+                test=sleeptest.test_idx).values_list('iteration', 'attribute',
+                                                     'value')))
+        self.assertEqual(
+            [(1, 'iresult', 1.5), (2, 'iresult', 2.5)],
+            sorted(tko_models.IterationResult.objects.filter(
+                test=sleeptest.test_idx).values_list('iteration', 'attribute',
+                                                     'value')))
+
+        rollups = tko_models.TestRollup.objects.filter(job_idx=job.index)
+        self.assertEqual((2, 1), (sum(r.test_count for r in rollups),
+                                  sum(r.passed_tests for r in rollups)))
+        self.assertTrue(rpc_cache.get_generation() > generation)
+
+    def test_reparse_keeps_user_created_attributes(self):
+        job = self._insert_first_job()
+        sleeptest_idx = job.tests[0].test_idx
+        tko_models.TestAttribute.objects.create(
+            test_id=sleeptest_idx, attribute='user_attr', value='user_value',
+            user_created=True)
+
+        # what the parser does with -r
+        reparsed = self._make_job([
+            self._make_test('sleeptest', status='FAIL',
+                            iterations=[models.iteration(1, {},
+                                                         {'iresult': 3.5})],
+                            attributes={'attr': 'new_value'})])
+        reparsed.index = job.index
+        reparsed.tests[0].test_idx = sleeptest_idx
+        dbutils.insert_job(JOB_TAG, reparsed)
+
+        self.assertEqual(1, tko_models.Job.objects.filter(tag=JOB_TAG).count())
+        test = tko_models.Test.objects.get(pk=sleeptest_idx)
+        self.assertEqual('FAIL', test.status.word)
+        self.assertEqual(
+            [('attr', 'new_value', False), ('user_attr', 'user_value', True)],
+            sorted(tko_models.TestAttribute.objects.filter(
+                test=sleeptest_idx).values_list('attribute', 'value',
+                                                'user_created')))
+        self.assertEqual(0, tko_models.IterationAttribute.objects.filter(
+            test=sleeptest_idx).count())
+        self.assertEqual(
+            [(1, 'iresult', 3.5)],
+            list(tko_models.IterationResult.objects.filter(
+                test=sleeptest_idx).values_list('iteration', 'attribute',
+                                                'value')))
+
+    def test_machine_changes(self):
+        refresh_calls = self._count_calls(tko_models.TestRollup.objects,
+                                          'refresh_machine')
+        job = self._insert_first_job()
+        self.assertEqual([], refresh_calls)
+
+        # reparsed, the machine did not change
+        job.tests = []
+        dbutils.insert_job(JOB_TAG, job)
+        self.assertEqual([], refresh_calls)
+
+        job.machine_owner = 'owner2'
+        dbutils.insert_job(JOB_TAG, job)
+        self.assertEqual(1, len(refresh_calls))
+        self.assertEqual(
+            ['owner2'],
+            list(tko_models.TestRollup.objects.filter(
+                job_idx=job.index).values_list('machine_owner',
+                                               flat=True).distinct()))
+
+    def _get_rollups(self, job_idx):
+        fields = (tko_models.TestRollup.view_fields +
+                  ('test_count', 'passed_tests', 'complete_tests',
+                   'incomplete_tests', 'latest_test_idx'))
+        return sorted(tko_models.TestRollup.objects.filter(
+            job_idx=job_idx).values_list(*fields))
+
+    def test_insert_test_adds_to_rollups(self):
+        job = self._insert_first_job()
+        refresh_calls = self._count_calls(tko_models.TestRollup.objects,
+                                          'refresh_job')
+        # as the tests of a running job finish, in the group of a test
+        # already inserted, then in a new group
+        for test in (self._make_test('sleeptest'),
+                     self._make_test('kernbench', status='FAIL')):
+            dbutils.insert_test(job, test)
+        self.assertEqual([], refresh_calls)
+
+        rollups = self._get_rollups(job.index)
+        self.assertEqual((4, 2), (sum(r[-5] for r in rollups),
+                                  sum(r[-4] for r in rollups)))
+        tko_models.TestRollup.objects.refresh_job(job.index)
+        self.assertEqual(self._get_rollups(job.index), rollups)
+
+        # updated tests make the rollups of the job computed again
+        del refresh_calls[:]
+        dbutils.insert_test(job, job.tests[1])
+        self.assertEqual(1, len(refresh_calls))
+
+    def test_insert_test_coalesces_generation_bumps(self):
+        bump_calls = self._count_calls(rpc_cache, 'bump_generation')
+        self.god.stub_with(dbutils, '_last_generation_bump', 0)
+        job = self._insert_first_job()
+        self.assertEqual(1, len(bump_calls))
+        for name in ('kernbench', 'iozone'):
+            dbutils.insert_test(job, self._make_test(name))
+        self.assertEqual(1, len(bump_calls))
+
+        dbutils._last_generation_bump -= dbutils._GENERATION_BUMP_INTERVAL
+        dbutils.insert_test(job, self._make_test('hackbench'))
+        self.assertEqual(2, len(bump_calls))
+
+    def test_failed_insert_leaves_no_job(self):
+        job = self._make_job([self._make_test('sleeptest'),
+                              self._make_test('dbench', status='BOGUS')])
+        self.assertRaises(tko_models.Status.DoesNotExist,
+                          dbutils.insert_job, JOB_TAG, job)
+        self.assertEqual(0, tko_models.Job.objects.filter(tag=JOB_TAG).count())
+        self.assertEqual(0, tko_models.Test.objects.count())
+        self.assertEqual(0, tko_models.Machine.objects.filter(
+            hostname='host1').count())
+
+    def test_bulk_create_batches(self):
+        self.god.stub_with(dbutils, '_BULK_INSERT_BATCH_SIZE', 2)
+        calls = self._count_calls(tko_models.TestAttribute.objects,
+                                  'bulk_create')
+        attributes = dict(('attr%d' % i, 'value') for i in xrange(5))
+        job = self._make_job([self._make_test('sleeptest',
+                                              attributes=attributes)])
+        dbutils.insert_job(JOB_TAG, job)
+
+        self.assertEqual([2, 2, 1], [len(call[0]) for call in calls])
+        self.assertEqual(sorted(attributes),
+                         sorted(tko_models.TestAttribute.objects.filter(
+                             test=job.tests[0].test_idx).values_list(
+                                 'attribute', flat=True)))
+
+    def test_status_and_kernel_caches(self):
+        status_calls = self._count_calls(tko_models.Status.objects, 'get')
+        kernel_calls = self._count_calls(dbutils, 'insert_kernel')
+        job = self._make_job([self._make_test('sleeptest'),
+                              self._make_test('dbench'),
+                              self._make_test('kernbench', status='FAIL')])
+        dbutils.insert_job(JOB_TAG, job)
+
+        self.assertEqual([(('word', 'GOOD'),), (('word', 'FAIL'),)],
+                         status_calls)
+        # the kernel is looked up once per insert_tests() call
+        self.assertEqual(1, len(kernel_calls))
+        self.assertEqual(1, tko_models.Kernel.objects.filter(
+            kernel_hash='kernel-hash').count())
+
+        dbutils.insert_tests(job, [self._make_test('dbench', status='FAIL')])
+        self.assertEqual(2, len(status_calls))
+        self.assertEqual(2, len(kernel_calls))
+        self.assertEqual(1, tko_models.Kernel.objects.filter(
+            kernel_hash='kernel-hash').count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,456 @@
+"""
+Parse the results directories of jobs into the TKO database, the work of
+autotest-tko-parse.
+"""
+
+import cPickle
+import errno
+import fcntl
+import logging
+import multiprocessing
+import os
+import socket
+import traceback
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared import mail
+from autotest.tko import status_lib, models, dbutils
+from autotest.tko import utils as tko_utils
+from autotest.client.shared import utils
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+import django.db
+from autotest.frontend.tko import models_utils as tko_models_utils
+
+# bounds the number of --jobs workers writing to the database at once
+_db_write_semaphore = None
+
+# where --incremental keeps the offset and parser state of a running job
+_PARSE_STATE_FILE = ".parse_state"
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+def format_failure_message(jobname, kernel, testname, status, reason):
+    format_string = "%-12s %-20s %-12s %-10s %s"
+    return format_string % (jobname, kernel, testname, status, reason)
+
+
+def mailfailure(jobname, job, message):
+    message_lines = [""]
+    message_lines.append("The following tests FAILED for this job")
+    message_lines.append("http://%s/results/%s" %
+                         (socket.gethostname(), jobname))
+    message_lines.append("")
+    message_lines.append(format_failure_message("Job name", "Kernel",
+                                                "Test name", "FAIL/WARN",
+                                                "Failure reason"))
+    message_lines.append(format_failure_message("=" * 8, "=" * 6, "=" * 8,
+                                                "=" * 8, "=" * 14))
+    message_header = "\n".join(message_lines)
+
+    subject = "AUTOTEST: FAILED tests from job %s" % jobname
+    mail.send("", job.user, "", subject, message_header + message)
+
+
+def _job_is_running(path):
+    """
+    True if autoserv is still running the job: its .autoserv_execute pidfile
+    has no exit status yet.
+    """
+    top_dir = tko_utils.find_toplevel_job_dir(path)
+    if not top_dir:
+        return False
+    execute_path = os.path.join(top_dir, ".autoserv_execute")
+    return len(open(execute_path).readlines()) < 2
+
+
+def _load_parse_state(path, status_log, status_version):
+    """
+    Load the state saved by the last incremental parse of path.
+
+    :return: the state dictionary, or None if there is none or it does not
+            match the status log anymore.
+    """
+    state_path = os.path.join(path, _PARSE_STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    try:
+        state = cPickle.load(open(state_path, "rb"))
+    except Exception:
+        logging.warning("Ignoring unreadable parse state %s", state_path)
+        return None
+    status_stat = os.stat(status_log)
+    if (state["status_log"] != os.path.basename(status_log) or
+            state["status_version"] != status_version or
+            state["inode"] != status_stat.st_ino or
+            state["offset"] > status_stat.st_size):
+        logging.info("Status log changed since the last parse, ignoring %s",
+                     state_path)
+        return None
+    return state
+
+
+def _save_parse_state(path, status_log, status_version, offset,
+                      parser_state):
+    state = {"status_log": os.path.basename(status_log),
+             "status_version": status_version,
+             "inode": os.stat(status_log).st_ino,
+             "offset": offset,
+             "parser_state": parser_state}
+    state_path = os.path.join(path, _PARSE_STATE_FILE)
+    temp_path = state_path + ".tmp"
+    state_file = open(temp_path, "wb")
+    try:
+        cPickle.dump(state, state_file, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        state_file.close()
+    os.rename(temp_path, state_path)
+
+
+def _remove_parse_state(path):
+    state_path = os.path.join(path, _PARSE_STATE_FILE)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+
+def _read_status_lines(status_file, include_incomplete):
+    """
+    Read a status log in chunks, starting at its current position.
+
+    :param include_incomplete: whether to also return a last line that is
+            not terminated by a newline (yet).
+    :return: yields (lines, offset) tuples, offset being the file position
+            right after the lines.
+    """
+    offset = status_file.tell()
+    pending = ""
+    while True:
+        data = status_file.read(_READ_CHUNK_SIZE)
+        if not data:
+            break
+        data = pending + data
+        end = data.rfind("\n") + 1
+        pending = data[end:]
+        if end:
+            offset += end
+            yield data[:end].splitlines(True), offset
+    if pending and include_incomplete:
+        yield [pending], offset + len(pending)
+
+
+def _write_job(jobname, job, stale_test_idxs):
+    """
+    Delete the tests of stale_test_idxs and write job into the database.
+    """
+    for test_idx in stale_test_idxs:
+        # insert_job() refreshes the rollups of the job
+        tko_models_utils.test_delete_by_idx(test_idx, refresh=False)
+    dbutils.insert_job(jobname, job)
+
+
+def parse_one(jobname, path, reparse, mail_on_failure, incremental=False):
+    """
+    Parse a single job. Optionally send email on failure.
+
+    With incremental, the status log of a running job is only parsed as far
+    as it goes; the offset and the parser state are saved in the results
+    directory and the next parse of the job resumes from there.  A job whose
+    parse cannot be resumed (a parser without state, or a state that does
+    not match the status log anymore) is parsed again from the start.
+
+    :return: the number of tests parsed, or None if the job was not parsed.
+    """
+    logging.info("Scanning %s (%s)", jobname, path)
+    old_job_idx = tko_models_utils.job_get_idx_by_tag(jobname)
+
+    # look up the status version
+    job_keyval = models.job.read_keyval(path)
+    status_version = job_keyval.get("status_version", 0)
+
+    status_log = os.path.join(path, "status.log")
+    if not os.path.exists(status_log):
+        status_log = os.path.join(path, "status")
+
+    # the job was inserted while it was running, and not since it finished
+    partially_parsed = os.path.exists(os.path.join(path, _PARSE_STATE_FILE))
+    parse_state = None
+    if (incremental and partially_parsed and old_job_idx is not None and
+            os.path.exists(status_log)):
+        parse_state = _load_parse_state(path, status_log, status_version)
+
+    # old tests is a dict from tuple (test_name, subdir) to test_idx
+    old_tests = {}
+    if old_job_idx is not None and parse_state is None:
+        if not reparse and not partially_parsed:
+            logging.info("Job is already parsed, done")
+            return None
+        if not reparse:
+            logging.info("Cannot resume the parse of the job, reparsing it")
+            reparse = True
+
+        old_tests_objs = tko_models_utils.tests_get_by_job_idx(old_job_idx)
+        if old_tests_objs:
+            old_tests = dict(((test.test, test.subdir), test.test_idx)
+                             for test in old_tests_objs)
+
+    # parse out the job
+    parser = status_lib.parser(status_version)
+    job = parser.make_job(path)
+    if not os.path.exists(status_log):
+        logging.error("Unable to parse job, no status file")
+        return None
+
+    # parse the status logs
+    job_running = incremental and _job_is_running(path)
+    logging.info("Parsing dir=%s, jobname=%s", path, jobname)
+    if parse_state is None:
+        offset = 0
+        parser.start(job)
+    else:
+        offset = parse_state["offset"]
+        logging.info("Resuming at offset %d of %s", offset, status_log)
+        parser.start(job, parse_state["parser_state"])
+    tests = []
+    status_file = open(status_log)
+    try:
+        status_file.seek(offset)
+        for lines, offset in _read_status_lines(
+                status_file, include_incomplete=not job_running):
+            tests.extend(parser.process_lines(lines))
+    finally:
+        status_file.close()
+    if not job_running:
+        tests.extend(parser.end())
+    elif parser.get_state() is None:
+        # inserting the tests would leave the job half parsed
+        logging.info("Cannot resume the parse of %s later, parsing it once "
+                     "the job is finished", jobname)
+        return None
+
+    # parser.end can return the same object multiple times, so filter out dups
+    job.tests = []
+    already_added = set()
+    for test in tests:
+        if test not in already_added:
+            already_added.add(test)
+            job.tests.append(test)
+
+    # the old tests the reparse did not find again
+    stale_test_idxs = []
+    if parse_state is not None:
+        # the tests parsed before carry their test_idx in the parser state
+        job.index = old_job_idx
+    # try and port test_idx over from the old tests, but if old tests stop
+    # matching up with new ones just give up
+    elif reparse and old_job_idx is not None:
+        job.index = old_job_idx
+        for test in job.tests:
+            test_idx = old_tests.pop((test.testname, test.subdir), None)
+            if test_idx is not None:
+                test.test_idx = test_idx
+            else:
+                logging.info("Reparse returned new test testname=%r subdir=%r",
+                             test.testname, test.subdir)
+        stale_test_idxs = old_tests.values()
+
+    # check for failures
+    message_lines = [""]
+    for test in job.tests:
+        if not test.subdir:
+            continue
+        logging.info("testname, status, reason: %s %s %s",
+                     test.subdir, test.status, test.reason)
+        if test.status in ("FAIL", "WARN"):
+            message_lines.append(format_failure_message(
+                jobname, test.kernel.base, test.subdir,
+                test.status, test.reason))
+    message = "\n".join(message_lines)
+
+    # send out a email report of failure
+    if len(message) > 2 and mail_on_failure:
+        logging.info("Sending email report of failure on %s to %s",
+                     jobname, job.user)
+        mailfailure(jobname, job, message)
+
+    if _db_write_semaphore:
+        with _db_write_semaphore:
+            _write_job(jobname, job, stale_test_idxs)
+    else:
+        _write_job(jobname, job, stale_test_idxs)
+
+    if job_running:
+        # saved after the insert so that the tests in the parser state know
+        # their test_idx
+        _save_parse_state(path, status_log, status_version, offset,
+                          parser.get_state())
+    else:
+        _remove_parse_state(path)
+    if job_running or parse_state is not None:
+        # job.tests only holds the tests parsed this time
+        return len(job.tests)
+
+    # Serializing job into a binary file
+    try:
+        from autotest.tko import tko_pb2
+        from autotest.tko import job_serializer
+
+        serializer = job_serializer.JobSerializer()
+        binary_file_name = os.path.join(path, "job.serialize")
+        serializer.serialize_to_binary(job, jobname, binary_file_name)
+
+        if reparse:
+            site_export_file = "autotest.tko.site_export"
+            site_export = utils.import_site_function(__file__,
+                                                     site_export_file,
+                                                     "site_export",
+                                                     _site_export_dummy)
+            site_export(binary_file_name)
+
+    except ImportError:
+        logging.debug("tko_pb2.py doesn't exist. Create it by compiling "
+                      "tko/tko.proto.")
+
+    return len(job.tests)
+
+
+def _site_export_dummy(binary_file_name):
+    pass
+
+
+def _get_job_subdirs(path):
+    """
+    Returns a list of job subdirectories at path. Returns None if the test
+    is itself a job directory. Does not recurse into the subdirs.
+    """
+    # if there's a .machines file, use it to get the subdirs
+    machine_list = os.path.join(path, ".machines")
+    if os.path.exists(machine_list):
+        subdirs = set(line.strip() for line in file(machine_list))
+        existing_subdirs = set(subdir for subdir in subdirs
+                               if os.path.exists(os.path.join(path, subdir)))
+        if len(existing_subdirs) != 0:
+            return existing_subdirs
+
+    # if this dir contains ONLY subdirectories, return them
+    contents = set(os.listdir(path))
+    contents.discard(".parse.lock")
+    contents.discard(_PARSE_STATE_FILE)
+    subdirs = set(sub for sub in contents if
+                  os.path.isdir(os.path.join(path, sub)))
+    if len(contents) == len(subdirs) != 0:
+        return subdirs
+
+    # this is a job directory, or something else we don't understand
+    return None
+
+
+def parse_leaf_path(path, level, reparse, mail_on_failure, incremental=False):
+    """
+    :return: a (jobs, tests) tuple counting what was parsed.
+    """
+    job_elements = path.split("/")[-level:]
+    jobname = "/".join(job_elements)
+    try:
+        num_tests = parse_one(jobname, path, reparse, mail_on_failure,
+                              incremental)
+    except Exception:
+        traceback.print_exc()
+        return 0, 0
+    if num_tests is None:
+        return 0, 0
+    return 1, num_tests
+
+
+def parse_path(path, level, reparse, mail_on_failure, incremental=False):
+    """
+    :return: a (jobs, tests) tuple counting what was parsed.
+    """
+    job_subdirs = _get_job_subdirs(path)
+    if job_subdirs is None:
+        # single machine job
+        return parse_leaf_path(path, level, reparse, mail_on_failure,
+                               incremental)
+
+    jobs, tests = 0, 0
+    # parse status.log in current directory, if it exists. multi-machine
+    # synchronous server side tests record output in this directory. without
+    # this check, we do not parse these results.
+    if os.path.exists(os.path.join(path, 'status.log')):
+        jobs, tests = parse_leaf_path(path, level, reparse, mail_on_failure,
+                                      incremental)
+    # multi-machine job
+    for subdir in job_subdirs:
+        jobpath = os.path.join(path, subdir)
+        subdir_jobs, subdir_tests = parse_path(jobpath, level + 1, reparse,
+                                               mail_on_failure, incremental)
+        jobs += subdir_jobs
+        tests += subdir_tests
+    return jobs, tests
+
+
+def parse_results_dir(path, options):
+    """
+    Parse the job(s) in a results directory while holding its .parse.lock.
+
+    :return: a (jobs, tests) tuple counting what was parsed.
+    """
+    lockfile = open(os.path.join(path, ".parse.lock"), "w")
+    flags = fcntl.LOCK_EX
+    if options.noblock:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(lockfile, flags)
+    except IOError as e:
+        # lock is not available and nonblock has been requested
+        if e.errno == errno.EWOULDBLOCK:
+            lockfile.close()
+            return 0, 0
+        else:
+            raise  # something unexpected happened
+    try:
+        return parse_path(path, options.level, options.reparse,
+                          options.mailit, options.incremental)
+    finally:
+        fcntl.flock(lockfile, fcntl.LOCK_UN)
+        lockfile.close()
+
+
+def _init_worker(db_write_semaphore):
+    global _db_write_semaphore
+    _db_write_semaphore = db_write_semaphore
+
+
+def _parse_results_dir_worker(args):
+    path, options = args
+    return parse_results_dir(path, options)
+
+
+def parse_results_dirs(jobs_list, options):
+    """
+    Parse the results directories in jobs_list, options.jobs at a time.
+
+    :return: a (jobs, tests) tuple counting what was parsed.
+    """
+    if options.jobs <= 1 or len(jobs_list) <= 1:
+        results = [parse_results_dir(path, options) for path in jobs_list]
+    else:
+        # every worker opens its own database connection, don't share ours
+        django.db.connection.close()
+        db_write_semaphore = multiprocessing.BoundedSemaphore(
+            max(options.max_db_writers, 1))
+        pool = multiprocessing.Pool(options.jobs, _init_worker,
+                                    (db_write_semaphore,))
+        try:
+            results = list(pool.imap_unordered(
+                _parse_results_dir_worker,
+                [(path, options) for path in jobs_list]))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return (sum(jobs for jobs, _ in results),
+            sum(tests for _, tests in results))
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+import optparse
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.client.shared.test_utils import mock
+from autotest.tko import parse
+
+STATUS_LOG = """\
+START\t----\t----\ttimestamp=1000\tlocaltime=Jan 01 00:00:00\t
+\tSTART\tsleeptest\tsleeptest\ttimestamp=1001\t
+\tEND GOOD\tsleeptest\tsleeptest\ttimestamp=1002\tcompleted
+\tSTART\tdbench\tdbench\ttimestamp=1003\t
+\tEND FAIL\tdbench\tdbench\ttimestamp=1004\tbroken
+END GOOD\t----\t----\ttimestamp=1005\t
+"""
+
+
+class FakeTest(object):
+
+    def __init__(self, test, subdir, test_idx):
+        self.test = test
+        self.subdir = subdir
+        self.test_idx = test_idx
+
+
+class parse_results_dirs_test(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.results_dir = tempfile.mkdtemp()
+        # what the parser wrote, appended to by the workers
+        self.writes_path = os.path.join(self.results_dir, ".writes")
+        self.job_dirs = []
+        for i in xrange(1, 5):
+            job_dir = os.path.join(self.results_dir, "%d-debug_user" % i)
+            os.mkdir(job_dir)
+            open(os.path.join(job_dir, "keyval"), "w").write(
+                "status_version=1\nhostname=host%d\nuser=debug_user\n" % i)
+            open(os.path.join(job_dir, "status.log"), "w").write(STATUS_LOG)
+            self.job_dirs.append(job_dir)
+
+        self.old_job_idx = None
+        self.god.stub_with(parse.tko_models_utils, "job_get_idx_by_tag",
+                           lambda tag: self.old_job_idx)
+        self.god.stub_with(parse.tko_models_utils, "tests_get_by_job_idx",
+                           lambda job_idx: [FakeTest("oldtest", "oldtest",
+                                                     job_idx * 10)])
+        self.god.stub_with(parse.tko_models_utils, "test_delete_by_idx",
+                           self._test_delete_by_idx)
+        self.god.stub_with(parse.dbutils, "insert_job", self._insert_job)
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.results_dir)
+
+    def _record_write(self, line):
+        # with --jobs, the one database writer allowed holds the semaphore
+        if parse._db_write_semaphore is not None:
+            if parse._db_write_semaphore.acquire(False):
+                parse._db_write_semaphore.release()
+                raise AssertionError("database written to without holding "
+                                     "the semaphore")
+        writes = open(self.writes_path, "a")
+        try:
+            writes.write("%s %d\n" % (line, os.getpid()))
+        finally:
+            writes.close()
+
+    def _test_delete_by_idx(self, test_idx, refresh=True):
+        self.assertFalse(refresh)
+        self._record_write("delete %d" % test_idx)
+
+    def _insert_job(self, jobname, job):
+        self._record_write("insert %s %d" % (jobname, len(job.tests)))
+
+    def _read_writes(self):
+        """:return: a (writes, pids) tuple of what the parser wrote."""
+        writes, pids = [], set()
+        for line in open(self.writes_path):
+            write, pid = line.rsplit(" ", 1)
+            writes.append(write)
+            pids.add(int(pid))
+        return sorted(writes), pids
+
+    def _options(self, **options):
+        values = {"level": 1, "reparse": False, "mailit": False,
+                  "noblock": False, "incremental": False, "jobs": 1,
+                  "max_db_writers": 1}
+        values.update(options)
+        return optparse.Values(values)
+
+    def test_serial(self):
+        self.assertEqual((4, 16), parse.parse_results_dirs(
+            self.job_dirs, self._options()))
+        writes, pids = self._read_writes()
+        self.assertEqual(["insert %d-debug_user 4" % i for i in xrange(1, 5)],
+                         writes)
+        self.assertEqual(set([os.getpid()]), pids)
+
+    def test_parallel(self):
+        self.assertEqual((4, 16), parse.parse_results_dirs(
+            self.job_dirs, self._options(jobs=2)))
+        writes, pids = self._read_writes()
+        self.assertEqual(["insert %d-debug_user 4" % i for i in xrange(1, 5)],
+                         writes)
+        # parsed by the workers of the pool
+        self.assertTrue(os.getpid() not in pids)
+        self.assertTrue(1 <= len(pids) <= 2)
+
+    def test_parallel_reparse(self):
+        self.old_job_idx = 7
+        self.assertEqual((4, 16), parse.parse_results_dirs(
+            self.job_dirs, self._options(jobs=2, reparse=True)))
+        writes, _ = self._read_writes()
+        self.assertEqual(["delete 70"] * 4 +
+                         ["insert %d-debug_user 4" % i for i in xrange(1, 5)],
+                         writes)
+
+    def test_already_parsed(self):
+        self.old_job_idx = 7
+        self.assertEqual((0, 0), parse.parse_results_dirs(
+            self.job_dirs, self._options(jobs=2)))
+        self.assertFalse(os.path.exists(self.writes_path))
+
+    def _start_job(self, job_dir, status_version):
+        open(os.path.join(job_dir, "keyval"), "w").write(
+            "status_version=%d\nhostname=host1\n" % status_version)
+        # autoserv is running: no exit status in its pidfile yet
+        open(os.path.join(job_dir, ".autoserv_execute"), "w").write("123\n")
+        open(os.path.join(job_dir, "status.log"), "w").write(
+            "".join(STATUS_LOG.splitlines(True)[:2]))
+
+    def _finish_job(self, job_dir):
+        open(os.path.join(job_dir, ".autoserv_execute"), "w").write(
+            "123\n0\n")
+        open(os.path.join(job_dir, "status.log"), "w").write(STATUS_LOG)
+
+    def _parse_one(self, job_dir):
+        return parse.parse_one(os.path.basename(job_dir), job_dir,
+                               reparse=False, mail_on_failure=False,
+                               incremental=True)
+
+    def test_incremental_without_parser_state(self):
+        job_dir = self.job_dirs[0]
+        self._start_job(job_dir, status_version=0)
+        # the parser cannot resume, the job is not inserted half parsed
+        self.assertEqual(None, self._parse_one(job_dir))
+        self.assertFalse(os.path.exists(self.writes_path))
+
+        self._finish_job(job_dir)
+        self.assertNotEqual(None, self._parse_one(job_dir))
+        writes, _ = self._read_writes()
+        self.assertEqual(1, len(writes))
+        self.assertTrue(writes[0].startswith("insert 1-debug_user "))
+        self.assertFalse(os.path.exists(os.path.join(job_dir,
+                                                     parse._PARSE_STATE_FILE)))
+
+    def test_incremental_with_discarded_parser_state(self):
+        job_dir = self.job_dirs[0]
+        state_path = os.path.join(job_dir, parse._PARSE_STATE_FILE)
+        self._start_job(job_dir, status_version=1)
+        self.assertEqual(3, self._parse_one(job_dir))
+        self.assertTrue(os.path.exists(state_path))
+
+        # the saved state cannot be used anymore
+        self.old_job_idx = 7
+        open(state_path, "w").write("garbage")
+        self._finish_job(job_dir)
+        self.assertEqual(4, self._parse_one(job_dir))
+        writes, _ = self._read_writes()
+        self.assertEqual(["delete 70", "insert 1-debug_user 3",
+                          "insert 1-debug_user 4"], writes)
+        self.assertFalse(os.path.exists(state_path))
+
+        # done for good
+        self.assertEqual(None, self._parse_one(job_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
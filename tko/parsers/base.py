@@ -12,12 +12,15 @@ class parser(object):
     implement a state_iterator method for this class to be useful.
     """
 
-    def start(self, job):
+    def start(self, job, state=None):
         """ Initialize the parser for processing the results of
-        'job'."""
+        'job'. If 'state' is given, it must come from get_state()
+        and the parser resumes from that point."""
         # initialize all the basic parser parameters
         self.job = job
         self.finished = False
+        self.resume_state = state
+        self.saved_state = state
         self.line_buffer = status_lib.line_buffer()
         # create and prime the parser state machine
         self.state = self.state_iterator(self.line_buffer)
@@ -53,6 +56,14 @@ class parser(object):
                          "".join(traceback.format_stack()))
             return []
 
+    def get_state(self):
+        """ Return a picklable snapshot of the parser state after
+        the lines processed so far (the state given to start()
+        if none were), to pass to start() later on, or None if the
+        parser does not support resuming. The snapshot shares objects
+        with the parser: pickle it before processing more lines."""
+        return self.saved_state
+
     @staticmethod
     def make_job(dir):
         """ Create a new instance of the job model used by the
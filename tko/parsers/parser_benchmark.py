@@ -0,0 +1,242 @@
+#!/usr/bin/python
+"""
+Measure the throughput of the status log parsers.
+
+Synthetic job results directories are generated with a configurable number
+of tests, group nesting depth, reboots, aborts and iteration keyval sizes.
+Each corpus is then run through status_line.parse_line alone and through
+the full version 0 and version 1 parsers (including the keyval loading done
+by parse_test), and the lines parsed per second and the peak memory growth
+of each run are reported.
+
+Every measurement runs in a forked child, so that the peak RSS of one run is
+not hidden by the one of an earlier, bigger run.
+"""
+
+import cPickle
+import optparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.tko import status_lib
+from autotest.tko.parsers import version_0, version_1
+
+HOSTNAME = "bench-host"
+KERNEL = "2.6.32-autotest"
+# lines fed to process_lines() at a time
+CHUNK_SIZE = 1000
+
+
+def _status_line(indent, status, subdir, testname, timestamp, reason="",
+                 **fields):
+    fields["timestamp"] = timestamp
+    optional = "".join("\t%s=%s" % item for item in sorted(fields.items()))
+    return "%s%s\t%s\t%s%s\t%s\n" % ("\t" * indent, status, subdir or "----",
+                                     testname or "----", optional, reason)
+
+
+def generate_status_log(tests, depth=1, reboot_every=0, abort_every=0,
+                        start_time=1000000000):
+    """
+    Generate the lines of a status log.
+
+    :param tests: number of top level tests.
+    :param depth: number of nested groups inside each test, 1 for plain
+            tests.
+    :param reboot_every: reboot before every reboot_every-th test, never if
+            0.
+    :param abort_every: abort every abort_every-th test, never if 0.
+    :return: the list of lines.
+    """
+    clock = [start_time]
+
+    def tick():
+        clock[0] += 1
+        return clock[0]
+
+    lines = [_status_line(0, "START", None, None, tick())]
+    for index in xrange(tests):
+        if reboot_every and index and index % reboot_every == 0:
+            lines.append(_status_line(1, "START", None, "reboot", tick()))
+            lines.append(_status_line(2, "GOOD", None, "reboot.start",
+                                      tick()))
+            lines.append(_status_line(2, "GOOD", None, "reboot.verify",
+                                      tick(), KERNEL))
+            lines.append(_status_line(1, "END GOOD", None, "reboot", tick(),
+                                      kernel=KERNEL))
+        name = "test%d" % index
+        if abort_every and (index + 1) % abort_every == 0:
+            status, reason = "ABORT", "Test aborted by user"
+        else:
+            status, reason = "GOOD", "completed successfully"
+        groups = [name] + ["%s.step%d" % (name, level)
+                           for level in xrange(1, depth)]
+        for level, group in enumerate(groups):
+            lines.append(_status_line(level + 1, "START", group, group,
+                                      tick()))
+        lines.append(_status_line(depth + 1, status, groups[-1], groups[-1],
+                                  tick(), reason))
+        for level in reversed(xrange(depth)):
+            lines.append(_status_line(level + 1, "END " + status,
+                                      groups[level], groups[level], tick()))
+    lines.append(_status_line(0, "END GOOD", None, None, tick()))
+    return lines
+
+
+def generate_job_dir(job_dir, tests, depth=1, reboot_every=0, abort_every=0,
+                     iterations=0, keyval_size=0):
+    """
+    Write a complete job results directory: the job keyval, the host keyval,
+    the autoserv pidfile, the status log and an iteration keyval for every
+    test.
+
+    :param iterations: number of iterations in each test keyval.
+    :param keyval_size: number of perf values in each iteration.
+    :return: the number of status log lines.
+    """
+    lines = generate_status_log(tests, depth, reboot_every, abort_every)
+    if not os.path.isdir(job_dir):
+        os.makedirs(job_dir)
+    keyval = open(os.path.join(job_dir, "keyval"), "w")
+    keyval.write("status_version=1\nhostname=%s\nuser=bench\nlabel=bench\n"
+                 "job_queued=%d\njob_started=%d\njob_finished=%d\n" %
+                 (HOSTNAME, 1000000000, 1000000000, 1000000000 + len(lines)))
+    keyval.close()
+    os.mkdir(os.path.join(job_dir, "host_keyvals"))
+    host_keyval = open(os.path.join(job_dir, "host_keyvals", HOSTNAME), "w")
+    host_keyval.write("platform=bench\nlabels=bench\n")
+    host_keyval.close()
+    open(os.path.join(job_dir, ".autoserv_execute"), "w").write("1\n0\n")
+    open(os.path.join(job_dir, "status.log"), "w").writelines(lines)
+
+    if iterations and keyval_size:
+        iteration = "".join("metric%d{perf}=%d.5\n" % (value, value)
+                            for value in xrange(keyval_size))
+        iteration_keyval = "\n".join([iteration] * iterations)
+        for index in xrange(tests):
+            results_dir = os.path.join(job_dir, "test%d" % index, "results")
+            os.makedirs(results_dir)
+            open(os.path.join(results_dir, "keyval"),
+                 "w").write(iteration_keyval)
+    return len(lines)
+
+
+def parse_job_dir(job_dir, version):
+    """Run the given parser version over a job results directory."""
+    parser = status_lib.parser(version)
+    job = parser.make_job(job_dir)
+    parser.start(job)
+    lines = open(os.path.join(job_dir, "status.log")).readlines()
+    tests = []
+    for start in xrange(0, len(lines), CHUNK_SIZE):
+        tests.extend(parser.process_lines(lines[start:start + CHUNK_SIZE]))
+    tests.extend(parser.end())
+    return tests
+
+
+def parse_status_lines(job_dir):
+    """Only run status_line.parse_line over the status log of job_dir."""
+    parse_line = version_1.status_line.parse_line
+    return [parse_line(line)
+            for line in open(os.path.join(job_dir, "status.log"))]
+
+
+def _measure(function, *args):
+    """
+    Call function(*args) in a forked child.
+
+    :return: (seconds, peak RSS growth in kB) of the call.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        try:
+            start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start_time = time.time()
+            function(*args)
+            seconds = time.time() - start_time
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, cPickle.dumps((seconds,
+                                              peak_rss - start_rss)))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    data = ""
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError("%s failed in the benchmark child process" %
+                           function.__name__)
+    return cPickle.loads(data)
+
+
+def run_benchmark(job_dir, num_lines, options):
+    runs = [("parse_line", parse_status_lines, (job_dir,)),
+            ("version_0", parse_job_dir, (job_dir, 0)),
+            ("version_1", parse_job_dir, (job_dir, 1))]
+    for name, function, args in runs:
+        results = [_measure(function, *args) for _ in xrange(options.repeat)]
+        seconds = min(result[0] for result in results)
+        peak_kb = max(result[1] for result in results)
+        print "  %-10s %8.3f s %10.0f lines/s %8.1f MB peak" % (
+            name, seconds, num_lines / max(seconds, 1e-6), peak_kb / 1024.0)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--tests", default="100,1000,10000",
+                      help="comma separated numbers of tests per job "
+                           "[default: %default]")
+    parser.add_option("--depth", type=int, default=3,
+                      help="group nesting depth of each test "
+                           "[default: %default]")
+    parser.add_option("--reboot-every", type=int, default=50,
+                      help="reboot before every Nth test, 0 for never "
+                           "[default: %default]")
+    parser.add_option("--abort-every", type=int, default=100,
+                      help="abort every Nth test, 0 for never "
+                           "[default: %default]")
+    parser.add_option("--iterations", type=int, default=3,
+                      help="iterations in each test keyval "
+                           "[default: %default]")
+    parser.add_option("--keyval-size", type=int, default=100,
+                      help="perf values in each iteration "
+                           "[default: %default]")
+    parser.add_option("--repeat", type=int, default=3,
+                      help="runs of each parser, the fastest is reported "
+                           "[default: %default]")
+    parser.add_option("--corpus-dir",
+                      help="generate the job results directories there and "
+                           "keep them, instead of using a temporary "
+                           "directory")
+    options = parser.parse_args()[0]
+
+    corpus_dir = options.corpus_dir or tempfile.mkdtemp()
+    try:
+        for tests in options.tests.split(","):
+            job_dir = os.path.join(corpus_dir, "%s-tests" % tests)
+            num_lines = generate_job_dir(
+                job_dir, int(tests), options.depth, options.reboot_every,
+                options.abort_every, options.iterations, options.keyval_size)
+            print "%s tests, %d status lines:" % (tests, num_lines)
+            run_benchmark(job_dir, num_lines, options)
+    finally:
+        if not options.corpus_dir:
+            shutil.rmtree(corpus_dir)
+
+
+if __name__ == "__main__":
+    main()
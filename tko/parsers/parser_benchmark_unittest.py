@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    import common  # pylint: disable=W0611
+from autotest.tko.parsers import parser_benchmark
+
+
+class GenerateJobDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.job_dir = os.path.join(tempfile.mkdtemp(), "job")
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.job_dir))
+
+    def _parse(self, version):
+        tests = {}
+        for test in parser_benchmark.parse_job_dir(self.job_dir, version):
+            tests[test.testname] = test
+        return tests
+
+    def test_status_log_size(self):
+        # job START/END, 5 lines per test, 4 lines per reboot
+        num_lines = parser_benchmark.generate_job_dir(
+            self.job_dir, 10, depth=2, reboot_every=4)
+        self.assertEquals(2 + 10 * 5 + 2 * 4, num_lines)
+        self.assertEquals(num_lines, len(parser_benchmark.parse_status_lines(
+            self.job_dir)))
+
+    def test_version_1_results(self):
+        parser_benchmark.generate_job_dir(
+            self.job_dir, 10, depth=3, reboot_every=4, abort_every=5,
+            iterations=2, keyval_size=3)
+        tests = self._parse(1)
+        expected = set("test%d" % index for index in xrange(10))
+        expected.update(["boot.0", "boot.1", "CLIENT_JOB.0", "SERVER_JOB"])
+        self.assertEquals(expected, set(tests))
+        self.assertEquals("ABORT", tests["test4"].status)
+        self.assertEquals("ABORT", tests["test9"].status)
+        self.assertEquals("GOOD", tests["test5"].status)
+        self.assertEquals("GOOD", tests["SERVER_JOB"].status)
+        self.assertEquals(2, len(tests["test0"].iterations))
+        self.assertEquals(3, len(tests["test0"].iterations[0].perf_keyval))
+        self.assertEquals(parser_benchmark.KERNEL,
+                          tests["test9"].kernel.base + "-autotest")
+
+    def test_version_0_results(self):
+        parser_benchmark.generate_job_dir(self.job_dir, 6, reboot_every=3,
+                                          abort_every=2)
+        tests = self._parse(0)
+        self.assertEquals("ABORT", tests["test1"].status)
+        self.assertEquals("GOOD", tests["test2"].status)
+        self.assertEquals("GOOD", tests["boot.0"].status)
+        self.assertEquals(7, len(tests))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -170,25 +170,45 @@ class parser(base.parser):
         line_buffer.put_back(abort)
 
     def state_iterator(self, buffer):
-        line = None
         new_tests = []
-        job_count, boot_count = 0, 0
-        min_stack_size = 0
-        stack = status_lib.status_stack()
-        current_kernel = kernel("", [])  # UNKNOWN
-        current_status = status_lib.statuses[-1]
-        current_reason = None
-        started_time_stack = [None]
-        subdir_stack = [None]
-        running_test = None
-        running_reasons = set()
+        if self.resume_state is None:
+            line = None
+            job_count, boot_count = 0, 0
+            min_stack_size = 0
+            stack = status_lib.status_stack()
+            current_kernel = kernel("", [])  # UNKNOWN
+            current_status = status_lib.statuses[-1]
+            current_reason = None
+            started_time_stack = [None]
+            subdir_stack = [None]
+            running_test = None
+            running_client = None
+            running_reasons = set()
+            running_job = None
+        else:
+            state = self.resume_state
+            line = state["line"]
+            job_count, boot_count = state["job_count"], state["boot_count"]
+            min_stack_size = state["min_stack_size"]
+            stack = state["stack"]
+            current_kernel = state["current_kernel"]
+            current_status = state["current_status"]
+            current_reason = state["current_reason"]
+            started_time_stack = state["started_time_stack"]
+            subdir_stack = state["subdir_stack"]
+            running_test = state["running_test"]
+            running_client = state["running_client"]
+            running_reasons = state["running_reasons"]
+            running_job = state["running_job"]
         yield []   # we're ready to start running
 
-        # create a RUNNING SERVER_JOB entry to represent the entire test
-        running_job = test.parse_partial_test(self.job, "----", "SERVER_JOB",
-                                              "", current_kernel,
-                                              self.job.started_time)
-        new_tests.append(running_job)
+        if running_job is None:
+            # create a RUNNING SERVER_JOB entry to represent the entire test
+            running_job = test.parse_partial_test(self.job, "----",
+                                                  "SERVER_JOB", "",
+                                                  current_kernel,
+                                                  self.job.started_time)
+            new_tests.append(running_job)
 
         while True:
             # are we finished with parsing?
@@ -218,6 +238,21 @@ class parser(base.parser):
 
             # stop processing once the buffer is empty
             if buffer.size() == 0:
+                # all the lines fed so far are processed, this is the point
+                # a later parse can resume from
+                self.saved_state = {
+                    "line": line, "job_count": job_count,
+                    "boot_count": boot_count,
+                    "min_stack_size": min_stack_size, "stack": stack,
+                    "current_kernel": current_kernel,
+                    "current_status": current_status,
+                    "current_reason": current_reason,
+                    "started_time_stack": started_time_stack,
+                    "subdir_stack": subdir_stack,
+                    "running_test": running_test,
+                    "running_client": running_client,
+                    "running_reasons": running_reasons,
+                    "running_job": running_job}
                 yield new_tests
                 new_tests = []
                 continue
@@ -1,6 +1,9 @@
 #!/usr/bin/python
 
+import cPickle
 import datetime
+import shutil
+import tempfile
 import time
 import unittest
 
@@ -247,5 +250,59 @@ class DummyAbortTestCase(unittest.TestCase):
                 '\t' * self.indent, self.testname, self.reason))
 
 
+class ResumeTestCase(unittest.TestCase):
+
+    STATUS_LOG = [
+        "START\t----\t----\ttimestamp=1000\tlocaltime=Jan 01 00:00:00\t\n",
+        "\tSTART\tsleeptest\tsleeptest\ttimestamp=1001\t\n",
+        "\t\tGOOD\tsleeptest\tsleeptest\ttimestamp=1002\tcompleted\n",
+        "\tEND GOOD\tsleeptest\tsleeptest\ttimestamp=1003\t\n",
+        "\tSTART\tdbench\tdbench\ttimestamp=1004\t\n",
+        "\t\tFAIL\tdbench\tdbench\ttimestamp=1005\tbroken\n",
+        "\tEND FAIL\tdbench\tdbench\ttimestamp=1006\t\n",
+        "END GOOD\t----\t----\ttimestamp=1007\t\n",
+    ]
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+    def _final_results(self, tests):
+        # later records of a test supersede the earlier ones
+        return dict((t.testname, (t.status, t.reason)) for t in tests)
+
+    def _parse(self, lines, state=None, end=False):
+        parser = version_1.parser()
+        parser.start(parser.make_job(self.job_dir), state)
+        tests = parser.process_lines(lines)
+        if end:
+            tests += parser.end()
+        return tests, parser.get_state()
+
+    def test_resumed_parse_matches_full_parse(self):
+        expected, _ = self._parse(self.STATUS_LOG, end=True)
+
+        first_half, state = self._parse(self.STATUS_LOG[:3])
+        state = cPickle.loads(cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL))
+        second_half, _ = self._parse(self.STATUS_LOG[3:], state, end=True)
+
+        self.assertEqual(self._final_results(expected),
+                         self._final_results(first_half + second_half))
+
+    def test_running_tests_are_finished_in_place(self):
+        first_half, state = self._parse(self.STATUS_LOG[:5])
+        running_dbench = first_half[-1]
+        self.assertEqual(("dbench", "RUNNING"),
+                         (running_dbench.testname, running_dbench.status))
+        running_dbench.test_idx = 42
+
+        state = cPickle.loads(cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL))
+        second_half, _ = self._parse(self.STATUS_LOG[5:], state, end=True)
+        dbench = [t for t in second_half if t.testname == "dbench"][-1]
+        self.assertEqual(("FAIL", 42), (dbench.status, dbench.test_idx))
+
+
 if __name__ == "__main__":
     unittest.main()